@@ -10,6 +10,17 @@
 // SERIAL COMMUNICATIONS
 #define DEV_NAME_PREFIX "NSP"           // the device name prefix
 #define BAUDRATE 921600                 // the device baudrate for serial communication
+#define FRAME_CHUNK_SIZE 4096           // how many bytes of the log file to send in one checksummed frame
+#define FRAME_MAGIC_0 0xA5              // the two bytes every frame starts with
+#define FRAME_MAGIC_1 0x5A
+#define FRAME_END 0xFFFFFFFF            // the chunk number of the empty frame that ends a framed export
+#define ENCODINGS "CSV,F4,Q2"           // the encodings framed exports can use, see Python/encoding.py
+#define ENCODING_CSV 0                  // send the log as it is
+#define ENCODING_F4 1                   // datapoints as binary records with a float32 spectrum
+#define ENCODING_Q2 2                   // datapoints as binary records with a scaled int16 spectrum
+#define RECORD_TEXT 0                   // record kind of a line that is not a datapoint
+#define Q2_RANGE 32767                  // the largest absolute Q2 value
+#define ENCODE_BUFFER_SIZE (3 * FRAME_CHUNK_SIZE + MAX_LINE_LENGTH) // encoded lines that start in one chunk
 
 // DEVICE SETTINGS
 #define DEF_CAPTURE_INTERVAL 60000      // how frequently to capture data in ms
@@ -31,6 +42,8 @@
 #define SENSOR_MIN_WAVELENGTH 340       // the minimum sensing wavelength (for W1 sensor)
 #define SENSOR_MAX_WAVELENGTH 1010      // the maximum sensing wavelength  (for W1 sensor)
 #define WAVELENGTH_STEPSIZE 5           // the sensor wavelength resolution (5 nm for W1 sensor)
+#define SPECTRUM_LENGTH ((MAX_WAVELENGTH - MIN_WAVELENGTH) / WAVELENGTH_STEPSIZE + 1) // spectral values in a datapoint
+#define DATAPOINT_NUMBERS (14 + SPECTRUM_LENGTH) // date, time, metadata and spectral numbers in a datapoint line
 
 // PINS
 #define SD_CS_PIN 4                     // pin connected to SD CS
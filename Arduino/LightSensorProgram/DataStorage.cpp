@@ -87,3 +87,9 @@ unsigned long Storage::get_size() {
 byte Storage::read_byte() {
   return log_file.read();
 }
+
+/* Read up to length bytes into buffer, much faster than one read_byte() at a time. Returns how many bytes were read. */
+unsigned int Storage::read_block(byte * buffer, unsigned int length) {
+  int n = log_file.read(buffer, length);
+  return n > 0 ? n : 0;
+}
@@ -39,6 +39,9 @@ class Storage {
 
   byte read_byte();
 
+  /* Read up to length bytes into buffer, returns how many bytes were read */
+  unsigned int read_block(byte * buffer, unsigned int length);
+
 };
 
 #endif
@@ -79,9 +79,15 @@ unsigned int data_counter = 0;                      // how many data points coll
 int s_dark_readings = 0;                            // how many sequential dark readings?
 unsigned long paused_time = 0;                      // when was the sensor paused
 unsigned long pause_duration = 0;                   // how long was the sensor paused for?
+time_t scheduled_start = 0;                         // when to start recording by itself, 0 for never
+time_t scheduled_stop = 0;                          // when to stop recording by itself, 0 for never
 
 char ser_buffer[32];                                // the serial buffer
 int read_index = 0;                                 // the serial buffer read index
+byte frame_buffer[FRAME_CHUNK_SIZE];                // one chunk of the log file during a framed export
+byte encode_buffer[ENCODE_BUFFER_SIZE];             // one encoded chunk of the log file during a framed export
+char line_buffer[MAX_LINE_LENGTH + 1];              // one line of the log file while it is encoded
+double line_numbers[DATAPOINT_NUMBERS];             // the numbers of a datapoint line while it is encoded
 
 // OBJECTS
 ArduinoAdaptor adaptor(PinRst, PinSS);              // master MCU adaptor
@@ -165,8 +171,8 @@ int validate_reading(SpectrumInfo infoS) {
   }
 }
 
-/* Take a manual or automatic measurement, and return the formatted datapoint line */
-String take_measurement(bool manual_measurement = false) {
+/* Take a manual or automatic measurement, and return the formatted datapoint line without logging it */
+String measure(bool manual_measurement = false) {
   SpectrumInfo infoS; // variable for storing the spectrum data
 
   bool dark_flag = true;
@@ -246,6 +252,13 @@ String take_measurement(bool manual_measurement = false) {
   // Standby seems to clear SpectrumInfo, therefore call it after processing the data
   nsp32.Standby(0);
 
+  return line;
+}
+
+/* Take a manual or automatic measurement, log it to the SD card, and return the formatted datapoint line */
+String take_measurement(bool manual_measurement = false) {
+  String line = measure(manual_measurement);
+
   // write the data to the SD card, if there is an error, try to restart SD
   while (!st.write_line( & line)) {
     digitalWrite(7, HIGH);
@@ -339,6 +352,150 @@ String format_line(SpectrumInfo infoS, bool manual_measurement, bool too_dark, i
   return line;
 }
 
+/* Update a CRC-32 (the one used by zip and zlib) with length bytes. Start with 0xFFFFFFFF and invert the result. */
+unsigned long crc32_update(unsigned long crc, byte * data, unsigned int length) {
+  for (unsigned int i = 0; i < length; i++) {
+    crc ^= data[i];
+    for (int k = 0; k < 8; k++) {
+      crc = (crc >> 1) ^ (0xEDB88320 & (0 - (crc & 1)));
+    }
+  }
+  return crc;
+}
+
+/* Send one frame of a framed export: the magic bytes, the chunk number and the payload length (little endian),
+ * the payload, and the CRC-32 of everything after the magic bytes. */
+void send_frame(unsigned long chunk, byte * payload, unsigned int length) {
+  byte header[8] = {FRAME_MAGIC_0, FRAME_MAGIC_1,
+                    (byte) chunk, (byte) (chunk >> 8), (byte) (chunk >> 16), (byte) (chunk >> 24),
+                    (byte) length, (byte) (length >> 8)};
+
+  unsigned long crc = ~crc32_update(crc32_update(0xFFFFFFFF, header + 2, 6), payload, length);
+  byte trailer[4] = {(byte) crc, (byte) (crc >> 8), (byte) (crc >> 16), (byte) (crc >> 24)};
+
+  Serial.write(header, 8);
+  Serial.write(payload, length);
+  Serial.write(trailer, 4);
+}
+
+/* Write the lowest count bytes of value, little endian. Returns count. */
+unsigned int put_bytes(byte * out, unsigned long value, unsigned int count) {
+  for (unsigned int i = 0; i < count; i++) {
+    out[i] = (byte) (value >> (8 * i));
+  }
+  return count;
+}
+
+/* Read the line of the log file starting at position into line_buffer, without its line break.
+ * Returns the position of the next line. */
+unsigned long read_line(unsigned long position) {
+  st.seek_to(position);
+  unsigned int n = st.read_block((byte *) line_buffer, MAX_LINE_LENGTH);
+
+  unsigned int length = 0;
+  while (length < n && line_buffer[length] != '\n') length++;
+  unsigned long next = position + length + (length < n ? 1 : 0);
+
+  if (length > 0 && line_buffer[length - 1] == '\r') length--;
+  line_buffer[length] = '\0';
+  return next;
+}
+
+/* Parse a datapoint line into line_numbers: day, month, year, hour, minute, second, the metadata columns and the
+ * spectrum. Returns false if the line is not a datapoint. */
+bool parse_datapoint(char * line) {
+  const char date_delimiters[] = "//,::,";
+  char * p = line;
+
+  for (int i = 0; i < DATAPOINT_NUMBERS; i++) {
+    char * end;
+    line_numbers[i] = strtod(p, & end);
+    char delimiter = i < 6 ? date_delimiters[i] : ',';
+    if (end == p || * end != delimiter) return false;
+    p = end + 1;
+  }
+
+  return * p == '\0';
+}
+
+/* Encode one line of the log file as a record, see Python/encoding.py. A datapoint becomes a binary record of the
+ * encoding, any other line a text record. Returns the number of bytes written to out. */
+unsigned int encode_line(char * line, byte encoding, byte * out) {
+  unsigned int n = 0;
+
+  if (!parse_datapoint(line)) {
+    unsigned int length = strlen(line);
+    out[n++] = RECORD_TEXT;
+    n += put_bytes(out + n, length, 2);
+    memcpy(out + n, line, length);
+    return n + length;
+  }
+
+  tmElements_t tm;
+  tm.Day = (int) line_numbers[0];
+  tm.Month = (int) line_numbers[1];
+  tm.Year = CalendarYrToTm((int) line_numbers[2]);
+  tm.Hour = (int) line_numbers[3];
+  tm.Minute = (int) line_numbers[4];
+  tm.Second = (int) line_numbers[5];
+
+  out[n++] = encoding;
+  n += put_bytes(out + n, makeTime(tm), 4);
+  out[n++] = (byte) line_numbers[6];                          // MANUAL
+  n += put_bytes(out + n, (unsigned long) line_numbers[7], 2); // INT_TIME
+  n += put_bytes(out + n, (unsigned long) line_numbers[8], 2); // FRAME_AVG
+  out[n++] = (byte) line_numbers[9];                          // AE
+  out[n++] = (byte) (int) line_numbers[10];                   // QUALITY, -1 is sent as 0xFF
+
+  // X, Y and Z in units of 10^-CIE_PRECISION
+  for (int i = 11; i < 14; i++) {
+    n += put_bytes(out + n, (unsigned long) lround(line_numbers[i] * pow(10, CIE_PRECISION)), 4);
+  }
+
+  double * spectrum = line_numbers + 14;
+
+  if (encoding == ENCODING_F4) {
+    for (int i = 0; i < SPECTRUM_LENGTH; i++) {
+      float value = spectrum[i];
+      memcpy(out + n, & value, 4);
+      n += 4;
+    }
+  } else {
+    // scale the spectrum so its largest absolute value is Q2_RANGE
+    float scale = 0;
+    for (int i = 0; i < SPECTRUM_LENGTH; i++) {
+      if (fabs(spectrum[i]) > scale) scale = fabs(spectrum[i]);
+    }
+    memcpy(out + n, & scale, 4);
+    n += 4;
+
+    for (int i = 0; i < SPECTRUM_LENGTH; i++) {
+      long value = scale > 0 ? lround(spectrum[i] / scale * Q2_RANGE) : 0;
+      n += put_bytes(out + n, (unsigned long) value, 2);
+    }
+  }
+
+  return n;
+}
+
+/* Encode every line of the log file that starts in a chunk into encode_buffer. A line that starts in the previous
+ * chunk belongs to it, so each chunk can be encoded on its own. Returns the number of bytes encoded. */
+unsigned int encode_chunk(unsigned long chunk, unsigned long file_size, byte encoding) {
+  unsigned long position = chunk * FRAME_CHUNK_SIZE;
+  unsigned long end = min(position + FRAME_CHUNK_SIZE, file_size);
+
+  // skip the end of a line that started in the previous chunk
+  if (chunk > 0) position = read_line(position - 1);
+
+  unsigned int length = 0;
+  while (position < end && length + MAX_LINE_LENGTH + 3 <= ENCODE_BUFFER_SIZE) {
+    position = read_line(position);
+    length += encode_line(line_buffer, encoding, encode_buffer + length);
+  }
+
+  return length;
+}
+
 /* Update the persistent storage */
 void update_memory() {
   // overwrite the file
@@ -426,13 +583,49 @@ void pause(bool do_pause) {
   }
 }
 
+/* Read a date and time sent as YYYYMMDDhhmmss. Returns 0 for anything else, which clears a timed start or stop */
+time_t parse_datetime(String s) {
+  if (s.length() != 14) return 0;
+
+  tmElements_t tm;
+  tm.Year = CalendarYrToTm(s.substring(0, 4).toInt());
+  tm.Month = s.substring(4, 6).toInt();
+  tm.Day = s.substring(6, 8).toInt();
+  tm.Hour = s.substring(8, 10).toInt();
+  tm.Minute = s.substring(10, 12).toInt();
+  tm.Second = s.substring(12, 14).toInt();
+  return makeTime(tm);
+}
+
+/* Start or stop recording once a timed start or stop is reached. Each only happens once, a stop that is already
+ * past when the start is reached cancels the start.
+*/
+void check_schedule() {
+  if (timeStatus() == timeNotSet) return;
+  time_t t = now();
+
+  if (scheduled_start != 0 && t >= scheduled_start) {
+    scheduled_start = 0;
+    if (!recording && (scheduled_stop == 0 || t < scheduled_stop)) {
+      pause(false);
+      update_memory();
+    }
+  }
+
+  if (scheduled_stop != 0 && t >= scheduled_stop) {
+    scheduled_stop = 0;
+    if (recording) {
+      pause(true);
+      update_memory();
+    }
+  }
+}
+
 /* Sleep the device until it is time to capture next data point. 
  * If time to next data point is greater than SLEEP_DURATION, sleep until SLEEP_DURATION.
 */
 void sleep_until_capture() {
 
-  // check if timed start or stop reached
-
   if (!recording) {
     if (!Serial) delay(SLEEP_DURATION);
     return;
@@ -664,15 +857,77 @@ void loop() {
 
         Serial.println("OK");      
         
-      } else if (ser_buffer[0] == '1' && ser_buffer[1] == '7') {
-        // 17: Set start time
+      } else if (ser_buffer[0] == '1' && ser_buffer[1] == '6') {
+        // 16: export chunks of the log file in checksummed frames, so the computer can ask again for the chunks that
+        // did not arrive intact. Sent as 16_[first chunk]_[number of chunks], optionally followed by _[encoding]
+        String s_buf = String(ser_buffer);
+        int first_delimiter = s_buf.indexOf("_");
+        int second_delimiter = s_buf.indexOf("_", first_delimiter + 1);
+        int third_delimiter = s_buf.indexOf("_", second_delimiter + 1);
+        unsigned long first_chunk = atol(s_buf.substring(first_delimiter + 1, second_delimiter).c_str());
+        unsigned long chunk_count = atol(s_buf.substring(second_delimiter + 1).c_str());
 
-        // what date and time to start at
+        String encoding_name = third_delimiter < 0 ? "CSV" : s_buf.substring(third_delimiter + 1);
+        byte encoding = ENCODING_CSV;
+        if (encoding_name == "F4") encoding = ENCODING_F4;
+        if (encoding_name == "Q2") encoding = ENCODING_Q2;
+
+        // pause recording because this is a lengthy command
+        bool was_recording = recording;
+        if (was_recording) pause(true);
+
+        unsigned long file_size = st.get_size();
+
+        if (st.open_file()) {
+          Serial.println("DATA");
+          Serial.println(file_size);
+          Serial.println(FRAME_CHUNK_SIZE);
+
+          for (unsigned long chunk = first_chunk; chunk < first_chunk + chunk_count && chunk < (file_size + FRAME_CHUNK_SIZE - 1) / FRAME_CHUNK_SIZE && Serial; chunk++) {
+            if (encoding == ENCODING_CSV) {
+              st.seek_to(chunk * FRAME_CHUNK_SIZE);
+              unsigned int length = st.read_block(frame_buffer, FRAME_CHUNK_SIZE);
+              send_frame(chunk, frame_buffer, length);
+            } else {
+              unsigned int length = encode_chunk(chunk, file_size, encoding);
+              send_frame(chunk, encode_buffer, length);
+            }
+          }
+          send_frame(FRAME_END, frame_buffer, 0);
+
+          st.close_file();
+        } else {
+          Serial.println("ERR");
+        }
+
+        if (was_recording) pause(false);
+
+        Serial.println("OK");
+
+      } else if (ser_buffer[0] == '1' && ser_buffer[1] == '9') {
+        // 19: list the encodings framed exports can use
+        Serial.println("DATA");
+        Serial.println(ENCODINGS);
+        Serial.println("OK");
+
+      } else if (ser_buffer[0] == '1' && ser_buffer[1] == '7') {
+        // 17: Set start time, sent as 17_YYYYMMDDhhmmss in device time, or 17_0 to clear it
         String s_buf = String(ser_buffer);
-        String start_date = s_buf.substring(s_buf.indexOf("_") + 1);
+        scheduled_start = parse_datetime(s_buf.substring(s_buf.indexOf("_") + 1));
+        Serial.println("OK");
  
       } else if (ser_buffer[0] == '1' && ser_buffer[1] == '8') {
-        // 18: Set stop time
+        // 18: Set stop time, sent as 18_YYYYMMDDhhmmss in device time, or 18_0 to clear it
+        String s_buf = String(ser_buffer);
+        scheduled_stop = parse_datetime(s_buf.substring(s_buf.indexOf("_") + 1));
+        Serial.println("OK");
+
+      } else if (ser_buffer[0] == '2' && ser_buffer[1] == '0') {
+        // 20: collect a data point manually without logging it, for live monitoring
+        String preview_data = measure(true);
+        Serial.println("DATA");
+        Serial.println(preview_data);
+        Serial.println("OK");
 
       } else {
         Serial.println("Err '" + String(ser_buffer) + "'");
@@ -680,6 +935,9 @@ void loop() {
     }
   }
   
+  // start or stop recording if a timed start or stop is reached
+  check_schedule();
+
   // if time is not set, or is not recording, do not go to sleep and (do not capture)
   if (timeStatus() == timeNotSet || !recording) {
     delay(10);
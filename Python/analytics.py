@@ -0,0 +1,396 @@
+'''
+Photometric and colorimetric metrics of spectra matrices.
+
+Every metric is computed for a whole N x 135 spectra matrix at once (logfile.parse_log, dataset.open_dataset or a
+batch from stream.py), with matrix products against weighting tables that are computed once per wavelength grid
+(get_weights). The colour rendering references only depend on CCT, so they are computed once for every temperature
+of the Planckian locus table and interpolated. Spectra are taken as spectral irradiance in W/m^2/nm.
+
+    illuminance     lx, 683.002 lm/W times the spectrum weighted by the CIE 1931 y function
+    cct, duv        correlated colour temperature in K and distance from the Planckian locus in CIE 1960 uv
+                    (Ohno 2014), positive above the locus
+    melanopic_edi   melanopic equivalent daylight (D65) illuminance in lx (CIE S 026)
+    cri_ra, cri_r   CIE 13.3 general colour rendering index and the 14 special indices
+    tm30_rf, tm30_rg  ANSI/IES TM-30-18 fidelity and gamut indices
+
+Every metric is computed from tabulated functions, read from CSV files in TABLES_DIR. Each file holds the
+wavelength in nm in the first column and one column per function, with an optional header line:
+
+    cie_1931_2deg.csv           x, y, z           every metric (CIE 015)
+    cie_1964_10deg.csv          x, y, z           TM-30 (CIE 015)
+    cie_daylight.csv            S0, S1, S2        CRI above 5000 K and TM-30 above 4000 K (CIE 015)
+    cie_13_3_tcs.csv            TCS01 to TCS14    CRI (CIE 13.3)
+    tm30_ces.csv                CES01 to CES99    TM-30 (ANSI/IES TM-30-18, CIE 224)
+    cie_s026_melanopic.csv      s_mel             melanopic EDI (CIE S 026)
+    cie_f_series.csv            F1 to F12         fluorescent illuminants with published CRI (CIE 015), not read here
+
+The tables in Python/tables/ are the 5 nm CIE and IES tables as distributed with colour-science 0.4.7 (BSD
+licence), the melanopic action spectrum from the CIE S 026 toolbox v1.049.
+
+    metrics = analyze(data["spectra"])                  # every metric the tables allow
+    metrics = analyze(data["spectra"], ["illuminance", "cct"])
+'''
+
+import os
+import numpy as np
+
+from logfile import WAVELENGTHS
+
+# CONSTANTS
+TABLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")  # where tabulated functions are read from
+ANALYTICS_BATCH_ROWS = 8192                 # how many spectra to process at once, bounds the temporary arrays
+KM = 683.002                                # lm/W, maximum luminous efficacy
+K_MEL_D65 = 1.3262e-3                       # W/lm, melanopic efficacy of luminous radiation of D65 (CIE S 026)
+C2 = 1.4388e-2                              # m K, second radiation constant (CIE 015)
+LOCUS_MIN_CCT = 1000                        # K, range of the Planckian locus table
+LOCUS_MAX_CCT = 100000
+LOCUS_STEP = 1.001                          # ratio between neighbouring temperatures of the locus table
+LOCUS_COARSE = 10                           # every how many locus table points the first search looks at
+TRIANGULAR_DUV = 0.002                      # below this |Duv|, CCT is refined with the triangular solution (Ohno 2014)
+CRI_DAYLIGHT_CCT = 5000                     # K, CRI reference is daylight from here, a Planckian radiator below
+TM30_BLEND = (4000, 5000)                   # K, TM-30 reference blends from Planckian to daylight over this range
+TM30_SCALE = 6.73                           # TM-30-18 fidelity scale factor
+TM30_HUE_BINS = 16                          # TM-30 hue bins for the gamut index
+
+# the data files of the tabulated functions, see the module docstring
+TABLE_FILES = {
+    "cmf_1931": "cie_1931_2deg.csv",
+    "cmf_1964": "cie_1964_10deg.csv",
+    "daylight": "cie_daylight.csv",
+    "tcs": "cie_13_3_tcs.csv",
+    "ces": "tm30_ces.csv",
+    "melanopic": "cie_s026_melanopic.csv",
+}
+
+# the tables each metric needs
+METRIC_TABLES = {
+    "illuminance": ["cmf_1931"],
+    "cct": ["cmf_1931"],
+    "duv": ["cmf_1931"],
+    "melanopic_edi": ["cmf_1931", "melanopic"],
+    "cri_ra": ["cmf_1931", "tcs", "daylight"],
+    "cri_r": ["cmf_1931", "tcs", "daylight"],
+    "tm30_rf": ["cmf_1931", "cmf_1964", "ces", "daylight"],
+    "tm30_rg": ["cmf_1931", "cmf_1964", "ces", "daylight"],
+}
+
+# CIECAM02 for CAM02-UCS under the TM-30 viewing conditions: LA = 100 cd/m^2, Yb = 20, average surround, D = 1
+M_CAT02 = np.array([[0.7328, 0.4296, -0.1624], [-0.7036, 1.6975, 0.0061], [0.0030, 0.0136, 0.9834]])
+M_HPE = np.array([[0.38971, 0.68898, -0.07868], [-0.22981, 1.18340, 0.04641], [0.0, 0.0, 1.0]])
+M_CAT02_HPE = M_HPE @ np.linalg.inv(M_CAT02)
+CAM_LA = 100
+CAM_YB = 20
+CAM_C = 0.69
+CAM_NC = 1.0
+
+# relative spectral radiance of Planckian radiators, a len(temperatures) x len(wavelengths) matrix
+def planck(wavelengths, temperatures):
+    metres = np.asarray(wavelengths, dtype=np.float64) * 1e-9
+    temperatures = np.asarray(temperatures, dtype=np.float64)[..., None]
+    with np.errstate(over="ignore"):
+        return metres ** -5 / np.expm1(C2 / (metres * temperatures)) * 1e-15
+
+# read a table of functions from a CSV file and interpolate it onto wavelengths, 0 outside the tabulated range.
+# Returns a functions x len(wavelengths) matrix
+def read_table(filename, wavelengths):
+    with open(filename, 'r') as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if (lines and not lines[0].split(",")[0].strip().replace(".", "", 1).isdigit()): lines = lines[1:]
+
+    table = np.array([[float(v) for v in line.split(",")] for line in lines])
+    return np.array([np.interp(wavelengths, table[:, 0], column, left=0, right=0) for column in table[:, 1:].T])
+
+# CIE daylight at each temperature from the S0, S1 and S2 components, a len(temperatures) x len(wavelengths) matrix
+def daylight(components, temperatures):
+    t = np.asarray(temperatures, dtype=np.float64)
+    x = np.where(t <= 7000, -4.6070e9 / t ** 3 + 2.9678e6 / t ** 2 + 0.09911e3 / t + 0.244063,
+                 -2.0064e9 / t ** 3 + 1.9018e6 / t ** 2 + 0.24748e3 / t + 0.237040)
+    y = -3 * x ** 2 + 2.870 * x - 0.275
+    m = 0.0241 + 0.2562 * x - 0.7341 * y
+    m1 = (-1.3515 - 1.7703 * x + 5.9114 * y) / m
+    m2 = (0.0300 - 31.4424 * x + 30.0717 * y) / m
+    return components[0] + m1[..., None] * components[1] + m2[..., None] * components[2]
+
+# CIE 1960 u, v of tristimulus values in the last axis
+def uv_1960(xyz):
+    denominator = xyz[..., 0] + 15 * xyz[..., 1] + 3 * xyz[..., 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 4 * xyz[..., 0] / denominator, 6 * xyz[..., 1] / denominator
+
+# the weighting tables of one wavelength grid, see get_weights. The wavelength step is folded into every table
+# so a matrix product is an integral
+class Weights:
+    def __init__(self, wavelengths, tables_dir = TABLES_DIR):
+        self.wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        self.step = float(np.mean(np.diff(self.wavelengths)))
+
+        tables = {}
+        for name, filename in TABLE_FILES.items():
+            path = os.path.join(tables_dir, filename)
+            if (os.path.exists(path)): tables[name] = read_table(path, self.wavelengths)
+        self.tables = tables
+        self.references = {}                # metric -> reference values at every locus temperature, see reference
+
+        # without the CIE 1931 functions no metric is supported, see supports
+        if ("cmf_1931" not in tables): return
+
+        # CIE 1931 functions, and the Planckian locus in CIE 1960 uv for CCT
+        self.cmf = tables["cmf_1931"] * self.step
+        self.locus_cct = LOCUS_MIN_CCT * LOCUS_STEP ** np.arange(int(np.log(LOCUS_MAX_CCT / LOCUS_MIN_CCT) / np.log(LOCUS_STEP)) + 1)
+        self.locus_u, self.locus_v = uv_1960(planck(self.wavelengths, self.locus_cct) @ self.cmf.T)
+
+        if ("melanopic" in tables): self.melanopic = tables["melanopic"][0] * self.step
+
+        # the tristimulus values of every sample under a spectrum are one matrix product: samples * 3 columns
+        if ("tcs" in tables):
+            self.tcs = (tables["tcs"][:, None, :] * self.cmf[None, :, :]).reshape(-1, len(self.wavelengths)).T
+        if ("cmf_1964" in tables):
+            self.cmf_10 = tables["cmf_1964"] * self.step
+            if ("ces" in tables):
+                self.ces = (tables["ces"][:, None, :] * self.cmf_10[None, :, :]).reshape(-1, len(self.wavelengths)).T
+
+    # whether the tables a metric needs are there
+    def supports(self, metric):
+        return all([name in self.tables for name in METRIC_TABLES[metric]])
+
+    # the reference values of a metric at each CCT, interpolated from compute(temperatures), which is called once
+    # for every temperature of the locus table on first use. compute returns a tuple of arrays
+    def reference(self, metric, compute, cct):
+        if (metric not in self.references): self.references[metric] = compute(self.locus_cct)
+
+        position = np.log(np.clip(np.nan_to_num(cct, nan=LOCUS_MIN_CCT), LOCUS_MIN_CCT, LOCUS_MAX_CCT) / LOCUS_MIN_CCT) / np.log(LOCUS_STEP)
+        i = np.minimum(position.astype(np.int64), len(self.locus_cct) - 2)
+        fraction = position - i
+        interpolate = lambda values: values[i] + (values[i + 1] - values[i]) * fraction.reshape((-1,) + (1,) * (values.ndim - 1))
+        return [interpolate(values) for values in self.references[metric]]
+
+weights_cache = {}                          # wavelength grid -> Weights, see get_weights
+
+# the weighting tables of a wavelength grid, computed on first use
+def get_weights(wavelengths = WAVELENGTHS):
+    key = tuple(np.asarray(wavelengths).tolist())
+    if (key not in weights_cache): weights_cache[key] = Weights(key)
+    return weights_cache[key]
+
+# CIE 1931 tristimulus values of spectra, N x 3
+def tristimulus(spectra, weights):
+    return np.asarray(spectra, dtype=np.float64) @ weights.cmf.T
+
+# illuminance in lx
+def illuminance(spectra, weights):
+    return KM * (np.asarray(spectra, dtype=np.float64) @ weights.cmf[1])
+
+# melanopic EDI in lx
+def melanopic_edi(spectra, weights):
+    return (np.asarray(spectra, dtype=np.float64) @ weights.melanopic) / K_MEL_D65
+
+# CCT and Duv of CIE 1960 u, v coordinates with Ohno's method: the nearest point of the locus table is found on
+# every LOCUS_COARSE-th point first, then among its neighbours, and refined with the triangular solution close
+# to the locus and the parabolic solution further away. Returns (cct, duv), NaN for black spectra
+def cct_duv(u, v, weights):
+    lu, lv, lt = weights.locus_u, weights.locus_v, weights.locus_cct
+    u = np.nan_to_num(u)[:, None]
+    v = np.nan_to_num(v)[:, None]
+
+    coarse = np.argmin((lu[::LOCUS_COARSE] - u) ** 2 + (lv[::LOCUS_COARSE] - v) ** 2, axis=1) * LOCUS_COARSE
+    window = np.clip(coarse[:, None] + np.arange(-LOCUS_COARSE, LOCUS_COARSE + 1), 1, len(lt) - 2)
+    distances = np.hypot(lu[window] - u, lv[window] - v)
+    i = window[np.arange(len(window)), np.argmin(distances, axis=1)]
+
+    u, v = u[:, 0], v[:, 0]
+    d0, d1, d2 = [np.hypot(lu[j] - u, lv[j] - v) for j in (i - 1, i, i + 1)]
+    t0, t1, t2 = lt[i - 1], lt[i], lt[i + 1]
+
+    # triangular solution
+    length = np.hypot(lu[i + 1] - lu[i - 1], lv[i + 1] - lv[i - 1])
+    x = (d0 ** 2 - d2 ** 2 + length ** 2) / (2 * length)
+    cct_t = t0 + (t2 - t0) * x / length
+    v_t = lv[i - 1] + (lv[i + 1] - lv[i - 1]) * x / length
+    sign = np.where(v >= v_t, 1.0, -1.0)
+    duv_t = sign * np.sqrt(np.maximum(d0 ** 2 - x ** 2, 0))
+
+    # parabolic solution
+    denominator = (t2 - t1) * (t0 - t2) * (t1 - t0)
+    a = (t0 * (d2 - d1) + t1 * (d0 - d2) + t2 * (d1 - d0)) / denominator
+    b = -(t0 ** 2 * (d2 - d1) + t1 ** 2 * (d0 - d2) + t2 ** 2 * (d1 - d0)) / denominator
+    c = -(d0 * (t2 - t1) * t1 * t2 + d1 * (t0 - t2) * t0 * t2 + d2 * (t1 - t0) * t0 * t1) / denominator
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cct_p = -b / (2 * a)
+    duv_p = sign * (a * cct_p ** 2 + b * cct_p + c)
+
+    near = np.abs(duv_t) < TRIANGULAR_DUV
+    cct = np.where(near, cct_t, cct_p)
+    duv = np.where(near, duv_t, duv_p)
+
+    black = (u == 0) & (v == 0)
+    return np.where(black, np.nan, cct), np.where(black, np.nan, duv)
+
+# the reference spectra for colour rendering at each CCT: Planckian radiators below blend[0], daylight from blend[1],
+# and a mix of both, each normalized to the same Y, in between. Returns a len(cct) x len(wavelengths) matrix
+def reference_spectra(cct, weights, cmf, blend):
+    cct = np.nan_to_num(np.clip(cct, LOCUS_MIN_CCT, LOCUS_MAX_CCT), nan=LOCUS_MIN_CCT)
+    radiators = planck(weights.wavelengths, cct)
+    sky = daylight(weights.tables["daylight"], np.clip(cct, 4000, 25000))
+
+    # weight of daylight
+    mix = np.clip((cct - blend[0]) / max(blend[1] - blend[0], 1e-9), 0, 1) if blend[1] > blend[0] else (cct >= blend[0]) * 1.0
+    radiators /= (radiators @ cmf[1])[:, None]
+    sky /= (sky @ cmf[1])[:, None]
+    return (1 - mix[:, None]) * radiators + mix[:, None] * sky
+
+# sample and illuminant tristimulus values of spectra, with the illuminant normalized to Y = 100. A black spectrum has
+# no Y to normalize to and gives NaN, callers ignore the division warnings. Returns (samples N x S x 3, illuminants N x 3)
+def sample_tristimulus(spectra, samples, cmf):
+    illuminants = spectra @ cmf.T
+    scale = 100 / illuminants[:, 1]
+    return (spectra @ samples).reshape(len(spectra), -1, 3) * scale[:, None, None], illuminants * scale[:, None]
+
+cd = lambda u, v: ((4 - u - 10 * v) / v, (1.708 * v + 0.404 - 1.481 * u) / v)
+
+# CIE 1964 U*, V*, W* of samples with CIE 1960 u, v and Y, relative to a white point
+def uvw_1964(u, v, y, white_u, white_v):
+    w = 25 * np.cbrt(y) - 17
+    return np.stack([13 * w * (u - white_u), 13 * w * (v - white_v), w], axis=-1)
+
+# the CRI reference illuminants at each CCT. Returns (white u, white v, U*V*W* of the samples)
+def cri_references(cct, weights):
+    samples, white = sample_tristimulus(reference_spectra(cct, weights, weights.cmf, (CRI_DAYLIGHT_CCT, CRI_DAYLIGHT_CCT)),
+                                        weights.tcs, weights.cmf)
+    white_u, white_v = uv_1960(white)
+    return white_u, white_v, uvw_1964(*uv_1960(samples), samples[..., 1], white_u[:, None], white_v[:, None])
+
+# CIE 13.3 colour rendering indices. Returns (Ra, R), R being N x 14
+def cri(spectra, weights, cct = None):
+    spectra = np.asarray(spectra, dtype=np.float64)
+    if (cct is None): cct = cct_duv(*uv_1960(tristimulus(spectra, weights)), weights)[0]
+    white_u, white_v, reference = weights.reference("cri", lambda t: cri_references(t, weights), cct)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        samples, white = sample_tristimulus(spectra, weights.tcs, weights.cmf)
+
+        # von Kries adaptation of the samples under the test source to the reference illuminant
+        ck, dk = cd(*uv_1960(white))
+        cr, dr = cd(white_u, white_v)
+        ci, di = cd(*uv_1960(samples))
+        cc = (cr / ck)[:, None] * ci
+        dd = (dr / dk)[:, None] * di
+        u = (10.872 + 0.404 * cc - 4 * dd) / (16.518 + 1.481 * cc - dd)
+        v = 5.520 / (16.518 + 1.481 * cc - dd)
+
+        test = uvw_1964(u, v, samples[..., 1], white_u[:, None], white_v[:, None])
+        r = 100 - 4.6 * np.sqrt(((test - reference) ** 2).sum(axis=-1))
+        return r[:, :8].mean(axis=1), r
+
+# CAM02-UCS J', a', b' of tristimulus values under a white point (Y = 100), both with the same leading axes
+def cam02_ucs(xyz, white):
+    k = 1 / (5 * CAM_LA + 1)
+    fl = 0.2 * k ** 4 * 5 * CAM_LA + 0.1 * (1 - k ** 4) ** 2 * (5 * CAM_LA) ** (1 / 3)
+    n = CAM_YB / 100
+    nbb = 0.725 * n ** -0.2
+    z = 1.48 + np.sqrt(n)
+
+    def compress(xyz):
+        rgb = xyz @ M_CAT02.T
+        rgb_white = white @ M_CAT02.T
+        rgb = rgb * (100 / rgb_white)[..., None, :] if rgb.ndim > rgb_white.ndim else rgb * (100 / rgb_white)
+        rgb = rgb @ M_CAT02_HPE.T
+        scaled = (fl * np.abs(rgb) / 100) ** 0.42
+        return np.sign(rgb) * 400 * scaled / (scaled + 27.13) + 0.1
+
+    rgb = compress(xyz)
+    rgb_white = compress(white)[..., None, :]
+    a = rgb[..., 0] - 12 * rgb[..., 1] / 11 + rgb[..., 2] / 11
+    b = (rgb[..., 0] + rgb[..., 1] - 2 * rgb[..., 2]) / 9
+    achromatic = lambda rgb: (2 * rgb[..., 0] + rgb[..., 1] + rgb[..., 2] / 20 - 0.305) * nbb
+    j = 100 * (achromatic(rgb) / achromatic(rgb_white)) ** (CAM_C * z)
+
+    h = np.arctan2(b, a)
+    e = 0.25 * (np.cos(h + 2) + 3.8)
+    t = (50000 / 13 * CAM_NC * nbb * e * np.hypot(a, b)) / (rgb[..., 0] + rgb[..., 1] + 21 / 20 * rgb[..., 2])
+    m = t ** 0.9 * np.sqrt(j / 100) * (1.64 - 0.29 ** n) ** 0.73 * fl ** 0.25
+
+    m_ucs = np.log1p(0.0228 * m) / 0.0228
+    return 1.7 * j / (1 + 0.007 * j), m_ucs * np.cos(h), m_ucs * np.sin(h)
+
+# the TM-30 reference illuminants at each CCT. Returns the J', a', b' of the samples
+def tm30_references(cct, weights):
+    reference = reference_spectra(cct, weights, weights.cmf_10, TM30_BLEND)
+    return cam02_ucs(*sample_tristimulus(reference, weights.ces, weights.cmf_10))
+
+# ANSI/IES TM-30-18 fidelity and gamut indices. Returns (Rf, Rg)
+def tm30(spectra, weights, cct = None):
+    spectra = np.asarray(spectra, dtype=np.float64)
+    if (cct is None): cct = cct_duv(*uv_1960(tristimulus(spectra, weights)), weights)[0]
+    ref = weights.reference("tm30", lambda t: tm30_references(t, weights), cct)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        test = cam02_ucs(*sample_tristimulus(spectra, weights.ces, weights.cmf_10))
+
+        difference = np.sqrt(sum([(t - r) ** 2 for t, r in zip(test, ref)]))
+        rf = 10 * np.log(np.exp((100 - TM30_SCALE * difference.mean(axis=1)) / 10) + 1)
+
+        # average a', b' of the samples in each hue bin of the reference, then the area of the polygon they form
+        bins = (np.arctan2(ref[2], ref[1]) % (2 * np.pi) // (2 * np.pi / TM30_HUE_BINS)).astype(np.int64)
+        members = bins[..., None] == np.arange(TM30_HUE_BINS)
+        counts = np.maximum(members.sum(axis=1), 1)
+        area = lambda a, b: 0.5 * np.abs((a * np.roll(b, -1, axis=1) - np.roll(a, -1, axis=1) * b).sum(axis=1))
+        centres = [np.einsum("rs,rsb->rb", values, members) / counts for values in (test[1], test[2], ref[1], ref[2])]
+        return rf, 100 * area(centres[0], centres[1]) / area(centres[2], centres[3])
+
+# the metrics of every spectrum, in blocks of ANALYTICS_BATCH_ROWS. metrics lists the names to compute, see the module
+# docstring, None for every metric the tables allow. Returns a dict of arrays, one row per spectrum.
+# Raises ValueError if a metric is unknown or its tables are missing
+def analyze(spectra, metrics = None, wavelengths = WAVELENGTHS):
+    weights = get_weights(wavelengths)
+    if (metrics is None): metrics = [metric for metric in METRIC_TABLES if weights.supports(metric)]
+
+    for metric in metrics:
+        if (metric not in METRIC_TABLES): raise ValueError("unknown metric " + metric)
+        if (not weights.supports(metric)):
+            raise ValueError(metric + " needs " + ", ".join([TABLE_FILES[name] for name in METRIC_TABLES[metric]]) + " in " + TABLES_DIR)
+
+    blocks = []
+    for start in range(0, len(spectra), ANALYTICS_BATCH_ROWS):
+        block = np.asarray(spectra[start:start + ANALYTICS_BATCH_ROWS], dtype=np.float64)
+        results = {}
+
+        if ("illuminance" in metrics): results["illuminance"] = illuminance(block, weights)
+        if ("melanopic_edi" in metrics): results["melanopic_edi"] = melanopic_edi(block, weights)
+
+        cct = None
+        if (set(metrics) & {"cct", "duv", "cri_ra", "cri_r", "tm30_rf", "tm30_rg"}):
+            cct, duv = cct_duv(*uv_1960(tristimulus(block, weights)), weights)
+            if ("cct" in metrics): results["cct"] = cct
+            if ("duv" in metrics): results["duv"] = duv
+
+        if (set(metrics) & {"cri_ra", "cri_r"}):
+            results["cri_ra"], results["cri_r"] = cri(block, weights, cct)
+        if (set(metrics) & {"tm30_rf", "tm30_rg"}):
+            results["tm30_rf"], results["tm30_rg"] = tm30(block, weights, cct)
+
+        blocks.append({metric: results[metric] for metric in metrics})
+
+    if not blocks: return {metric: np.empty((0, 14) if metric == "cri_r" else 0) for metric in metrics}
+    return {metric: np.concatenate([block[metric] for block in blocks]) for metric in metrics}
+
+# add metrics to each batch of a stream, see stream.py
+def with_metrics(batches, metrics = None):
+    for batch in batches:
+        batch.update(analyze(batch["spectra"], metrics, batch["wavelengths"]))
+        yield batch
+
+if __name__ == "__main__":
+    import sys
+    from dataset import DATASET_EXT, open_dataset
+    from logfile import parse_log
+
+    if (len(sys.argv) < 2):
+        print("Usage: python analytics.py EXPORT.CSV|DATASET" + DATASET_EXT + " [METRIC ...]")
+        exit(1)
+
+    data = open_dataset(sys.argv[1]) if sys.argv[1].rstrip("/\\").endswith(DATASET_EXT) else parse_log(sys.argv[1])
+    metrics = analyze(data["spectra"], sys.argv[2:] or None, data["wavelengths"])
+
+    print(str(len(data["spectra"])) + " spectra")
+    for metric, values in metrics.items():
+        values = values[np.isfinite(values).all(axis=-1)] if values.ndim > 1 else values[np.isfinite(values)]
+        if (values.size == 0): continue
+        print("%-16s mean %10.4g  min %10.4g  max %10.4g" % (metric, values.mean(), values.min(), values.max()))
@@ -0,0 +1,264 @@
+'''
+Compressed archives of exported datapoints for long-term storage, with a guaranteed maximum error on the spectra.
+
+An archive is a directory (name + ARCHIVE_EXT) holding a JSON header and one data file of compressed chunks of
+ARCHIVE_CHUNK_ROWS rows. The metadata columns are stored losslessly. Each spectrum is quantized in steps of just
+under twice max_error times its peak, so no value of a spectrum read back differs from the original by more than
+max_error times the largest value of that spectrum, whatever its brightness. The quantized values are stored as
+differences between neighbouring wavelengths, split into byte planes and compressed with zlib. At the default ARCHIVE_MAX_ERROR of
+0.1 %, well below the noise of the sensor, daylight spectra take about a seventh of a dataset and a thirtieth of the
+CSV (see bench.py archive). A max_error of 0 stores the spectra losslessly.
+
+The header lists every chunk with its offset, its earliest and latest timestamp and the sizes of its parts, so a
+time window only decodes the chunks that hold datapoints in it, straight from the memory-mapped data file, and
+stream_archive yields one chunk at a time however large the archive is. Chunks are appended like dataset rows: the
+data file first, then the header, so an archive interrupted while appending opens with the chunks committed.
+
+    archive_file("data/NSP_A.ossd", "archive/NSP_A.ossa")
+    columns = read_archive("archive/NSP_A.ossa", start, end)
+'''
+
+import os
+import json
+import mmap
+import zlib
+import numpy as np
+
+from logfile import WAVELENGTHS, COLUMN_TYPES, SPECTRA_TYPE, concatenate_columns
+from dataset import DATASET_EXT, HEADER_FILENAME, write_header
+
+# CONSTANTS
+ARCHIVE_FORMAT = "oss-archive"              # format name stored in the header
+ARCHIVE_VERSION = 1                         # format version stored in the header
+ARCHIVE_EXT = ".ossa"                       # archive directory extension
+ARCHIVE_DATA = "chunks.bin"                 # the file of compressed chunks inside an archive
+ARCHIVE_CHUNK_ROWS = 4096                   # rows in each chunk, the smallest amount decoded at a time
+ARCHIVE_MAX_ERROR = 1e-3                    # largest error of a spectrum value, as a fraction of the peak of its spectrum
+ARCHIVE_MIN_ERROR = 1e-5                    # smallest max_error above 0, below it float32 rounding breaks the guarantee
+ARCHIVE_LEVEL = 6                           # zlib compression level
+ARCHIVE_STEP_MARGIN = 0.99                  # quantization steps are this much smaller than the bound allows, for float32 rounding
+
+def read_archive_header(path):
+    with open(os.path.join(path, HEADER_FILENAME), 'r') as f:
+        header = json.load(f)
+
+    if (header.get("format") != ARCHIVE_FORMAT):
+        raise ValueError(path + " is not an OSS archive")
+    if (header.get("version", 0) > ARCHIVE_VERSION):
+        raise ValueError(path + " was written by a newer version (" + str(header["version"]) + ")")
+
+    return header
+
+# create an empty archive. Returns its header. Raises ValueError if max_error is between 0 and ARCHIVE_MIN_ERROR
+def create_archive(path, max_error = ARCHIVE_MAX_ERROR, wavelengths = WAVELENGTHS):
+    if (0 < max_error < ARCHIVE_MIN_ERROR or max_error < 0):
+        raise ValueError("max_error must be 0 for lossless spectra or at least " + str(ARCHIVE_MIN_ERROR))
+
+    os.makedirs(path, exist_ok=True)
+    header = {
+        "format": ARCHIVE_FORMAT,
+        "version": ARCHIVE_VERSION,
+        "rows": 0,
+        "wavelengths": [int(w) for w in wavelengths],
+        "columns": dict(COLUMN_TYPES),
+        "spectra": SPECTRA_TYPE,
+        "max_error": max_error,
+        "bytes": 0,
+        "chunks": [],
+    }
+    open(os.path.join(path, ARCHIVE_DATA), 'wb').close()
+    write_header(path, header)
+    return header
+
+# compress an array split into byte planes, so the high bytes, mostly the same, compress well
+def pack(values):
+    values = np.ascontiguousarray(values)
+    planes = values.view(np.uint8).reshape(-1, values.dtype.itemsize).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), ARCHIVE_LEVEL)
+
+def unpack(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+# quantize spectra to steps of just under twice max_error times the peak of each spectrum. Returns (steps, the
+# quantized values as differences between neighbouring wavelengths, zigzag coded in the smallest unsigned type)
+def quantize(spectra, max_error):
+    steps = 2 * max_error * ARCHIVE_STEP_MARGIN * np.abs(spectra).max(axis=1).astype(np.float64)
+    steps[steps == 0] = 1
+    quantized = np.rint(spectra / steps[:, None]).astype(np.int64)
+    deltas = np.diff(quantized, axis=1, prepend=0)
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    largest = zigzag.max() if zigzag.size else 0
+    return steps, zigzag.astype(np.uint8 if largest < 1 << 8 else np.uint16 if largest < 1 << 16 else np.uint32)
+
+def dequantize(steps, zigzag):
+    zigzag = zigzag.astype(np.int64)
+    quantized = np.cumsum((zigzag >> 1) ^ -(zigzag & 1), axis=1)
+    return (quantized * steps[:, None]).astype(SPECTRA_TYPE)
+
+# compress rows into a chunk. Returns (its parts, its header entry without the offset)
+def encode_chunk(header, columns):
+    rows = len(columns["timestamp"])
+    spectra = np.asarray(columns["spectra"], dtype=header["spectra"])
+    if (spectra.shape != (rows, len(header["wavelengths"]))):
+        raise ValueError("spectra shape " + str(spectra.shape) + " does not match the archive wavelengths")
+
+    timestamps = np.asarray(columns["timestamp"], dtype=header["columns"]["timestamp"])
+    parts = [pack(np.diff(timestamps, prepend=0))]
+    parts += [pack(np.asarray(columns[column], dtype=dtype)) for column, dtype in header["columns"].items() if column != "timestamp"]
+
+    # spectra that are not finite, which cannot be quantized, are kept as they are
+    quantized = header["max_error"] > 0 and np.isfinite(spectra).all()
+    if quantized:
+        steps, zigzag = quantize(spectra, header["max_error"])
+        parts += [pack(steps), pack(zigzag)]
+    else:
+        parts.append(pack(spectra))
+
+    entry = {"rows": rows, "start": int(timestamps.min()), "stop": int(timestamps.max()), "sizes": [len(part) for part in parts],
+             "spectra": zigzag.dtype.str if quantized else None}
+    return parts, entry
+
+# decompress a chunk from the data buffer. Returns its columns, see logfile.parse_log
+def decode_chunk(header, entry, data):
+    rows = entry["rows"]
+    shape = (rows, len(header["wavelengths"]))
+    parts = []
+    position = entry["offset"]
+    for size in entry["sizes"]:
+        parts.append(data[position:position + size])
+        position += size
+
+    columns = {"timestamp": np.cumsum(unpack(parts[0], header["columns"]["timestamp"], (rows,)))}
+    for i, (column, dtype) in enumerate([(column, dtype) for column, dtype in header["columns"].items() if column != "timestamp"]):
+        columns[column] = unpack(parts[1 + i], dtype, (rows,))
+
+    if entry["spectra"]:
+        columns["spectra"] = dequantize(unpack(parts[-2], np.float64, (rows,)), unpack(parts[-1], entry["spectra"], shape))
+    else:
+        columns["spectra"] = unpack(parts[-1], header["spectra"], shape)
+    columns["wavelengths"] = np.array(header["wavelengths"], dtype=np.int32)
+    return columns
+
+# append rows to an archive in chunks of chunk_rows. columns is a dict with an array for every metadata column
+# and the spectra. Returns the number of rows in the archive
+def append_archive(path, columns, chunk_rows = ARCHIVE_CHUNK_ROWS):
+    header = read_archive_header(path)
+    rows = len(columns["timestamp"])
+
+    with open(os.path.join(path, ARCHIVE_DATA), 'r+b') as f:
+        # drop anything past the committed chunks, left over from an interrupted append
+        f.truncate(header["bytes"])
+        f.seek(header["bytes"])
+        for start in range(0, rows, chunk_rows):
+            parts, entry = encode_chunk(header, {column: values[start:start + chunk_rows] for column, values in columns.items() if column != "wavelengths"})
+            entry["offset"] = header["bytes"]
+            f.write(b"".join(parts))
+            header["bytes"] += sum(entry["sizes"])
+            header["rows"] += entry["rows"]
+            header["chunks"].append(entry)
+        f.flush()
+        os.fsync(f.fileno())
+
+    write_header(path, header)
+    return header["rows"]
+
+# write batches of columns to an archive in full chunks of chunk_rows, creating it if it does not exist, and pass
+# them on. See stream.py
+def write_archive(batches, path, max_error = ARCHIVE_MAX_ERROR, chunk_rows = ARCHIVE_CHUNK_ROWS):
+    if (not os.path.exists(os.path.join(path, HEADER_FILENAME))): create_archive(path, max_error)
+
+    pending = []
+    size = 0
+    for batch in batches:
+        pending.append(batch)
+        size += len(batch["timestamp"])
+        if (size >= chunk_rows):
+            columns = concatenate_columns(pending)
+            full = size // chunk_rows * chunk_rows
+            append_archive(path, {column: values[:full] for column, values in columns.items()}, chunk_rows)
+            pending = [{column: values if column == "wavelengths" else values[full:] for column, values in columns.items()}]
+            size -= full
+        yield batch
+
+    if (size > 0): append_archive(path, concatenate_columns(pending), chunk_rows)
+
+# yield the columns of every chunk of an archive with datapoints start <= timestamp < end, one chunk at a time and
+# in the order they were archived, keeping only the datapoints in the window
+def stream_archive(path, start = None, end = None):
+    header = read_archive_header(path)
+    if (header["bytes"] == 0): return
+
+    with open(os.path.join(path, ARCHIVE_DATA), 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for entry in header["chunks"]:
+                if ((start is not None and entry["stop"] < start) or (end is not None and entry["start"] >= end)): continue
+                columns = decode_chunk(header, entry, data)
+                if ((start is None or entry["start"] >= start) and (end is None or entry["stop"] < end)):
+                    yield columns
+                    continue
+
+                inside = np.ones(entry["rows"], dtype=bool)
+                if (start is not None): inside &= columns["timestamp"] >= start
+                if (end is not None): inside &= columns["timestamp"] < end
+                yield {column: values if column == "wavelengths" else values[inside] for column, values in columns.items()}
+
+# the datapoints of an archive with start <= timestamp < end, as columns, see logfile.parse_log
+def read_archive(path, start = None, end = None):
+    return concatenate_columns(list(stream_archive(path, start, end)))
+
+# the batches of a log file or dataset, ARCHIVE_CHUNK_ROWS rows at a time
+def read_source(source):
+    if source.rstrip("/\\").endswith(DATASET_EXT):
+        from dataset import open_dataset
+
+        data = open_dataset(source)
+        for start in range(0, len(data["timestamp"]), ARCHIVE_CHUNK_ROWS):
+            yield {column: values if column == "wavelengths" else np.asarray(values[start:start + ARCHIVE_CHUNK_ROWS]) for column, values in data.items()}
+    else:
+        from stream import parse_batches
+        from logfile import read_blocks
+
+        yield from parse_batches(read_blocks(source))
+
+# archive a log file or dataset into a new archive. Returns the number of rows archived. Raises FileExistsError if
+# the archive exists
+def archive_file(source, path, max_error = ARCHIVE_MAX_ERROR):
+    from stream import drain
+
+    if (os.path.exists(path)): raise FileExistsError(path + " already exists")
+    create_archive(path, max_error)
+    drain(write_archive(read_source(source), path, max_error))
+    return read_archive_header(path)["rows"]
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if (len(sys.argv) < 3):
+        print("Usage: python archive.py LOG.CSV|DATASET" + DATASET_EXT + " ARCHIVE" + ARCHIVE_EXT + " [MAX_ERROR]    archive a log or dataset\n" +
+              "       python archive.py ARCHIVE" + ARCHIVE_EXT + " OUTPUT" + DATASET_EXT + "|OUTPUT.CSV [START END]   write the datapoints back out\n" +
+              "MAX_ERROR is a fraction of the peak of each spectrum, " + str(ARCHIVE_MAX_ERROR) + " by default, 0 is lossless. " +
+              "START and END are epoch seconds")
+        exit(1)
+
+    start_time = time.perf_counter()
+    if (sys.argv[1].rstrip("/\\").endswith(ARCHIVE_EXT)):
+        from stream import write_dataset, write_csv, drain
+        from logfile import file_header
+
+        window = [int(value) for value in sys.argv[3:5]] + [None] * (2 - len(sys.argv[3:5]))
+        if (sys.argv[2].rstrip("/\\").endswith(DATASET_EXT)):
+            rows = sum([len(batch["timestamp"]) for batch in write_dataset(stream_archive(sys.argv[1], *window), sys.argv[2])])
+        else:
+            with open(sys.argv[2], 'w', buffering=1048576) as f:
+                f.write(file_header())
+                rows = sum([len(batch["timestamp"]) for batch in write_csv(stream_archive(sys.argv[1], *window), f)])
+        print(str(rows) + " datapoints written to " + sys.argv[2] + " in " + str(round(time.perf_counter() - start_time, 1)) + " s")
+    else:
+        rows = archive_file(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else ARCHIVE_MAX_ERROR)
+        size = os.path.getsize(sys.argv[1]) if os.path.isfile(sys.argv[1]) else sum([entry.stat().st_size for entry in os.scandir(sys.argv[1])])
+        archived = sum([entry.stat().st_size for entry in os.scandir(sys.argv[2])])
+        print(str(rows) + " datapoints archived to " + sys.argv[2] + ", " + str(round(archived / 1e6, 1)) + " MB, " +
+              str(round(size / max(archived, 1), 1)) + " times smaller, in " + str(round(time.perf_counter() - start_time, 1)) + " s")
@@ -0,0 +1,640 @@
+'''
+Benchmarks for the OSS host tools.
+
+Usage: python bench.py [rows]
+       python bench.py startup
+       python bench.py encoding [rows]
+       python bench.py monitor
+       python bench.py analytics [rows]
+       python bench.py index [rows]
+       python bench.py merge [rows]
+       python bench.py rollup [rows]
+       python bench.py telemetry
+       python bench.py plots [rows]
+       python bench.py ingest [rows]
+       python bench.py archive [rows]
+       python bench.py quality [rows]
+       python bench.py cache [rows]
+       python bench.py suite [--update-baseline]
+
+The suite measures export throughput and host CPU time per MB against a simulated device (see simulator.py),
+the end-to-end speed of encoded exports over a serial link and of decoding and writing them, the live monitor capture and redraw rates, discovery latency,
+analytics throughput, plot binning and rendering speed, time index build and query speed, merge speed and memory, microSD ingestion speed, archive compression ratio and speed, quality flagging speed, parse cache load and update time, rollup update time, the cost of recording a command, parse speed and startup time, and compares them with the baseline stored in BASELINE_FILE.
+The functional checks are in the tests, see tests/conftest.py. Only the performance budgets are checked here:
+startup time, flagging speed, warm cache loads and the memory binning and merging take.
+A metric more than BASELINE_TOLERANCE worse than its baseline is a regression and the suite exits with status 1.
+Baselines depend on the computer, run the suite with --update-baseline to record new ones after a deliberate change
+or on a new computer.
+'''
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import subprocess
+import numpy as np
+
+from logfile import WAVELENGTHS, file_header, is_datapoint, parse_timestamp, parse_log
+from simulator import FRAME_CHUNK_SIZE, START_TIME, generate_log, generate_daylight_log, encode_chunk
+
+# CONSTANTS
+BENCH_ROWS = 1000000                        # rows in the generated log
+STARTUP_BUDGET = 0.3                        # seconds "python dock.py --help" may take, interpreter included
+STARTUP_RUNS = 5                            # how many times to start dock.py, the fastest run counts
+SUITE_ROWS = 20000                          # datapoints in the simulated device log for the export benchmark (58 MB)
+SUITE_PARSE_ROWS = 100000                   # rows in the generated log for the parse benchmark
+EXPORT_RUNS = 3                             # how many times to export the simulated log, the fastest run counts
+DISCOVERY_DEVICES = 8                       # simulated devices to discover
+DISCOVERY_SILENT_PORTS = 8                  # ports that never answer, discovered alongside the devices
+DISCOVERY_RUNS = 3                          # how many times to probe the devices alone, the fastest run counts
+ENCODING_ROWS = 500                         # datapoints in the simulated device log for the encoding benchmark (1.4 MB)
+LINK_SPEED = 92160                          # bytes per second of a 921600 baud serial link
+FRAME_OVERHEAD = 12                         # bytes of FRAME_MAGIC, header and CRC around each frame payload
+MONITOR_CAPTURES = 500                      # datapoints the live monitor benchmark captures
+INDEX_ROWS = 200000                         # rows in the generated log for the time index benchmark (580 MB)
+INDEX_QUERIES = 20                          # random time ranges to query
+INDEX_QUERY_ROWS = 480                      # datapoints in each queried range, 8 hours at one per minute
+MERGE_ROWS = 30000                          # rows in the largest generated log for the merge benchmark (87 MB)
+MERGE_MEMORY_LIMIT = 64e6                   # bytes the merge benchmark may allocate at most, a quarter of its inputs
+ROLLUP_ROWS = 20000                         # rows in the generated sync file for the rollup benchmark (58 MB)
+ROLLUP_UPDATE_ROWS = 1440                   # rows of the sync whose rollup update is timed, a day at one per minute
+TELEMETRY_COMMANDS = 100000                 # command round trips recorded to time the recorder
+PLOTS_ROWS = 30000                          # rows in the generated log for the plots benchmark (87 MB)
+PLOTS_MEMORY_LIMIT = 64e6                   # bytes binning the log may allocate at most, whatever its size
+INGEST_ROWS = 20000                         # rows in the log of the largest generated card for the ingest benchmark (58 MB)
+INGEST_CARDS = 4                            # generated microSD cards, each with half the rows of the one before
+ARCHIVE_ROWS = 20000                        # rows in the generated daylight log for the archive benchmark, two weeks at one per minute
+QUALITY_ROWS = 20000                        # rows in the generated daylight log for the quality benchmark
+QUALITY_MIN_MB_S = 25                       # MB of CSV per second flagging must keep up with, about the fastest export
+CACHE_ROWS = 20000                          # rows in the generated log for the parse cache benchmark (58 MB)
+CACHE_UPDATE_ROWS = 1440                    # rows appended to the log whose cache update is timed, a day at one per minute
+CACHE_WARM_BUDGET = 0.05                    # seconds loading an unchanged log from the cache may take
+ANALYTICS_ROWS = 100000                     # spectra the analytics benchmark computes metrics of
+ANALYTICS_REFERENCE_CCT = [2000, 2856, 3500, 4500, 6500, 10000, 20000]  # K, Planckian spectra the analytics are timed on
+BASELINE_FILE = "bench_baseline.json"       # stored suite results, next to this file
+BASELINE_TOLERANCE = 0.3                    # how much worse than its baseline a metric may get before it is a regression
+
+# suite metrics, and whether higher values are better
+METRICS = {
+    "export_mb_s": True,
+    "export_cpu_s_per_mb": False,
+    "framed_export_mb_s": True,
+    "framed_export_cpu_s_per_mb": False,
+    "encoded_export_speedup": True,
+    "encoded_export_mb_s": True,
+    "encoded_write_mb_s": True,
+    "monitor_captures_s": True,
+    "monitor_redraw_s": False,
+    "analytics_rows_s": True,
+    "tm30_rows_s": True,
+    "discovery_s": False,
+    "discovery_mixed_s": False,
+    "parse_mb_s": True,
+    "index_build_mb_s": True,
+    "index_query_s": False,
+    "merge_mb_s": True,
+    "ingest_mb_s": True,
+    "archive_ratio": True,
+    "archive_encode_mb_s": True,
+    "archive_decode_mb_s": True,
+    "quality_rows_s": True,
+    "cache_warm_s": False,
+    "cache_update_s": False,
+    "rollup_update_s": False,
+    "telemetry_command_us": False,
+    "plots_rows_s": True,
+    "startup_s": False,
+}
+
+# parse a log the way dock.py did before the bulk parser: one get_formatted_datapoint() call per line,
+# copied into preallocated arrays so a large log fits in memory
+def parse_log_per_line(filename, rows):
+    from dock import get_formatted_datapoint
+
+    spectra = np.empty((rows, len(WAVELENGTHS)), dtype=np.float32)
+    timestamps = np.empty(rows, dtype=np.int64)
+    quality = np.empty(rows, dtype=np.int8)
+
+    i = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            if (not is_datapoint(line.rstrip("\r\n"))): continue
+            x, y, timestamp, manual, int_time, frame_avg, ae, q, cie_x, cie_y, cie_z = get_formatted_datapoint(line)
+            spectra[i] = y
+            timestamps[i] = parse_timestamp(*timestamp.split(" "))
+            quality[i] = q
+            i += 1
+
+    return spectra[:i], timestamps[:i], quality[:i]
+
+# time a function call. Returns (result, seconds)
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+# compare the bulk parser against the per-line parser on a generated log. Returns the suite metrics
+def bench_parse(rows = BENCH_ROWS, compare = True):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "LOG.CSV")
+        _, seconds = timed(generate_log, filename, rows)
+        size = os.path.getsize(filename)
+        print("generated " + str(rows) + " rows, " + str(round(size / 1e6, 1)) + " MB in " + str(round(seconds, 1)) + " s")
+
+        columns, bulk_seconds = timed(parse_log, filename)
+        print("parse_log:             " + str(round(bulk_seconds, 2)) + " s, " + str(int(rows / bulk_seconds)) + " rows/s, " +
+              str(round(size / bulk_seconds / 1e6, 1)) + " MB/s")
+        if (not compare): return {"parse_mb_s": size / bulk_seconds / 1e6}
+
+        (spectra, timestamps, quality), line_seconds = timed(parse_log_per_line, filename, rows)
+        print("get_formatted_datapoint: " + str(round(line_seconds, 2)) + " s, " + str(int(rows / line_seconds)) + " rows/s, " +
+              str(round(size / line_seconds / 1e6, 1)) + " MB/s")
+
+        print("speedup: " + str(round(line_seconds / bulk_seconds, 2)) + "x")
+        return {"parse_mb_s": size / bulk_seconds / 1e6}
+
+# time how long dock.py takes to start. Fails with an AssertionError if it takes longer than budget.
+# Returns the suite metrics
+def bench_startup(budget = STARTUP_BUDGET, runs = STARTUP_RUNS):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    run = lambda *args: subprocess.run([sys.executable] + list(args), cwd=directory, capture_output=True, text=True, check=True)
+    
+    interpreter = min([timed(run, "-c", "pass")[1] for _ in range(runs)])
+    startup = min([timed(run, "dock.py", "--help")[1] for _ in range(runs)])
+    print("python:             " + str(round(interpreter * 1000)) + " ms")
+    print("dock.py --help:     " + str(round(startup * 1000)) + " ms (budget " + str(round(budget * 1000)) + " ms)")
+    
+    assert startup <= budget, "dock.py takes " + str(round(startup, 3)) + " s to start, over the " + str(budget) + " s budget"
+    return {"startup_s": startup}
+
+# serve simulated devices from another process, so they do not use the CPU time measured for the host.
+# Returns the process and the port names, close the process stdin to stop it
+def start_simulator(count = 1, rows = 0, options = []):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, "simulator.py", "--count", str(count), "--rows", str(rows)] + options, cwd=directory,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    return process, [process.stdout.readline().strip() for _ in range(count)]
+
+def stop_simulator(process):
+    process.stdin.close()
+    process.wait()
+
+# export the log of a simulated device through dock.py, the way the EXPORT_DATA menu does, as a plain stream or
+# in checksummed frames. Raises RuntimeError if an export fails. Returns the suite metrics: throughput and host CPU
+# seconds per MB of the fastest run
+def bench_export(rows = SUITE_ROWS, runs = EXPORT_RUNS, framed = False):
+    import dock
+
+    process, port_names = start_simulator(1, rows)
+    dock.FRAMED_EXPORT = framed
+    dock.EXPORT_ENCODINGS = ["CSV"]
+    s = dock.connect_to_device(port_names[0])
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            dock.SAVE_DIR = directory + "/"
+            for _ in range(runs):
+                start_cpu = time.process_time()
+                filename, bytes_read, elapsed, complete, message = dock.export_datapoints(s, "EXPORT", False)
+                if (not complete): raise RuntimeError(message)
+                results.append((elapsed, time.process_time() - start_cpu, bytes_read))
+    finally:
+        if s is not None: s.close()
+        stop_simulator(process)
+
+    elapsed, cpu, bytes_read = min(results)
+    mb = bytes_read / 1e6
+    name = "framed_export" if framed else "export"
+    print(("%-20s" % (name + ":")) + str(round(mb, 1)) + " MB in " + str(round(elapsed, 2)) + " s, " + str(round(mb / elapsed, 1)) +
+          " MB/s, " + str(round(cpu / mb * 1000, 1)) + " ms CPU/MB")
+    return {name + "_mb_s": mb / elapsed, name + "_cpu_s_per_mb": cpu / mb}
+
+# the bytes a framed export of a log sends in each encoding, frames included. Returns {encoding: bytes}
+def wire_sizes(filename, encodings):
+    size = os.path.getsize(filename)
+    chunks = -(-size // FRAME_CHUNK_SIZE)
+    sizes = {}
+    with open(filename, 'rb') as f:
+        for encoding in encodings:
+            payload = size if encoding == "CSV" else sum([len(encode_chunk(f, chunk, size, encoding)) for chunk in range(chunks)])
+            sizes[encoding] = payload + chunks * FRAME_OVERHEAD
+    return sizes
+
+# decode the framed export of a log in an encoding and write it back out as CSV, the step an encoded export adds
+# after the transfer, see stream.write_decoded. Returns the seconds taken
+def decode_write_time(filename, encoding):
+    from stream import decode_batches, write_decoded, drain
+
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        payloads = [encode_chunk(f, chunk, size, encoding) for chunk in range(-(-size // FRAME_CHUNK_SIZE))]
+    with tempfile.TemporaryFile('wb') as f:
+        return timed(drain, write_decoded(decode_batches(payloads, encoding), f))[1]
+
+# export the log of a simulated device over a link of link_speed bytes per second in each encoding, timing each
+# export end to end: the transfer, decoding, writing the CSV file and saving the dataset. Raises RuntimeError if an
+# export fails. Returns the suite metrics: the speedup of F4 over CSV, the F4 export speed in MB of device log per
+# second, and the speed of decoding and writing F4 alone
+def bench_encoding(rows = ENCODING_ROWS, link_speed = LINK_SPEED):
+    import dock
+    from encoding import ENCODINGS
+
+    process, port_names = start_simulator(1, rows, ["--link-speed", str(link_speed)])
+    dock.FRAMED_EXPORT = True
+    s = dock.connect_to_device(port_names[0])
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            dock.SAVE_DIR = directory + "/"
+            log_filename = os.path.join(directory, "LOG2.CSV")
+            generate_log(log_filename, rows)
+            mb = os.path.getsize(log_filename) / 1e6
+            sizes = wire_sizes(log_filename, ENCODINGS)
+
+            for encoding in ENCODINGS:
+                dock.EXPORT_ENCODINGS = [encoding]
+                (filename, bytes_read, elapsed, complete, message), seconds = timed(dock.export_datapoints, s, encoding, False)
+                if (not complete): raise RuntimeError(message)
+                results[encoding] = seconds
+                print(("%-20s" % ("encoding " + encoding + ":")) + str(round(sizes[encoding] / 1e6, 2)) + " MB on the wire (" +
+                      str(round(sizes["CSV"] / sizes[encoding], 2)) + "x smaller), exported in " + str(round(seconds, 2)) + " s at " +
+                      str(round(mb / seconds, 2)) + " MB/s (" + str(round(results["CSV"] / seconds, 2)) + "x faster)")
+                if (encoding != "CSV"):
+                    results[encoding + "_write"] = decode_write_time(log_filename, encoding)
+                    print("                    of which decoding and writing the CSV " + str(round(results[encoding + "_write"] * 1000)) +
+                          " ms at " + str(round(mb / results[encoding + "_write"], 1)) + " MB/s")
+    finally:
+        if s is not None: s.close()
+        stop_simulator(process)
+
+    return {"encoded_export_speedup": results["CSV"] / results["F4"], "encoded_export_mb_s": mb / results["F4"],
+            "encoded_write_mb_s": mb / results["F4_write"]}
+
+# run the live monitor against a simulated device that captures as fast as its loop allows, graphing with the
+# Agg backend. Raises RuntimeError if the device stops answering. Returns the suite metrics: datapoints captured per
+# second and seconds per redraw
+def bench_monitor(captures = MONITOR_CAPTURES):
+    import matplotlib
+    matplotlib.use("Agg")
+    import dock
+    from monitor import MONITOR_CAPACITY, monitor
+
+    process, port_names = start_simulator(1)
+    s = dock.connect_to_device(port_names[0])
+    try:
+        with tempfile.TemporaryFile('w+') as f:
+            f.write(file_header())
+            stats = monitor(s, f, MONITOR_CAPACITY, captures)
+    finally:
+        if s is not None: s.close()
+        stop_simulator(process)
+
+    if (stats["error"] is not None): raise RuntimeError(str(stats["error"]))
+    rate = stats["captures"] / stats["elapsed"]
+    redraw = stats["redraw_seconds"] / max(stats["frames"], 1)
+    print("monitor:            " + str(captures) + " datapoints at " + str(round(rate, 1)) + " /s, " + str(stats["frames"]) +
+          " frames at " + str(round(redraw * 1000, 2)) + " ms per redraw")
+    return {"monitor_captures_s": rate, "monitor_redraw_s": redraw}
+
+# time recording command round trips. Returns the suite metrics: microseconds to record a command
+def bench_telemetry(commands = TELEMETRY_COMMANDS):
+    from telemetry import Recorder
+
+    recorder = Recorder()
+    _, seconds = timed(lambda: [recorder.command("COM1", "_SAY_HELLO", i * 1e-6) for i in range(commands)])
+    print("telemetry:          " + str(round(seconds / commands * 1e6, 2)) + " us to record a command")
+    return {"telemetry_command_us": seconds / commands * 1e6}
+
+# bin a generated log for plotting within PLOTS_MEMORY_LIMIT, then bin and render every plot from its dataset.
+# Fails with an AssertionError if binning takes more memory. Returns the suite metrics: datapoints of the dataset
+# binned and plotted per second
+def bench_plots(rows = PLOTS_ROWS):
+    import tracemalloc
+    from dataset import csv_to_dataset
+    from plots import PLOT_TIME_BINS, bin_inputs, plot_all
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename, path = os.path.join(directory, "LOG.CSV"), os.path.join(directory, "LOG.ossd")
+        generate_log(filename, rows)
+        csv_to_dataset(filename, path)
+
+        tracemalloc.start()
+        try:
+            binned, csv_seconds = timed(bin_inputs, [filename], PLOT_TIME_BINS, None, 1)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < PLOTS_MEMORY_LIMIT, "binning took " + str(round(peak / 1e6)) + " MB"
+
+        filenames, seconds = timed(plot_all, [path], os.path.join(directory, "plots", "LOG"))
+
+    print("plots:              " + str(rows) + " datapoints binned from the log in " + str(round(csv_seconds, 2)) + " s (" +
+          str(round(peak / 1e6)) + " MB), binned and plotted from the dataset in " + str(round(seconds, 2)) + " s (" +
+          str(round(rows / seconds)) + " /s)")
+    return {"plots_rows_s": rows / seconds}
+
+# index a generated log, query random time ranges, then append a sync with a new segment that starts over in time.
+# Returns the suite metrics: index build speed and seconds per query
+def bench_index(rows = INDEX_ROWS, queries = INDEX_QUERIES):
+    from timeindex import update_index, query
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "SYNC.CSV")
+        generate_log(filename, rows)
+        size = os.path.getsize(filename)
+
+        header, build_seconds = timed(update_index, filename)
+        timestamps = parse_log(filename)["timestamp"]
+
+        random = np.random.default_rng(0)
+        seconds = []
+        for first in random.integers(0, rows - INDEX_QUERY_ROWS, queries).tolist():
+            _, query_seconds = timed(query, filename, timestamps[first], timestamps[first + INDEX_QUERY_ROWS])
+            seconds.append(query_seconds)
+
+        with open(filename, 'rb') as f:
+            lines = f.read(100000).split(b"\n")
+        with open(filename, 'ab') as f:
+            f.write(lines[0] + b"\n" + b"\n".join(lines[1:4]) + b"\n")
+        header, append_seconds = timed(update_index, filename)
+
+    query_seconds = float(np.median(seconds))
+    print("time index:         " + str(round(size / 1e6)) + " MB indexed in " + str(round(build_seconds, 2)) + " s, " + str(INDEX_QUERY_ROWS) +
+          " datapoints queried in " + str(round(query_seconds * 1000, 1)) + " ms, sync appended in " + str(round(append_seconds * 1000, 1)) + " ms")
+    return {"index_build_mb_s": size / build_seconds / 1e6, "index_query_s": query_seconds}
+
+# merge overlapping exports of a device, a sync file holding the same datapoints in two segments out of order and
+# the export of another device taken at the same times. Fails with an AssertionError if merging takes more than
+# MERGE_MEMORY_LIMIT. Returns the suite metrics: MB of inputs merged per second
+def bench_merge(rows = MERGE_ROWS):
+    import tracemalloc
+    from merge import MERGE_BATCH_ROWS, merge, input_order
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ["A.CSV", "A0.CSV", "SYNC_A.CSV", "B.CSV"]]
+        generate_log(paths[0], rows * 2 // 3)
+        generate_log(paths[1], rows)
+        generate_log(paths[3], rows // 3, seed=1)
+        with open(paths[1], 'rb') as f:
+            data = f.read()
+        header, middle = data.index(b"\n") + 1, data.index(b"\n", len(data) // 2) + 1
+        with open(paths[2], 'wb') as f:
+            f.write(data[:header] + data[middle:] + data[:middle])
+
+        size = sum([os.path.getsize(path) for path in paths])
+        for path in paths: input_order(path)
+        tracemalloc.start()
+        try:
+            (read, written), seconds = timed(merge, paths, os.path.join(directory, "MERGED.ossd"), MERGE_BATCH_ROWS, 1)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < MERGE_MEMORY_LIMIT, "merging took " + str(round(peak / 1e6)) + " MB"
+
+    print("merge:              " + str(round(size / 1e6)) + " MB, " + str(read) + " datapoints merged into " + str(written) + " in " +
+          str(round(seconds, 2)) + " s (" + str(round(size / seconds / 1e6, 1)) + " MB/s), " + str(round(peak / 1e6)) + " MB of memory")
+    return {"merge_mb_s": size / seconds / 1e6}
+
+# ingest a directory of generated microSD cards. Returns the suite metrics: MB of logs ingested per second
+def bench_ingest(rows = INGEST_ROWS, cards = INGEST_CARDS):
+    from ingest import ingest
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "cards")
+        logs = []
+        for card in range(cards):
+            os.makedirs(os.path.join(source, "NSP_" + chr(ord("A") + card)))
+            logs.append(os.path.join(source, "NSP_" + chr(ord("A") + card), "LOG2.CSV" if card else "log.csv"))
+            generate_log(logs[-1], rows >> card, seed=card)
+        size = sum([os.path.getsize(log) for log in logs])
+
+        _, seconds = timed(ingest, [source], os.path.join(directory, "datasets"), {}, 1)
+
+    print("ingest:             " + str(round(size / 1e6)) + " MB on " + str(cards) + " cards ingested in " + str(round(seconds, 2)) + " s (" +
+          str(round(size / seconds / 1e6, 1)) + " MB/s)")
+    return {"ingest_mb_s": size / seconds / 1e6}
+
+# archive a generated daylight log, lossy and lossless, and read it back. Returns the suite metrics: how many times
+# smaller than the dataset the archive is, and MB of dataset encoded and decoded per second
+def bench_archive(rows = ARCHIVE_ROWS):
+    from dataset import csv_to_dataset, open_dataset
+    from archive import archive_file, read_archive
+
+    def size(path):
+        return sum([entry.stat().st_size for entry in os.scandir(path)]) if os.path.isdir(path) else os.path.getsize(path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = os.path.join(directory, "LOG.CSV")
+        generate_daylight_log(log, rows)
+        csv_to_dataset(log, os.path.join(directory, "LOG.ossd"))
+        data = open_dataset(os.path.join(directory, "LOG.ossd"))
+        dataset_size = size(os.path.join(directory, "LOG.ossd"))
+
+        archive = os.path.join(directory, "LOG.ossa")
+        _, encode_seconds = timed(archive_file, os.path.join(directory, "LOG.ossd"), archive)
+        archived, decode_seconds = timed(read_archive, archive)
+        archive_size = size(archive)
+        errors = np.abs(archived["spectra"] - data["spectra"]).max(axis=1) / np.abs(data["spectra"]).max(axis=1)
+
+        archive_file(log, os.path.join(directory, "LOSSLESS.ossa"), 0)
+        lossless_size = size(os.path.join(directory, "LOSSLESS.ossa"))
+
+        print("archive:            " + str(rows) + " datapoints, " + str(round(size(log) / 1e6, 1)) + " MB CSV, " + str(round(dataset_size / 1e6, 1)) +
+              " MB dataset, " + str(round(archive_size / 1e6, 2)) + " MB archived (" + str(round(dataset_size / archive_size, 1)) + " times smaller than the dataset, " +
+              str(round(size(log) / archive_size, 1)) + " than the CSV), largest error " + str(round(errors.max() * 100, 4)) + " % of the peak, mean " +
+              str(round(errors.mean() * 100, 4)) + " %\n" +
+              "                    encoded at " + str(round(dataset_size / encode_seconds / 1e6, 1)) + " MB/s, decoded at " +
+              str(round(dataset_size / decode_seconds / 1e6, 1)) + " MB/s, lossless " + str(round(dataset_size / lossless_size, 1)) + " times smaller")
+
+    return {"archive_ratio": dataset_size / archive_size, "archive_encode_mb_s": dataset_size / encode_seconds / 1e6,
+            "archive_decode_mb_s": dataset_size / decode_seconds / 1e6}
+
+# flag a generated daylight log. Fails with an AssertionError if flagging is slower than QUALITY_MIN_MB_S of CSV.
+# Returns the suite metrics: datapoints flagged per second
+def bench_quality(rows = QUALITY_ROWS):
+    from quality import new_state, flag_columns, count_flags
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = os.path.join(directory, "LOG.CSV")
+        generate_daylight_log(log, rows)
+        columns = parse_log(log)
+        size = os.path.getsize(log)
+
+    flags, seconds = timed(flag_columns, columns, new_state())
+    counts = count_flags(flags)
+    print("quality:            " + str(rows) + " datapoints flagged in " + str(round(seconds * 1000)) + " ms (" + str(round(rows / seconds)) + " datapoints/s, " +
+          str(round(size / seconds / 1e6)) + " MB/s of CSV), " + ", ".join([str(count) + " " + name for name, count in counts.items() if count]))
+    assert size / seconds / 1e6 > QUALITY_MIN_MB_S, "flagging is slower than an export"
+    return {"quality_rows_s": rows / seconds}
+
+# load a generated log through the parse cache cold, then unchanged, then after a day of datapoints was appended.
+# Fails with an AssertionError if loading the unchanged log takes longer than CACHE_WARM_BUDGET. Returns the suite
+# metrics: the seconds loading an unchanged log and loading it after the day was appended take
+def bench_cache(rows = CACHE_ROWS, update_rows = CACHE_UPDATE_ROWS):
+    from cache import load_log
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = os.path.join(directory, "cache")
+        log = os.path.join(directory, "A.CSV")
+        generate_log(log, rows)
+        generate_log(os.path.join(directory, "more.CSV"), update_rows, seed=1, start_time=START_TIME + rows * 60)
+        with open(os.path.join(directory, "more.CSV"), 'rb') as f:
+            more = f.read().split(b"\n", 1)[1]
+
+        _, cold_seconds = timed(load_log, log, store)
+        _, warm_seconds = timed(load_log, log, store)
+        assert warm_seconds < CACHE_WARM_BUDGET, "loading an unchanged log took " + str(round(warm_seconds * 1000)) + " ms"
+
+        with open(log, 'ab') as f:
+            f.write(more)
+        _, update_seconds = timed(load_log, log, store)
+
+    print("cache:              " + str(rows) + " datapoints parsed into the cache in " + str(round(cold_seconds, 2)) + " s, loaded unchanged in " +
+          str(round(warm_seconds * 1000, 1)) + " ms, " + str(update_rows) + " appended datapoints loaded in " + str(round(update_seconds * 1000)) + " ms")
+    return {"cache_warm_s": warm_seconds, "cache_update_s": update_seconds}
+
+# roll up a generated sync file, then time the update for its last day of datapoints. Returns the suite metrics:
+# the seconds one update of a day of datapoints takes
+def bench_rollup(rows = ROLLUP_ROWS):
+    from rollup import update_rollup
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_filename = os.path.join(directory, "LOG.CSV")
+        generate_log(log_filename, rows)
+        with open(log_filename, 'rb') as f:
+            log = f.read()
+
+        sync_filename = os.path.join(directory, "SYNC.CSV")
+        store = os.path.join(directory, "SYNC.rollup")
+        day = log.index(b"\n", len(log) - len(log) // rows * ROLLUP_UPDATE_ROWS) + 1
+        with open(sync_filename, 'wb') as f:
+            f.write(log[:day])
+        update_rollup(store, sync_filename)
+        with open(sync_filename, 'ab') as f:
+            f.write(log[day:])
+        _, seconds = timed(update_rollup, store, sync_filename)
+
+    print("rollup:             " + str(rows) + " datapoints synced, a day of datapoints rolled up in " + str(round(seconds * 1000, 1)) + " ms")
+    return {"rollup_update_s": seconds}
+
+# measure the throughput of the analytics on Planckian spectra scaled at random. Returns the suite metrics: spectra
+# per second for illuminance, CCT and Duv, and for TM-30
+def bench_analytics(rows = ANALYTICS_ROWS):
+    import analytics
+    from analytics import analyze, planck, tm30
+
+    weights = analytics.get_weights(WAVELENGTHS)
+    random = np.random.default_rng(0)
+    spectra = planck(WAVELENGTHS, np.array(ANALYTICS_REFERENCE_CCT, dtype=np.float64))
+    spectra = np.repeat(spectra, -(-rows // len(spectra)), axis=0)[:rows] * random.uniform(0.5, 2, (rows, 1))
+
+    _, seconds = timed(analyze, spectra, ["illuminance", "cct", "duv"])
+    batches = [spectra[start:start + analytics.ANALYTICS_BATCH_ROWS] for start in range(0, rows, analytics.ANALYTICS_BATCH_ROWS)]
+    _, tm30_seconds = timed(lambda: [tm30(batch, weights) for batch in batches])
+
+    print("analytics:          illuminance, CCT and Duv of " + str(rows) + " spectra at " + str(round(rows / seconds)) + " /s, TM-30 at " +
+          str(round(rows / tm30_seconds)) + " /s")
+    return {"analytics_rows_s": rows / seconds, "tm30_rows_s": rows / tm30_seconds}
+
+# probe simulated devices with hello, alone and mixed with ports that never answer, like a first discovery scan.
+# Returns the suite metrics
+def bench_discovery(devices = DISCOVERY_DEVICES, silent = DISCOVERY_SILENT_PORTS):
+    from device import hello_all
+    from discovery import PROBE_TIMEOUT
+
+    process, port_names = start_simulator(devices)
+    silent_ports = [os.openpty() for _ in range(silent)]
+    try:
+        seconds = min([timed(asyncio.run, hello_all(port_names, PROBE_TIMEOUT))[1] for _ in range(DISCOVERY_RUNS)])
+        silent_names = [os.ttyname(slave) for master, slave in silent_ports]
+        _, mixed_seconds = timed(asyncio.run, hello_all(port_names + silent_names, PROBE_TIMEOUT))
+    finally:
+        for fd in [fd for pair in silent_ports for fd in pair]: os.close(fd)
+        stop_simulator(process)
+
+    print("discovery:          " + str(devices) + " devices in " + str(round(seconds * 1000)) + " ms, with " + str(silent) +
+          " silent ports in " + str(round(mixed_seconds * 1000)) + " ms (probe timeout " + str(round(PROBE_TIMEOUT * 1000)) + " ms)")
+    return {"discovery_s": seconds, "discovery_mixed_s": mixed_seconds}
+
+# compare suite results with their baselines. Returns the metrics that regressed by more than tolerance
+def compare_baseline(results, baseline, tolerance = BASELINE_TOLERANCE):
+    regressions = []
+    for metric, value in results.items():
+        if (metric not in baseline):
+            print("%-22s %12.4g  (no baseline)" % (metric, value))
+            continue
+
+        change = value / baseline[metric] - 1
+        worse = -change if METRICS[metric] else change
+        if (worse > tolerance): regressions.append(metric)
+        print("%-22s %12.4g  baseline %12.4g  %+6.1f%%%s" % (metric, value, baseline[metric], change * 100,
+                                                          "  REGRESSION" if worse > tolerance else ""))
+    return regressions
+
+# run every benchmark and compare the results with the stored baseline, or store them as the new baseline.
+# Returns the exit status, 1 if a metric regressed
+def bench_suite(update_baseline = False):
+    results = {}
+    results.update(bench_startup())
+    results.update(bench_parse(SUITE_PARSE_ROWS, compare=False))
+    results.update(bench_index())
+    results.update(bench_merge())
+    results.update(bench_ingest())
+    results.update(bench_archive())
+    results.update(bench_quality())
+    results.update(bench_cache())
+    results.update(bench_rollup())
+    results.update(bench_export())
+    results.update(bench_export(framed=True))
+    results.update(bench_telemetry())
+    results.update(bench_encoding())
+    results.update(bench_monitor())
+    results.update(bench_analytics())
+    results.update(bench_plots())
+    results.update(bench_discovery())
+
+    baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), BASELINE_FILE)
+    if (update_baseline or not os.path.exists(baseline_file)):
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent=1)
+        print("baseline saved to " + baseline_file)
+        return 0
+
+    with open(baseline_file, 'r') as f:
+        regressions = compare_baseline(results, json.load(f))
+    if (regressions): print("regressed: " + ", ".join(regressions))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 1 and sys.argv[1] == "startup"):
+        bench_startup()
+    elif (len(sys.argv) > 1 and sys.argv[1] == "encoding"):
+        bench_encoding(int(sys.argv[2]) if len(sys.argv) > 2 else ENCODING_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "monitor"):
+        bench_monitor()
+    elif (len(sys.argv) > 1 and sys.argv[1] == "index"):
+        bench_index(int(sys.argv[2]) if len(sys.argv) > 2 else INDEX_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "merge"):
+        bench_merge(int(sys.argv[2]) if len(sys.argv) > 2 else MERGE_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "ingest"):
+        bench_ingest(int(sys.argv[2]) if len(sys.argv) > 2 else INGEST_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "archive"):
+        bench_archive(int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "quality"):
+        bench_quality(int(sys.argv[2]) if len(sys.argv) > 2 else QUALITY_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "cache"):
+        bench_cache(int(sys.argv[2]) if len(sys.argv) > 2 else CACHE_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "rollup"):
+        bench_rollup(int(sys.argv[2]) if len(sys.argv) > 2 else ROLLUP_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "telemetry"):
+        bench_telemetry()
+    elif (len(sys.argv) > 1 and sys.argv[1] == "plots"):
+        bench_plots(int(sys.argv[2]) if len(sys.argv) > 2 else PLOTS_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "analytics"):
+        bench_analytics(int(sys.argv[2]) if len(sys.argv) > 2 else ANALYTICS_ROWS)
+    elif (len(sys.argv) > 1 and sys.argv[1] == "suite"):
+        sys.exit(bench_suite("--update-baseline" in sys.argv))
+    else:
+        bench_parse(int(sys.argv[1]) if len(sys.argv) > 1 else BENCH_ROWS)
@@ -0,0 +1,196 @@
+'''
+A cache of parsed log files on disk, so exports and sync files opened again are not parsed from text again.
+
+load_log returns the same columns as logfile.parse_log, memory-mapped from a dataset (see dataset.py) in the cache
+directory, read-only. Each dataset is named after the SHA-256 of the bytes of the file it was parsed from and
+PARSER_VERSION, so a file copied or saved under another name is found too, and a new parser never uses what an
+older one parsed. The cache index remembers the size and modification time of every file loaded, and the content
+of a file that has neither changed since is not hashed again either: it is opened in milliseconds, however large.
+
+A file that grew since it was cached, such as a sync file, or that starts with the whole of a file cached before,
+such as an export of a device that was not erased, is only parsed from the end of the last complete line cached.
+Its dataset is copied, or renamed if no other file uses it, and the new datapoints appended. A line cut off at
+the end of a file is parsed again once it is complete.
+
+The cache holds at most CACHE_MAX_BYTES. Past that, the datasets used least recently are removed.
+
+    from cache import load_log
+    data = load_log("data/SYNC_NSP_A.CSV")
+'''
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from logfile import PARSER_VERSION, PARSE_BLOCK_SIZE, parse_block
+from dataset import DATASET_EXT, HEADER_FILENAME, create_dataset, append_rows, open_dataset, read_header, write_header
+
+# CONSTANTS
+CACHE_DIR = "./data/.cache/"                # where parsed files are cached, next to the files dock.py saves
+CACHE_MAX_BYTES = 4000000000                # the most bytes the cached datasets may take before the oldest are removed
+CACHE_INDEX = "cache.json"                  # the index of cached datasets and files, in the cache directory
+HASH_BLOCK_SIZE = 16777216                  # how many bytes to hash at a time
+PART_EXT = ".part"                          # suffix of a dataset while it is being written
+
+def read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, CACHE_INDEX), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"entries": {}, "files": {}}
+
+# write the index and atomically replace the old one
+def write_index(cache_dir, index):
+    filename = os.path.join(cache_dir, CACHE_INDEX)
+    with open(filename + PART_EXT, 'w') as f:
+        json.dump(index, f)
+    os.replace(filename + PART_EXT, filename)
+
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key + DATASET_EXT)
+
+# the key of a dataset parsed from bytes with a SHA-256 digest
+def content_key(digest):
+    return digest + "-" + str(PARSER_VERSION)
+
+# add the bytes of f from its position up to end to a hash
+def hash_bytes(f, end, hasher):
+    while (f.tell() < end):
+        data = f.read(min(HASH_BLOCK_SIZE, end - f.tell()))
+        if not data: break
+        hasher.update(data)
+    return hasher
+
+# the bytes on disk of a dataset
+def disk_bytes(path):
+    return sum([entry.stat().st_size for entry in os.scandir(path)])
+
+# the cached dataset whose file the open file f starts with, if any, the longest first. Candidates are found by a
+# CRC-32 of their last bytes (see timeindex.fingerprint), then checked with the hash of everything before. Returns
+# (its key or None, a hash of f up to its size, or of nothing)
+def find_prefix(cache_dir, index, f, size):
+    from timeindex import fingerprint
+
+    candidates = sorted([(entry["size"], key) for key, entry in index["entries"].items()
+                         if key.endswith("-" + str(PARSER_VERSION)) and 0 < entry["size"] <= size and fingerprint(f, entry["size"]) == entry["fingerprint"] and
+                         os.path.exists(os.path.join(entry_path(cache_dir, key), HEADER_FILENAME))])
+    hasher = hashlib.sha256()
+    f.seek(0)
+    found = None
+    for prefix, key in candidates:
+        hash_bytes(f, prefix, hasher)
+        if (content_key(hasher.copy().hexdigest()) == key): found = (key, hasher.copy())
+
+    if found is None:
+        f.seek(0)
+        return None, hashlib.sha256()
+    f.seek(index["entries"][found[0]]["size"])
+    return found
+
+# parse the bytes of f from start to end and append them to a dataset. The datapoints after the last line break are
+# appended too, as parse_log would. Returns (the offset after the last line break, the rows appended after it)
+def parse_into(path, f, start, end, block_size = PARSE_BLOCK_SIZE):
+    f.seek(start)
+    position = start
+    carry = b""
+    while (position + len(carry) < end):
+        data = carry + f.read(min(block_size, end - position - len(carry)))
+        cut = data.rfind(b"\n") + 1
+        carry = data[cut:]
+        if (cut == 0): continue
+
+        columns = parse_block(data[:cut])
+        position += cut
+        if (len(columns["timestamp"]) > 0): append_rows(path, columns)
+
+    columns = parse_block(carry)
+    if (len(columns["timestamp"]) > 0): append_rows(path, columns)
+    return position, len(columns["timestamp"])
+
+# remove the datasets used least recently until the cache holds at most max_bytes, keeping the one with key keep
+def evict(cache_dir, index, max_bytes, keep = None):
+    total = sum([entry["disk"] for entry in index["entries"].values()])
+    for used, key in sorted([(entry["used"], key) for key, entry in index["entries"].items() if key != keep]):
+        if (total <= max_bytes): break
+        total -= index["entries"].pop(key)["disk"]
+        shutil.rmtree(entry_path(cache_dir, key), ignore_errors=True)
+
+    index["files"] = {name: state for name, state in index["files"].items() if state["key"] in index["entries"]}
+
+# the columns of a log file, see logfile.parse_log, read from the cache, parsing only what is not cached yet.
+# The arrays are read-only memory maps of the cached dataset
+def load_log(filename, cache_dir = CACHE_DIR, max_bytes = CACHE_MAX_BYTES):
+    from timeindex import fingerprint
+
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    index = read_index(cache_dir)
+
+    # unchanged since it was loaded last, by this parser
+    known = index["files"].get(filename)
+    if (known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns and known["key"] in index["entries"] and
+        known["key"].endswith("-" + str(PARSER_VERSION)) and
+        os.path.exists(os.path.join(entry_path(cache_dir, known["key"]), HEADER_FILENAME))):
+        key = known["key"]
+    else:
+        with open(filename, 'rb') as f:
+            size = stat.st_size
+            base, hasher = find_prefix(cache_dir, index, f, size)
+            key = content_key(hash_bytes(f, size, hasher).hexdigest())
+
+            if (key not in index["entries"] or not os.path.exists(os.path.join(entry_path(cache_dir, key), HEADER_FILENAME))):
+                part = entry_path(cache_dir, key) + PART_EXT
+                shutil.rmtree(part, ignore_errors=True)
+                start = 0
+                if base:
+                    # a dataset no other file uses is taken over. The datapoints after its last line break are dropped,
+                    # that line may have been cut off
+                    previous = index["entries"][base]
+                    if (any([state["key"] == base for name, state in index["files"].items() if name != filename])):
+                        shutil.copytree(entry_path(cache_dir, base), part)
+                    else:
+                        os.replace(entry_path(cache_dir, base), part)
+                        index["entries"].pop(base)
+                    header = read_header(part)
+                    header["rows"] -= previous["tail_rows"]
+                    write_header(part, header)
+                    start = previous["lines_end"]
+                else:
+                    create_dataset(part)
+
+                lines_end, tail_rows = parse_into(part, f, start, size)
+                shutil.rmtree(entry_path(cache_dir, key), ignore_errors=True)
+                os.replace(part, entry_path(cache_dir, key))
+                index["entries"][key] = {"size": size, "fingerprint": fingerprint(f, size), "lines_end": lines_end, "tail_rows": tail_rows,
+                                         "rows": read_header(entry_path(cache_dir, key))["rows"], "disk": disk_bytes(entry_path(cache_dir, key))}
+
+    index["entries"][key]["used"] = time.time()
+    index["files"][filename] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "key": key}
+    evict(cache_dir, index, max_bytes, key)
+    write_index(cache_dir, index)
+    return open_dataset(entry_path(cache_dir, key))
+
+# remove every cached dataset
+def clear(cache_dir = CACHE_DIR):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    import sys
+
+    if (len(sys.argv) < 2):
+        print("Usage: python cache.py LOG.CSV [LOG.CSV ...]   parse log files into the cache, or update them\n" +
+              "       python cache.py --clear               empty the cache\n" +
+              "The cache is in " + CACHE_DIR + " and holds at most " + str(round(CACHE_MAX_BYTES / 1e9, 1)) + " GB")
+        exit(1)
+
+    if (sys.argv[1] == "--clear"):
+        clear()
+        print("cache cleared")
+    else:
+        for filename in sys.argv[1:]:
+            start_time = time.perf_counter()
+            rows = len(load_log(filename)["timestamp"])
+            print(filename + ": " + str(rows) + " datapoints in " + str(round(time.perf_counter() - start_time, 3)) + " s")
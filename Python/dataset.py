@@ -0,0 +1,164 @@
+'''
+Columnar, memory-mappable dataset format for exported OSS datapoints.
+
+A dataset is a directory (name + DATASET_EXT) holding a small JSON header and one raw little-endian
+file per column. The spectra are stored as an N x 135 float32 matrix, and the metadata columns are
+typed arrays of length N. Every file can be opened with numpy.memmap, so years of captures can be
+analysed without parsing text or loading everything into memory.
+
+Rows are appended by writing the column files first and then updating the row count in the header,
+so a dataset interrupted while appending still opens with the rows that were committed.
+'''
+
+import json
+import os
+import numpy as np
+
+from logfile import WAVELENGTHS, CIE_PRECISION, COLUMN_TYPES, SPECTRA_TYPE, file_header, format_timestamp, parse_block, read_blocks
+
+# CONSTANTS
+DATASET_FORMAT = "oss-dataset"              # format name stored in the header
+DATASET_VERSION = 1                         # format version stored in the header
+DATASET_EXT = ".ossd"                       # dataset directory extension
+HEADER_FILENAME = "header.json"             # the header file inside a dataset
+COLUMN_EXT = ".bin"                         # extension of the raw column files
+
+# the path of a column file inside a dataset
+def column_path(path, column):
+    return os.path.join(path, column + COLUMN_EXT)
+
+def read_header(path):
+    with open(os.path.join(path, HEADER_FILENAME), 'r') as f:
+        header = json.load(f)
+
+    if (header.get("format") != DATASET_FORMAT):
+        raise ValueError(path + " is not an OSS dataset")
+    if (header.get("version", 0) > DATASET_VERSION):
+        raise ValueError(path + " was written by a newer version (" + str(header["version"]) + ")")
+
+    return header
+
+# write the header next to the columns and atomically replace the old one
+def write_header(path, header):
+    header_filename = os.path.join(path, HEADER_FILENAME)
+    with open(header_filename + ".part", 'w') as f:
+        json.dump(header, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(header_filename + ".part", header_filename)
+
+# create an empty dataset with the given metadata columns and their types. Returns its header
+def create_dataset(path, wavelengths = WAVELENGTHS, columns = COLUMN_TYPES):
+    os.makedirs(path, exist_ok=True)
+
+    header = {
+        "format": DATASET_FORMAT,
+        "version": DATASET_VERSION,
+        "rows": 0,
+        "wavelengths": [int(w) for w in wavelengths],
+        "columns": dict(columns),
+        "spectra": SPECTRA_TYPE,
+    }
+
+    for column in list(columns.keys()) + ["spectra"]:
+        open(column_path(path, column), 'wb').close()
+
+    write_header(path, header)
+    return header
+
+# memory-map every column of a dataset. Returns a dict of arrays, with the spectra matrix under
+# "spectra" and the wavelength axis under "wavelengths"
+def open_dataset(path, mode = 'r'):
+    header = read_header(path)
+    rows = header["rows"]
+    n_wavelengths = len(header["wavelengths"])
+
+    data = {"wavelengths": np.array(header["wavelengths"], dtype=np.int32)}
+
+    for column, dtype in header["columns"].items():
+        data[column] = map_column(column_path(path, column), dtype, (rows,), mode)
+
+    data["spectra"] = map_column(column_path(path, "spectra"), header["spectra"], (rows, n_wavelengths), mode)
+    return data
+
+# numpy cannot memory-map an empty file
+def map_column(filename, dtype, shape, mode):
+    if (shape[0] == 0): return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode=mode, shape=shape)
+
+# append rows to a dataset. columns is a dict with an array for every metadata column and the spectra
+def append_rows(path, columns):
+    header = read_header(path)
+    rows = header["rows"]
+    n = len(columns["timestamp"])
+
+    spectra = np.asarray(columns["spectra"], dtype=header["spectra"])
+    if (spectra.shape != (n, len(header["wavelengths"]))):
+        raise ValueError("spectra shape " + str(spectra.shape) + " does not match the dataset wavelengths")
+
+    for column, dtype in list(header["columns"].items()) + [("spectra", header["spectra"])]:
+        values = spectra if column == "spectra" else np.asarray(columns[column], dtype=dtype)
+
+        # drop anything past the committed rows, left over from an interrupted append
+        with open(column_path(path, column), 'r+b') as f:
+            f.truncate(rows * np.dtype(dtype).itemsize * (spectra.shape[1] if column == "spectra" else 1))
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(values).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    header["rows"] = rows + n
+    write_header(path, header)
+    return header["rows"]
+
+# convert an exported CSV file into a dataset. Returns the number of rows in the dataset
+def csv_to_dataset(csv_filename, path = None):
+    if (path is None): path = os.path.splitext(csv_filename)[0] + DATASET_EXT
+    create_dataset(path)
+
+    rows = 0
+    for block in read_blocks(csv_filename):
+        columns = parse_block(block)
+        if (len(columns["timestamp"]) > 0): rows = append_rows(path, columns)
+
+    return rows
+
+# format one dataset row as a CSV line in the device layout. Spectra are written with 9 significant
+# digits, which is enough to read back the exact float32 value
+def format_row(data, i):
+    date, clock = format_timestamp(data["timestamp"][i])
+    cie = "%." + str(CIE_PRECISION) + "f"
+    line = (date + "," + clock + "," + str(int(data["manual"][i])) + "," + str(int(data["int_time"][i])) + "," +
+            str(int(data["frame_avg"][i])) + "," + str(int(data["ae"][i])) + "," + str(int(data["quality"][i])) + "," +
+            cie % data["x"][i] + "," + cie % data["y"][i] + "," + cie % data["z"][i] + ",")
+    return line + ",".join(["%.9g" % v for v in data["spectra"][i].tolist()]) + ",\n"
+
+# write a dataset back out as a CSV file in the device layout
+def dataset_to_csv(path, csv_filename):
+    data = open_dataset(path)
+
+    with open(csv_filename, 'w', buffering=1048576) as f:
+        f.write(file_header())
+        for i in range(len(data["timestamp"])):
+            f.write(format_row(data, i))
+
+    return len(data["timestamp"])
+
+if __name__ == "__main__":
+    import sys
+
+    if (len(sys.argv) < 2):
+        print("Usage: python dataset.py EXPORT.CSV [DATASET" + DATASET_EXT + "]\n" +
+              "       python dataset.py DATASET" + DATASET_EXT + " EXPORT.CSV")
+        exit(1)
+
+    if (sys.argv[1].rstrip("/\\").endswith(DATASET_EXT)):
+        if (len(sys.argv) < 3):
+            print("Enter the CSV file to write the dataset to.")
+            exit(1)
+        rows = dataset_to_csv(sys.argv[1], sys.argv[2])
+        print(str(rows) + " datapoints written to " + sys.argv[2])
+    else:
+        path = sys.argv[2] if len(sys.argv) > 2 else None
+        rows = csv_to_dataset(sys.argv[1], path)
+        print(str(rows) + " datapoints converted.")
@@ -0,0 +1,681 @@
+'''
+Asyncio client for the OSS device serial protocol.
+
+A command is two digits from the commands table, optionally followed by an argument, ended by a line break.
+The device answers with lines: "DATA", the reply values, then "OK". Commands without a reply value only answer
+"OK", and a command that fails answers with a line starting with "ERR". Exports and syncs answer "DATA", the
+number of bytes that follow, the raw bytes of the log, then "OK".
+
+Framed exports (EXPORT_CHUNKS, "16_<first chunk>_<number of chunks>") answer "DATA", the log size and the chunk
+size, then one frame per chunk of the log and an empty frame numbered FRAME_END, then "OK". A frame is FRAME_MAGIC,
+the chunk number and payload length, the payload, and the CRC-32 of everything after FRAME_MAGIC. Chunks that are
+lost or corrupted on the way are simply asked for again. Firmware without framed exports answers "Err '16...'".
+A framed export can also ask for an encoding from encoding.py, "16_<first chunk>_<number of chunks>_<encoding>",
+when the device lists it in reply to _GET_ENCODINGS. Each frame then holds the encoded lines that start in its chunk.
+
+    async with Device(port_name) as device:
+        status = await device.hello()
+        await device.request("SET_COLLECTION_INTERVAL", "_60000")
+
+Devices do not need a thread each. A whole rack of sensors can be driven from one event loop:
+
+    statuses = await asyncio.gather(*[device.hello() for device in devices])
+
+DeviceThread runs that event loop in a background thread for code that is not async, like dock.py, and
+BlockingDevice gives it blocking, pyserial-like access to a Device.
+'''
+
+import asyncio
+import time
+import zlib
+import struct
+import serial
+import serial_asyncio
+import telemetry
+from threading import Thread
+
+# CONSTANTS
+BAUDRATE = 921600                           # baudrate
+COMMAND_TIMEOUT = 10                        # seconds to wait for a reply (should be a few seconds longer than device sleep time)
+DISCARD_TIMEOUT = 0.05                      # how long the line must stay quiet before leftover bytes are considered discarded
+CLOSE_TIMEOUT = 1                           # seconds to wait for the serial port to close
+TRANSFER_CHUNK_SIZE = 16384                 # how many bytes to read at a time during a stream
+PIPELINE_DEPTH = 4                          # how many commands request_all sends ahead of their replies
+PROGRESS_INTERVAL = 0.25                    # minimum seconds between progress callbacks during a stream
+STALL_GAP = 0.1                             # seconds without a byte during a transfer before the line counts as stalled
+END_MARKER = b"OK"                          # the marker the device sends after a streamed file
+CHUNKS_PER_REQUEST = 256                    # how many chunks a framed export asks for at a time (1 MB)
+CHUNK_RETRIES = 5                           # how many times chunks that did not arrive intact are asked for again
+FRAME_TIMEOUT = 1                           # seconds without a frame before the rest of a framed reply is considered lost
+FRAME_MAGIC = b"\xa5\x5a"                   # the bytes every frame starts with
+FRAME_HEADER = struct.Struct("<2sIH")       # FRAME_MAGIC, chunk number, payload length
+FRAME_CRC = struct.Struct("<I")             # CRC-32 of the chunk number, payload length and payload
+FRAME_END = 0xFFFFFFFF                      # the chunk number of the empty frame that ends a framed reply
+MAX_ENCODED_LENGTH = 65535                  # the longest payload of an encoded frame, encoded chunks vary in length
+
+# Instructions that the OSS device understands
+commands = {
+    "TOGGLE_DATA_CAPTURE": "00",
+    "MANUAL_CAPTURE": "01",
+    "EXPORT_ALL": "02",
+    "SYNC_DATAPOINTS": "15",
+    "EXPORT_CHUNKS": "16",
+    "ERASE_STORAGE": "14",
+    "SET_COLLECTION_INTERVAL": "04",
+    "SET_DEVICE_NAME": "08",
+    "SET_CALIBRATION_FACTOR": "11",
+    "RESET_DEVICE": "03",
+
+    "_START_RECORDING": "12",
+    "_STOP_RECORDING": "13",
+    "_SET_DATETIME": "05",
+    "_SAY_HELLO": "07",
+    "_GET_INFO": "09",
+    "_NSP_SETTINGS": "10",
+    "_SET_START_TIME": "17",
+    "_SET_STOP_TIME": "18",
+    "_GET_ENCODINGS": "19",
+    "_PREVIEW_CAPTURE": "20",
+}
+
+# the device answered with an error, stopped answering, or could not be opened
+class DeviceError(Exception):
+    pass
+
+# the device did not answer in time
+class DeviceTimeout(DeviceError):
+    pass
+
+# buffers everything the serial transport receives for a Device, and adds up the gaps of more than STALL_GAP
+# between the bytes it receives
+class DeviceProtocol(asyncio.Protocol):
+    def __init__(self):
+        self.buffer = bytearray()
+        self.received = asyncio.Event()
+        self.connected = True
+        self.last_received = time.perf_counter()
+        self.stall_seconds = 0
+
+    def data_received(self, data):
+        now = time.perf_counter()
+        if (now - self.last_received > STALL_GAP): self.stall_seconds += now - self.last_received
+        self.last_received = now
+        self.buffer += data
+        self.received.set()
+
+    # start adding up stalls from now
+    def reset_stalls(self):
+        self.last_received = time.perf_counter()
+        self.stall_seconds = 0
+
+    # the seconds the line was stalled since reset_stalls(), including a stall still going on
+    def stalled(self):
+        gap = time.perf_counter() - self.last_received
+        return self.stall_seconds + (gap if gap > STALL_GAP else 0)
+
+    def connection_lost(self, exc):
+        self.connected = False
+        self.received.set()
+
+# one OSS device on a serial port or pyserial URL. Requests to the same device are sent one at a time.
+# Streams (exports and syncs) are not locked, so they must not run while other requests to the same device do
+class Device:
+    def __init__(self, port_name, baudrate = BAUDRATE, timeout = COMMAND_TIMEOUT):
+        self.port = port_name
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.transport = None
+        self.protocol = None
+        self.lock = asyncio.Lock()
+        self.status = None                  # the last reply to hello()
+        self.transfer = None                # (file_size, chunk_size, chunks received, encoding, start time) of the framed export in progress
+
+    # open the serial port. Opening some ports blocks for seconds, so it runs in a worker thread and gives up after
+    # timeout seconds instead of holding up every other device on the event loop
+    async def open(self, timeout = None):
+        loop = asyncio.get_running_loop()
+        try:
+            serial_instance = await asyncio.wait_for(
+                loop.run_in_executor(None, lambda: serial.serial_for_url(self.port, baudrate=self.baudrate)),
+                self.timeout if timeout is None else timeout)
+            self.transport, self.protocol = await serial_asyncio.connection_for_serial(loop, DeviceProtocol, serial_instance)
+        except asyncio.TimeoutError:
+            raise DeviceTimeout("Could not open " + self.port + " in time")
+        except (serial.SerialException, OSError, ValueError) as e:
+            raise DeviceError("Could not open " + self.port + ": " + str(e))
+        return self
+
+    async def close(self):
+        if (self.transport is None): return
+        self.transport.close()
+        await self.wait(lambda: not self.protocol.connected, CLOSE_TIMEOUT)
+        self.transport = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def in_waiting(self):
+        return len(self.protocol.buffer)
+
+    # wait until ready() is true. Returns False if timeout seconds pass or the device disconnects first
+    async def wait(self, ready, timeout = None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.timeout if timeout is None else timeout)
+
+        while not ready():
+            remaining = deadline - loop.time()
+            if (not self.protocol.connected or remaining <= 0): return False
+
+            self.protocol.received.clear()
+            try:
+                await asyncio.wait_for(self.protocol.received.wait(), remaining)
+            except asyncio.TimeoutError:
+                return ready()
+
+        return True
+
+    # take n bytes off the front of the receive buffer
+    def take(self, n):
+        data = bytes(self.protocol.buffer[:n])
+        del self.protocol.buffer[:n]
+        return data
+
+    # read a line including its line break. Returns what was received so far if the line does not end in time
+    async def readline(self, timeout = None):
+        await self.wait(lambda: b"\n" in self.protocol.buffer, timeout)
+        end = self.protocol.buffer.find(b"\n") + 1
+        return self.take(end if end > 0 else len(self.protocol.buffer))
+
+    # read n bytes. Returns fewer if they do not all arrive in time
+    async def read(self, n, timeout = None):
+        await self.wait(lambda: len(self.protocol.buffer) >= n, timeout)
+        return self.take(n)
+
+    # read into a writable buffer. Returns how many bytes were read, fewer than len(view) if they do not all arrive in time
+    async def readinto(self, view, timeout = None):
+        await self.wait(lambda: len(self.protocol.buffer) >= len(view), timeout)
+        n = min(len(view), len(self.protocol.buffer))
+        view[:n] = self.protocol.buffer[:n]
+        del self.protocol.buffer[:n]
+        return n
+
+    # throw away everything received until the line has been quiet for timeout seconds,
+    # like the rest of a reply that is no longer wanted
+    async def discard(self, timeout = DISCARD_TIMEOUT):
+        while True:
+            self.protocol.buffer.clear()
+            if (not await self.wait(lambda: len(self.protocol.buffer) > 0, timeout)): return
+
+    # frame a command from the commands table and write it without waiting for the reply
+    def send(self, command, argument = ""):
+        self.transport.write(bytes(commands[command] + str(argument) + "\n", "utf-8"))
+
+    # read a reply up to its OK. Returns the reply values, the lines between DATA and OK. Raises DeviceError if
+    # the device answers with an error, or DeviceTimeout if the reply does not arrive within timeout seconds
+    async def read_reply(self, timeout = None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.timeout if timeout is None else timeout)
+        values = []
+        data = False
+
+        while True:
+            line = await self.readline(max(deadline - loop.time(), 0))
+            if (not line.endswith(b"\n")):
+                await self.discard()
+                raise DeviceTimeout(self.port + " did not reply in time")
+
+            line = line.decode("utf-8", "replace").strip()
+            if (line.lower() == "ok"): return values
+
+            if (line.lower().startswith("err")):
+                raise DeviceError(self.port + " replied " + line)
+
+            if (line == "DATA" and not data):
+                data = True
+            else:
+                values.append(line)
+
+    # read the reply to a command sent at start_time and record its round trip, see telemetry.py. Returns the reply
+    # values, see read_reply
+    async def timed_reply(self, command, start_time, timeout = None):
+        outcome = "timeout"
+        try:
+            values = await self.read_reply(timeout)
+            outcome = "ok"
+            return values
+        except DeviceTimeout:
+            raise
+        except DeviceError:
+            outcome = "error"
+            raise
+        finally:
+            telemetry.record_command(self.port, command, time.perf_counter() - start_time, outcome)
+
+    # send a command and wait for its reply. Returns the reply values, see read_reply
+    async def request(self, command, argument = "", timeout = None):
+        async with self.lock:
+            start_time = time.perf_counter()
+            self.send(command, argument)
+            return await self.timed_reply(command, start_time, timeout)
+
+    # send several commands back to back and match their replies in order. requests is a list of (command, argument).
+    # Up to depth commands are sent ahead, and every reply lets the next command go out, so the device never waits
+    # for a round trip. Returns a list with the reply values of each command, or the DeviceError it failed with.
+    # A reply that does not arrive in time fails that command and every command after it
+    async def request_all(self, requests, timeout = None, depth = PIPELINE_DEPTH):
+        results = []
+        sent_times = []
+
+        async with self.lock:
+            for i in range(len(requests)):
+                while (len(sent_times) < len(requests) and len(sent_times) < i + depth):
+                    sent_times.append(time.perf_counter())
+                    self.send(*requests[len(sent_times) - 1])
+
+                try:
+                    results.append(await self.timed_reply(requests[i][0], sent_times[i], timeout))
+                except DeviceTimeout as e:
+                    results += [e] + [DeviceTimeout(self.port + " did not confirm " + command)
+                                      for command, argument in requests[i + 1:]]
+                    break
+                except DeviceError as e:
+                    results.append(e)
+
+        return results
+
+    # ask the device for its name and status. Returns a dict with "port_name", "device_name", "logging_interval",
+    # "data_counter" and "device_status" ('1' when recording)
+    async def hello(self, timeout = None):
+        values = await self.request("_SAY_HELLO", timeout=timeout)
+
+        try:
+            device_name, logging_interval, device_status, data_counter = values
+            self.status = {"port_name": self.port,
+                           "device_name": device_name,
+                           "logging_interval": int(logging_interval),
+                           "data_counter": int(data_counter),
+                           "device_status": device_status}
+        except ValueError:
+            raise DeviceError(self.port + " is not an OSS device")
+
+        return self.status
+
+    # set the device clock. date is YYYYMMDDhhmmss
+    async def set_datetime(self, date, timeout = None):
+        await self.request("_SET_DATETIME", date, timeout)
+
+    # set when the device starts and stops recording by itself, start and stop as YYYYMMDDhhmmss in device time,
+    # None for no timed start or stop. The stop is sent first, so a start that is already due never meets the stop
+    # of an older window. Raises DeviceTimeout on firmware without timed start and stop, which does not answer them
+    async def set_window(self, start, stop, timeout = None):
+        await self.request("_SET_STOP_TIME", "_" + (stop or "0"), timeout)
+        await self.request("_SET_START_TIME", "_" + (start or "0"), timeout)
+
+    # send a command that answers with a streamed file (exports and syncs). Returns how many bytes will follow,
+    # -1 if a sync starts past the end of the device log. Read the bytes with stream(). The round trip is recorded
+    # up to the file size, and stalls are counted from the request
+    async def request_stream(self, command, argument = "", timeout = None):
+        start_time = time.perf_counter()
+        self.protocol.reset_stalls()
+        self.send(command, argument)
+
+        header = await self.readline(timeout)
+        if (header.strip().lower() != b"data"):
+            telemetry.record_command(self.port, command, time.perf_counter() - start_time, "error" if header.endswith(b"\n") else "timeout")
+            await self.discard()
+            raise DeviceError(self.port + " could not open its log file")
+
+        size = await self.readline(timeout)
+        try:
+            size = int(size)
+        except ValueError:
+            telemetry.record_command(self.port, command, time.perf_counter() - start_time, "error")
+            await self.discard()
+            raise DeviceError(self.port + " sent an invalid file size")
+
+        telemetry.record_command(self.port, command, time.perf_counter() - start_time)
+        return size
+
+    # receive a streamed file of file_size bytes followed by END_MARKER, yielding the payload in chunks as it arrives.
+    # Each read waits at most timeout seconds, so a device that stops sending ends the stream instead of stalling it.
+    # The last bytes are held back until the stream ends so an early END_MARKER is never yielded as data.
+    # status is filled in with "bytes", "elapsed", "complete" and "stall_seconds", the time the line was quiet
+    # for more than STALL_GAP since request_stream(). progress is called with
+    # (bytes_received, file_size, start_time) at most every PROGRESS_INTERVAL seconds and when the stream ends
+    async def stream(self, file_size, status, progress = None, timeout = None):
+        buffer = bytearray(TRANSFER_CHUNK_SIZE)
+        view = memoryview(buffer)
+        expected = file_size + len(END_MARKER)
+        received = 0
+        pending = b""
+        tail = b""
+
+        status["bytes"] = 0
+        status["complete"] = False
+
+        start_time = time.perf_counter()
+        last_progress = start_time
+
+        while received < expected:
+            n = await self.readinto(view[:min(TRANSFER_CHUNK_SIZE, expected - received)], timeout)
+
+            # timed out, the device stopped sending
+            if not n: break
+
+            # everything up to file_size is payload, the rest is the end marker
+            payload = min(n, max(file_size - received, 0))
+            received += n
+
+            # remember the last bytes of the stream so a marker split across reads is still found
+            tail = (tail + bytes(view[max(0, n - len(END_MARKER)):n]))[-len(END_MARKER):]
+
+            if (payload > 0):
+                chunk = pending + bytes(view[:payload])
+                pending = chunk[-len(END_MARKER):]
+                if (len(chunk) > len(END_MARKER)):
+                    status["bytes"] += len(chunk) - len(END_MARKER)
+                    yield chunk[:-len(END_MARKER)]
+
+            now = time.perf_counter()
+            if (progress and now - last_progress >= PROGRESS_INTERVAL):
+                progress(min(received, file_size), file_size, start_time)
+                last_progress = now
+
+        status["complete"] = received == expected and tail == END_MARKER
+
+        # the held back bytes are data unless the device ended the stream early with the marker
+        if (pending and (status["complete"] or received > file_size or tail != END_MARKER)):
+            status["bytes"] += len(pending)
+            yield pending
+
+        status["elapsed"] = time.perf_counter() - start_time
+        status["stall_seconds"] = self.protocol.stalled()
+        if (progress): progress(status["bytes"], file_size, start_time)
+
+    # read the next intact frame, skipping anything that is not one. Returns (chunk number, payload),
+    # or None if no intact frame arrives within timeout seconds
+    async def read_frame(self, max_length, timeout = FRAME_TIMEOUT):
+        buffer = self.protocol.buffer
+        while True:
+            if (not await self.wait(lambda: len(buffer) >= FRAME_HEADER.size, timeout)): return None
+
+            start = buffer.find(FRAME_MAGIC)
+            if (start < 0):
+                # keep the last byte, it may be the start of FRAME_MAGIC
+                del buffer[:len(buffer) - 1]
+                continue
+            del buffer[:start]
+
+            if (not await self.wait(lambda: len(buffer) >= FRAME_HEADER.size, timeout)): return None
+            _, chunk, length = FRAME_HEADER.unpack_from(buffer)
+            end = FRAME_HEADER.size + length + FRAME_CRC.size
+
+            if (length <= max_length):
+                if (not await self.wait(lambda: len(buffer) >= end, timeout)): return None
+                if (zlib.crc32(buffer[2:end - FRAME_CRC.size]) == FRAME_CRC.unpack_from(buffer, end - FRAME_CRC.size)[0]):
+                    payload = bytes(buffer[FRAME_HEADER.size:end - FRAME_CRC.size])
+                    del buffer[:end]
+                    return chunk, payload
+
+            # a corrupted frame, or FRAME_MAGIC inside a payload. Look for the next frame
+            del buffer[:1]
+
+    # read the reply to an EXPORT_CHUNKS request. Returns (file_size, chunk_size, chunks), chunks maps the number of
+    # every chunk that arrived intact to its payload. Raises DeviceError if the device could not open its log, or
+    # does not support framed exports
+    async def read_chunks(self, timeout = None, encoded = False):
+        header = await self.readline(timeout)
+        if (header.strip().lower() != b"data"):
+            await self.discard()
+            if (header.startswith(b"Err '")): raise DeviceError(self.port + " does not support framed exports")
+            raise DeviceError(self.port + " could not open its log file")
+
+        try:
+            file_size = int(await self.readline(timeout))
+            chunk_size = int(await self.readline(timeout))
+        except ValueError:
+            await self.discard()
+            raise DeviceError(self.port + " sent an invalid framed export header")
+
+        chunks = {}
+        while True:
+            frame = await self.read_frame(MAX_ENCODED_LENGTH if encoded else chunk_size)
+            if (frame is None):
+                # the end of the reply was lost, throw away whatever is left of it
+                await self.discard()
+                break
+
+            chunk, payload = frame
+            if (chunk == FRAME_END):
+                await self.readline(FRAME_TIMEOUT)
+                break
+            chunks[chunk] = payload
+
+        return file_size, chunk_size, chunks
+
+    # the encodings the device can send framed exports in, see encoding.py. Firmware that does not know
+    # _GET_ENCODINGS only sends CSV
+    async def encodings(self, timeout = None):
+        try:
+            values = await self.request("_GET_ENCODINGS", timeout=timeout)
+        except DeviceTimeout:
+            raise
+        except DeviceError:
+            return ["CSV"]
+
+        return values[0].split(",") if values else ["CSV"]
+
+    # send an EXPORT_CHUNKS request for count chunks from first, sent in encoding
+    def send_chunked(self, first, count, encoding = "CSV"):
+        self.send("EXPORT_CHUNKS", "_" + str(first) + "_" + str(count) + ("" if encoding == "CSV" else "_" + encoding))
+
+    # check that the device supports framed exports by asking for no chunks, which starts no transfer. Returns the
+    # log size. Raises DeviceError if it does not, or if the device could not open its log
+    async def probe_framed(self, timeout = None):
+        self.send_chunked(0, 0)
+        return (await self.read_chunks(timeout))[0]
+
+    # start a framed export: ask for the first count chunks of the log in an encoding the device supports. Returns
+    # the log size, read the log with chunked_stream(). Raises DeviceError if the device does not support framed
+    # exports, or if it could not open its log
+    async def request_chunked(self, count = CHUNKS_PER_REQUEST, timeout = None, encoding = "CSV"):
+        start_time = time.perf_counter()
+        self.protocol.reset_stalls()
+        self.send_chunked(0, count, encoding)
+        self.transfer = await self.read_chunks(timeout, encoding != "CSV") + (encoding, start_time)
+        return self.transfer[0]
+
+    # receive the log of a framed export started with request_chunked(), yielding it in order, one window of
+    # CHUNKS_PER_REQUEST chunks at a time. Chunks that did not arrive intact are asked for again, up to CHUNK_RETRIES
+    # times per window, and the next window is asked for before the current one is yielded. status and progress
+    # are the same as for stream(), status also gets "retries", the number of chunks asked for again, and
+    # "wire_bytes", the size of the payloads received. Encoded payloads are yielded as they arrived, "bytes" then
+    # counts the bytes of the log they cover
+    async def chunked_stream(self, status, progress = None, timeout = None):
+        file_size, chunk_size, chunks, encoding, start_time = self.transfer
+        encoded = encoding != "CSV"
+        total = -(-file_size // chunk_size)
+        first = 0
+
+        status["bytes"] = 0
+        status["wire_bytes"] = 0
+        status["retries"] = 0
+        status["complete"] = False
+        last_progress = start_time
+
+        while first < total:
+            window = range(first, min(first + CHUNKS_PER_REQUEST, total))
+
+            for attempt in range(CHUNK_RETRIES + 1):
+                # the last chunk may have grown since the export started, but no chunk can be shorter than expected.
+                # Encoded chunks have no expected length, the CRC of their frame is all there is to check
+                missing = [chunk for chunk in window if (chunk not in chunks or
+                           (not encoded and len(chunks[chunk]) < min(chunk_size, file_size - chunk * chunk_size)))]
+                if (not missing or attempt == CHUNK_RETRIES): break
+
+                status["retries"] += len(missing)
+                for start, count in chunk_runs(missing):
+                    self.send_chunked(start, count, encoding)
+                    try:
+                        chunks.update((await self.read_chunks(timeout, encoded))[2])
+                    except DeviceError:
+                        pass
+
+            if (missing): break
+
+            # let the device send the next window while this one is being written
+            first = window.stop
+            if (first < total): self.send_chunked(first, CHUNKS_PER_REQUEST, encoding)
+
+            for chunk in window:
+                payload = chunks.pop(chunk)
+                if (not encoded): payload = payload[:file_size - chunk * chunk_size]
+                status["bytes"] += min(chunk_size, file_size - chunk * chunk_size)
+                status["wire_bytes"] += len(payload)
+                yield payload
+
+            if (first < total):
+                try:
+                    chunks.update((await self.read_chunks(timeout, encoded))[2])
+                except DeviceError:
+                    pass
+
+            now = time.perf_counter()
+            if (progress and now - last_progress >= PROGRESS_INTERVAL):
+                progress(status["bytes"], file_size, start_time)
+                last_progress = now
+
+        status["complete"] = status["bytes"] == file_size
+        status["elapsed"] = time.perf_counter() - start_time
+        status["stall_seconds"] = self.protocol.stalled()
+        self.transfer = None
+        if (progress): progress(status["bytes"], file_size, start_time)
+
+# consecutive numbers as (first, count) runs
+def chunk_runs(numbers):
+    runs = []
+    for number in numbers:
+        if (runs and runs[-1][0] + runs[-1][1] == number):
+            runs[-1][1] += 1
+        else:
+            runs.append([number, 1])
+    return runs
+
+# say hello to a port. Opening the port and the reply each wait at most timeout seconds.
+# Returns the status, see Device.hello, or None if the port is not an OSS device or did not answer in time
+async def probe(port_name, timeout = COMMAND_TIMEOUT):
+    device = Device(port_name, timeout=timeout)
+    try:
+        await device.open()
+        return await device.hello()
+    except DeviceError:
+        return None
+    finally:
+        await device.close()
+
+# say hello to every port at the same time. Returns the status of every port that answered as an OSS device, see probe
+async def hello_all(port_names, timeout = COMMAND_TIMEOUT):
+    statuses = await asyncio.gather(*[probe(port_name, timeout) for port_name in port_names])
+    return [status for status in statuses if status is not None]
+
+# runs an event loop in a background thread, so code that is not async can drive devices.
+# Every device opened through the same DeviceThread is served by its one thread
+class DeviceThread:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, daemon=True).start()
+
+    # run a coroutine on the event loop and wait for its result
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    # open a device. Returns a BlockingDevice. Raises DeviceError if the port cannot be opened
+    def open(self, port_name, baudrate = BAUDRATE, timeout = COMMAND_TIMEOUT):
+        device = Device(port_name, baudrate, timeout)
+        self.run(device.open())
+        return BlockingDevice(device, self)
+
+device_thread = None                        # the DeviceThread shared by the blocking API, see get_device_thread
+
+# the shared DeviceThread, started on first use
+def get_device_thread():
+    global device_thread
+    if (device_thread is None): device_thread = DeviceThread()
+    return device_thread
+
+# blocking access to a Device running on a DeviceThread. Reads follow pyserial: they wait up to the device
+# timeout and return what arrived in time
+class BlockingDevice:
+    def __init__(self, device, thread):
+        self.device = device
+        self.thread = thread
+
+    @property
+    def port(self):
+        return self.device.port
+
+    @property
+    def in_waiting(self):
+        return self.device.in_waiting
+
+    def close(self):
+        self.thread.run(self.device.close())
+
+    def readline(self):
+        return self.thread.run(self.device.readline())
+
+    def read(self, n = 1):
+        return self.thread.run(self.device.read(n))
+
+    def readinto(self, view):
+        return self.thread.run(self.device.readinto(view))
+
+    def discard(self):
+        self.thread.run(self.device.discard())
+
+    def request(self, command, argument = "", timeout = None):
+        return self.thread.run(self.device.request(command, argument, timeout))
+
+    def request_all(self, requests, timeout = None, depth = PIPELINE_DEPTH):
+        return self.thread.run(self.device.request_all(requests, timeout, depth))
+
+    def hello(self, timeout = None):
+        return self.thread.run(self.device.hello(timeout))
+
+    def set_datetime(self, date, timeout = None):
+        self.thread.run(self.device.set_datetime(date, timeout))
+
+    def set_window(self, start, stop, timeout = None):
+        self.thread.run(self.device.set_window(start, stop, timeout))
+
+    def request_stream(self, command, argument = "", timeout = None):
+        return self.thread.run(self.device.request_stream(command, argument, timeout))
+
+    def encodings(self, timeout = None):
+        return self.thread.run(self.device.encodings(timeout))
+
+    def probe_framed(self, timeout = None):
+        return self.thread.run(self.device.probe_framed(timeout))
+
+    def request_chunked(self, count = CHUNKS_PER_REQUEST, timeout = None, encoding = "CSV"):
+        return self.thread.run(self.device.request_chunked(count, timeout, encoding))
+
+    # a generator over Device.stream. The chunks are received on the event loop and handed to the calling thread
+    def stream(self, file_size, status, progress = None, timeout = None):
+        return self.iterate(self.device.stream(file_size, status, progress, timeout))
+
+    # a generator over Device.chunked_stream, see stream
+    def chunked_stream(self, status, progress = None, timeout = None):
+        return self.iterate(self.device.chunked_stream(status, progress, timeout))
+
+    # run an async generator of the device on the event loop, one item at a time
+    def iterate(self, chunks):
+        while True:
+            try:
+                yield self.thread.run(anext(chunks))
+            except StopAsyncIteration:
+                return
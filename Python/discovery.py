@@ -0,0 +1,102 @@
+'''
+Fast discovery of OSS devices among the serial ports of a computer.
+
+New ports are probed with a short _SAY_HELLO, all at the same time, so a port that is not an OSS device costs
+PROBE_TIMEOUT instead of a full command timeout. USB ports are identified by vendor id, product id and serial
+number, and the name of every OSS device found is cached in CACHE_FILE, so a known device is listed again right
+away without being probed. Each scan only looks at the ports that appeared since the previous one, which makes
+scanning cheap enough to repeat in a loop and follow devices as they are plugged in and out, the way dock.py waits
+for a device and the fleet daemon (fleet.py) looks for devices at every poll.
+
+    discovery = Discovery()
+    devices = await discovery.scan()
+'''
+
+import json
+import os
+import time
+import serial.tools.list_ports
+
+from device import hello_all
+
+# CONSTANTS
+CACHE_FILE = "./devices.json"               # where the names of known devices are cached
+PROBE_TIMEOUT = 0.5                         # seconds a port gets to open and answer hello before it is skipped
+RETRY_INTERVAL = 5                          # seconds before probing a port that did not answer again
+
+# the USB identity of a port as "VID:PID:SERIAL", or None if the port cannot be recognised after a replug
+def port_identity(port):
+    if (port.vid is None or not port.serial_number): return None
+    return "%04X:%04X:%s" % (port.vid, port.pid, port.serial_number)
+
+# the serial ports of the computer. Returns a dict of port name to identity
+def list_ports():
+    return {port.device: port_identity(port) for port in serial.tools.list_ports.comports()}
+
+def read_cache(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# write the cache and atomically replace the old one
+def write_cache(filename, cache):
+    with open(filename + ".part", 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(filename + ".part", filename)
+
+# follows the OSS devices connected to the computer. devices holds the status of every device found, by port name.
+# Devices listed from the cache only have "port_name" and "device_name", call remember() with a full status once connected
+class Discovery:
+    def __init__(self, cache_file = CACHE_FILE, probe_timeout = PROBE_TIMEOUT):
+        self.cache_file = cache_file
+        self.probe_timeout = probe_timeout
+        self.cache = read_cache(cache_file)
+        self.ports = {}                     # port name -> identity of every port seen by the last scan
+        self.devices = {}                   # port name -> status of every OSS device found
+        self.failed = {}                    # port name -> when the last probe that got no answer was sent
+
+    # look for devices on the ports that appeared since the last scan, and forget the devices whose port is gone.
+    # Known devices are listed from the cache, other new ports are probed. rescan probes every port again.
+    # Returns the devices, sorted by port name
+    async def scan(self, rescan = False):
+        ports = list_ports()
+        now = time.monotonic()
+
+        for port_name in list(self.devices.keys()) + list(self.failed.keys()):
+            # unplugged, or another device was plugged into the same port
+            if (rescan or ports.get(port_name, "gone") != self.ports.get(port_name)):
+                self.devices.pop(port_name, None)
+                self.failed.pop(port_name, None)
+
+        to_probe = []
+        for port_name, identity in ports.items():
+            if (port_name in self.devices): continue
+
+            if (identity in self.cache):
+                self.devices[port_name] = {"port_name": port_name, "device_name": self.cache[identity]["device_name"]}
+            elif (now - self.failed.get(port_name, now - RETRY_INTERVAL) >= RETRY_INTERVAL):
+                to_probe.append(port_name)
+
+        self.ports = ports
+
+        for status in await hello_all(to_probe, self.probe_timeout):
+            self.remember(status)
+
+        for port_name in to_probe:
+            if (port_name not in self.devices): self.failed[port_name] = now
+
+        return [self.devices[port_name] for port_name in sorted(self.devices)]
+
+    # record the status of a connected device, and cache its name if its port can be recognised again
+    def remember(self, status):
+        port_name = status["port_name"]
+        self.devices[port_name] = status
+        self.failed.pop(port_name, None)
+
+        identity = self.ports.get(port_name)
+        if (identity is None or self.cache.get(identity, {}).get("device_name") == status["device_name"]): return
+
+        self.cache[identity] = {"device_name": status["device_name"], "port_name": port_name}
+        write_cache(self.cache_file, self.cache)
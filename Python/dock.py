@@ -2,117 +2,119 @@
 Command-line tool suite for Open Spectral Sensing (OSS) device.
 '''
 
-# TODO IPR Sync feature copies datapoints into a special file and only transfers new data
-# TODO IPR look into high CPU usage while trasferring serial, slow serial
-# TODO IPR fix sync issue when log file deleted manually
-# TODO IPR scheduled capture start and stop
 # TODO use SDFat instead of SD in Arduino to improve SD performance
 
-import math
-import serial
-import serial.tools.list_ports
 import time
 import datetime
 import os
-from threading import Thread
+import itertools
+import json
+import asyncio
+import argparse
+import sys
+import telemetry
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os.path import exists
-import matplotlib.pyplot as plt
+from device import commands, Device, DeviceError, DeviceTimeout, hello_all, get_device_thread
+from discovery import Discovery
+
+# matplotlib, and NumPy through logfile, dataset and stream, take most of the startup time,
+# so they are imported in the functions that use them
 
 # helpers
-cls = lambda: os.system('cls')              # clear console
+cls = lambda: os.system('cls' if os.name == 'nt' else 'clear')   # clear console
 
 # CONSTANTS
-BAUDRATE = 921600                           # baudrate
-SER_TIMEOUT = 10                            # serial timeout (should be a few seconds longer than device sleep time)
-MIN_WAVELENGTH = 340                        # sensor minimum wavelength
-MAX_WAVELENGTH = 1010                       # sensor maximum wavelength
-WAVELENGTH_STEPSIZE = 5                     # sensor stepsize
 MIN_LOGGING_INTERVAL = 10000                # the minimum logging interval
 MAX_TRANSFER_DATAPOINTS = 100               # the suggested maximum number of datapoints to transfer over serial
-
-# serial
-s = None                                    # the currently selected serial device
-command_to_send = ""                        # the serial instruction to send to device
+TRANSFER_CHUNK_SIZE = 16384                 # how many bytes to read at a time when discarding a stream
+END_MARKER = b"OK"                          # the marker the device sends after a streamed file
+MAX_TRANSFER_WORKERS = 8                    # the maximum number of devices transferring at the same time in batch mode
+SCHEDULE_TIMEOUT = 2                        # seconds to wait for a timed start and stop to be confirmed, older firmware never does
+RESCAN_INTERVAL = 1                         # seconds between scans while waiting for a device to be plugged in
 
 # FIILE IO
 SAVE_DIR = "./data/"                        # directory for saving files
 FILE_EXT = ".CSV"                           # file extension
-SYNC_FILE_NAME = "SYNC"
+PART_EXT = ".part"                          # suffix for files that are still being transferred
+WRITE_BUFFER_SIZE = 1048576                 # write buffer size for transferred files
+SAVE_DATASET = True                         # also save exports as a memory-mappable dataset next to the CSV
+SAVE_FLAGS = True                           # add a column of quality flags to saved datasets, see quality.py
+SAVE_INDEX = True                           # keep a time index next to exports and sync files, see timeindex.py
+SAVE_ROLLUP = True                          # keep hourly and daily rollups of each device up to date, see rollup.py
+EXPORT_ROLLUP_NAME = "EXPORT"               # prefix of the per-device rollup store of exports, syncs have their own
+FRAMED_EXPORT = True                        # export in checksummed chunks when the device firmware supports it
+EXPORT_ENCODINGS = ["CSV"]                  # framed export encodings to use, in order of preference, see encoding.py. With CSV
+                                            # the saved log is a byte-for-byte copy of the device log, the others rebuild it
+                                            # from the decoded values, re-formatted, and round the spectra
+SYNC_FILE_NAME = "SYNC"                     # prefix of the per-device sync file
+SYNC_STATE_EXT = ".sync"                    # suffix of the sidecar file that remembers where the device log starts
+SYNC_VERIFY_BYTES = 256                     # how many already synced bytes to request again to check the device log is unchanged
+FRAGMENT_SEARCH_BYTES = 8192                # how far back from the end of a sync file to look for a cut off line
+PROFILE_DIR = "./profiles/"                 # directory for saved configuration profiles
+PROFILE_EXT = ".json"                       # configuration profile file extension
+TELEMETRY_LOG = None                        # JSON lines log of every command and transfer, see telemetry.py, None for no log
+PROMETHEUS_FILE = None                      # Prometheus text-format file of the command and transfer metrics, None for no file
+PROFILE_LINES = 40                          # how many of the slowest functions --profile prints
 
 # user input
 inp = ""
 
-# Instructions that the OSS device understands
-commands = {
-    "TOGGLE_DATA_CAPTURE": "00",
-    "MANUAL_CAPTURE": "01",
-    "EXPORT_ALL": "02",
-    "_SYNC_DATAPOINTS": "15",
-    "ERASE_STORAGE": "14",
-    "SET_COLLECTION_INTERVAL": "04",
-    "SET_DEVICE_NAME": "08",
-    "SET_CALIBRATION_FACTOR": "11",
-    "RESET_DEVICE": "03",
-    
-    "_START_RECORDING": "12",
-    "_STOP_RECORDING": "13",
-    "_SET_DATETIME": "05",
-    "_SAY_HELLO": "07",
-    "_GET_INFO": "09",
-    "_NSP_SETTINGS": "10",
-    "_SET_START_TIME": "17",
-    "_SET_STOP_TIME": "18",
-}
+# follows the devices plugged into the computer, see find_devices
+discovery = None
+
+# held while choosing a file name, so devices exporting at the same time never pick the same one
+save_lock = Lock()
 
 local_functions = [
     "DISCONNECT",
     "CONFIGURE_SENSOR",
-    # "TIMED_START_STOP",
+    "LIVE_MONITOR",
+    "TIMED_START_STOP",
     "REFRESH",
 ]
 
+# open a device on the shared device thread, see device.py. Returns a BlockingDevice, or None if the port could not be opened
 def connect_to_device(port_name):
     try:
-        return serial.Serial(port=port_name, baudrate=BAUDRATE, timeout=SER_TIMEOUT)
-    except Exception as e:
+        return get_device_thread().open(port_name)
+    except DeviceError as e:
         return None
 
-# write to all devices, or a specific one if id is supplied
-def write_to_device(msg, serial_object):
+# send a command and wait for its reply. Returns the reply values, or None if the device answered with an error or not at all
+def send_command(serial_object, command, argument = ""):
     try:
-        serial_object.write(bytes(msg + '\n', 'utf-8'))
-        time.sleep(0.1)
-        return True
-    except Exception as e:
-        return False
-           
-def read_from_device(serial_object):
-    response = []
-    line = ""
-    while (line.lower() != "ok" and not ("err" in line.lower())):
-        line = serial_object.readline().decode().strip()
-        response.append(line)
-    return response
+        return serial_object.request(command, argument)
+    except DeviceError as e:
+        return None
 
-# open a new file for writing. If file name already exists, append a number
-def open_file(filename, add_header = False, open_mode = 'w', overwrite = False):
+# find an unused file name in the save directory. If file name already exists, or is still being transferred,
+# append a number
+def get_save_filename(filename, overwrite = False):
     
     # if the "data" directory doesn't exist, create it
     if (not os.path.exists(SAVE_DIR)): os.makedirs(SAVE_DIR)
     
-    f = None
-    # open a file to write response into
     file_suffix = -1
     while True:
         save_filename = SAVE_DIR + str(filename) + (str(file_suffix) if file_suffix > -1 else "") + FILE_EXT
-        if exists(save_filename) and not overwrite:
+        if (exists(save_filename) or exists(save_filename + PART_EXT)) and not overwrite:
             file_suffix += 1
         else:
-            f = open(save_filename, open_mode)
-            break
+            return save_filename
+
+# open a new file for writing. If file name already exists, append a number
+def open_file(filename, add_header = False, open_mode = 'w', overwrite = False):
+    
+    # open a file to write response into
+    save_filename = get_save_filename(filename, overwrite)
+    f = open(save_filename, open_mode)
         
     # add the file header
-    if (add_header): f.write(file_header())
+    if (add_header):
+        from logfile import file_header
+        f.write(file_header())
     return f, save_filename
 
 # Create a folder if not exists, otherwise create a new folder with unique numeral suffix
@@ -128,75 +130,24 @@ def open_folder(foldername):
             break
     return new_foldername
 
-# produce the file header
-def file_header():
-    line = "DATE,TIME,MANUAL,INT_TIME,FRAME_AVG,AE,QUALITY,X,Y,Z,"
-    for i in range (MIN_WAVELENGTH, MAX_WAVELENGTH + WAVELENGTH_STEPSIZE, WAVELENGTH_STEPSIZE):
-        line += str(i) + ","
-    line += "\n"
-    return line    
-    
+# ask the device for its current status. Returns the status dict, see device.Device.hello, or None if it did not answer
 def update_device_status(s):
     try:
-        s.write(bytes(commands["_SAY_HELLO"] + '\n', 'utf-8'))
-        time.sleep(0.1)
-        
-        res = s.readline().decode().strip()
-
-        if res.lower() == "data":
-            # if data is the first response, second response is the device name
-            device_name = s.readline().decode().strip()
-            logging_interval = s.readline().decode().strip()
-            device_status = s.readline().decode().strip()
-            data_counter = s.readline().decode().strip()
-            # clear the buffer by reading the OK response
-            _ok = s.readline()
-            # save the name to the response
-            device = {"port_name": s.port, 
-                      "device_name": device_name, 
-                      "logging_interval": int(logging_interval), 
-                      "data_counter": int(data_counter),
-                      "device_status": device_status}
-    
-        return device
-    
-    except Exception as e:
+        status = s.hello()
+    except DeviceError as e:
         return None
     
-# Pings all serial devices connected, saves responses of valid OSS devices. If response was valid, table contains name, else None
-def say_hello(port, response, ind):
-    try:
-        with serial.Serial(port=port, baudrate=BAUDRATE, timeout=SER_TIMEOUT) as _s:
-            device = update_device_status(_s)
-            response[ind] = device
-    except Exception as e:
-        pass  
+    if (discovery is not None): discovery.remember(status)
+    return status
            
-def find_devices():
-    # list of serial ports connected to the computer
-    ports = []
-    
-    while len(ports) <= 0:
-        ports = serial.tools.list_ports.comports()        
-        print("Looking for devices...")
-        time.sleep(1)
-        
-    # for detecting which serial devices are open spectral sensors  
-    responses = [None] * len(ports)
-    threads = [None] * len(ports)
-    
-    # say hello to each device in a thread
-    for i in range(len(threads)):
-        threads[i] = Thread(target=say_hello, args=(ports[i].name, responses, i))
-        threads[i].start()
+# the OSS devices plugged into the computer. Only ports that appeared since the last call are probed, and known
+# devices are listed without a probe, see discovery.py. rescan probes every port again
+def find_devices(rescan = False):
+    global discovery
+    if (discovery is None): discovery = Discovery()
     
-    # wait for every device to respond
-    for i in range(len(threads)): threads[i].join()
-        
-    # detected spectral sensors          
-    devices = [device for device in responses if device is not None]
-
-    return devices     
+    print("Looking for devices...")
+    return get_device_thread().run(discovery.scan(rescan))
 
 def get_formatted_date():
     return (str(datetime.datetime.now().year).zfill(4) +
@@ -206,8 +157,10 @@ def get_formatted_date():
             str(datetime.datetime.now().minute).zfill(2) +
             str(datetime.datetime.now().second).zfill(2))
 
-# format a datapoint for quick graphing
+# format a single datapoint for quick graphing. Use logfile.parse_log to parse whole files
 def get_formatted_datapoint(line):
+    from logfile import WAVELENGTHS
+    
     tokens = line.split(',')
     
     timestamp = tokens[0] + " " + tokens[1]
@@ -220,15 +173,526 @@ def get_formatted_datapoint(line):
     cie_y = float(tokens[8])
     cie_z = float(tokens[9])
     
-    x = [i for i in range(MIN_WAVELENGTH, MAX_WAVELENGTH + WAVELENGTH_STEPSIZE, WAVELENGTH_STEPSIZE)]
+    x = WAVELENGTHS
     y = [float(i) for i in tokens[10:-1]]
 
     return [x, y, timestamp, manual, int_time, frame_avg, ae, quality, cie_x, cie_y, cie_z]
 
+# graph a datapoint line in a new figure. Call show_plots() to display the figures
+def plot_datapoint(line, title = "Manual Datapoint Capture"):
+    import matplotlib.pyplot as plt
+    from logfile import MIN_WAVELENGTH, MAX_WAVELENGTH
+    
+    x, y, timestamp, manual, int_time, frame_avg, ae, quality, cie_x, cie_y, cie_z  = get_formatted_datapoint(line)
+    plt.figure()
+    plt.plot(x,y)
+    plt.xlim([MIN_WAVELENGTH, MAX_WAVELENGTH])
+    plt.ylabel("Power (W/m^2)")
+    plt.xlabel("Wavelength (nm)")
+    plt.title(title + " at " + timestamp)
+    for i, (name, value) in enumerate([("X", cie_x), ("Y", cie_y), ("Z", cie_z)]):
+        plt.text(0.98, 0.95 - i * 0.06, name + ": " + str(value), ha='right', va='top', transform=plt.gca().transAxes)
+
+def show_plots():
+    import matplotlib.pyplot as plt
+    plt.show()
+
+# capture datapoints one after the other and graph them live, saving them all to one session file in SAVE_DIR,
+# see monitor.py. Returns a message for the user
+def monitor_device(serial_object, device_name, capacity = None, count = None, duration = None, plot = True, save = True):
+    from monitor import MONITOR_CAPACITY, monitor
+    
+    f, filename = open_file("MONITOR_" + device_name + "_" + get_formatted_date(), add_header=True) if save else (None, None)
+    try:
+        stats = monitor(serial_object, f, capacity or MONITOR_CAPACITY, count, duration, plot, device_name)
+    finally:
+        if f: f.close()
+    
+    message = (str(stats["captures"]) + " datapoints captured in " + str(round(stats["elapsed"], 1)) + " s (" +
+               str(round(stats["captures"] / max(stats["elapsed"], 1e-6), 1)) + " per second)")
+    if (isinstance(stats["error"], DeviceTimeout)): message += ", stopped because the device did not answer"
+    elif (stats["error"] is not None): message += ", stopped because " + str(stats["error"])
+    if (filename): message += ". Saved as " + filename
+    return message
+
+# call a function and time it. Returns (result, seconds)
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+# call a function and add the seconds it took to phases[phase], see telemetry.py. Returns its result
+def timed_phase(phases, phase, function, *args):
+    start_time = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        phases[phase] = phases.get(phase, 0) + time.perf_counter() - start_time
+
+# record a transfer and how long each of its phases took, see telemetry.py. The time receive_file spent flushing
+# the file to disk is taken out of the transfer phase
+def record_transfer(serial_object, kind, status, phases, **fields):
+    if ("flush_seconds" in status):
+        phases["transfer"] -= status["flush_seconds"]
+        phases["flush"] = status["flush_seconds"]
+    telemetry.record_transfer(serial_object.port, kind, status, phases, **fields)
+
+# throw away the rest of a reply that is no longer wanted
 def flush_serial(s):
-    while s.in_waiting > 0:
-        s.readline()   
+    s.discard()
+        
+# redraw the transfer progress on a single console line
+def print_progress(bytes_read, file_size, start_time):
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    percentage_transferred = (bytes_read / file_size) * 100 if file_size > 0 else 100
+    print("\r" + str(round(percentage_transferred, 1)) + " % transferred, " +
+          str(int(bytes_read / elapsed)) + " bytes/s   ", end="", flush=True)
+
+# receive a streamed file of file_size bytes followed by END_MARKER, yielding the payload in chunks as it arrives.
+# encoding receives a framed export started with request_export instead, None for a plain stream.
+# status is filled in with "bytes", "elapsed" and "complete", see device.Device.stream
+def iter_stream(serial_object, file_size, status, show_progress = True, encoding = None):
+    progress = print_progress if show_progress else None
+    if (encoding is not None):
+        yield from serial_object.chunked_stream(status, progress)
+    else:
+        yield from serial_object.stream(file_size, status, progress)
+    if (show_progress): print()
+
+# receive a streamed file and write it to f. pipeline is an optional function that takes the iterable of
+# received chunks and returns the stages to run on them while the transfer is running, see stream.py.
+# An encoded framed export is decoded as it arrives, and pipeline gets the decoded batches instead of chunks.
+# status, if given, is filled in with the status of the transfer (see device.Device.stream) and "cpu_seconds", the host CPU time.
+# Returns (bytes_written, seconds_elapsed, complete), bytes_written counting the bytes of the device log
+def receive_stream(serial_object, f, file_size, show_progress = True, pipeline = None, encoding = None, status = None):
+    from stream import write_chunks, decode_batches, write_decoded, drain
+    
+    status = {} if status is None else status
+    start_cpu = time.process_time()
+    chunks = iter_stream(serial_object, file_size, status, show_progress, encoding)
+    if (encoding in (None, "CSV")):
+        chunks = write_chunks(chunks, f)
+    else:
+        chunks = write_decoded(decode_batches(chunks, encoding), f)
+    
+    if (pipeline): chunks = pipeline(chunks)
+    drain(chunks)
+    status["cpu_seconds"] = time.process_time() - start_cpu
+    
+    return status["bytes"], status["elapsed"], status["complete"]
+
+# receive a streamed file into a temporary file, then atomically rename it into SAVE_DIR once complete.
+# If save_dataset is set, the datapoints are parsed while they arrive and saved as a dataset next to the file.
+# status is filled in as by receive_stream, and with "flush_seconds", the time taken to flush the file to disk.
+# Returns (filename, bytes_written, seconds_elapsed, complete). Incomplete transfers are left as PART_EXT files
+def receive_file(serial_object, filename, file_size, show_progress = True, save_dataset = False, encoding = None, status = None):
+    with save_lock:
+        save_filename = get_save_filename(filename)
+        part_filename = save_filename + PART_EXT
+        open(part_filename, 'wb').close()
+    
+    pipeline = None
+    if (save_dataset):
+        from dataset import DATASET_EXT, create_dataset
+        from stream import parse_batches, write_dataset
+        from logfile import COLUMN_TYPES
+        from quality import FLAGGED_COLUMN_TYPES, flag_batches
+        
+        dataset_path = os.path.splitext(save_filename)[0] + DATASET_EXT
+        create_dataset(dataset_path + PART_EXT, columns=FLAGGED_COLUMN_TYPES if SAVE_FLAGS else COLUMN_TYPES)
+        flag = flag_batches if SAVE_FLAGS else lambda batches: batches
+        if (encoding in (None, "CSV")):
+            pipeline = lambda chunks: write_dataset(flag(parse_batches(chunks)), dataset_path + PART_EXT)
+        else:
+            pipeline = lambda batches: write_dataset(flag(batches), dataset_path + PART_EXT)
+    
+    status = {} if status is None else status
+    with open(part_filename, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+        bytes_written, elapsed, complete = receive_stream(serial_object, f, file_size, show_progress, pipeline, encoding, status)
+        status["flush_seconds"] = timed(flush_file, f)[1]
+    
+    if (not complete): return part_filename, bytes_written, elapsed, False
+    
+    os.replace(part_filename, save_filename)
+    if (save_dataset): os.replace(dataset_path + PART_EXT, dataset_path)
+    return save_filename, bytes_written, elapsed, True
+
+# write everything written to a file through to the disk
+def flush_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+# read and discard a number of streamed bytes
+def drain_stream(serial_object, n):
+    while n > 0:
+        b = serial_object.read(min(TRANSFER_CHUNK_SIZE, n))
+        if not b: break
+        n -= len(b)
+
+# the local file that datapoints from a device are synced into
+def get_sync_filename(device_name):
+    if (not os.path.exists(SAVE_DIR)): os.makedirs(SAVE_DIR)
+    return SAVE_DIR + SYNC_FILE_NAME + "_" + device_name + FILE_EXT
+
+# the byte position in the sync file at which the current device log starts
+def read_sync_base(sync_filename):
+    try:
+        with open(sync_filename + SYNC_STATE_EXT, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+def write_sync_base(sync_filename, base):
+    with open(sync_filename + SYNC_STATE_EXT + PART_EXT, 'w') as f:
+        f.write(str(base))
+    os.replace(sync_filename + SYNC_STATE_EXT + PART_EXT, sync_filename + SYNC_STATE_EXT)
+
+# the bytes after the last line break of a file, left by an interrupted transfer
+def read_line_fragment(filename):
+    with open(filename, 'rb') as f:
+        f.seek(max(0, os.path.getsize(filename) - FRAGMENT_SEARCH_BYTES))
+        data = f.read()
+    return data[data.rfind(b"\n") + 1:]
+
+# ask the device to stream its log starting at a byte offset. Returns how many bytes will follow,
+# -1 if the device log is smaller than the offset, or None if the device could not open its log
+def request_sync(serial_object, offset):
+    try:
+        return serial_object.request_stream("SYNC_DATAPOINTS", "_" + str(offset))
+    except DeviceError as e:
+        return None
+
+# append the datapoints the device logged since the last sync to the local sync file.
+# An interrupted sync resumes from the bytes already saved. If the device log was deleted or replaced,
+# a new segment is started at the end of the sync file and the whole new device log is appended.
+# pipeline is passed on to receive_stream and sees only the new bytes, starting with any line cut off by an interrupted sync.
+# The time index of the sync file is brought up to date once the sync is complete if SAVE_INDEX is set, see timeindex.py,
+# and so are the rollups of the sync file if SAVE_ROLLUP is set, see rollup.py. The transfer is recorded, see telemetry.py.
+# Returns (filename, bytes_synced, seconds_elapsed, complete, message)
+def sync_datapoints(serial_object, device_name, show_progress = True, pipeline = None):
+    start_time = time.perf_counter()
+    sync_filename = get_sync_filename(device_name)
+    local_size = os.path.getsize(sync_filename) if exists(sync_filename) else 0
+    base = min(read_sync_base(sync_filename), local_size)
+    
+    # request the last few synced bytes again to make sure the device still has the same log
+    device_offset = local_size - base
+    verify = min(SYNC_VERIFY_BYTES, device_offset)
+    file_size = request_sync(serial_object, device_offset - verify)
+    
+    if (file_size is None):
+        flush_serial(serial_object)
+        return sync_filename, 0, 0, False, "Device could not open its log file. Please try again."
+    
+    if (file_size >= 0 and file_size < verify):
+        # shorter than what was synced, not the log we synced from
+        drain_stream(serial_object, file_size + len(END_MARKER))
+        serial_object.readline()
+        file_size = -1
+    
+    if (file_size >= 0 and verify > 0):
+        overlap = serial_object.read(verify)
+        with open(sync_filename, 'rb') as f:
+            f.seek(local_size - verify)
+            local_tail = f.read(verify)
+        
+        if (len(overlap) < verify):
+            flush_serial(serial_object)
+            return sync_filename, 0, 0, False, "Sync interrupted, device stopped responding. Run the sync again to resume."
+        
+        if (overlap == local_tail):
+            file_size -= verify
+        else:
+            # same size or larger, but not the log we synced from
+            drain_stream(serial_object, file_size - verify + len(END_MARKER))
+            serial_object.readline()
+            file_size = -1
+    
+    recovered = file_size == -1
+    
+    with open(sync_filename, 'ab', buffering=WRITE_BUFFER_SIZE) as f:
+        if (recovered):
+            # device log was deleted or truncated, start a new segment with the device's current log
+            if (local_size > 0):
+                with open(sync_filename, 'rb') as r:
+                    r.seek(local_size - 1)
+                    if (r.read(1) != b"\n"):
+                        f.write(b"\n")
+                        local_size += 1
+            
+            write_sync_base(sync_filename, local_size)
+            file_size = request_sync(serial_object, 0)
+            
+            if (file_size is None or file_size < 0):
+                flush_serial(serial_object)
+                return sync_filename, 0, 0, False, "Device could not open its log file. Please try again."
+        
+        # hand the cut off line to the pipeline so the first new datapoint is parsed whole
+        fragment = read_line_fragment(sync_filename) if pipeline else b""
+        stages = pipeline
+        if (fragment): stages = lambda chunks: pipeline(itertools.chain([fragment], chunks))
+        
+        phases = {"request": time.perf_counter() - start_time}
+        status = {}
+        bytes_written, elapsed, complete = timed_phase(phases, "transfer", receive_stream, serial_object, f, file_size, show_progress, stages,
+                                                       None, status)
+        timed_phase(phases, "flush", flush_file, f)
+        
+    if (not complete):
+        flush_serial(serial_object)
+        record_transfer(serial_object, "sync", status, phases, device_name=device_name, filename=sync_filename)
+        return (sync_filename, bytes_written, elapsed, False, "Sync interrupted after " + str(bytes_written) + " of " +
+                str(file_size) + " bytes. Run the sync again to resume.")
+    
+    # consume the line ending after the end marker
+    serial_object.readline()
+    
+    if (SAVE_INDEX):
+        from timeindex import update_index
+        timed_phase(phases, "index", update_index, sync_filename)
+    
+    if (SAVE_ROLLUP):
+        from rollup import ROLLUP_EXT, update_rollup
+        timed_phase(phases, "rollup", update_rollup, os.path.splitext(sync_filename)[0] + ROLLUP_EXT, sync_filename)
+    
+    record_transfer(serial_object, "sync", status, phases, device_name=device_name, filename=sync_filename)
+    
+    message = "Datapoints synchronized to " + sync_filename + ". " + str(bytes_written) + " bytes read."
+    if (recovered): message = "Device log was replaced since the last sync, started a new segment. " + message
+    
+    return sync_filename, bytes_written, elapsed, True, message
+
+# set the device clock to the computer's time. Returns a message for the user
+def set_device_time(serial_object):
+    date = get_formatted_date()
+    if (send_command(serial_object, "_SET_DATETIME", date) is None):
+        return "Time could not be set."
+    return "Time has been set successfully to " + date
+
+# give the device a timed start and stop, as datetimes in device time or None for none. Returns True if the firmware
+# confirmed them, False if it predates timed start and stop. Raises DeviceError if the device fails otherwise
+def set_recording_window(serial_object, start, stop):
+    try:
+        serial_object.set_window(*[moment.strftime("%Y%m%d%H%M%S") if moment else None for moment in (start, stop)], SCHEDULE_TIMEOUT)
+        return True
+    except DeviceTimeout as e:
+        return False
+
+# ask the device for its whole log, in checksummed chunks if FRAMED_EXPORT is set and the firmware supports them,
+# as one plain stream otherwise. Framed exports use the first of EXPORT_ENCODINGS the device supports.
+# Returns (file_size, encoding), encoding None for a plain stream. Raises DeviceError if the device could not start the export
+def request_export(serial_object):
+    if (FRAMED_EXPORT):
+        try:
+            supported = serial_object.encodings()
+            encoding = ([e for e in EXPORT_ENCODINGS if e in supported] + ["CSV"])[0]
+            return serial_object.request_chunked(encoding=encoding), encoding
+        except DeviceError as e:
+            flush_serial(serial_object)
+    return serial_object.request_stream("EXPORT_ALL"), None
+
+# whether the device firmware supports framed exports, which are safe for large logs
+def supports_framed_export(serial_object):
+    try:
+        serial_object.probe_framed()
+        return True
+    except DeviceError as e:
+        return False
+
+# ask the device for its whole log and save it as filename in SAVE_DIR, see receive_file. If SAVE_ROLLUP is set
+# and device_name given, the datapoints the device logged since its last export are added to its export rollups.
+# The transfer is recorded, see telemetry.py. Returns (filename, bytes_read, seconds_elapsed, complete, message)
+def export_datapoints(serial_object, filename, show_progress = True, device_name = None):
+    phases = {}
+    try:
+        file_size, encoding = timed_phase(phases, "request", request_export, serial_object)
+    except DeviceError as e:
+        return None, 0, 0, False, "Could not export data. Please try again."
+    
+    if (file_size <= 0):
+        flush_serial(serial_object)
+        return None, 0, 0, False, "Could not read file. Please try again."
+    
+    status = {}
+    filename, bytes_read, elapsed, complete = timed_phase(phases, "transfer", receive_file, serial_object, filename, file_size,
+                                                          show_progress, SAVE_DATASET, encoding, status)
+    fields = {"device_name": device_name, "encoding": encoding or "stream", "filename": filename}
+    
+    if (not complete):
+        flush_serial(serial_object)
+        record_transfer(serial_object, "export", status, phases, **fields)
+        return (filename, bytes_read, elapsed, False, "Transfer incomplete, " + str(bytes_read) + " of " + str(file_size) +
+                " bytes received. Partial data kept in " + filename + ". Please try again.")
+    
+    message = ("File saved as " + filename + " (" + str(bytes_read) + " bytes in " +
+               str(round(elapsed, 1)) + " s, " + str(int(bytes_read / max(elapsed, 1e-6))) + " bytes/s" +
+               ("" if encoding in (None, "CSV") else ", sent as " + encoding) + ")")
+    
+    if (SAVE_DATASET):
+        from dataset import DATASET_EXT
+        message += "\nDatapoints saved to " + os.path.splitext(filename)[0] + DATASET_EXT
+    
+    if (SAVE_INDEX):
+        from timeindex import update_index
+        timed_phase(phases, "index", update_index, filename)
+    
+    if (SAVE_ROLLUP and device_name):
+        from rollup import ROLLUP_EXT, update_rollup
+        timed_phase(phases, "rollup", update_rollup, SAVE_DIR + EXPORT_ROLLUP_NAME + "_" + device_name + ROLLUP_EXT, filename)
+    
+    record_transfer(serial_object, "export", status, phases, **fields)
+    
+    return filename, bytes_read, elapsed, True, message
+
+# export or sync one device over its own serial connection, for batch mode. mode is "export" or "sync".
+# Exports are saved as <device_name>_<date>. Never raises, errors are reported in the result.
+# Returns a dict with the device, "filename", "bytes", "elapsed", "complete" and "message"
+def transfer_device(device, mode, delete_data = False):
+    result = {"device_name": device["device_name"], "port_name": device["port_name"],
+              "filename": None, "bytes": 0, "elapsed": 0, "complete": False}
+    
+    serial_object = connect_to_device(device["port_name"])
+    if (serial_object is None):
+        result["message"] = "Could not connect."
+        return result
+    
+    try:
+        # the name may have changed since the device was found
+        result["device_name"] = serial_object.hello()["device_name"]
+        set_device_time(serial_object)
+        
+        if (mode == "sync"):
+            transfer = sync_datapoints(serial_object, result["device_name"], show_progress=False)
+        else:
+            transfer = export_datapoints(serial_object, result["device_name"] + "_" + get_formatted_date(), False, result["device_name"])
+        result["filename"], result["bytes"], result["elapsed"], result["complete"], result["message"] = transfer
+        
+        if (delete_data and mode == "export" and result["complete"]):
+            send_command(serial_object, "ERASE_STORAGE")
+    
+    except Exception as e:
+        result["message"] = "Transfer failed: " + str(e)
+    
+    finally:
+        serial_object.close()
+    
+    return result
+
+# export or sync every device at the same time, each in its own worker with its own serial connection.
+# A device that fails or stops responding only ends its own transfer. Prints each result as it finishes,
+# then the total. Returns the list of results, see transfer_device
+def transfer_all_devices(devices, mode, delete_data = False, workers = MAX_TRANSFER_WORKERS):
+    results = []
+    
+    # devices with the same name would sync into the same file
+    names = [device["device_name"] for device in devices]
+    if (mode == "sync"):
+        for device in [device for device in devices if names.count(device["device_name"]) > 1]:
+            results.append({"device_name": device["device_name"], "port_name": device["port_name"],
+                            "filename": None, "bytes": 0, "elapsed": 0, "complete": False,
+                            "message": "Skipped, another device has the same name. Give each device a unique name to sync."})
+            print(device["device_name"] + " on " + device["port_name"] + ": " + results[-1]["message"])
+        devices = [device for device in devices if names.count(device["device_name"]) == 1]
+    
+    start_time = time.perf_counter()
+    
+    if (len(devices) > 0):
+        with ThreadPoolExecutor(max_workers=min(workers, len(devices))) as pool:
+            futures = [pool.submit(transfer_device, device, mode, delete_data) for device in devices]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                print(result["device_name"] + " on " + result["port_name"] + ": " + result["message"])
+    
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    total_bytes = sum([result["bytes"] for result in results])
+    completed = len([result for result in results if result["complete"]])
+    
+    print("---")
+    print(str(completed) + " of " + str(len(results)) + " devices transferred, " + str(total_bytes) + " bytes in " +
+          str(round(elapsed, 1)) + " s (" + str(int(total_bytes / elapsed)) + " bytes/s)")
+    
+    return results
+
+# the commands that apply a configuration profile, in order. A profile is a dict with any of "device_name", "use_ae",
+# "frame_avg", "int_time", "calibration_factor", "logging_interval" and "recording". Settings it leaves out are not changed,
+# except that the NSP settings are always sent together
+def profile_requests(profile):
+    requests = []
+    
+    if ("device_name" in profile):
+        requests.append(("SET_DEVICE_NAME", "_" + profile["device_name"]))
+    
+    if ("use_ae" in profile or "frame_avg" in profile or "int_time" in profile):
+        requests.append(("_NSP_SETTINGS", str(int(profile.get("use_ae", True))) + str(profile.get("frame_avg", 3)).zfill(3) +
+                         str(profile.get("int_time", 500)).zfill(4)))
+    
+    if ("calibration_factor" in profile):
+        requests.append(("SET_CALIBRATION_FACTOR", "_" + str(profile["calibration_factor"])))
+    
+    if ("logging_interval" in profile):
+        requests.append(("SET_COLLECTION_INTERVAL", "_" + str(profile["logging_interval"])))
+    
+    if ("recording" in profile):
+        requests.append(("_START_RECORDING" if profile["recording"] else "_STOP_RECORDING", ""))
+    
+    return requests
+
+# the commands of a profile whose replies failed
+def failed_requests(requests, replies):
+    return [command for (command, argument), reply in zip(requests, replies) if isinstance(reply, DeviceError)]
+
+# apply a configuration profile to a connected device, pipelining the commands. Returns the commands that failed
+def configure_device(serial_object, profile):
+    requests = profile_requests(profile)
+    return failed_requests(requests, serial_object.request_all(requests))
+
+# save a configuration profile in PROFILE_DIR. Returns the file name
+def save_profile(name, profile):
+    if (not os.path.exists(PROFILE_DIR)): os.makedirs(PROFILE_DIR)
+    
+    filename = PROFILE_DIR + name + PROFILE_EXT
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=1)
+    return filename
+
+def load_profile(name):
+    with open(PROFILE_DIR + name + PROFILE_EXT, 'r') as f:
+        return json.load(f)
+
+# the names of the saved configuration profiles
+def list_profiles():
+    if (not os.path.exists(PROFILE_DIR)): return []
+    return sorted([os.path.splitext(f)[0] for f in os.listdir(PROFILE_DIR) if f.endswith(PROFILE_EXT)])
+
+# apply a configuration profile to every device at the same time and set their clocks. All devices are driven
+# from the one device thread, each with its commands pipelined. Prints each result as it finishes.
+# Returns a dict of the commands that failed on each port, with None for devices that could not be reached
+def apply_profile(devices, profile):
+    requests = profile_requests(profile)
+    
+    async def configure(device):
+        try:
+            async with Device(device["port_name"]) as connection:
+                replies = await connection.request_all(requests + [("_SET_DATETIME", get_formatted_date())])
+            failed = failed_requests(requests, replies)
+            message = ("configured." if len(failed) == 0 else "could not be configured (" + ", ".join(failed) + ").")
+        except DeviceError as e:
+            failed = None
+            message = "could not be reached. " + str(e)
         
+        print(device["device_name"] + " on " + device["port_name"] + " " + message)
+        return device["port_name"], failed
+    
+    async def configure_all():
+        return dict(await asyncio.gather(*[configure(device) for device in devices]))
+    
+    results = get_device_thread().run(configure_all())
+    
+    print("---")
+    print(str(len([failed for failed in results.values() if failed == []])) + " of " + str(len(devices)) + " devices configured.")
+    return results
+
 def is_float(val):     
     try:
         float(val)
@@ -236,9 +700,261 @@ def is_float(val):
     except ValueError:
         return False
     
+
+# send one command to every device at the same time from the device thread. Returns a dict of the reply values
+# of each port, with None for devices that answered with an error or not at all
+def request_each(devices, command, argument = "", timeout = None):
+    async def request(device):
+        try:
+            async with Device(device["port_name"]) as connection:
+                return device["port_name"], await connection.request(command, argument, timeout)
+        except DeviceError as e:
+            return device["port_name"], None
+    
+    async def request_all():
+        return dict(await asyncio.gather(*[request(device) for device in devices]))
+    
+    return get_device_thread().run(request_all())
+
+# SUBCOMMANDS
+# With a subcommand dock.py does one thing without asking anything and exits, for scripts and cron.
+# Every subcommand returns the exit code: 0 if it worked on every device, 1 otherwise
+
+# the devices a subcommand works on, with their current status: the ports given with --port, or every device found
+def select_devices(ports):
+    if (not ports): ports = [device["port_name"] for device in find_devices()]
+    statuses = get_device_thread().run(hello_all(ports))
+    
+    for status in statuses:
+        if (discovery is not None): discovery.remember(status)
+    
+    for port_name in sorted(set(ports) - set([status["port_name"] for status in statuses])):
+        print(port_name + ": no OSS device answered.")
+    
+    if (len(statuses) == 0): print("No devices found.")
+    return statuses
+
+def command_status(args):
+    devices = select_devices(args.port)
+    for d in devices:
+        print(d["device_name"] + " on " + d["port_name"] + ": " + ("RECORDING" if d["device_status"] == '1' else "PAUSED") +
+              ", recording interval " + str(d["logging_interval"]) + " ms, " + str(d["data_counter"]) + " entries")
+    return 0 if devices and len(devices) == len(args.port or devices) else 1
+
+# export and sync
+def command_transfer(args):
+    global EXPORT_ENCODINGS
+    if (args.command == "export" and args.encoding): EXPORT_ENCODINGS = [args.encoding, "CSV"]
+    
+    devices = select_devices(args.port)
+    if (len(devices) == 0): return 1
+    
+    results = transfer_all_devices(devices, args.command, args.command == "export" and args.erase)
+    return 0 if all([result["complete"] for result in results]) else 1
+
+def command_capture(args):
+    devices = select_devices(args.port)
+    replies = request_each(devices, "MANUAL_CAPTURE")
+    
+    for d in devices:
+        values = replies[d["port_name"]]
+        if (not values):
+            print(d["device_name"] + " on " + d["port_name"] + ": datapoint could not be captured.")
+            continue
+        
+        print(d["device_name"] + " on " + d["port_name"] + ": " + values[0])
+        
+        if (args.save):
+            f, filename = open_file("MANUAL_" + d["device_name"] + "_" + get_formatted_date(), add_header=True)
+            f.write(values[0] + "\n")
+            f.close()
+            print("Saved as " + filename)
+        
+        if (args.plot): plot_datapoint(values[0], d["device_name"])
+    
+    captured = [values for values in replies.values() if values]
+    if (args.plot and captured): show_plots()
+    return 0 if devices and len(captured) == len(devices) else 1
+
+def command_monitor(args):
+    devices = select_devices(args.port)
+    if (len(devices) == 0): return 1
+    if (len(devices) > 1):
+        print("Monitor one device at a time, choose one with --port.")
+        return 1
+    
+    d = devices[0]
+    s = connect_to_device(d["port_name"])
+    if (s is None):
+        print(d["device_name"] + " on " + d["port_name"] + ": could not connect.")
+        return 1
+    
+    try:
+        print("Monitoring " + d["device_name"] + " on " + d["port_name"] + ". Close the window or press Ctrl+C to stop.")
+        print(monitor_device(s, d["device_name"], args.buffer, args.count, args.duration, not args.no_plot, not args.no_save))
+    finally:
+        s.close()
+    return 0
+
+def command_configure(args):
+    profile = load_profile(args.profile) if args.profile else {}
+    
+    options = {"device_name": args.name, "use_ae": args.ae, "frame_avg": args.frame_avg, "int_time": args.int_time,
+               "calibration_factor": args.calibration_factor, "logging_interval": args.interval, "recording": args.recording}
+    profile.update([(key, value) for key, value in options.items() if value is not None])
+    
+    if (len(profile) == 0):
+        print("Nothing to configure. Give a --profile or settings to change, see dock.py configure --help.")
+        return 1
+    
+    if (profile.get("logging_interval", MIN_LOGGING_INTERVAL) < MIN_LOGGING_INTERVAL):
+        print("The recording interval must be at least " + str(MIN_LOGGING_INTERVAL) + " ms.")
+        return 1
+    
+    if (args.save_profile):
+        print("Profile saved as " + save_profile(args.save_profile, dict([(key, value) for key, value in profile.items() if key != "device_name"])))
+    
+    devices = select_devices(args.port)
+    if ("device_name" in profile and len(devices) > 1):
+        print("A name can only be given to one device at a time, select it with --port.")
+        return 1
+    
+    results = apply_profile(devices, profile)
+    return 0 if devices and all([failed == [] for failed in results.values()]) else 1
+
+def command_daemon(args):
+    import fleet
+    
+    print("Looking after " + (", ".join(args.port) if args.port else "every device found") + ". Press Ctrl+C to stop.")
+    try:
+        fleet.run(fleet.read_config(args.config), args.port)
+    except KeyboardInterrupt:
+        print("Stopped.")
+    return 0
+
+def command_erase(args):
+    if (not args.yes):
+        print("This deletes every datapoint stored on the devices. Add --yes to confirm.")
+        return 1
+    
+    devices = select_devices(args.port)
+    replies = request_each(devices, "ERASE_STORAGE")
+    
+    for d in devices:
+        print(d["device_name"] + " on " + d["port_name"] + ": " +
+              ("storage erased." if replies[d["port_name"]] is not None else "storage could not be erased."))
+    
+    return 0 if devices and all([values is not None for values in replies.values()]) else 1
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="dock.py", description="Command-line tool suite for Open Spectral Sensing (OSS) devices. " +
+                                     "Run without a command for the interactive menu.")
+    parser.add_argument("--log", metavar="FILE", default=TELEMETRY_LOG, help="append every command and transfer to FILE as JSON lines")
+    parser.add_argument("--prometheus", metavar="FILE", default=PROMETHEUS_FILE, help="write command and transfer metrics to FILE " +
+                        "in the Prometheus text format, for the node exporter textfile collector")
+    parser.add_argument("--profile", action="store_true", help="print where the time went: the round trip of each command, " +
+                        "the phases of each transfer and the slowest functions")
+    parser.add_argument("--profile-output", metavar="FILE", help="save the profile to FILE for pstats or snakeviz, implies --profile")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    select = argparse.ArgumentParser(add_help=False)
+    select.add_argument("-p", "--port", action="append", help="serial port of a device, can be repeated (default: every device found)")
+    
+    subparsers.add_parser("status", parents=[select], help="show the status of the devices")
+    
+    export = subparsers.add_parser("export", parents=[select], help="export every datapoint stored on the devices to " + SAVE_DIR)
+    export.add_argument("--erase", action="store_true", help="erase device storage after a complete export")
+    export.add_argument("--encoding", choices=["CSV", "F4", "Q2"], help="send the log in a compact encoding, faster but the saved " +
+                        "file is rebuilt from the decoded values and not the bytes on the device: the spectra are re-formatted " +
+                        "at float32 (F4) or 16-bit (Q2) precision (default: CSV)")
+    
+    subparsers.add_parser("sync", parents=[select], help="append the datapoints recorded since the last sync to " +
+                          SAVE_DIR + SYNC_FILE_NAME + "_<device name>" + FILE_EXT)
+    
+    capture = subparsers.add_parser("capture", parents=[select], help="capture a datapoint on each device and print it")
+    capture.add_argument("--save", action="store_true", help="save each datapoint to " + SAVE_DIR)
+    capture.add_argument("--plot", action="store_true", help="graph each datapoint")
+    
+    monitor = subparsers.add_parser("monitor", parents=[select], help="capture datapoints continuously and graph them live")
+    monitor.add_argument("--count", type=int, help="stop after this many datapoints")
+    monitor.add_argument("--duration", type=float, help="stop after this many seconds")
+    monitor.add_argument("--buffer", type=int, help="how many of the latest datapoints to graph (default: 600)")
+    monitor.add_argument("--no-plot", action="store_true", help="only print the capture rate")
+    monitor.add_argument("--no-save", action="store_true", help="do not save the datapoints to " + SAVE_DIR)
+    
+    configure = subparsers.add_parser("configure", parents=[select], help="change device settings, from a saved profile or the options below")
+    configure.add_argument("--profile", help="apply a profile saved in " + PROFILE_DIR)
+    configure.add_argument("--save-profile", metavar="NAME", help="save the settings as a profile, without the device name")
+    configure.add_argument("--name", help="device name, for a single device")
+    configure.add_argument("--interval", type=int, help="recording interval in ms")
+    configure.add_argument("--ae", action=argparse.BooleanOptionalAction, help="use auto-exposure")
+    configure.add_argument("--frame-avg", type=int, choices=range(1, 11), metavar="[1-10]", help="frames to average into a single reading")
+    configure.add_argument("--int-time", type=int, choices=range(1, 1001), metavar="[1-1000]", help="integration time without auto-exposure")
+    configure.add_argument("--calibration-factor", type=float, help="sensor calibration factor")
+    recording = configure.add_mutually_exclusive_group()
+    recording.add_argument("--start", dest="recording", action="store_const", const=True, help="start recording")
+    recording.add_argument("--stop", dest="recording", action="store_const", const=False, help="stop recording")
+    
+    erase = subparsers.add_parser("erase", parents=[select], help="delete every datapoint stored on the devices")
+    erase.add_argument("--yes", action="store_true", help="confirm")
+    
+    daemon = subparsers.add_parser("daemon", parents=[select], help="keep the devices recording on schedule, synced and on time " +
+                                   "until stopped, see fleet.py")
+    daemon.add_argument("config", help="JSON configuration file, see fleet.py")
+    
+    return parser.parse_args(argv)
+
+subcommands = {
+    "status": command_status,
+    "export": command_transfer,
+    "sync": command_transfer,
+    "capture": command_capture,
+    "monitor": command_monitor,
+    "configure": command_configure,
+    "erase": command_erase,
+    "daemon": command_daemon,
+}
+
+# run a subcommand in cProfile, every thread included, then print the command and transfer summary of telemetry.py
+# and the PROFILE_LINES functions that took the longest. The profile is saved as args.profile_output if given.
+# Returns the exit code
+def profile_command(args):
+    profiler = telemetry.ThreadProfiler()
+    start_time = time.perf_counter()
+    profiler.start()
+    try:
+        return subcommands[args.command](args)
+    finally:
+        # the device thread keeps running, stop profiling it from the inside
+        async def stop_device_thread():
+            profiler.stop_thread()
+        get_device_thread().run(stop_device_thread())
+        stats = profiler.stop()
+        
+        print("--- profile of " + args.command + ", " + str(round(time.perf_counter() - start_time, 2)) + " s")
+        print(telemetry.recorder.summary())
+        stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+        if (args.profile_output):
+            stats.dump_stats(args.profile_output)
+            print("Profile saved as " + args.profile_output)
+
+# run a subcommand from command-line arguments. Returns the exit code
+def run_command(argv):
+    args = parse_arguments(argv)
+    telemetry.configure(args.log, args.prometheus)
+    try:
+        if (args.profile or args.profile_output): return profile_command(args)
+        return subcommands[args.command](args)
+    finally:
+        telemetry.flush()
     
 if __name__ == "__main__":
     
+    # run a single command and exit if one is given
+    if (len(sys.argv) > 1): sys.exit(run_command(sys.argv[1:]))
+    
+    telemetry.configure(TELEMETRY_LOG, PROMETHEUS_FILE)
+    
     # start main loop
     while True:
         devices = find_devices()
@@ -252,7 +968,38 @@ if __name__ == "__main__":
                 for i, device in enumerate(devices):
                     print("[" + str(i) + "] " + device["device_name"])
                     
-                inp = input("Select a device to connect to\n>")
+                inp = input("Select a device to connect to, enter 'export' or 'sync' to transfer from all devices, " +
+                            "or 'configure' to apply a saved profile to all devices\n>").strip().lower()
+                
+                if (inp == "configure"):
+                    profiles = list_profiles()
+                    if (len(profiles) == 0):
+                        print("No profiles saved. Connect to a device and save one from CONFIGURE_SENSOR.")
+                        continue
+                    
+                    for i, name in enumerate(profiles):
+                        print("[" + str(i) + "] " + name)
+                    
+                    inp = input("Select a profile to apply to all devices\n>").strip()
+                    if (not inp.isnumeric() or int(inp) >= len(profiles)):
+                        print("Invalid entry. Please try again.")
+                        continue
+                    
+                    apply_profile(devices, load_profile(profiles[int(inp)]))
+                    input("Press enter to continue\n>")
+                    devices = find_devices()
+                    continue
+                
+                if (inp == "export" or inp == "sync"):
+                    delete_data = False
+                    if (inp == "export"):
+                        delete_data = input("Delete datapoints from device storage after exporting? y or (n)?\n>").strip().lower() == 'y'
+                    
+                    transfer_all_devices(devices, inp, delete_data)
+                    input("Press enter to continue\n>")
+                    devices = find_devices()
+                    continue
+                
                 if (not inp.strip().isnumeric() or int(inp) < 0 or int(inp) >= len(devices)):
                     print("Invalid entry. Please try again.")
                     continue
@@ -260,7 +1007,8 @@ if __name__ == "__main__":
                 inp = int(inp)
             else:
                 print("No devices detected... Trying again")
-                time.sleep(1)
+                time.sleep(RESCAN_INTERVAL)
+                devices = find_devices()
                 continue
             
             # S is the selected OSS device
@@ -269,6 +1017,15 @@ if __name__ == "__main__":
             
             if (s is None):
                 print("Could not connect, please try again.")
+                devices = find_devices()
+                continue
+            
+            # devices known from an earlier session are listed without asking them, make sure this one answers
+            d = update_device_status(s)
+            if (d is None):
+                s.close()
+                print("Device did not respond, please try again.")
+                devices = find_devices(rescan=True)
                 continue
             
             break
@@ -276,19 +1033,7 @@ if __name__ == "__main__":
         response = ""
         
         # device selected, set time
-        date = get_formatted_date()
-        command_to_send = commands["_SET_DATETIME"] + date
-        write_to_device(command_to_send, s)
-        resp = read_from_device(s)
-        
-        if len(resp) <= 0 or resp[0].lower() != "ok":
-            response = "Time could not be set."
-            response = resp
-        else:
-            response = "Time has been set successfully to " + date
-            
-        
-        flush_serial(s)
+        response = set_device_time(s)
         
         # trigger device status update flag
         trigger_update = False
@@ -346,6 +1091,11 @@ if __name__ == "__main__":
                     print("Goodbye!")
                     exit()
                                          
+                elif (selected_command == "LIVE_MONITOR"):
+                    print("Close the window or press Ctrl+C to stop.")
+                    response = monitor_device(s, d["device_name"])
+                    trigger_update = True
+                
                 elif (selected_command == "CONFIGURE_SENSOR"):
 
                     device_name = ""
@@ -355,6 +1105,7 @@ if __name__ == "__main__":
                     int_time = 500
                     collection_freq = 0
                     start_recording = False              
+                    cancelled = True
 
                     while True:
                         # get the device name
@@ -469,34 +1220,54 @@ if __name__ == "__main__":
                         else:
                             start_recording = True
                         
+                        cancelled = False
                         break
-                        
-                    # write name
-                    write_to_device(commands["SET_DEVICE_NAME"] + "_" + device_name, s)
-                    read_from_device(s)
                     
-                    # write the settings
-                    write_to_device(commands["_NSP_SETTINGS"] + str(int(use_ae)) + str(frame_avg).zfill(3) + str(int_time).zfill(4), s)
-                    read_from_device(s)
+                    if cancelled: continue
+                    
+                    profile = {"use_ae": use_ae, "frame_avg": frame_avg, "int_time": int_time,
+                               "calibration_factor": float(calibration_factor), "logging_interval": collection_freq,
+                               "recording": start_recording}
                     
-                    # set collection frequency
-                    write_to_device(commands["SET_COLLECTION_INTERVAL"] + "_" + str(collection_freq), s)
-                    read_from_device(s)
+                    # send every setting at once and check the replies
+                    failed = configure_device(s, dict(profile, device_name=device_name))
                     
-                    # start recording or stop depending
-                    if (start_recording):
-                        write_to_device(commands["_START_RECORDING"], s)
-                        read_from_device(s)
+                    if (len(failed) > 0):
+                        response = "Device could not be configured (" + ", ".join(failed) + "). Please try again."
                     else:
-                        write_to_device(commands["_STOP_RECORDING"], s)
-                        read_from_device(s)
+                        response = "Device configured."
                         
-                    response = "Device configured."
+                        # save the settings to apply them to other devices, without the name which is per device
+                        inp = input("Save these settings as a profile? Enter a profile name or hit enter to skip.\n>").strip()
+                        if (len(inp) > 0 and inp.lower() != "cancel" and inp.lower() != "exit"):
+                            response += " Profile saved as " + save_profile(inp, profile)
+                    
                     trigger_update = True
                     continue
                     
                 elif (selected_command == "TIMED_START_STOP"):
-                    response = "This feature has not been implemented yet."
+                    try:
+                        inp = input("Start recording at? YYYY-MM-DD HH:MM in device time, or hit enter to start now\n>").strip()
+                        start = datetime.datetime.strptime(inp, "%Y-%m-%d %H:%M") if inp else None
+                        inp = input("Stop recording at? YYYY-MM-DD HH:MM in device time, or hit enter to keep recording\n>").strip()
+                        stop = datetime.datetime.strptime(inp, "%Y-%m-%d %H:%M") if inp else None
+                    except ValueError:
+                        response = "Invalid date. Please try again."
+                        continue
+                    
+                    # the device starts and stops by its own clock
+                    set_device_time(s)
+                    try:
+                        if (not set_recording_window(s, start, stop)):
+                            response = ("The device firmware does not support timed start and stop. Update it, or run " +
+                                        "'dock.py daemon' to start and stop devices on a schedule.")
+                            continue
+                        if (start is None): send_command(s, "_START_RECORDING")
+                        response = ("Recording " + ("from " + str(start) if start else "from now") +
+                                    (" until " + str(stop) if stop else "") + ".")
+                    except DeviceError as e:
+                        response = "Timed start and stop could not be set. Please try again."
+                    trigger_update = True
                     continue
                        
                 elif (selected_command == "REFRESH"):
@@ -510,14 +1281,10 @@ if __name__ == "__main__":
 
             # find the right command to send
             selected_command = list(public_commands.keys())[inp]
-            command_to_send = ""
             
             if (selected_command == "TOGGLE_DATA_CAPTURE"):
-                command_to_send = commands["TOGGLE_DATA_CAPTURE"]
-                write_to_device(command_to_send, s)
-                
                 # no need to save the response
-                read_from_device(s)    
+                send_command(s, "TOGGLE_DATA_CAPTURE")
                 response = ""
                 
                 trigger_update = True
@@ -564,29 +1331,21 @@ if __name__ == "__main__":
                     else:
                         continue
                         
-                    command_to_send = commands["MANUAL_CAPTURE"]
-                    write_to_device(command_to_send, s)
-                    response = read_from_device(s)
-                    
+                    response = send_command(s, "MANUAL_CAPTURE")
                     trigger_update = True
                     
+                    if (not response):
+                        response = "Datapoint could not be captured. Please try again."
+                        break
+                    
                     if (save_file):
-                        f, filename = open_file(user_filename)
-                        f.write(file_header())
-                        f.write(response[1] + "\n")
+                        f, filename = open_file(user_filename, add_header=True)
+                        f.write(response[0] + "\n")
                         f.close()
                     
                     if (do_graph):
-                        x, y, timestamp, manual, int_time, frame_avg, ae, quality, cie_x, cie_y, cie_z  = get_formatted_datapoint(response[1])
-                        plt.plot(x,y)
-                        plt.xlim([MIN_WAVELENGTH, MAX_WAVELENGTH])
-                        plt.ylabel("Power (W/m^2)")
-                        plt.xlabel("Wavelength (nm)")
-                        plt.title("Manual Datapoint Capture at " + timestamp)
-                        plt.text(500, 300, "X: " + str(cie_x), ha='center', va='center', transform=None)
-                        plt.text(500, 280, "Y: " + str(cie_y), ha='center', va='center', transform=None)
-                        plt.text(500, 260, "Z: " + str(cie_z), ha='center', va='center', transform=None)
-                        plt.show()
+                        plot_datapoint(response[0])
+                        show_plots()
                         
                     response = "Manual datapoint captured."
                     
@@ -599,8 +1358,8 @@ if __name__ == "__main__":
                     response = "No data to export."
                     continue
                 
-                # check if too much data, 
-                if (d["data_counter"] > MAX_TRANSFER_DATAPOINTS):
+                # check if too much data to export without framing
+                if (d["data_counter"] > MAX_TRANSFER_DATAPOINTS and not supports_framed_export(s)):
                     inp = input("For large amounts of data, it is recommended to read from the microSD directly. Do you wish to continue exporting anyways? (y) or n\n>").strip()
                     if (inp.lower() == 'n'):
                         response = "Export cancelled. No data transferred."
@@ -616,123 +1375,21 @@ if __name__ == "__main__":
                 if (len(inp) == 0 or inp.lower() == 'y'):
                     delete_data = True
                 
-                f, filename = open_file(get_formatted_date(), open_mode='wb')
-                command_to_send = commands["EXPORT_ALL"]
-                write_to_device(command_to_send, s)
+                filename, bytes_read, elapsed, complete, response = export_datapoints(s, get_formatted_date(), device_name=d["device_name"])
                 
-                # read the "DATA" header
-                h_data = s.readline().decode().strip()
-                
-                if (h_data.lower() != "data"):
-                    response = "Could not export data. Please try again."
-                    continue
-                
-                # read the file size header
-                file_size = int(s.readline().decode().strip())
-                
-                if (file_size <= 0):
-                    response = "Could not read file. Please try again."
-                    continue
-
-                bytes_read = 0
-                
-                while True:
-                    if s.in_waiting > 0:
-                                               
-                        b = s.read(s.in_waiting)
-                        bytes_read += len(b)
-                        
-                        percentage_transferred = (bytes_read / file_size) * 100
-                        
-                        cls()
-                        print(str(round(percentage_transferred, 5)) + " % exported")
-                    
-                        if (b.strip()[-2:] == b'OK'):
-                            break
-                        
-                        f.write(b)
-
-                # close the file    
-                f.close()
-                response = "File saved as " + filename
+                if (not complete): continue
                 
                 if delete_data:
                     trigger_update = True
-                    write_to_device(commands["ERASE_STORAGE"], s)
-                    res = read_from_device(s)
-                    # if res[0].lower() != "OK":
-                    #     response += " File could not be deleted from device storage."
+                    if (send_command(s, "ERASE_STORAGE") is None):
+                        response += "\nFile could not be deleted from device storage."
                 
             elif (selected_command == "SYNC_DATAPOINTS"):
-                
-                # open the sync file and find the file size in bytes
-                sync_file_size = 0
-                filename = ""
-                f = None
-                
-                
-                
-                if not exists(SAVE_DIR + SYNC_FILE_NAME + FILE_EXT):
-                    f, filename = open_file(SYNC_FILE_NAME, overwrite = True)
-                else:
-                    sync_file_size = os.stat(SAVE_DIR + SYNC_FILE_NAME + FILE_EXT).st_size
-                    
-                # close the datapoint file
-                if f: f.close()
-                
-                # send the byte size to the sensor
-                command_to_send = commands["SYNC_DATAPOINTS"]
-                command_to_send += "_" + str(sync_file_size)
-            
-                print(command_to_send)
-                exit()
-
-                write_to_device(command_to_send, s)
-                
-                # read the DATA response
-                response = s.readline().decode().strip()
-
-                if (response.lower() != "data"):
-                    response = "Could not SYNC."
-                    continue
-                
-                # read the file size header
-                file_size = int(s.readline().decode().strip())
-                if (file_size == -1):
-                    # sync mismatch
-                    response = "There is a sync issue. Please export all sensor data and reset the device."
-                    continue
-            
-                # open the sync file for writing
-                f, filename = open_file("SYNC", open_mode = 'wb', overwrite = True)
-
-                bytes_read = 0
-                
-                while True:
-                    if s.in_waiting > 0:
-                        
-                        b = s.read(s.in_waiting)
-                        bytes_read += len(b)
-                        
-                        cls()
-                        print(str((bytes_read / file_size) * 100) + " % exported")
-                        
-                        if (b.strip()[-2:] == b'OK'):
-                            break
-                        
-                        f.write(b)
-
-                
-                # close the SYNC file
-                f.close()
-                
-                response = "Datapoints synchronized. " + str(bytes_read) + " bytes read."                
+                filename, bytes_read, elapsed, complete, response = sync_datapoints(s, d["device_name"])
+                trigger_update = True
 
             elif (selected_command == "RESET_DEVICE"):
-                command_to_send = commands["RESET_DEVICE"]
-                write_to_device(command_to_send, s)
-                response = read_from_device(s)
-                if (response[0].lower() == "ok"):
+                if (send_command(s, "RESET_DEVICE") is not None):
                     response = "Device successfully reset to factory settings."
                 else:
                     response = "Device could not be reset. Please try again."
@@ -740,11 +1397,7 @@ if __name__ == "__main__":
                 trigger_update = True
                 
             elif (selected_command == "ERASE_STORAGE"):
-                command_to_send = commands["ERASE_STORAGE"]
-                write_to_device(command_to_send, s)
-                
-                response = read_from_device(s)
-                if (response[0].lower() == "ok"):
+                if (send_command(s, "ERASE_STORAGE") is not None):
                     response = "Device storage successfully erased."
                 else:
                     response = "Storage could not be erased. Please try again."
@@ -765,9 +1418,10 @@ if __name__ == "__main__":
                         print("Enter a value greater than " + str(MIN_LOGGING_INTERVAL))
                         continue
                     
-                    command_to_send = commands["SET_COLLECTION_INTERVAL"] + "_" + inp.strip()
-                    write_to_device(command_to_send, s)
-                    response = read_from_device(s)
+                    if (send_command(s, "SET_COLLECTION_INTERVAL", "_" + inp.strip()) is not None):
+                        response = "Collection interval set to " + inp.strip() + " ms."
+                    else:
+                        response = "Collection interval could not be set. Please try again."
 
                     break
                 trigger_update = True                    
@@ -784,9 +1438,10 @@ if __name__ == "__main__":
                         continue
                     
                     inp = inp.replace(' ', '_')
-                    command_to_send = commands["SET_DEVICE_NAME"] + "_" + inp
-                    write_to_device(command_to_send, s)
-                    response = read_from_device(s)
+                    if (send_command(s, "SET_DEVICE_NAME", "_" + inp) is not None):
+                        response = "Device name set."
+                    else:
+                        response = "Device name could not be set. Please try again."
                     
                     # update local variables
                     d["device_name"] = inp.strip()
@@ -796,9 +1451,7 @@ if __name__ == "__main__":
                 trigger_update = True
                 
             elif (selected_command == "_GET_INFO"):
-                command_to_send = commands["GET_INFO"]
-                write_to_device(command_to_send, s)
-                response = read_from_device(s)
+                response = send_command(s, "_GET_INFO")
                 
             elif (selected_command == "SET_CALIBRATION_FACTOR"):
                 while True:
@@ -811,9 +1464,10 @@ if __name__ == "__main__":
                         print("Enter a numeric value")
                         continue
                     
-                    command_to_send = commands["SET_CALIBRATION_FACTOR"] + "_" + inp
-                    write_to_device(command_to_send, s)
-                    response = read_from_device(s)
+                    if (send_command(s, "SET_CALIBRATION_FACTOR", "_" + inp) is not None):
+                        response = "Calibration factor set to " + inp + "."
+                    else:
+                        response = "Calibration factor could not be set. Please try again."
                     
                     break
                     
@@ -0,0 +1,146 @@
+'''
+Compact wire encodings for framed exports.
+
+A framed export (see device.py) can send the log encoded instead of as CSV text. Each frame still covers one chunk
+of the log file, so chunks can be asked for again on their own: the frame holds every line that starts inside the
+chunk, one record per line. A datapoint becomes a fixed size binary record, any other line (the header,
+"DATA LOGGING ERROR") a text record:
+
+    TEXT    kind 0, length (uint16), the line without its line break
+    F4      kind 1, metadata, the spectrum as float32                                   564 bytes
+    Q2      kind 2, metadata, scale (float32), the spectrum as int16 * scale / 32767    298 bytes
+
+The metadata is the timestamp (uint32 seconds since 1970-01-01 in device time), MANUAL (uint8), INT_TIME (uint16),
+FRAME_AVG (uint16), AE (uint8), QUALITY (int8), and X, Y and Z as int32 in units of 10^-CIE_PRECISION.
+Everything is little endian and packed.
+
+A datapoint line is about 2.9 KB of text. F4 is 5 times smaller and decodes to exactly the float32 spectra that
+parsing the CSV gives. Q2 is 10 times smaller, and rounds each spectral value by at most Q2_TOLERANCE (1/65534
+plus float32 rounding) of the largest absolute value in its spectrum. The device lists its encodings in reply to _GET_ENCODINGS, firmware that does not
+know the command only sends CSV.
+
+The log file an encoded export saves is not the bytes on the device: stream.write_decoded formats the decoded values
+again, the spectra with 9 significant digits, so only a CSV export gives a byte-for-byte copy. Decoding and writing
+runs at about 30 MB of log per second, a small part of an export over USB (python bench.py encoding).
+'''
+
+import numpy as np
+
+from logfile import WAVELENGTHS, CIE_PRECISION, COLUMN_TYPES, SPECTRA_TYPE, is_datapoint, parse_timestamp, empty_columns
+
+# CONSTANTS
+RECORD_TEXT = 0                             # record kind of a line that is not a datapoint
+RECORD_F4 = 1                               # record kind of a datapoint with a float32 spectrum
+RECORD_Q2 = 2                               # record kind of a datapoint with a scaled int16 spectrum
+Q2_RANGE = 32767                            # the largest absolute Q2 value, for the largest absolute spectral value
+Q2_TOLERANCE = 0.5 / Q2_RANGE + 2 ** -22    # the largest Q2 error, relative to the largest absolute value of the spectrum
+CIE_SCALE = 10 ** CIE_PRECISION             # X, Y and Z are sent in units of 1 / CIE_SCALE
+
+# the record kind of every encoding, CSV sends the log as it is
+ENCODINGS = {"CSV": None, "F4": RECORD_F4, "Q2": RECORD_Q2}
+
+METADATA_RECORD = [
+    ("kind", "u1"),
+    ("timestamp", "<u4"),
+    ("manual", "u1"),
+    ("int_time", "<u2"),
+    ("frame_avg", "<u2"),
+    ("ae", "u1"),
+    ("quality", "i1"),
+    ("x", "<i4"),
+    ("y", "<i4"),
+    ("z", "<i4"),
+]
+
+# the packed layout of the datapoint records
+RECORD_TYPES = {
+    RECORD_F4: np.dtype(METADATA_RECORD + [("spectra", "<f4", (len(WAVELENGTHS),))]),
+    RECORD_Q2: np.dtype(METADATA_RECORD + [("scale", "<f4"), ("spectra", "<i2", (len(WAVELENGTHS),))]),
+}
+
+# round half away from zero, like the firmware's lround()
+def round_away(values):
+    return np.sign(values) * np.floor(np.abs(values) + 0.5)
+
+# encode one log line, without its line break, as a record. Datapoints get the record of the encoding, every
+# other line a text record
+def encode_line(line, encoding):
+    text = line.decode("ascii", "replace")
+    if (is_datapoint(text)):
+        fields = text.split(",")
+        try:
+            timestamp = parse_timestamp(fields[0], fields[1])
+            numbers = np.array([float(v) for v in fields[2:-1]])
+        except ValueError:
+            numbers = None
+
+        if (numbers is not None and 0 <= timestamp < 2 ** 32):
+            kind = ENCODINGS[encoding]
+            record = np.zeros(1, dtype=RECORD_TYPES[kind])
+            record["kind"] = kind
+            record["timestamp"] = timestamp
+            for i, column in enumerate(["manual", "int_time", "frame_avg", "ae", "quality"]):
+                record[column] = numbers[i]
+            for i, column in enumerate(["x", "y", "z"]):
+                record[column] = round_away(numbers[5 + i] * CIE_SCALE)
+
+            spectrum = numbers[8:]
+            if (kind == RECORD_F4):
+                record["spectra"] = spectrum.astype(np.float32)
+            else:
+                scale = np.float32(np.abs(spectrum).max())
+                record["scale"] = scale
+                record["spectra"] = round_away(spectrum / np.float64(scale) * Q2_RANGE) if scale > 0 else 0
+            return record.tobytes()
+
+    return bytes([RECORD_TEXT]) + len(line).to_bytes(2, "little") + line
+
+# decode the records of an encoded export into NumPy columns, the same columns logfile.parse_block returns.
+# Returns (columns, lines): lines holds (row, line) for every line that is not a datapoint, row being the number
+# of datapoints before it. Raises ValueError if the records are not valid for the encoding
+def decode_records(buffer, encoding):
+    buffer = bytes(buffer)
+    kind = ENCODINGS[encoding]
+    size = RECORD_TYPES[kind].itemsize
+
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    lines = []
+    if (len(buffer) % size == 0 and (raw[::size] == kind).all()):
+        # only datapoint records, the usual frame: a text record would start with RECORD_TEXT at one of these bytes
+        records = np.frombuffer(buffer, dtype=RECORD_TYPES[kind])
+    else:
+        # take each run of datapoint records between the text records as one view, only the text records are read
+        # one by one
+        runs = []
+        rows = 0
+        i = 0
+        while i < len(buffer):
+            others = raw[i::size] != kind
+            run = int(np.argmax(others)) if others.any() else len(others)
+            if (i + size * run > len(buffer)): raise ValueError("the last record is cut off")
+            runs.append(np.frombuffer(buffer, dtype=RECORD_TYPES[kind], count=run, offset=i))
+            rows += run
+            i += size * run
+            if (i == len(buffer)): break
+
+            if (buffer[i] != RECORD_TEXT): raise ValueError("unknown record kind " + str(buffer[i]) + " at byte " + str(i))
+            end = i + 3 + int.from_bytes(buffer[i + 1:i + 3], "little")
+            lines.append((rows, buffer[i + 3:end]))
+            i = end
+
+        if (i > len(buffer)): raise ValueError("the last record is cut off")
+        records = np.concatenate(runs)
+
+    if not len(records): return empty_columns(), lines
+
+    columns = {column: records[column].astype(dtype) for column, dtype in COLUMN_TYPES.items() if column not in ("x", "y", "z")}
+    for column in ["x", "y", "z"]:
+        columns[column] = records[column] / CIE_SCALE
+
+    if (kind == RECORD_F4):
+        columns["spectra"] = records["spectra"].astype(SPECTRA_TYPE)
+    else:
+        scale = records["scale"].astype(np.float64) / Q2_RANGE
+        columns["spectra"] = (records["spectra"] * scale[:, None]).astype(SPECTRA_TYPE)
+    columns["wavelengths"] = np.array(WAVELENGTHS, dtype=np.int32)
+    return columns, lines
@@ -0,0 +1,214 @@
+'''
+Headless fleet daemon: keeps every docked sensor recording on schedule, synced and on time, unattended.
+
+Every FLEET_POLL_INTERVAL the daemon looks for devices, on the ports it was given or with discovery.py, and visits
+each device that is due, in a pool of at most FLEET_WORKERS threads with a serial connection each. A visit sets
+the device clock every CLOCK_INTERVAL, brings the device in line with its recording schedule and syncs it every
+SYNC_INTERVAL (see dock.sync_datapoints). An interrupted sync resumes at the next visit.
+
+A schedule is a list of daily windows in device time, which is the local time of the computer since the daemon
+sets the clocks. A window that stops before it starts runs past midnight, and one that stops when it starts runs
+all day. Devices record during their windows and are paused outside them. Firmware with timed start and stop gets
+the current or next window with _SET_START_TIME and _SET_STOP_TIME, and keeps to it even while undocked. Every
+device is also visited when a window starts and stops, and sent _START_RECORDING or _STOP_RECORDING if it is not
+recording when it should, which is all older firmware gets. Devices with timed start and stop are given EDGE_GRACE to
+start and stop on their own first.
+
+A device that cannot be reached or fails a visit is visited again after a backoff that doubles with each failure,
+up to BACKOFF_MAX, so an unplugged device costs next to nothing until it is back. Devices are followed by port: a
+device plugged back in is visited like a new one, and its sync resumes where it stopped.
+
+The configuration is a JSON file, every key optional:
+
+    {"sync_interval": 3600, "clock_interval": 3600, "workers": 8, "timeout": 10, "ports": ["/dev/ttyACM0"],
+     "windows": [["07:00", "19:00"]], "devices": {"NSP_NIGHT": {"windows": [["19:00", "07:00"]]}}}
+
+"timeout" is how long to wait for each reply, see device.COMMAND_TIMEOUT. "devices" gives devices their own windows by
+name. Without "windows", recording is left alone, and with no windows, [], devices are kept paused.
+
+    python dock.py daemon fleet.json
+'''
+
+import json
+import time
+import random
+import datetime
+from threading import Event
+from concurrent.futures import ThreadPoolExecutor
+
+import dock
+from device import COMMAND_TIMEOUT, DeviceError, get_device_thread
+
+# CONSTANTS
+FLEET_POLL_INTERVAL = 5                     # seconds between looking for devices and visiting the ones that are due
+FLEET_WORKERS = 8                           # the most devices visited at the same time
+SYNC_INTERVAL = 3600                        # seconds between syncs of each device
+CLOCK_INTERVAL = 3600                       # seconds between setting the clock of each device
+BACKOFF_BASE = 5                            # seconds before visiting a device again after its first failure
+BACKOFF_MAX = 600                           # the longest wait before visiting a device again after failures
+EDGE_GRACE = 2                              # seconds after a window starts or stops before checking the device followed it
+TIME_FORMATS = ["%H:%M:%S", "%H:%M"]        # formats of the start and stop of a window
+
+def read_config(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+# the windows of a device, by name. Returns None if its recording is left alone
+def device_windows(config, device_name):
+    return config.get("devices", {}).get(device_name, {}).get("windows", config.get("windows"))
+
+# the time of day of the start or stop of a window. Raises ValueError for anything but TIME_FORMATS
+def parse_clock(text):
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, time_format).time()
+        except ValueError:
+            pass
+    raise ValueError("unknown time of day " + text + ", use HH:MM[:SS]")
+
+# the window of a daily schedule that now is in, or the next one if it is in none. Returns (start, stop) as
+# datetimes, or None if there are no windows
+def current_window(windows, now):
+    candidates = []
+    for start, stop in windows:
+        for day in (-1, 0, 1):
+            date = now.date() + datetime.timedelta(days=day)
+            window_start = datetime.datetime.combine(date, parse_clock(start))
+            window_stop = datetime.datetime.combine(date, parse_clock(stop))
+            if (window_stop <= window_start): window_stop += datetime.timedelta(days=1)
+            if (window_stop > now): candidates.append((window_start, window_stop))
+    return min(candidates) if candidates else None
+
+# what the daemon knows about the device on a port
+def new_state(port_name):
+    return {"port_name": port_name,
+            "device_name": None,
+            "failures": 0,                  # visits that failed in a row
+            "next_visit": 0,                # time.time() of the next visit
+            "last_sync": None,
+            "last_clock": None,
+            "scheduled": None,              # whether the firmware has timed start and stop, None until asked
+            "window": None}                 # the window the device was given
+
+# give the device its current or next window if the firmware has timed start and stop, then start or stop it
+# if it is not recording when it should. Returns the window, or the window it was given while it may still be
+# starting or stopping on its own
+def apply_schedule(serial_object, state, status, windows, log):
+    now = datetime.datetime.now()
+    window = current_window(windows, now)
+    recording = window is not None and window[0] <= now < window[1]
+
+    # a device that was given its window may still be about to start or stop on its own clock
+    given = state["window"] if state["scheduled"] else None
+    if (given is not None and any([edge <= now < edge + datetime.timedelta(seconds=EDGE_GRACE) for edge in given])): return given
+
+    if (state["scheduled"] is not False and window != state["window"]):
+        state["scheduled"] = dock.set_recording_window(serial_object, *(window or (None, None)))
+        if (state["scheduled"]):
+            state["window"] = window
+            log(state, "window " + (" to ".join([str(moment) for moment in window]) if window else "cleared"))
+        else:
+            log(state, "firmware without timed start and stop, recording is started and stopped by the daemon")
+
+    if ((status["device_status"] == '1') != recording):
+        serial_object.request("_START_RECORDING" if recording else "_STOP_RECORDING")
+        log(state, "recording started" if recording else "recording stopped")
+
+    return window
+
+# visit a device: set its clock, apply its schedule and sync it when they are due. Never raises, a visit that fails
+# schedules the next one after a backoff. Returns the state
+def visit(state, config, log):
+    now = time.time()
+    sync_interval = config.get("sync_interval", SYNC_INTERVAL)
+    clock_interval = config.get("clock_interval", CLOCK_INTERVAL)
+    serial_object = None
+
+    try:
+        serial_object = get_device_thread().open(state["port_name"], timeout=config.get("timeout", COMMAND_TIMEOUT))
+        status = serial_object.hello()
+        state["device_name"] = status["device_name"]
+
+        if (state["last_clock"] is None or now - state["last_clock"] >= clock_interval):
+            serial_object.set_datetime(dock.get_formatted_date())
+            state["last_clock"] = now
+
+        windows = device_windows(config, state["device_name"])
+        window = None if windows is None else apply_schedule(serial_object, state, status, windows, log)
+
+        if (state["last_sync"] is None or now - state["last_sync"] >= sync_interval):
+            filename, bytes_synced, elapsed, complete, message = dock.sync_datapoints(serial_object, state["device_name"], False)
+            if (not complete): raise DeviceError(message)
+            state["last_sync"] = now
+            log(state, str(bytes_synced) + " bytes synced in " + str(round(elapsed, 1)) + " s")
+
+        # come back for the next sync, clock or window start or stop, whichever is first
+        due = [state["last_sync"] + sync_interval, state["last_clock"] + clock_interval]
+        if (window):
+            delay = datetime.timedelta(seconds=EDGE_GRACE if state["scheduled"] else 0)
+            edges = [edge + delay for edge in window if edge + delay > datetime.datetime.now()]
+            if edges: due.append(edges[0].timestamp())
+        state["next_visit"] = min(due)
+        state["failures"] = 0
+
+    except Exception as e:
+        state["failures"] += 1
+        state["scheduled"] = None
+        state["window"] = None
+        backoff = min(BACKOFF_BASE * 2 ** (state["failures"] - 1), BACKOFF_MAX)
+        backoff *= random.uniform(0.5, 1)
+        state["next_visit"] = time.time() + backoff
+        log(state, "visit failed (" + str(e) + "), trying again in " + str(round(backoff, 1)) + " s")
+
+    finally:
+        if serial_object is not None:
+            try:
+                serial_object.close()
+            except DeviceError:
+                pass
+
+    return state
+
+# print a message about a device with the time
+def print_log(state, message):
+    print(time.strftime("%Y-%m-%d %H:%M:%S") + " " + (state["device_name"] or "?") + " on " + state["port_name"] + ": " + message, flush=True)
+
+# run the daemon until stop is set. ports are the ports to look after, every device found if None. log is called
+# with the state of a device and a message about it. Returns the state of every device, by port
+def run(config, ports = None, stop = None, log = print_log, poll_interval = FLEET_POLL_INTERVAL):
+    from discovery import Discovery
+
+    stop = stop or Event()
+    ports = ports or config.get("ports")
+    discovery = None if ports else Discovery()
+    states = {}
+    visits = {}
+
+    with ThreadPoolExecutor(max_workers=config.get("workers", FLEET_WORKERS)) as pool:
+        while not stop.is_set():
+            found = ports or [device["port_name"] for device in get_device_thread().run(discovery.scan())]
+            for port_name in found:
+                if (port_name not in states): states[port_name] = new_state(port_name)
+
+            # forget unplugged devices once their visit is over
+            for port_name in [port_name for port_name in states if port_name not in found and port_name not in visits]:
+                log(states.pop(port_name), "unplugged")
+
+            for port_name in [port_name for port_name, future in visits.items() if future.done()]:
+                visits.pop(port_name)
+
+            # devices with the same name would sync into the same file
+            names = [state["device_name"] for state in states.values() if state["device_name"]]
+            now = time.time()
+            for port_name, state in states.items():
+                if (names.count(state["device_name"]) > 1):
+                    if (port_name not in visits and now >= state["next_visit"]):
+                        log(state, "skipped, another device has the same name. Give each device a unique name")
+                        state["next_visit"] = now + BACKOFF_MAX
+                    continue
+                if (port_name not in visits and now >= state["next_visit"]):
+                    visits[port_name] = pool.submit(visit, state, config, log)
+
+            stop.wait(poll_interval)
+
+    return states
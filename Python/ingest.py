@@ -0,0 +1,190 @@
+'''
+Bulk ingestion of microSD card dumps: every log file under the given directories is converted into a dataset.
+
+Point ingest at the mounted cards, or at a directory of copied LOG.CSV files, and every file matching
+INGEST_PATTERNS is converted into a dataset (see dataset.py) in the output directory, named after the directory
+given and the path of the file in it, so the logs of several cards never collide: cards/NSP_A/LOG2.CSV becomes
+cards_NSP_A_LOG2.ossd. Logs carry no device name, so name the card directories after their devices.
+
+Each file is memory-mapped and cut into parts of about INGEST_PART_BYTES at line ends, and the parts of every
+file are parsed by a pool of INGEST_WORKERS processes, each mapping the file and parsing only its own part, so
+ingestion scales with the cores of the computer. The parsed parts are written to each dataset in order by the
+main process, with at most two parts per worker in flight at a time, however large the cards are. The main process
+also adds the quality flags of every datapoint (see quality.py).
+
+A dataset is written next to its final place (PART_EXT) and only put in place once complete, then the file is
+checkpointed in INGEST_STATE_FILE in the output directory with its size and a CRC-32 of its last bytes (see
+timeindex.fingerprint). Running ingest again skips every file that was converted and has not changed since, so an
+interrupted run picks up with the first file it did not finish. A file that changed, such as a card that kept
+recording, is converted again.
+
+    python ingest.py /media/cards data/cards
+'''
+
+import os
+import json
+import mmap
+import fnmatch
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from logfile import parse_block
+from dataset import DATASET_EXT, create_dataset
+
+# CONSTANTS
+INGEST_WORKERS = os.cpu_count() or 1        # the most worker processes parsing logs at the same time
+INGEST_PART_BYTES = 8 * 1024 * 1024         # about how many bytes of a log each worker parses at a time
+INGEST_PATTERNS = ["LOG*.CSV"]              # names of the log files to ingest, in any case
+INGEST_STATE_FILE = "ingest.json"           # the checkpoint of every file ingested, in the output directory
+PART_EXT = ".part"                          # suffix of a dataset while it is being written
+
+# the log files under a directory, or the file itself, as (path, dataset name) in path order. Raises
+# FileNotFoundError if there is no such directory or file, such as a card that is not mounted
+def find_logs(source, patterns = INGEST_PATTERNS):
+    source = source.rstrip("/\\") or source
+    if (not os.path.exists(source)): raise FileNotFoundError(source + " does not exist")
+    if (os.path.isfile(source)): return [(source, os.path.splitext(os.path.basename(source))[0])]
+
+    logs = []
+    for directory, directories, filenames in os.walk(source):
+        directories.sort()
+        for filename in sorted(filenames):
+            if (not any([fnmatch.fnmatchcase(filename.upper(), pattern.upper()) for pattern in patterns])): continue
+            relative = os.path.relpath(os.path.join(directory, filename), source)
+            parts = [os.path.basename(os.path.abspath(source))] + os.path.splitext(relative)[0].split(os.sep)
+            logs.append((os.path.join(directory, filename), "_".join([part for part in parts if part])))
+    return logs
+
+# cut a file into byte ranges of about part_bytes that end at line ends. Returns [(start, end), ...]
+def file_parts(filename, part_bytes = INGEST_PART_BYTES):
+    parts = []
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if (size == 0): return parts
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while (start < size):
+                end = data.find(b"\n", min(start + part_bytes, size) - 1) + 1
+                if (end == 0): end = size
+                parts.append((start, end))
+                start = end
+    return parts
+
+# parse the datapoints between two byte offsets of a file. Runs in the worker processes
+def parse_part(filename, start, end):
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_block(data[start:end])
+
+# the size and CRC-32 of the last bytes of a file, which tell whether it changed since it was ingested
+def file_state(filename):
+    from timeindex import fingerprint
+
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        return {"bytes": size, "fingerprint": fingerprint(f, size)}
+
+def read_state(output):
+    try:
+        with open(os.path.join(output, INGEST_STATE_FILE), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# write the checkpoints and atomically replace the old ones
+def write_state(output, state):
+    filename = os.path.join(output, INGEST_STATE_FILE)
+    with open(filename + PART_EXT, 'w') as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + PART_EXT, filename)
+
+# convert every log file under sources into a dataset in output, skipping the files that were converted before and
+# have not changed. status["files"], status["skipped"], status["rows"] and status["bytes"] count what was done.
+# Returns the checkpoints, by file
+def ingest(sources, output, status = None, workers = INGEST_WORKERS, part_bytes = INGEST_PART_BYTES, patterns = INGEST_PATTERNS):
+    import shutil
+    from stream import write_dataset, drain
+    from quality import FLAGGED_COLUMN_TYPES, flag_batches
+
+    status = {} if status is None else status
+    status.update({"files": 0, "skipped": 0, "rows": 0, "bytes": 0})
+    os.makedirs(output, exist_ok=True)
+    state = read_state(output)
+
+    # the files still to convert, checking every name is used by one file only
+    logs = []
+    names = {}
+    for source in sources:
+        for filename, name in find_logs(source, patterns):
+            filename = os.path.abspath(filename)
+            if (names.setdefault(name, filename) != filename):
+                raise ValueError(filename + " and " + names[name] + " would both be ingested as " + name + DATASET_EXT)
+            checkpoint = state.get(filename)
+            current = file_state(filename)
+            if (checkpoint and checkpoint["name"] == name and checkpoint["bytes"] == current["bytes"] and
+                checkpoint["fingerprint"] == current["fingerprint"] and os.path.exists(os.path.join(output, name + DATASET_EXT))):
+                status["skipped"] += 1
+                continue
+            logs.append((filename, name, current))
+
+    # every part of every file, in order, so the pool moves on to the next file while the last parts of one are written
+    tasks = deque([(i, filename, start, end) for i, (filename, name, current) in enumerate(logs) for start, end in file_parts(filename, part_bytes)])
+    executor = ProcessPoolExecutor(workers) if workers > 1 and len(tasks) > 1 else None
+
+    # parse a part in a worker process or right away
+    def submit(task):
+        if executor: return executor.submit(parse_part, *task[1:])
+        future = Future()
+        future.set_result(parse_part(*task[1:]))
+        return future
+
+    # the parsed parts of file i, in order, keeping the pool busy with the next ones
+    pending = deque()
+    def parsed(i):
+        while (pending or tasks):
+            while (tasks and len(pending) < 2 * workers):
+                task = tasks.popleft()
+                pending.append((task, submit(task)))
+            if (pending[0][0][0] != i): return
+            task, future = pending.popleft()
+            columns = future.result()
+            status["bytes"] += task[3] - task[2]
+            status["rows"] += len(columns["timestamp"])
+            if (len(columns["timestamp"]) > 0): yield columns
+
+    try:
+        for i, (filename, name, current) in enumerate(logs):
+            path = os.path.join(output, name + DATASET_EXT)
+            if (os.path.exists(path + PART_EXT)): shutil.rmtree(path + PART_EXT)
+            create_dataset(path + PART_EXT, columns=FLAGGED_COLUMN_TYPES)
+            drain(write_dataset(flag_batches(parsed(i)), path + PART_EXT))
+
+            if (os.path.exists(path)): shutil.rmtree(path)
+            os.replace(path + PART_EXT, path)
+            state[filename] = dict(current, name=name)
+            write_state(output, state)
+            status["files"] += 1
+    finally:
+        if executor: executor.shutdown(cancel_futures=True)
+
+    return state
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if (len(sys.argv) < 3):
+        print("Usage: python ingest.py OUTPUT_DIR SOURCE [SOURCE ...]\n" +
+              "Sources are mounted microSD cards, directories of copied log files or log files, searched for " + ", ".join(INGEST_PATTERNS))
+        exit(1)
+
+    status = {}
+    start_time = time.perf_counter()
+    ingest(sys.argv[2:], sys.argv[1], status)
+    elapsed = time.perf_counter() - start_time
+    print(str(status["files"]) + " files ingested into " + sys.argv[1] + " (" + str(status["skipped"]) + " unchanged skipped), " +
+          str(status["rows"]) + " datapoints, " + str(round(status["bytes"] / 1e6, 1)) + " MB in " + str(round(elapsed, 1)) + " s (" +
+          str(round(status["bytes"] / 1e6 / max(elapsed, 1e-6), 1)) + " MB/s)")
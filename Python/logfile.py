@@ -0,0 +1,251 @@
+'''
+Layout of the datapoint log written by the Open Spectral Sensing (OSS) device.
+
+The device writes one CSV line per datapoint: 10 metadata columns followed by the spectral power
+at every wavelength, each value followed by a comma. The same layout is used on the microSD card,
+in exports and in sync files.
+'''
+
+import calendar
+import time
+import warnings
+import numpy as np
+
+# CONSTANTS
+MIN_WAVELENGTH = 340                        # sensor minimum wavelength
+MAX_WAVELENGTH = 1010                       # sensor maximum wavelength
+WAVELENGTH_STEPSIZE = 5                     # sensor stepsize
+CIE_PRECISION = 4                           # digits after the decimal point the device writes for X, Y and Z
+SPECTRA_PRECISION = 18                      # digits after the decimal point the device writes for spectral values
+PARSE_BLOCK_SIZE = 33554432                 # how many bytes of a log file to parse at once
+PARSER_VERSION = 1                          # raise when parse_block returns anything different, so cached parses are redone (see cache.py)
+
+# the metadata columns in front of the spectrum
+METADATA_COLUMNS = ["DATE", "TIME", "MANUAL", "INT_TIME", "FRAME_AVG", "AE", "QUALITY", "X", "Y", "Z"]
+
+# the wavelength of every spectrum column
+WAVELENGTHS = list(range(MIN_WAVELENGTH, MAX_WAVELENGTH + WAVELENGTH_STEPSIZE, WAVELENGTH_STEPSIZE))
+
+# number of comma separated values in a datapoint line
+LINE_FIELDS = len(METADATA_COLUMNS) + len(WAVELENGTHS)
+
+# number of values in a datapoint line once DATE and TIME are split into day, month, year and hour, minute, second
+NUMERIC_FIELDS = LINE_FIELDS + 4
+
+# number of values in front of the spectrum once DATE and TIME are split
+METADATA_FIELDS = NUMERIC_FIELDS - len(WAVELENGTHS)
+
+# turns a datapoint line into plain comma separated numbers. The trailing comma of each line separates it from the next
+TOKEN_TABLE = bytes.maketrans(b"/:\r\n", b",,  ")
+
+# constants for decoding 8 ASCII digits packed into a little-endian uint64
+ASCII_ZEROS = np.uint64(0x3030303030303030)
+HIGH_NIBBLES = np.uint64(0xF0F0F0F0F0F0F0F0)
+DIGIT_CARRY = np.uint64(0x0606060606060606)
+ALL_THREES = np.uint64(0x3333333333333333)
+
+# the parsed metadata columns and their types
+COLUMN_TYPES = {
+    "timestamp": "<i8",                     # seconds since 1970-01-01 in device time (DATE and TIME)
+    "manual": "i1",
+    "int_time": "<i2",
+    "frame_avg": "<i2",
+    "ae": "i1",
+    "quality": "i1",
+    "x": "<f8",
+    "y": "<f8",
+    "z": "<f8",
+}
+SPECTRA_TYPE = "<f4"                        # type of the parsed spectra matrix
+
+# produce the file header
+def file_header():
+    line = ",".join(METADATA_COLUMNS) + ","
+    for i in WAVELENGTHS:
+        line += str(i) + ","
+    line += "\n"
+    return line
+
+# a line is a datapoint if it has a value for every column. Headers and event lines such as
+# "POWER LOSS DETECTED" are not datapoints
+def is_datapoint(line):
+    return line[:1].isdigit() and line.count(',') == LINE_FIELDS
+
+# convert the device DATE (dd/mm/yyyy) and TIME (hh:mm:ss) columns to seconds since 1970-01-01.
+# The device clock has no time zone, so timestamps are kept in device time
+def parse_timestamp(date, clock):
+    day, month, year = date.split('/')
+    hour, minute, second = clock.split(':')
+    return calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+
+# convert seconds since 1970-01-01 back to the device DATE and TIME columns
+def format_timestamp(epoch):
+    t = time.gmtime(int(epoch))
+    return time.strftime("%d/%m/%Y", t), time.strftime("%H:%M:%S", t)
+
+# columns with no datapoints
+def empty_columns(spectra_dtype = SPECTRA_TYPE):
+    columns = {column: np.empty(0, dtype=dtype) for column, dtype in COLUMN_TYPES.items()}
+    columns["spectra"] = np.empty((0, len(WAVELENGTHS)), dtype=spectra_dtype)
+    columns["wavelengths"] = np.array(WAVELENGTHS, dtype=np.int32)
+    return columns
+
+# parse comma separated numbers, returns None if text is not made of numbers only
+def parse_numbers(text):
+    with warnings.catch_warnings():
+        # numpy warns instead of raising when it stops at something that is not a number
+        warnings.simplefilter("error")
+        try:
+            return np.fromstring(text, dtype=np.float64, sep=",")
+        except (ValueError, DeprecationWarning):
+            return None
+
+# decode 8 ASCII digits packed little-endian into a uint64, the first digit being the most significant.
+# Uses a few multiplications per 8 digits instead of one conversion per digit
+def parse_eight_digits(words):
+    words = words - ASCII_ZEROS
+    words = words * np.uint64(10) + (words >> np.uint64(8))
+    return (((words & np.uint64(0x000000FF000000FF)) * np.uint64(100 + (1000000 << 32)) +
+             ((words >> np.uint64(16)) & np.uint64(0x000000FF000000FF)) * np.uint64(1 + (10000 << 32))) >> np.uint64(32))
+
+# True where all 8 bytes packed into a uint64 are ASCII digits
+def are_eight_digits(words):
+    return ((words & HIGH_NIBBLES) | (((words + DIGIT_CARRY) & HIGH_NIBBLES) >> np.uint64(4))) == ALL_THREES
+
+# parse the spectral values of joined datapoint lines by decoding their digits directly. Converting the 18 digit
+# values from text one at a time is what makes reading a log slow. commas holds the position of every comma, one row
+# per line. Returns an N x 135 float32 matrix equal to float32(float(value)) for every value, or None if a value is
+# not written with SPECTRA_PRECISION digits after the decimal point
+def parse_spectra_fixed(text, commas):
+    if (SPECTRA_PRECISION < 16): return None
+
+    data = np.frombuffer(text, dtype=np.uint8)
+    ends = commas[:, len(METADATA_COLUMNS):].ravel()
+    starts = commas[:, len(METADATA_COLUMNS) - 1:-1].ravel() + 1
+    points = ends - SPECTRA_PRECISION - 1
+
+    # optional sign, 1 to 8 integer digits, a decimal point and SPECTRA_PRECISION digits
+    negative = data[starts] == ord("-")
+    starts = starts + negative
+    integer_digits = points - starts
+    if (integer_digits.min() < 1 or integer_digits.max() > 8 or not (data[points] == ord(".")).all()):
+        return None
+
+    # spectral values are almost always below 10, only walk further digits when there are any
+    digit = data[starts] - np.uint8(ord("0"))
+    if ((digit > 9).any()): return None
+    integer = digit.astype(np.int64)
+
+    for i in range(1, integer_digits.max()):
+        has_digit = np.flatnonzero(integer_digits > i)
+        digit = data[starts[has_digit] + i] - np.uint8(ord("0"))
+        if ((digit > 9).any()): return None
+        integer[has_digit] = integer[has_digit] * 10 + digit
+
+    # view every byte offset of the text as the start of a little-endian uint64
+    words = np.ndarray((len(text) - 7,), dtype="<u8", buffer=text, strides=(1,))
+    first = words[points + 1]
+    second = words[points + 9]
+    if (not (are_eight_digits(first).all() and are_eight_digits(second).all())): return None
+
+    rest = np.zeros(ends.size, dtype=np.int64)
+    for i in range(16, SPECTRA_PRECISION):
+        digit = data[points + 1 + i] - np.uint8(ord("0"))
+        if ((digit > 9).any()): return None
+        rest *= 10
+        rest += digit
+
+    # both parts are exact integers, so each division is correctly rounded and the sum is within 2 ulp of the value
+    values = ((integer * 100000000 + parse_eight_digits(first).astype(np.int64)) / 1e8 +
+              (parse_eight_digits(second).astype(np.int64) * 10 ** (SPECTRA_PRECISION - 16) + rest) / 10.0 ** SPECTRA_PRECISION)
+    values[negative] = -values[negative]
+    spectra = values.astype(np.float32)
+
+    # the 29 low mantissa bits of a float64 are dropped when rounding to float32. A value within a few ulp of halfway
+    # between two float32 values could round either way, convert those from text
+    dropped = (values.view(np.uint64) & np.uint64((1 << 29) - 1)).astype(np.int64)
+    uncertain = np.flatnonzero(np.abs(dropped - (1 << 28)) <= 4)
+    for i in uncertain.tolist():
+        spectra[i] = float(text[starts[i] - negative[i]:ends[i]])
+
+    return spectra.reshape(commas.shape[0], len(WAVELENGTHS))
+
+# seconds since 1970-01-01 of arrays of calendar dates and times, see parse_timestamp
+def epoch_seconds(day, month, year, hour, minute, second):
+    days = ((year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (month - 1).astype("timedelta64[M]"))
+    days = (days.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")).astype(np.int64)
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+# turn parsed numbers into columns. metadata has the first METADATA_FIELDS numbers of every line
+def build_columns(metadata, spectra, spectra_dtype = SPECTRA_TYPE):
+    columns = {"timestamp": epoch_seconds(*metadata[:, :6].astype(np.int64).T)}
+    for i, column in enumerate(list(COLUMN_TYPES.keys())[1:]):
+        columns[column] = metadata[:, 6 + i].astype(COLUMN_TYPES[column])
+
+    columns["spectra"] = spectra.astype(spectra_dtype, copy=False)
+    columns["wavelengths"] = np.array(WAVELENGTHS, dtype=np.int32)
+    return columns
+
+# parse a buffer of complete log lines into NumPy columns in one pass. Header lines, event lines such as
+# "POWER LOSS DETECTED" and cut off lines are skipped wherever they are in the buffer.
+# Returns a dict with an array for every metadata column, the N x 135 "spectra" matrix and the shared "wavelengths" axis
+def parse_block(buffer, spectra_dtype = SPECTRA_TYPE):
+    lines = [line for line in bytes(buffer).split(b"\n") if line[:1].isdigit() and line.count(b",") == LINE_FIELDS]
+    if not lines: return empty_columns(spectra_dtype)
+
+    if (np.dtype(spectra_dtype) == np.float32):
+        text = b"".join(lines)
+        commas = np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord(",")).reshape(len(lines), LINE_FIELDS)
+        spectra = parse_spectra_fixed(text, commas)
+
+        if (spectra is not None):
+            # the metadata of each line runs from the end of the previous line up to its 10th comma
+            starts = [0] + (commas[:-1, -1] + 1).tolist()
+            metadata = b",".join([text[i:j] for i, j in zip(starts, commas[:, len(METADATA_COLUMNS) - 1].tolist())])
+            metadata = parse_numbers(metadata.translate(TOKEN_TABLE))
+
+            if (metadata is not None and metadata.size == len(lines) * METADATA_FIELDS):
+                return build_columns(metadata.reshape(-1, METADATA_FIELDS), spectra, spectra_dtype)
+
+    values = parse_numbers(b"\n".join(lines).translate(TOKEN_TABLE).rstrip(b" ,"))
+
+    if (values is None or values.size != len(lines) * NUMERIC_FIELDS):
+        # at least one line holds something that is not a number, parse line by line to drop it
+        values = [parse_numbers(line.translate(TOKEN_TABLE).rstrip(b" ,")) for line in lines]
+        values = [v for v in values if v is not None and v.size == NUMERIC_FIELDS]
+        if not values: return empty_columns(spectra_dtype)
+        values = np.concatenate(values)
+
+    values = values.reshape(-1, NUMERIC_FIELDS)
+    return build_columns(values[:, :METADATA_FIELDS], values[:, METADATA_FIELDS:], spectra_dtype)
+
+# join parsed blocks into one set of columns
+def concatenate_columns(blocks, spectra_dtype = SPECTRA_TYPE):
+    if not blocks: return empty_columns(spectra_dtype)
+    if (len(blocks) == 1): return blocks[0]
+
+    columns = {column: np.concatenate([block[column] for block in blocks]) for column in blocks[0] if column != "wavelengths"}
+    columns["wavelengths"] = blocks[0]["wavelengths"]
+    return columns
+
+# read a log file in blocks of complete lines
+def read_blocks(filename, block_size = PARSE_BLOCK_SIZE):
+    carry = b""
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data: break
+
+            data = carry + data
+            end = data.rfind(b"\n") + 1
+            carry = data[end:]
+            if (end > 0): yield data[:end]
+
+    if carry: yield carry
+
+# parse a whole log, export or sync file, or a bytes-like buffer holding one, into NumPy columns. See parse_block
+def parse_log(source, spectra_dtype = SPECTRA_TYPE):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return parse_block(source, spectra_dtype)
+
+    return concatenate_columns([parse_block(block, spectra_dtype) for block in read_blocks(source)], spectra_dtype)
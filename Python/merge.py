@@ -0,0 +1,184 @@
+'''
+Merge log files and datasets into one time-sorted dataset or CSV file without duplicate datapoints.
+
+Repeated exports of a device that was not erased hold the same datapoints again, and open_file never overwrites,
+so they pile up as name.CSV, name0.CSV, name1.CSV and so on. merge combines any number of exports, sync files,
+microSD logs and datasets, of one device or several, with a k-way merge. Each input is read in time order in
+batches of MERGE_BATCH_ROWS rows, through its time index (see timeindex.py) for log files and its memory-mapped
+timestamp column for datasets, so header lines anywhere in a file and inputs that are not in time order, such as
+sync files with several segments, are handled the same way. Only about two batches per input are held at a time,
+however large the inputs are. The next batch of every input is read and parsed by a pool of worker processes while
+the current ones are merged.
+
+A datapoint is a duplicate if it has the same timestamp, metadata and spectrum as one already merged, compared by
+a 64-bit digest of the whole row. Datapoints of different devices taken in the same second are kept.
+
+    merge(["data/NSP_A.CSV", "data/NSP_A0.CSV", "data/SYNC_NSP_A.CSV"], "data/NSP_A.ossd")
+'''
+
+import os
+import glob
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from logfile import COLUMN_TYPES, SPECTRA_TYPE, file_header, concatenate_columns
+from dataset import DATASET_EXT, open_dataset
+from stream import take, write_dataset, write_csv, drain
+
+# CONSTANTS
+MERGE_BATCH_ROWS = 1024                     # how many rows of each input to read at a time
+MERGE_WORKERS = os.cpu_count() or 1         # the most worker processes parsing inputs at the same time
+PART_EXT = ".part"                          # suffix of the output while it is being written
+
+# constants of the splitmix64 finalizer, which mixes each value of a row before the row digest adds them up
+MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+MIX_STEP = np.uint64(0x9E3779B97F4A7C15)
+
+def is_dataset(path):
+    return path.rstrip("/\\").endswith(DATASET_EXT)
+
+# the row order that reads an input in time order, stable so datapoints taken in the same second keep their order.
+# Brings the time index of a log file up to date
+def input_order(path):
+    if is_dataset(path):
+        timestamps = open_dataset(path)["timestamp"]
+        if (len(timestamps) == 0 or (np.diff(timestamps) >= 0).all()): return np.arange(len(timestamps))
+        return np.argsort(timestamps, kind="stable")
+
+    from timeindex import update_index, open_index
+    header = update_index(path)
+    if (header["sorted"]): return np.arange(header["entries"])
+    return np.argsort(open_index(path, header)["timestamp"], kind="stable")
+
+# read the rows of an input, in that order. Runs in the worker processes
+def read_batch(path, rows):
+    if is_dataset(path):
+        data = open_dataset(path)
+        return {column: values if column == "wavelengths" else np.asarray(values[rows]) for column, values in data.items()}
+
+    from timeindex import INDEX_EXT, read_index_header, open_index, read_rows
+    return read_rows(path, open_index(path, read_index_header(path + INDEX_EXT)), rows)
+
+# a 64-bit digest of every row of a batch: the timestamp, metadata and spectrum, each value mixed with splitmix64
+def row_digests(batch):
+    columns = [np.asarray(batch[column]).astype(np.float64 if np.dtype(dtype).kind == "f" else np.int64).view(np.uint64)
+               for column, dtype in COLUMN_TYPES.items()]
+    values = np.column_stack(columns + [np.asarray(batch["spectra"]).astype(SPECTRA_TYPE).view(np.uint32).astype(np.uint64)])
+
+    # each column gets its own constant, so the same values in different columns do not cancel
+    with np.errstate(over="ignore"):
+        values += MIX_STEP * np.arange(1, values.shape[1] + 1, dtype=np.uint64)
+        values ^= values >> MIX_SHIFTS[0]
+        values *= MIX_MULTIPLIERS[0]
+        values ^= values >> MIX_SHIFTS[1]
+        values *= MIX_MULTIPLIERS[1]
+        values ^= values >> MIX_SHIFTS[2]
+        return values.sum(axis=1, dtype=np.uint64)
+
+# drop the rows of a batch that are duplicates of an earlier row, or of a row merged before it: carry holds the
+# timestamp and digests of the last second merged. Returns (the rest of the batch in time order, the new carry)
+def drop_duplicates(batch, carry):
+    timestamps = batch["timestamp"]
+    digests = row_digests(batch)
+
+    order = np.lexsort((digests, timestamps))
+    duplicate = np.zeros(len(order), dtype=bool)
+    duplicate[1:] = (timestamps[order[1:]] == timestamps[order[:-1]]) & (digests[order[1:]] == digests[order[:-1]])
+    if (carry is not None):
+        duplicate |= (timestamps[order] == carry[0]) & np.isin(digests[order], carry[1])
+
+    kept = np.sort(order[~duplicate])
+    kept = kept[np.argsort(timestamps[kept], kind="stable")]
+    if (len(kept) == 0): return take(batch, kept), carry
+
+    last = timestamps[kept[-1]]
+    last_digests = digests[kept][timestamps[kept] == last]
+    if (carry is not None and carry[0] == last): last_digests = np.concatenate([carry[1], last_digests])
+    return take(batch, kept), (last, last_digests)
+
+# k-way merge of inputs in time order, without duplicates. Yields batches of columns, see logfile.parse_log.
+# Each input is read in batches of batch_rows, by up to workers processes. status["read"] counts the datapoints read
+def merge_batches(paths, status, batch_rows = MERGE_BATCH_ROWS, workers = MERGE_WORKERS):
+    orders = [input_order(path) for path in paths]
+    positions = [0] * len(paths)
+    workers = min(workers, len(paths))
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    # read the next batch of an input, in a worker process or right away
+    def submit(i):
+        rows = orders[i][positions[i]:positions[i] + batch_rows]
+        positions[i] += len(rows)
+        if executor: return executor.submit(read_batch, paths[i], rows)
+        future = Future()
+        future.set_result(read_batch(paths[i], rows))
+        return future
+
+    pending = {i: submit(i) for i in range(len(paths)) if len(orders[i]) > 0}
+    current = {}
+    carry = None
+    status["read"] = 0
+    try:
+        while (pending or current):
+            # every input still being read needs its current batch to know how far the merge can go
+            for i in [i for i in pending if i not in current]:
+                current[i] = pending.pop(i).result()
+                status["read"] += len(current[i]["timestamp"])
+                if (positions[i] < len(orders[i])): pending[i] = submit(i)
+            current = {i: batch for i, batch in current.items() if len(batch["timestamp"]) > 0}
+            if (any([i not in current for i in pending])): continue
+            if not current: break
+
+            # rows up to the earliest last timestamp of the current batches can be merged, every later row of
+            # every input comes after them
+            bound = min([batch["timestamp"][-1] for batch in current.values()])
+            parts = []
+            for i, batch in list(current.items()):
+                n = int(np.searchsorted(batch["timestamp"], bound, 'right'))
+                parts.append(take(batch, slice(0, n)))
+                current[i] = take(batch, slice(n, None))
+
+            merged, carry = drop_duplicates(concatenate_columns(parts), carry)
+            if (len(merged["timestamp"]) > 0): yield merged
+    finally:
+        if executor: executor.shutdown(cancel_futures=True)
+
+# merge inputs into a new dataset (output ending in DATASET_EXT) or CSV file, which is only put in place once
+# complete. Returns (datapoints read, datapoints written). Raises FileExistsError if output exists
+def merge(paths, output, batch_rows = MERGE_BATCH_ROWS, workers = MERGE_WORKERS):
+    if (os.path.exists(output)): raise FileExistsError(output + " already exists")
+    part = output + PART_EXT
+    status = {"written": 0}
+
+    def count(batches):
+        for batch in batches:
+            status["written"] += len(batch["timestamp"])
+            yield batch
+
+    batches = count(merge_batches(paths, status, batch_rows, workers))
+    if is_dataset(output):
+        import shutil
+        if (os.path.exists(part)): shutil.rmtree(part)
+        drain(write_dataset(batches, part))
+    else:
+        with open(part, 'w', buffering=1048576) as f:
+            f.write(file_header())
+            drain(write_csv(batches, f))
+    os.replace(part, output)
+
+    return status["read"], status["written"]
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if (len(sys.argv) < 3):
+        print("Usage: python merge.py OUTPUT" + DATASET_EXT + "|OUTPUT.CSV INPUT [INPUT ...]\n" +
+              "Inputs are export, sync or microSD log files and datasets, wildcards like data/NSP_A*.CSV are expanded")
+        exit(1)
+
+    paths = [path for pattern in sys.argv[2:] for path in (sorted(glob.glob(pattern)) or [pattern])]
+    start_time = time.perf_counter()
+    read, written = merge(paths, sys.argv[1])
+    print(str(read) + " datapoints in " + str(len(paths)) + " inputs, " + str(written) + " written to " + sys.argv[1] + " (" +
+          str(read - written) + " duplicates dropped) in " + str(round(time.perf_counter() - start_time, 1)) + " s")
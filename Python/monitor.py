@@ -0,0 +1,281 @@
+'''
+Live monitor: capture datapoints from a device as fast as it can take them, and graph them as they arrive.
+
+Captures run in a background thread and are handed over through a queue, so the window never waits for the device
+and the device never waits for the window. The last capacity datapoints are kept in a RingBuffer of fixed size.
+The window is drawn once, then each frame only redraws the latest spectrum and the Y time series on top of the
+saved background of their axes (blitting), so a frame costs the same however fast datapoints arrive. The waterfall
+of the buffered spectra is the most expensive to draw and is refreshed every WATERFALL_INTERVAL instead. Every datapoint is appended to one session file, which has a single header.
+The device does not log these captures to its microSD card, which needs firmware with _PREVIEW_CAPTURE.
+
+    with open("MONITOR.CSV", 'w') as f:
+        f.write(file_header())
+        monitor(serial_object, f)
+'''
+
+import time
+import queue
+import numpy as np
+from threading import Thread, Event
+
+from logfile import MIN_WAVELENGTH, MAX_WAVELENGTH, COLUMN_TYPES, SPECTRA_TYPE, WAVELENGTHS, parse_block
+from device import DeviceError, DeviceTimeout
+
+# CONSTANTS
+MONITOR_CAPACITY = 600                      # how many of the latest datapoints the monitor keeps and graphs
+FRAME_INTERVAL = 1 / 30                     # seconds between redraws of the live window
+WATERFALL_INTERVAL = 0.5                    # seconds between redraws of the waterfall
+STATUS_INTERVAL = 0.5                       # seconds between status lines when not graphing
+RESCALE_MARGIN = 2                          # headroom above the largest value when an axis has to grow
+MONITOR_MAX_ERRORS = 5                      # errors in a row before the monitor gives up on the device
+
+# the latest capacity rows of every column, in preallocated arrays that are overwritten oldest first
+class RingBuffer:
+    def __init__(self, capacity = MONITOR_CAPACITY):
+        self.capacity = capacity
+        self.columns = {column: np.zeros(capacity, dtype=dtype) for column, dtype in COLUMN_TYPES.items()}
+        self.columns["spectra"] = np.zeros((capacity, len(WAVELENGTHS)), dtype=SPECTRA_TYPE)
+        self.count = 0                      # rows appended since the buffer was created
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # append the rows of a batch of columns, see logfile.parse_block. Only the last capacity rows are kept
+    def append(self, batch):
+        n = min(len(batch["timestamp"]), self.capacity)
+        if (n == 0): return
+
+        index = (self.count + len(batch["timestamp"]) - n + np.arange(n)) % self.capacity
+        for column, values in self.columns.items():
+            values[index] = batch[column][-n:]
+        self.count += len(batch["timestamp"])
+
+    # the kept rows of a column, oldest first
+    def ordered(self, column):
+        values = self.columns[column]
+        if (self.count <= self.capacity): return values[:self.count]
+        return np.roll(values, -(self.count % self.capacity), axis=0)
+
+    # the newest row of a column
+    def latest(self, column):
+        return self.columns[column][(self.count - 1) % self.capacity]
+
+# capture datapoints one after the other until stop is set or count datapoints are captured, putting each datapoint
+# line on lines. The captures are not logged on the device (_PREVIEW_CAPTURE), so monitoring neither fills its
+# microSD card nor wears its flash. Puts the DeviceError that ended the captures, if any, then None when done: a
+# DeviceTimeout, MONITOR_MAX_ERRORS errors in a row, or firmware that cannot capture without logging
+def capture_loop(serial_object, lines, stop, count = None):
+    captured = 0
+    errors = 0
+    while (not stop.is_set() and (count is None or captured < count)):
+        try:
+            values = serial_object.request("_PREVIEW_CAPTURE")
+        except DeviceTimeout as e:
+            lines.put(e)
+            break
+        except DeviceError as e:
+            if (captured == 0 and "replied Err" in str(e)):
+                lines.put(DeviceError(str(e) + ", its firmware cannot capture without logging, update it to monitor"))
+                break
+            errors += 1
+            if (errors >= MONITOR_MAX_ERRORS):
+                lines.put(e)
+                break
+            continue
+
+        errors = 0
+        if values:
+            lines.put(values[0])
+            captured += 1
+
+    lines.put(None)
+
+# everything waiting in a queue, without blocking
+def take_all(items):
+    taken = []
+    while True:
+        try:
+            taken.append(items.get_nowait())
+        except queue.Empty:
+            return taken
+
+# the live window: the latest spectrum, a waterfall of the buffered spectra and the Y time series. The artists
+# that change are animated, and redrawn over the saved background of their axes on each update
+class LivePlot:
+    def __init__(self, capacity, title = ""):
+        import matplotlib.pyplot as plt
+
+        self.capacity = capacity
+        self.figure, (self.spectrum_axes, self.waterfall_axes, self.series_axes) = plt.subplots(
+            3, 1, figsize=(8, 9), gridspec_kw={"height_ratios": [2, 2, 1]})
+        self.figure.canvas.manager.set_window_title(title or "Live Monitor")
+
+        self.spectrum_axes.set_xlim([MIN_WAVELENGTH, MAX_WAVELENGTH])
+        self.spectrum_axes.set_ylim([0, 1])
+        self.spectrum_axes.set_xlabel("Wavelength (nm)")
+        self.spectrum_axes.set_ylabel("Power (W/m^2)")
+        self.spectrum_line, = self.spectrum_axes.plot(WAVELENGTHS, np.zeros(len(WAVELENGTHS)), animated=True)
+        self.status_text = self.spectrum_axes.text(0.99, 0.95, "", ha="right", va="top",
+                                                   transform=self.spectrum_axes.transAxes, animated=True)
+
+        self.waterfall = self.waterfall_axes.imshow(np.zeros((capacity, len(WAVELENGTHS)), dtype=SPECTRA_TYPE), aspect="auto",
+                                                    origin="lower", interpolation="nearest", vmin=0, vmax=1, animated=True,
+                                                    extent=[MIN_WAVELENGTH, MAX_WAVELENGTH, -capacity, 0])
+        self.waterfall_axes.set_xlabel("Wavelength (nm)")
+        self.waterfall_axes.set_ylabel("Captures ago")
+
+        self.series_axes.set_xlim([-capacity, 0])
+        self.series_axes.set_ylim([0, 1])
+        self.series_axes.set_xlabel("Captures ago")
+        self.series_axes.set_ylabel("Y")
+        self.series_line, = self.series_axes.plot([], [], animated=True)
+
+        # the animated artists of each axes
+        self.artists = {self.spectrum_axes: [self.spectrum_line, self.status_text],
+                        self.waterfall_axes: [self.waterfall],
+                        self.series_axes: [self.series_line]}
+        self.backgrounds = {}
+        self.last_waterfall = 0
+        self.closed = False
+        self.figure.tight_layout()
+        self.figure.canvas.mpl_connect("draw_event", self.on_draw)
+        self.figure.canvas.mpl_connect("close_event", self.on_close)
+
+        plt.show(block=False)
+        self.figure.canvas.draw()
+
+    # a full draw, on start, resize or rescale: save the background of each axes without the animated artists,
+    # then draw them
+    def on_draw(self, event):
+        for axes, artists in self.artists.items():
+            self.backgrounds[axes] = self.figure.canvas.copy_from_bbox(axes.bbox)
+            for artist in artists:
+                self.figure.draw_artist(artist)
+
+    def on_close(self, event):
+        self.closed = True
+
+    # show the contents of a ring buffer and a status line. The axes are only redrawn when the data outgrows them
+    def update(self, buffer, status):
+        latest = buffer.latest("spectra")
+        y = buffer.ordered("y")
+        self.spectrum_line.set_ydata(latest)
+        self.series_line.set_data(np.arange(-len(y), 0), y)
+        self.status_text.set_text(status)
+
+        now = time.perf_counter()
+        redraw = [self.spectrum_axes, self.series_axes]
+        if (now - self.last_waterfall >= WATERFALL_INTERVAL):
+            spectra = buffer.ordered("spectra")
+            image = np.zeros((self.capacity, len(WAVELENGTHS)), dtype=SPECTRA_TYPE)
+            image[self.capacity - len(spectra):] = spectra
+            self.waterfall.set_data(image)
+            redraw.append(self.waterfall_axes)
+            self.last_waterfall = now
+
+        rescale = False
+        peak = float(latest.max())
+        if (peak > self.spectrum_axes.get_ylim()[1]):
+            self.spectrum_axes.set_ylim([0, peak * RESCALE_MARGIN])
+            self.waterfall.set_clim(0, peak * RESCALE_MARGIN)
+            rescale = True
+
+        low, high = float(y.min(initial=0)), float(y.max(initial=0))
+        if (low < self.series_axes.get_ylim()[0] or high > self.series_axes.get_ylim()[1]):
+            self.series_axes.set_ylim([min(low * RESCALE_MARGIN, 0), high * RESCALE_MARGIN])
+            rescale = True
+
+        canvas = self.figure.canvas
+        if (rescale or not self.backgrounds):
+            canvas.draw()
+        else:
+            for axes in redraw:
+                canvas.restore_region(self.backgrounds[axes])
+                for artist in self.artists[axes]:
+                    self.figure.draw_artist(artist)
+                canvas.blit(axes.bbox)
+        canvas.flush_events()
+
+    # handle window events for up to seconds
+    def wait(self, seconds):
+        self.figure.canvas.start_event_loop(seconds)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.figure)
+
+# capture datapoints from a device until count datapoints are captured, duration seconds have passed, the window
+# is closed or Ctrl+C is pressed. The last capacity datapoints are graphed live if plot is set, and every datapoint
+# line is appended to f if given. Returns a dict with "captures", "elapsed", "frames", "redraw_seconds" (the time
+# spent drawing) and "error", the DeviceError that ended the captures or None
+def monitor(serial_object, f = None, capacity = MONITOR_CAPACITY, count = None, duration = None, plot = True, title = ""):
+    buffer = RingBuffer(capacity)
+    lines = queue.Queue()
+    stop = Event()
+    worker = Thread(target=capture_loop, args=(serial_object, lines, stop, count), daemon=True)
+
+    live = LivePlot(capacity, title) if plot else None
+    stats = {"captures": 0, "elapsed": 0, "frames": 0, "redraw_seconds": 0, "error": None}
+    start_time = time.perf_counter()
+    last_status = start_time
+    next_frame = start_time
+    worker.start()
+
+    try:
+        running = True
+        while running:
+            # keep the frame rate whatever the last frame took to draw
+            next_frame = max(next_frame + FRAME_INTERVAL, time.perf_counter() + 0.001)
+            if live:
+                live.wait(next_frame - time.perf_counter())
+            else:
+                time.sleep(next_frame - time.perf_counter())
+
+            received = take_all(lines)
+            if (None in received):
+                running = False
+            for item in received:
+                if isinstance(item, DeviceError): stats["error"] = item
+            received = [item for item in received if isinstance(item, str)]
+
+            now = time.perf_counter()
+            stats["elapsed"] = now - start_time
+            if (duration is not None and stats["elapsed"] >= duration): running = False
+            if (live and live.closed): running = False
+            if not received: continue
+
+            # parse everything that arrived since the last frame at once
+            buffer.append(parse_block("\n".join(received).encode("utf-8")))
+            stats["captures"] += len(received)
+            if f:
+                f.write("".join([line + "\n" for line in received]))
+                f.flush()
+
+            rate = stats["captures"] / max(stats["elapsed"], 1e-6)
+            status = (str(stats["captures"]) + " captures, " + str(round(rate, 1)) + " /s, Y " +
+                      str(round(float(buffer.latest("y")), 4)))
+            if live:
+                live.update(buffer, status)
+                stats["redraw_seconds"] += time.perf_counter() - now
+                stats["frames"] += 1
+            elif (now - last_status >= STATUS_INTERVAL):
+                print("\r" + status + "   ", end="", flush=True)
+                last_status = now
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        stop.set()
+        worker.join()
+        if live:
+            live.close()
+        else:
+            print()
+
+    # datapoints that arrived after the window closed are still saved
+    received = [item for item in take_all(lines) if isinstance(item, str)]
+    if (f and received): f.write("".join([line + "\n" for line in received]))
+    stats["captures"] += len(received)
+    stats["elapsed"] = time.perf_counter() - start_time
+    return stats
@@ -0,0 +1,286 @@
+'''
+Headless plots of whole exports, sync files and datasets, rendered straight to PNG or SVG.
+
+    heatmap     time x wavelength image of the spectra
+    overlay     the spectra drawn over each other as one LineCollection, coloured by time
+    metrics     one time series panel per lighting metric (see analytics.py): the mean and the range of each bin
+
+However many datapoints the inputs hold, they are binned before anything is drawn (bin_inputs): the time they
+span is cut into at most PLOT_TIME_BINS bins, and each bin keeps the number of datapoints, the sum of their
+spectra and the sum, minimum and maximum of each metric. The inputs are read in parts of PLOT_PART_ROWS
+datapoints, byte ranges of log files found with their time index (see timeindex.py) and row ranges of the
+memory-mapped columns of datasets, and a pool of worker processes bins runs of PLOT_TASK_PARTS parts. Memory is
+bounded by the parts and the bins, not the datapoints, and no plot draws more than PLOT_TIME_BINS columns or
+OVERLAY_LINES lines, so a year of one-minute data renders in seconds.
+
+    binned = bin_inputs(["data/SYNC_NSP_A.CSV"])
+    plot_heatmap(binned, "plots/NSP_A_heatmap.png")
+    plot_metrics(binned, "plots/NSP_A_metrics.svg")
+
+Exports of the same device hold the same datapoints again, merge them first (see merge.py). Figures are drawn
+with matplotlib's Agg and SVG renderers directly, without pyplot, so no display is needed.
+'''
+
+import os
+import numpy as np
+
+from logfile import parse_block
+
+# CONSTANTS
+PLOT_TIME_BINS = 2000                       # the most time bins, columns of the heatmap and points of the time series
+OVERLAY_LINES = 200                         # the most spectra the overlay draws, each the mean of a run of bins
+PLOT_METRICS = ["illuminance", "cct", "duv", "melanopic_edi"]  # metrics plotted by default, when their tables are there
+PLOT_PART_ROWS = 2048                       # how many datapoints to read and bin at a time
+PLOT_TASK_PARTS = 32                        # how many parts each worker process bins before handing its bins back
+PLOT_WORKERS = os.cpu_count() or 1          # the most worker processes binning at the same time
+PLOT_SIZE = (12, 6)                         # inches, size of each figure
+PLOT_DPI = 100                              # dots per inch of PNG files
+HEATMAP_COLORMAP = "inferno"
+OVERLAY_COLORMAP = "viridis"
+
+# the axis label of each metric
+METRIC_LABELS = {
+    "illuminance": "Illuminance (lx)",
+    "cct": "CCT (K)",
+    "duv": "Duv",
+    "melanopic_edi": "Melanopic EDI (lx)",
+    "cri_ra": "CRI Ra",
+    "tm30_rf": "TM-30 Rf",
+    "tm30_rg": "TM-30 Rg",
+}
+
+def is_dataset(path):
+    from dataset import DATASET_EXT
+    return path.rstrip("/\\").endswith(DATASET_EXT)
+
+# the first and last timestamp of an input and the parts it is binned in: byte ranges of rows lines of a log file,
+# found with its time index, or row ranges of a dataset. Returns (None, []) if it has no datapoints.
+# Brings the time index of a log file up to date
+def input_parts(path, rows = PLOT_PART_ROWS):
+    if is_dataset(path):
+        from dataset import open_dataset
+        timestamps = open_dataset(path)["timestamp"]
+        parts = [(start, min(start + rows, len(timestamps))) for start in range(0, len(timestamps), rows)]
+    else:
+        from timeindex import update_index, open_index
+        entries = open_index(path, update_index(path))
+        timestamps = entries["timestamp"]
+        ends = [min(start + rows, len(entries)) - 1 for start in range(0, len(entries), rows)]
+        parts = [(int(entries["offset"][start]), int(entries["offset"][end] + entries["length"][end]))
+                 for start, end in zip(range(0, len(entries), rows), ends)]
+
+    if (len(timestamps) == 0): return None, []
+    return (int(timestamps.min()), int(timestamps.max())), parts
+
+# the columns of a part of an input, see input_parts and logfile.parse_log
+def read_part(path, part):
+    if is_dataset(path):
+        from dataset import open_dataset
+        data = open_dataset(path)
+        return {column: values if column == "wavelengths" else np.asarray(values[part[0]:part[1]]) for column, values in data.items()}
+
+    with open(path, 'rb') as f:
+        f.seek(part[0])
+        return parse_block(f.read(part[1] - part[0]))
+
+# the bins of a part of an input over edges: the "count" of datapoints and the "sums" of their spectra in each bin,
+# and the "sum", "count" (of finite values), "min" and "max" of each metric under "metrics"
+def bin_part(path, part, edges, metrics):
+    from analytics import analyze
+
+    batch = read_part(path, part)
+    bins = len(edges) - 1
+    binned = {"count": np.zeros(bins, dtype=np.int64), "sums": np.zeros((bins, len(batch["wavelengths"]))),
+              "wavelengths": batch["wavelengths"], "metrics": {}}
+    for metric in metrics:
+        binned["metrics"][metric] = {"sum": np.zeros(bins), "count": np.zeros(bins, dtype=np.int64),
+                                     "min": np.full(bins, np.nan), "max": np.full(bins, np.nan)}
+    if (len(batch["timestamp"]) == 0): return binned
+
+    # the rows of each bin form runs once sorted by bin
+    index = np.clip(np.searchsorted(edges, batch["timestamp"], 'right') - 1, 0, bins - 1)
+    order = np.argsort(index, kind="stable")
+    index = index[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+    runs = index[starts]
+
+    binned["count"][runs] = np.diff(np.append(starts, len(index)))
+    binned["sums"][runs] = np.add.reduceat(np.asarray(batch["spectra"], dtype=np.float64)[order], starts, axis=0)
+
+    for metric, result in analyze(batch["spectra"], metrics, batch["wavelengths"]).items():
+        result = result[order]
+        finite = np.isfinite(result)
+        stats = binned["metrics"][metric]
+        stats["sum"][runs] = np.add.reduceat(np.where(finite, result, 0), starts)
+        stats["count"][runs] = np.add.reduceat(finite.astype(np.int64), starts)
+        stats["min"][runs] = np.fmin.reduceat(np.where(finite, result, np.nan), starts)
+        stats["max"][runs] = np.fmax.reduceat(np.where(finite, result, np.nan), starts)
+
+    return binned
+
+# add the bins of a part to the bins of the parts before it
+def add_bins(total, binned):
+    if (total is None): return binned
+    total["count"] += binned["count"]
+    total["sums"] += binned["sums"]
+    for metric, stats in binned["metrics"].items():
+        for key in ["sum", "count"]:
+            total["metrics"][metric][key] += stats[key]
+        total["metrics"][metric]["min"] = np.fmin(total["metrics"][metric]["min"], stats["min"])
+        total["metrics"][metric]["max"] = np.fmax(total["metrics"][metric]["max"], stats["max"])
+    return total
+
+# the bins of several parts of an input, added up. Runs in the worker processes
+def bin_parts(path, parts, edges, metrics):
+    total = None
+    for part in parts:
+        total = add_bins(total, bin_part(path, part, edges, metrics))
+    return total
+
+# bin the datapoints of every input over time, at most bins bins of whole seconds spanning all of them, with metrics
+# (see analytics.py, None for the PLOT_METRICS the tables allow). Parts of the inputs are binned by up to workers
+# processes. Returns a dict with the bin "edges" (one more than the bins, in seconds since 1970-01-01 in device
+# time), "count", the mean "spectra" (NaN for empty bins), the "wavelengths" axis and the "mean", "min" and "max"
+# of every metric in each bin under "metrics". Raises ValueError if no input holds a datapoint
+def bin_inputs(paths, bins = PLOT_TIME_BINS, metrics = None, workers = PLOT_WORKERS):
+    from concurrent.futures import ProcessPoolExecutor
+    from analytics import get_weights
+
+    inputs = [(path, input_parts(path)) for path in paths]
+    spans = [span for path, (span, parts) in inputs if span]
+    if not spans: raise ValueError("no datapoints in " + ", ".join(paths))
+    first, last = min([span[0] for span in spans]), max([span[1] for span in spans])
+
+    width = max(-(-(last - first + 1) // bins), 1)
+    edges = first + width * np.arange(-(-(last - first + 1) // width) + 1, dtype=np.int64)
+    if (metrics is None): metrics = [metric for metric in PLOT_METRICS if get_weights().supports(metric)]
+    metrics = [metric for metric in metrics if metric != "cri_r"]
+
+    tasks = [(path, parts[i:i + PLOT_TASK_PARTS]) for path, (span, parts) in inputs for i in range(0, len(parts), PLOT_TASK_PARTS)]
+    workers = min(workers, len(tasks))
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        results = executor.map(bin_parts, *zip(*[(path, parts, edges, metrics) for path, parts in tasks])) if executor else \
+                  (bin_parts(path, parts, edges, metrics) for path, parts in tasks)
+        total = None
+        for binned in results:
+            total = add_bins(total, binned)
+    finally:
+        if executor: executor.shutdown(cancel_futures=True)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {"edges": edges, "count": total["count"], "spectra": total["sums"] / total["count"][:, None],
+                "wavelengths": total["wavelengths"],
+                "metrics": {metric: {"mean": stats["sum"] / stats["count"], "min": stats["min"], "max": stats["max"]}
+                            for metric, stats in total["metrics"].items()}}
+
+# timestamps in device time as matplotlib dates
+def to_dates(timestamps):
+    import matplotlib.dates as mdates
+    return mdates.date2num(np.asarray(timestamps, dtype=np.int64).astype("datetime64[s]"))
+
+def new_figure(rows = 1):
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(PLOT_SIZE[0], PLOT_SIZE[1] if rows == 1 else 2 * rows + 1))
+    return figure, figure.subplots(rows, 1, sharex=True, squeeze=False)[:, 0]
+
+# label an axis of matplotlib dates
+def date_axis(axis):
+    import matplotlib.dates as mdates
+    locator = mdates.AutoDateLocator()
+    axis.set_major_locator(locator)
+    axis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+
+# write a figure to filename, PNG or SVG by its extension
+def save_figure(figure, filename):
+    if (os.path.dirname(filename)): os.makedirs(os.path.dirname(filename), exist_ok=True)
+    figure.savefig(filename, dpi=PLOT_DPI)
+
+# time x wavelength image of the mean spectrum of each bin, empty bins left blank
+def plot_heatmap(binned, filename, title = ""):
+    figure, (axes,) = new_figure()
+    start, end = to_dates(binned["edges"][[0, -1]])
+    wavelengths = binned["wavelengths"]
+    step = (wavelengths[-1] - wavelengths[0]) / max(len(wavelengths) - 1, 1)
+
+    image = axes.imshow(np.ma.masked_invalid(binned["spectra"].T), aspect="auto", origin="lower", interpolation="nearest",
+                        cmap=HEATMAP_COLORMAP, extent=[start, end, wavelengths[0] - step / 2, wavelengths[-1] + step / 2])
+    figure.colorbar(image, ax=axes, label="Power (W/m^2)")
+    date_axis(axes.xaxis)
+    axes.set_ylabel("Wavelength (nm)")
+    axes.set_title(title)
+    save_figure(figure, filename)
+
+# the spectra drawn over each other as one LineCollection, at most lines of them, each the mean spectrum of a run of
+# bins, coloured by time
+def plot_overlay(binned, filename, lines = OVERLAY_LINES, title = ""):
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import Normalize
+
+    # combine runs of bins, weighted by their datapoints
+    count = binned["count"]
+    group = np.arange(len(count)) * min(lines, len(count)) // len(count)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(group)) + 1))
+    counts = np.add.reduceat(count, starts)
+    sums = np.add.reduceat(np.nan_to_num(binned["spectra"]) * count[:, None], starts, axis=0)
+    times = np.add.reduceat(binned["edges"][:-1] * count, starts)
+    kept = counts > 0
+    spectra = sums[kept] / counts[kept, None]
+    times = to_dates(times[kept] // counts[kept])
+
+    figure, (axes,) = new_figure()
+    wavelengths = np.broadcast_to(binned["wavelengths"], spectra.shape)
+    collection = LineCollection(np.stack([wavelengths, spectra], axis=-1), cmap=OVERLAY_COLORMAP, linewidths=0.8, alpha=0.6,
+                                norm=Normalize(*to_dates(binned["edges"][[0, -1]])))
+    collection.set_array(times)
+    axes.add_collection(collection)
+    axes.set_xlim(binned["wavelengths"][0], binned["wavelengths"][-1])
+    axes.set_ylim(min(0, spectra.min(initial=0)), spectra.max(initial=0) * 1.05 or 1)
+    date_axis(figure.colorbar(collection, ax=axes).ax.yaxis)
+    axes.set_xlabel("Wavelength (nm)")
+    axes.set_ylabel("Power (W/m^2)")
+    axes.set_title(title or str(int(counts.sum())) + " datapoints in " + str(len(spectra)) + " spectra")
+    save_figure(figure, filename)
+
+# one panel per metric: the mean of each bin and the range between its minimum and maximum
+def plot_metrics(binned, filename, title = ""):
+    metrics = list(binned["metrics"])
+    if not metrics: raise ValueError("no metrics to plot")
+
+    figure, panels = new_figure(len(metrics))
+    dates = to_dates(binned["edges"][:-1] + (binned["edges"][1] - binned["edges"][0]) // 2)
+    for axes, metric in zip(panels, metrics):
+        stats = binned["metrics"][metric]
+        axes.fill_between(dates, stats["min"], stats["max"], alpha=0.3, linewidth=0)
+        axes.plot(dates, stats["mean"], linewidth=0.8)
+        axes.set_ylabel(METRIC_LABELS.get(metric, metric))
+    date_axis(panels[-1].xaxis)
+    panels[0].set_title(title)
+    save_figure(figure, filename)
+
+# every plot of the inputs, to prefix + "_heatmap", "_overlay" and "_metrics" with extension. Returns the filenames
+def plot_all(paths, prefix, extension = ".png", bins = PLOT_TIME_BINS, metrics = None):
+    binned = bin_inputs(paths, bins, metrics)
+    title = ", ".join([os.path.basename(path.rstrip("/\\")) for path in paths])
+    filenames = [prefix + "_heatmap" + extension, prefix + "_overlay" + extension]
+    plot_heatmap(binned, filenames[0], title)
+    plot_overlay(binned, filenames[1])
+    if binned["metrics"]:
+        filenames.append(prefix + "_metrics" + extension)
+        plot_metrics(binned, filenames[2], title)
+    return filenames
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if (len(sys.argv) < 3):
+        print("Usage: python plots.py OUTPUT.png|OUTPUT.svg INPUT [INPUT ...]\n" +
+              "Writes OUTPUT_heatmap, OUTPUT_overlay and OUTPUT_metrics of export, sync or microSD log files and datasets")
+        exit(1)
+
+    start_time = time.perf_counter()
+    prefix, extension = os.path.splitext(sys.argv[1])
+    for filename in plot_all(sys.argv[2:], prefix, extension or ".png"):
+        print(filename)
+    print("in " + str(round(time.perf_counter() - start_time, 1)) + " s")
@@ -0,0 +1,162 @@
+'''
+Quality flags of datapoints, computed on whole batches as they are exported, synced or ingested.
+
+Every datapoint gets a FLAGS_TYPE bit field, 0 for a datapoint nothing is wrong with, with a bit for each problem:
+
+    FLAG_DARK           the device found it too dark (QUALITY -1)
+    FLAG_SATURATED      the device found it too bright (QUALITY 1)
+    FLAG_EXPOSURE       the integration time is at its shortest or longest, where readings are least reliable
+    FLAG_DROPOUT        the spectrum is all zero or not a number, or the CIE values are negative or not a number
+    FLAG_GAP            more than QUALITY_GAP_FACTOR capture intervals since the datapoint before it
+    FLAG_DUPLICATE      the same time as the datapoint before it
+    FLAG_BACKWARDS      an earlier time than the datapoint before it, the clock was set back
+    FLAG_SPIKE          a narrow spike in the spectrum: a wavelength that jumped away from its neighbours compared
+                        with the median of the QUALITY_BASELINE_ROWS spectra before it, by more than
+                        QUALITY_SPIKE_THRESHOLD of the peak
+
+The capture interval is the median time between datapoints, so manual captures and any logging interval are
+handled alike. Flags are computed with NumPy on whole batches and carried over from one batch to the next, so a
+log gets the same flags however it is cut into batches. Saved datasets hold them in a "flags" column:
+
+    data = open_dataset("data/NSP_A.ossd")
+    good = data["spectra"][data["flags"] == 0]
+    dark = data["flags"] & FLAG_DARK != 0
+'''
+
+import numpy as np
+
+from logfile import COLUMN_TYPES
+
+# CONSTANTS
+FLAGS_COLUMN = "flags"                      # the name of the flags column in batches and datasets
+FLAGS_TYPE = "<u2"                          # type of the flags column
+FLAGGED_COLUMN_TYPES = dict(COLUMN_TYPES, **{FLAGS_COLUMN: FLAGS_TYPE})   # the columns of a dataset with flags
+QUALITY_MIN_INT_TIME = 1                    # the shortest integration time the sensor has
+QUALITY_MAX_INT_TIME = 1200                 # the longest integration time the firmware uses, MAX_INT_TIME in Constants.h
+QUALITY_GAP_FACTOR = 3                      # capture intervals between datapoints before it is a gap
+QUALITY_MIN_INTERVALS = 16                  # time steps in a batch needed to measure the capture interval from it
+QUALITY_BASELINE_ROWS = 5                   # spectra before a datapoint its spectrum is compared with
+QUALITY_SPIKE_THRESHOLD = 0.1               # fraction of the peak a wavelength may jump from its neighbours before it is a spike
+
+FLAG_DARK = 1 << 0
+FLAG_SATURATED = 1 << 1
+FLAG_EXPOSURE = 1 << 2
+FLAG_DROPOUT = 1 << 3
+FLAG_GAP = 1 << 4
+FLAG_DUPLICATE = 1 << 5
+FLAG_BACKWARDS = 1 << 6
+FLAG_SPIKE = 1 << 7
+
+# the names of the flags, in bit order
+FLAG_NAMES = {
+    FLAG_DARK: "dark",
+    FLAG_SATURATED: "saturated",
+    FLAG_EXPOSURE: "exposure",
+    FLAG_DROPOUT: "dropout",
+    FLAG_GAP: "gap",
+    FLAG_DUPLICATE: "duplicate",
+    FLAG_BACKWARDS: "backwards",
+    FLAG_SPIKE: "spike",
+}
+
+# what is carried over from one batch to the next
+def new_state():
+    return {"timestamp": None,              # the time of the last datapoint
+            "interval": None,               # the capture interval, None until measured
+            "baseline": None}               # the last QUALITY_BASELINE_ROWS spectra, divided by their peak
+
+# the flags of a batch of columns (see logfile.parse_log), continuing from the batches before it through state
+def flag_columns(columns, state):
+    timestamps = np.asarray(columns["timestamp"], dtype=np.int64)
+    spectra = np.asarray(columns["spectra"], dtype=np.float32)
+    rows = len(timestamps)
+    flags = np.zeros(rows, dtype=FLAGS_TYPE)
+    if (rows == 0): return flags
+
+    quality = np.asarray(columns["quality"])
+    int_time = np.asarray(columns["int_time"])
+    flags[quality < 0] |= FLAG_DARK
+    flags[quality > 0] |= FLAG_SATURATED
+    flags[(int_time <= QUALITY_MIN_INT_TIME) | (int_time >= QUALITY_MAX_INT_TIME)] |= FLAG_EXPOSURE
+
+    with np.errstate(invalid="ignore"):
+        peaks = spectra.max(axis=1)
+        cie = np.column_stack([columns["x"], columns["y"], columns["z"]])
+        dropout = ~(peaks > 0) | ~np.isfinite(spectra).all(axis=1) | ~np.isfinite(cie).all(axis=1) | (cie < 0).any(axis=1)
+    flags[dropout] |= FLAG_DROPOUT
+
+    # time steps, the first from the last datapoint of the batch before, if there was one
+    steps = np.diff(timestamps, prepend=timestamps[0] if state["timestamp"] is None else state["timestamp"])
+    follows = np.ones(rows, dtype=bool)
+    if (state["timestamp"] is None): follows[0] = False
+    flags[steps < 0] |= FLAG_BACKWARDS
+    flags[follows & (steps == 0)] |= FLAG_DUPLICATE
+    forward = steps[steps > 0]
+    if (len(forward) >= QUALITY_MIN_INTERVALS): state["interval"] = float(np.median(forward))
+    if (state["interval"] is not None): flags[steps > QUALITY_GAP_FACTOR * state["interval"]] |= FLAG_GAP
+    state["timestamp"] = int(timestamps[-1])
+
+    # each spectrum against the median of the ones before it, all divided by their peak. A change of the light
+    # changes every wavelength a little, a spike one or two a lot, so spikes are what is left after taking out the
+    # neighbours. Dropouts take no part
+    normalized = np.where(dropout[:, None], 0, spectra / np.where(dropout, 1, peaks)[:, None])
+    previous = state["baseline"] if state["baseline"] is not None else np.repeat(normalized[:1], QUALITY_BASELINE_ROWS, axis=0)
+    history = np.concatenate([previous, normalized])
+    residuals = normalized - rolling_median(history, rows)
+    jumps = np.abs(residuals[:, 1:-1] - (residuals[:, :-2] + residuals[:, 2:]) / 2)
+    flags[(jumps > QUALITY_SPIKE_THRESHOLD).any(axis=1) & ~dropout & (quality >= 0)] |= FLAG_SPIKE
+    state["baseline"] = history[-QUALITY_BASELINE_ROWS:]
+
+    return flags
+
+# the median of every QUALITY_BASELINE_ROWS rows in a row of history, for the last count rows. The median of five
+# takes a few comparisons, which is ten times faster than sorting
+def rolling_median(history, count):
+    if (QUALITY_BASELINE_ROWS != 5):
+        return np.median(np.lib.stride_tricks.sliding_window_view(history, QUALITY_BASELINE_ROWS, axis=0)[:count], axis=2)
+
+    a, b, c, d, e = [history[i:i + count] for i in range(5)]
+    # the second and third smallest of the first four, then the middle of those two and the fifth
+    low, high = np.maximum(np.minimum(a, b), np.minimum(c, d)), np.minimum(np.maximum(a, b), np.maximum(c, d))
+    return np.minimum(np.maximum(np.minimum(low, high), e), np.maximum(low, high))
+
+# add the flags column to batches of columns and pass them on, see stream.py
+def flag_batches(batches, state = None):
+    state = new_state() if state is None else state
+    for batch in batches:
+        batch[FLAGS_COLUMN] = flag_columns(batch, state)
+        yield batch
+
+# how many datapoints have each flag, by name, and "flagged", how many have any
+def count_flags(flags):
+    flags = np.asarray(flags)
+    counts = {name: int(np.count_nonzero(flags & flag)) for flag, name in FLAG_NAMES.items()}
+    counts["flagged"] = int(np.count_nonzero(flags))
+    return counts
+
+# the names of the flags set in a flags value
+def flag_names(value):
+    return [name for flag, name in FLAG_NAMES.items() if int(value) & flag]
+
+if __name__ == "__main__":
+    import sys
+    from dataset import DATASET_EXT, open_dataset
+
+    if (len(sys.argv) < 2):
+        print("Usage: python quality.py LOG.CSV|DATASET" + DATASET_EXT + "   count the datapoints with each quality flag")
+        exit(1)
+
+    if (sys.argv[1].rstrip("/\\").endswith(DATASET_EXT)):
+        data = open_dataset(sys.argv[1])
+        flags = data[FLAGS_COLUMN] if FLAGS_COLUMN in data else flag_columns(data, new_state())
+        rows = len(data["timestamp"])
+    else:
+        from logfile import read_blocks
+        from stream import parse_batches
+        flags = np.concatenate([batch[FLAGS_COLUMN] for batch in flag_batches(parse_batches(read_blocks(sys.argv[1])))] + [np.empty(0, dtype=FLAGS_TYPE)])
+        rows = len(flags)
+
+    counts = count_flags(flags)
+    print(str(rows) + " datapoints, " + str(counts.pop("flagged")) + " flagged")
+    for name, count in counts.items():
+        print("%-12s %10d" % (name, count))
@@ -0,0 +1,243 @@
+'''
+Hourly and daily rollups of the datapoints of each sensor, kept up to date as new datapoints are exported or synced.
+
+A rollup holds, for every hour and day with datapoints, the number of datapoints, the sum of their spectra and the
+sum, minimum and maximum of their illuminance (analytics.illuminance). Means are computed when reading, so rollups
+of any datapoints can be combined by adding sums and counts and taking minimums and maximums, whatever order they
+were computed in.
+
+A rollup store is a directory (name + ROLLUP_EXT) holding a JSON header and immutable segment files, one per
+update and interval. update_rollup only parses the bytes appended to a log file since it was last rolled up: the
+header remembers how many bytes of each source file were read and a CRC-32 of the last of them (see
+timeindex.fingerprint). A new export of a device that was not erased starts with the export rolled up before it,
+so only the datapoints after it are added. Segments are written before the header, so an interrupted update
+leaves the store as it was. Once there are more than ROLLUP_MAX_SEGMENTS, they are combined into one.
+
+    update_rollup("data/ROLLUP_NSP_A.rollup", "data/SYNC_NSP_A.CSV")
+    hourly = read_rollup("data/ROLLUP_NSP_A.rollup", "hourly")
+
+Feed the store of a device either its sync file or its exports: a sync file and an export hold the same datapoints
+in different files, which would be counted twice.
+'''
+
+import os
+import json
+import numpy as np
+
+from logfile import WAVELENGTHS, PARSE_BLOCK_SIZE, parse_block
+from dataset import HEADER_FILENAME, write_header
+
+# CONSTANTS
+ROLLUP_FORMAT = "oss-rollup"                # format name stored in the header
+ROLLUP_VERSION = 1                          # format version stored in the header
+ROLLUP_EXT = ".rollup"                      # rollup store directory extension
+ROLLUP_MAX_SEGMENTS = 16                    # how many segments a store may have before they are combined
+SEGMENT_EXT = ".npy"                        # extension of the segment files
+
+# the bucket length in seconds of each interval
+INTERVALS = {
+    "hourly": 3600,
+    "daily": 86400,
+}
+
+# one row per bucket
+def rollup_type(wavelengths = WAVELENGTHS):
+    return np.dtype([("timestamp", "<i8"), ("count", "<i8"), ("illuminance_sum", "<f8"), ("illuminance_min", "<f8"),
+                     ("illuminance_max", "<f8"), ("spectra_sum", "<f8", (len(wavelengths),))])
+
+# combine rollup rows of the same buckets: counts and sums are added, minimums and maximums kept.
+# Returns one row per bucket, in time order
+def combine(rows):
+    if (len(rows) == 0): return rows
+    rows = rows[np.argsort(rows["timestamp"], kind="stable")]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(rows["timestamp"])) + 1))
+    if (len(starts) == len(rows)): return rows
+
+    combined = np.empty(len(starts), dtype=rows.dtype)
+    combined["timestamp"] = rows["timestamp"][starts]
+    for field in ["count", "illuminance_sum", "spectra_sum"]:
+        combined[field] = np.add.reduceat(rows[field], starts, axis=0)
+    combined["illuminance_min"] = np.minimum.reduceat(rows["illuminance_min"], starts)
+    combined["illuminance_max"] = np.maximum.reduceat(rows["illuminance_max"], starts)
+    return combined
+
+# the rollup of datapoint columns (see logfile.parse_log) over buckets of interval seconds
+def rollup_columns(columns, interval):
+    from analytics import get_weights, illuminance
+
+    rows = np.empty(len(columns["timestamp"]), dtype=rollup_type(columns["wavelengths"]))
+    rows["timestamp"] = np.asarray(columns["timestamp"]) // interval * interval
+    rows["count"] = 1
+    lux = illuminance(columns["spectra"], get_weights(columns["wavelengths"]))
+    for field in ["illuminance_sum", "illuminance_min", "illuminance_max"]:
+        rows[field] = lux
+    rows["spectra_sum"] = columns["spectra"]
+    return combine(rows)
+
+def segment_path(path, segment, interval):
+    return os.path.join(path, segment + "_" + interval + SEGMENT_EXT)
+
+def read_rollup_header(path):
+    with open(os.path.join(path, HEADER_FILENAME), 'r') as f:
+        header = json.load(f)
+
+    if (header.get("format") != ROLLUP_FORMAT):
+        raise ValueError(path + " is not an OSS rollup store")
+    if (header.get("version", 0) > ROLLUP_VERSION):
+        raise ValueError(path + " was written by a newer version (" + str(header["version"]) + ")")
+
+    return header
+
+# open a rollup store, creating it if it does not exist. Returns its header
+def open_rollup(path, wavelengths = WAVELENGTHS):
+    if (os.path.exists(os.path.join(path, HEADER_FILENAME))): return read_rollup_header(path)
+
+    os.makedirs(path, exist_ok=True)
+    header = {
+        "format": ROLLUP_FORMAT,
+        "version": ROLLUP_VERSION,
+        "wavelengths": [int(w) for w in wavelengths],
+        "intervals": dict(INTERVALS),
+        "segments": [],
+        "next_segment": 0,
+        "sources": {},
+    }
+    write_header(path, header)
+    return header
+
+# the rows of every segment of an interval, not combined
+def read_segments(path, header, interval):
+    rows = [np.load(segment_path(path, segment, interval)) for segment in header["segments"]]
+    return np.concatenate(rows) if rows else np.empty(0, dtype=rollup_type(header["wavelengths"]))
+
+# add the rollups of every interval as a new segment, then commit it and the sources in the header. Segments are
+# combined into one once there are more than ROLLUP_MAX_SEGMENTS
+def add_segment(path, header, rollups, sources):
+    segment = "%06d" % header["next_segment"]
+    for interval, rows in rollups.items():
+        with open(segment_path(path, segment, interval) + ".part", 'wb') as f:
+            np.save(f, rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(segment_path(path, segment, interval) + ".part", segment_path(path, segment, interval))
+
+    header["segments"].append(segment)
+    header["next_segment"] += 1
+    header["sources"] = sources
+    write_header(path, header)
+
+    if (len(header["segments"]) > ROLLUP_MAX_SEGMENTS): compact(path, header)
+
+# combine every segment of a store into one, then remove the old ones
+def compact(path, header):
+    old = header["segments"]
+    rollups = {interval: combine(read_segments(path, header, interval)) for interval in header["intervals"]}
+    header["segments"] = []
+    add_segment(path, header, rollups, header["sources"])
+
+    for segment in old:
+        for interval in header["intervals"]:
+            os.remove(segment_path(path, segment, interval))
+
+# the source of a store that filename continues: filename itself or an earlier export of the same device log, if
+# filename still starts with the bytes rolled up from it. Returns (source, bytes already rolled up)
+def find_source(sources, filename, f):
+    from timeindex import fingerprint
+
+    size = os.fstat(f.fileno()).st_size
+    candidates = sorted(sources.items(), key=lambda item: item[0] != filename)
+    for source, state in candidates:
+        if ((state["bytes"] > 0 or source == filename) and state["bytes"] <= size and
+            fingerprint(f, state["bytes"]) == state["fingerprint"]): return source, state["bytes"]
+    return None, 0
+
+# roll up the datapoints appended to a log file since it, or the export it continues, was last rolled up. Only
+# complete lines are read, a line cut off by a sync in progress is rolled up once it is complete.
+# Returns how many datapoints were added
+def update_rollup(path, filename, block_size = PARSE_BLOCK_SIZE):
+    from timeindex import fingerprint
+
+    header = open_rollup(path)
+    filename = os.path.abspath(filename)
+    rollups = {interval: [] for interval in header["intervals"]}
+    added = 0
+
+    with open(filename, 'rb') as f:
+        source, position = find_source(header["sources"], filename, f)
+        f.seek(position)
+        carry = b""
+        while True:
+            data = f.read(block_size)
+            if not data: break
+
+            data = carry + data
+            end = data.rfind(b"\n") + 1
+            carry = data[end:]
+            if (end == 0): continue
+
+            columns = parse_block(data[:end])
+            position += end
+            added += len(columns["timestamp"])
+            if (len(columns["timestamp"]) == 0): continue
+            for interval, seconds in header["intervals"].items():
+                rollups[interval].append(rollup_columns(columns, seconds))
+
+        sources = {name: state for name, state in header["sources"].items() if name != source}
+        sources[filename] = {"bytes": position, "fingerprint": fingerprint(f, position)}
+
+    if (added == 0):
+        if (sources != header["sources"]):
+            header["sources"] = sources
+            write_header(path, header)
+        return 0
+
+    add_segment(path, header, {interval: combine(np.concatenate(rows)) for interval, rows in rollups.items()}, sources)
+    return added
+
+# combine rollup stores, of several sensors or sessions, into a new store at path
+def merge_rollups(paths, path):
+    headers = [read_rollup_header(p) for p in paths]
+    if (any([h["intervals"] != headers[0]["intervals"] or h["wavelengths"] != headers[0]["wavelengths"] for h in headers])):
+        raise ValueError("rollup stores with different intervals or wavelengths cannot be merged")
+
+    header = open_rollup(path, headers[0]["wavelengths"])
+    header["intervals"] = headers[0]["intervals"]
+    sources = {source: state for h in headers for source, state in h["sources"].items()}
+    add_segment(path, header, {interval: combine(np.concatenate([read_segments(p, h, interval) for p, h in zip(paths, headers)]))
+                               for interval in header["intervals"]}, sources)
+
+# the buckets of an interval with start <= timestamp < end, read from the store alone. Returns a dict with the
+# bucket start "timestamp", "count", the mean "spectra", "illuminance_mean", "illuminance_min", "illuminance_max"
+# and the "wavelengths" axis
+def read_rollup(path, interval = "hourly", start = None, end = None):
+    header = read_rollup_header(path)
+    if (interval not in header["intervals"]): raise ValueError("unknown interval " + interval + ", use " + ", ".join(header["intervals"]))
+
+    rows = combine(read_segments(path, header, interval))
+    if (start is not None): rows = rows[rows["timestamp"] >= start]
+    if (end is not None): rows = rows[rows["timestamp"] < end]
+
+    return {"timestamp": rows["timestamp"], "count": rows["count"],
+            "spectra": (rows["spectra_sum"] / np.maximum(rows["count"], 1)[:, None]).astype(np.float32),
+            "illuminance_mean": rows["illuminance_sum"] / np.maximum(rows["count"], 1),
+            "illuminance_min": rows["illuminance_min"], "illuminance_max": rows["illuminance_max"],
+            "wavelengths": np.array(header["wavelengths"], dtype=np.int32)}
+
+if __name__ == "__main__":
+    import sys
+    from logfile import format_timestamp
+
+    if (len(sys.argv) < 3):
+        print("Usage: python rollup.py STORE" + ROLLUP_EXT + " LOG.CSV [LOG.CSV ...]   roll up what was added to each log\n" +
+              "       python rollup.py STORE" + ROLLUP_EXT + " hourly|daily                 print the buckets")
+        exit(1)
+
+    if (sys.argv[2] in INTERVALS):
+        buckets = read_rollup(sys.argv[1], sys.argv[2])
+        print("%-20s %8s %12s %12s %12s" % ("start", "count", "mean lx", "min lx", "max lx"))
+        for i in range(len(buckets["timestamp"])):
+            print("%-20s %8d %12.1f %12.1f %12.1f" % (" ".join(format_timestamp(buckets["timestamp"][i])), buckets["count"][i],
+                  buckets["illuminance_mean"][i], buckets["illuminance_min"][i], buckets["illuminance_max"][i]))
+    else:
+        for filename in sys.argv[2:]:
+            print(filename + ": " + str(update_rollup(sys.argv[1], filename)) + " datapoints rolled up")
@@ -0,0 +1,577 @@
+'''
+Simulated OSS device, for testing and benchmarking the host tools without hardware.
+
+SimulatedDevice answers the serial protocol the way LightSensorProgram.ino does, quirks included: one command is
+handled per loop, an export ends with "OK" without a line break, a sync from past the end of the log answers "-1"
+without "OK", and an unknown command answers "Err '<command>'".
+The log is a real LOG2.CSV in the device layout. It can be generated with any number of datapoints, and grows
+with manual captures and, once the clock is set, with recorded captures every logging interval.
+
+link_speed limits how many bytes per second the device sends, and faults can be injected into streamed logs:
+corrupted or dropped bytes, a stream that stalls after some bytes, a device that stops answering, or a microSD
+card that cannot be opened. They are plain attributes and can be changed while the device is being served.
+
+framed=False simulates firmware released before framed exports, which answers "Err '16...'" to them, and
+encoded=False firmware released before the encodings of encoding.py, which answers "Err '19'" to _GET_ENCODINGS
+and ignores the encoding of a framed export. scheduled=False simulates firmware released before timed start and
+stop, which leaves _SET_START_TIME and _SET_STOP_TIME unanswered. previewed=False simulates firmware released before
+captures that are not logged, which answers "Err '20'" to _PREVIEW_CAPTURE.
+
+A simulated device is served on a pseudo terminal (POSIX only) or on a TCP socket, and the host opens the port
+name it gets back like any serial port:
+
+    port_name = serve_pty(SimulatedDevice(rows=10000))              # "/dev/pts/5"
+    port_name = serve_socket(SimulatedDevice(name="NSP_B"))         # "socket://localhost:40123"
+
+pyserial's loop:// URL only echoes what the host writes, so it cannot stand in for a device.
+
+From the command line, the port names are printed and the devices are served until stdin is closed:
+
+    python simulator.py --rows 10000 --count 4
+'''
+
+import os
+import sys
+import time
+import zlib
+import struct
+import socket
+import select
+import argparse
+import calendar
+import tempfile
+import numpy as np
+from threading import Thread
+
+from logfile import WAVELENGTHS, file_header, format_timestamp
+from encoding import ENCODINGS, encode_line
+
+# CONSTANTS
+LOG_FILENAME = "LOG2.CSV"                   # the log file name on the device microSD card
+DEV_NAME_PREFIX = "NSP"                     # the device name prefix
+DEF_CAPTURE_INTERVAL = 60000                # default logging interval in ms
+DEF_INT_TIME = 500                          # default integration time in ms
+DEF_FRAME_AVG = 3                           # default number of frames averaged into a reading
+DEF_AE = 1                                  # auto-exposure on by default
+DEF_CALIBRATION_FACTOR = 1.0                # default calibration factor
+UNIQUE_SPECTRA = 1000                       # distinct spectra in a generated log, reused cyclically to keep generation fast
+START_TIME = 1672531200                     # timestamp of the first generated datapoint (2023-01-01 00:00:00)
+CAPTURE_INTERVAL = 60                       # seconds between generated datapoints
+DAYLIGHT_NOISE = 0.01                        # relative noise of generated daylight spectra, about that of the sensor
+READ_SIZE = 4096                            # how many bytes to read from the host at a time
+STREAM_BLOCK_SIZE = 4096                    # how many bytes of the log to send at a time
+LOOP_DELAY = 0.01                           # the firmware waits 10 ms after each loop while not recording
+WRITE_TIMEOUT = 10                          # seconds a reply may wait for the host to read before it is abandoned
+ERROR_SIZE = 4294967295                     # the size the firmware reports when the log cannot be opened (unsigned -1)
+FRAME_CHUNK_SIZE = 4096                     # how many bytes of the log the firmware sends in one frame
+FRAME_MAGIC = b"\xa5\x5a"                   # the bytes every frame starts with
+FRAME_END = 0xFFFFFFFF                      # the chunk number of the empty frame that ends a framed export
+
+# smooth, realistic looking spectra scaled by a random illuminance, and the CSV columns from X to the last
+# wavelength for each of them
+def generate_spectra(rng, count = UNIQUE_SPECTRA):
+    peaks = rng.uniform(420, 650, count)[:, None]
+    scale = rng.uniform(0.001, 0.05, count)[:, None]
+    return (scale * np.exp(-((np.array(WAVELENGTHS)[None, :] - peaks) / 120.0) ** 2)).astype(np.float32)
+
+def format_body(spectrum):
+    return (",".join(["%.4f" % (v * 6830) for v in spectrum[[45, 50, 30]]]) + "," +
+            "".join(["%.18f," % v for v in spectrum.tolist()]))
+
+# one datapoint line in the device layout, without its line break
+def format_datapoint(epoch, body, manual = 0, int_time = DEF_INT_TIME, frame_avg = DEF_FRAME_AVG, ae = DEF_AE, quality = 0):
+    date, clock = format_timestamp(epoch)
+    return date + "," + clock + "," + str(manual) + "," + str(int_time) + "," + str(frame_avg) + "," + str(ae) + "," + str(quality) + "," + body
+
+# write a log in the device layout: \r\n line endings, 18 digit spectral values and a trailing comma on every line
+def generate_log(filename, rows, seed = 0, start_time = START_TIME):
+    rng = np.random.default_rng(seed)
+    bodies = [format_body(spectrum) for spectrum in generate_spectra(rng)]
+
+    with open(filename, 'w', newline='', buffering=1048576) as f:
+        f.write(file_header().replace("\n", "\r\n"))
+        for i in range(rows):
+            f.write(format_datapoint(start_time + i * CAPTURE_INTERVAL, bodies[i % UNIQUE_SPECTRA], 0, 100 + i % 900, 3, 1, i % 3 - 1) + "\r\n")
+
+# write a log of changing daylight in the device layout: a day and night cycle, drifting clouds and colour
+# temperature, and noise on every value, unlike generate_log, whose few repeated spectra compress too well
+def generate_daylight_log(filename, rows, noise = DAYLIGHT_NOISE, seed = 0):
+    rng = np.random.default_rng(seed)
+    seconds = np.arange(rows) * CAPTURE_INTERVAL
+    wavelengths = np.array(WAVELENGTHS, dtype=np.float64)
+    sun = np.clip(np.sin(seconds % 86400 / 86400 * 2 * np.pi - np.pi / 2) + 0.2, 0.01, None)
+    clouds = np.exp(np.cumsum(rng.normal(0, 0.02, rows)))
+    peaks = 450 + 60 * np.sin(seconds / 86400 * 2 * np.pi)
+    shapes = np.exp(-((wavelengths[None, :] - peaks[:, None]) / 150) ** 2) + 0.3 * np.exp(-((wavelengths[None, :] - 610) / 30) ** 2)
+    spectra = (0.05 * sun * clouds / clouds.max())[:, None] * shapes
+    spectra = (spectra * (1 + rng.normal(0, noise, spectra.shape))).astype(np.float32)
+
+    with open(filename, 'w', newline='', buffering=1048576) as f:
+        f.write(file_header().replace("\n", "\r\n"))
+        for i in range(rows):
+            f.write(format_datapoint(START_TIME + int(seconds[i]), format_body(spectra[i]), 0, 100 + i % 900, 3, 1, i % 3 - 1) + "\r\n")
+
+# the leading integer of a string, or 0, like Arduino's String.toInt() and atol()
+def to_int(text):
+    text = text.strip()
+    end = 1 if text[:1] in ("-", "+") else 0
+    while (end < len(text) and text[end].isdigit()): end += 1
+    try:
+        return int(text[:end])
+    except ValueError:
+        return 0
+
+# the leading number of a string, or 0, like Arduino's String.toFloat()
+def to_float(text):
+    text = text.strip()
+    for end in range(len(text), 0, -1):
+        try:
+            return float(text[:end])
+        except ValueError:
+            pass
+    return 0.0
+
+# what follows the first underscore, or the whole string if there is none, like s.substring(s.indexOf("_") + 1)
+def after_underscore(text):
+    return text[text.find("_") + 1:]
+
+# a pseudo terminal master, with the recv and sendall of a socket. The slave stays open so the host can close
+# and open the port again, like replugging a device
+class PtyConnection:
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        os.set_blocking(self.master, False)
+        self.port_name = os.ttyname(self.slave)
+
+    def fileno(self):
+        return self.master
+
+    def recv(self, size):
+        try:
+            return os.read(self.master, size)
+        except BlockingIOError:
+            return b""
+
+    # raises TimeoutError if the host does not read for WRITE_TIMEOUT seconds
+    def sendall(self, data):
+        view = memoryview(data)
+        while view:
+            if (not select.select([], [self.master], [], WRITE_TIMEOUT)[1]): raise TimeoutError("host stopped reading")
+            try:
+                view = view[os.write(self.master, view):]
+            except BlockingIOError:
+                pass
+
+# a host that stopped reading, the rest of the reply is abandoned
+class ReplyAbandoned(Exception):
+    pass
+
+# the state and behaviour of one OSS device. rows datapoints are generated into a fresh log, or log_dir holds an
+# existing LOG2.CSV. loop_delay and capture_time (how long a capture takes, int_time * frame_avg on the real
+# device) can be lowered to speed up tests
+class SimulatedDevice:
+    def __init__(self, name = DEV_NAME_PREFIX, rows = 0, log_dir = None, seed = 0, link_speed = None,
+                 loop_delay = LOOP_DELAY, capture_time = 0.0, framed = True, encoded = True, scheduled = True,
+                 previewed = True, corrupt_rate = 0.0, drop_rate = 0.0, stall_after = None, unresponsive = False, fail_open = False):
+        self.name = name
+        self.logging_interval = DEF_CAPTURE_INTERVAL
+        self.data_counter = rows
+        self.calibration_factor = DEF_CALIBRATION_FACTOR
+        self.recording = False
+        self.int_time = DEF_INT_TIME
+        self.frame_avg = DEF_FRAME_AVG
+        self.ae = DEF_AE
+
+        self.link_speed = link_speed        # bytes per second the device sends, None for as fast as the host reads
+        self.loop_delay = loop_delay
+        self.capture_time = capture_time
+        self.framed = framed                # supports framed exports (EXPORT_CHUNKS)
+        self.encoded = encoded              # supports the encodings of encoding.py in framed exports
+        self.scheduled = scheduled          # supports timed start and stop (_SET_START_TIME and _SET_STOP_TIME)
+        self.previewed = previewed          # supports captures that are not logged (_PREVIEW_CAPTURE)
+        self.corrupt_rate = corrupt_rate    # probability of each streamed byte being replaced by a random one
+        self.drop_rate = drop_rate          # probability of each streamed byte being lost
+        self.stall_after = stall_after      # the next stream stops after this many bytes, without its end marker
+        self.unresponsive = unresponsive    # read commands but never answer them
+        self.fail_open = fail_open          # the log cannot be opened, like a missing microSD card
+
+        self.commands = []                  # every command line received, for tests
+        self.bytes_sent = 0
+
+        self.rng = np.random.default_rng(seed)
+        self.spectra = generate_spectra(self.rng)
+        self.started = time.monotonic()
+        self.clock = None                   # (device time, monotonic time) when the clock was set, None if never set
+        self.scheduled_start = None         # device time of the timed start, None for none
+        self.scheduled_stop = None          # device time of the timed stop, None for none
+        self.last_capture = None
+        self.link_clock = 0
+
+        self.temporary_dir = None
+        if (log_dir is None):
+            self.temporary_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(log_dir or self.temporary_dir.name, LOG_FILENAME)
+        if (rows > 0 or log_dir is None): generate_log(self.log_path, rows, seed)
+
+    # seconds since 1970-01-01 on the device clock, which starts at 0 when the clock is not set
+    def now(self):
+        if (self.clock is None): return int(time.monotonic() - self.started)
+        return int(self.clock[0] + time.monotonic() - self.clock[1])
+
+    # the log size, creating the log with its header if it does not exist like Storage::open_file(). None if it cannot be opened
+    def log_size(self):
+        if (self.fail_open): return None
+        if (not os.path.exists(self.log_path)):
+            with open(self.log_path, 'w', newline='') as f:
+                f.write(file_header().replace("\n", "\r\n"))
+        return os.path.getsize(self.log_path)
+
+    def delete_log(self):
+        if (os.path.exists(self.log_path)): os.remove(self.log_path)
+
+    # take a measurement and append it to the log, unless log is False. Returns the datapoint line
+    def capture(self, manual = False, log = True):
+        if (self.capture_time): time.sleep(self.capture_time)
+
+        spectrum = self.spectra[self.data_counter % len(self.spectra)] * self.calibration_factor
+        line = format_datapoint(self.now(), format_body(spectrum), int(manual), self.int_time, self.frame_avg, self.ae)
+
+        if (not log): return line
+        if (self.log_size() is not None):
+            with open(self.log_path, 'a', newline='') as f:
+                f.write(line + "\r\n")
+        self.data_counter += 1
+        return line
+
+    # start or stop recording once a timed start or stop is reached, like check_schedule() in the firmware
+    def check_schedule(self):
+        now = self.now()
+        if (self.scheduled_start is not None and now >= self.scheduled_start):
+            self.scheduled_start = None
+            if (self.scheduled_stop is None or now < self.scheduled_stop): self.recording = True
+        if (self.scheduled_stop is not None and now >= self.scheduled_stop):
+            self.scheduled_stop = None
+            self.recording = False
+
+    # a recorded capture when the logging interval has passed, only once the clock is set
+    def tick(self):
+        if (self.clock is not None): self.check_schedule()
+        if (not self.recording or self.clock is None): return
+        if (self.last_capture is None or time.monotonic() - self.last_capture >= self.logging_interval / 1000):
+            self.last_capture = time.monotonic()
+            self.capture()
+
+    # serve one host connection until it closes. connection has recv, sendall and fileno, like a socket
+    def serve(self, connection):
+        self.connection = connection
+        pending = bytearray()
+        while True:
+            if (b"\n" not in pending and select.select([connection], [], [], self.loop_delay or LOOP_DELAY)[0]):
+                try:
+                    data = connection.recv(READ_SIZE)
+                except ConnectionError:
+                    return
+                if (data == b"" and not isinstance(connection, PtyConnection)): return
+                pending += data
+
+            # one command per loop, the rest stays buffered
+            if (b"\n" in pending):
+                line, _, rest = bytes(pending).partition(b"\n")
+                pending = bytearray(rest)
+                try:
+                    self.handle(line.decode("utf-8", "replace"))
+                except ReplyAbandoned:
+                    pending.clear()
+                except ConnectionError:
+                    return
+
+                if (self.loop_delay and (not self.recording or self.clock is None)): time.sleep(self.loop_delay)
+
+            self.tick()
+
+    # send bytes to the host at link_speed. Raises ReplyAbandoned if the host stops reading
+    def write(self, data):
+        if (isinstance(data, str)): data = data.encode("utf-8")
+        if (self.link_speed):
+            now = time.monotonic()
+            self.link_clock = max(self.link_clock, now) + len(data) / self.link_speed
+            if (self.link_clock > now): time.sleep(self.link_clock - now)
+        try:
+            self.connection.sendall(data)
+        except TimeoutError:
+            raise ReplyAbandoned()
+        self.bytes_sent += len(data)
+
+    def println(self, value):
+        self.write(str(value) + "\r\n")
+
+    # send the log from offset, with the injected faults. Returns False if the stream stalled
+    def stream_log(self, offset):
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            return self.send_stream(iter(lambda: f.read(STREAM_BLOCK_SIZE), b""))
+
+    # send the frames of a framed export, see device.py
+    def stream_frames(self, first, count, size, encoding = "CSV"):
+        def frames():
+            with open(self.log_path, 'rb') as f:
+                for chunk in range(first, min(first + count, -(-size // FRAME_CHUNK_SIZE))):
+                    if (encoding == "CSV"):
+                        f.seek(chunk * FRAME_CHUNK_SIZE)
+                        yield frame(chunk, f.read(FRAME_CHUNK_SIZE))
+                    else:
+                        yield frame(chunk, encode_chunk(f, chunk, size, encoding))
+            yield frame(FRAME_END, b"")
+        return self.send_stream(frames())
+
+    # send blocks of a stream, with the injected faults. Returns False if the stream stalled
+    def send_stream(self, blocks):
+        stall_after, self.stall_after = self.stall_after, None
+        sent = 0
+        for block in blocks:
+            block = self.inject_faults(block)
+            if (stall_after is not None and sent + len(block) >= stall_after):
+                self.write(block[:max(stall_after - sent, 0)])
+                return False
+            self.write(block)
+            sent += len(block)
+        return True
+
+    def inject_faults(self, block):
+        if (self.corrupt_rate):
+            block = bytearray(block)
+            for i in np.flatnonzero(self.rng.random(len(block)) < self.corrupt_rate):
+                block[i] = int(self.rng.integers(0, 256))
+            block = bytes(block)
+        if (self.drop_rate):
+            keep = self.rng.random(len(block)) >= self.drop_rate
+            block = np.frombuffer(block, dtype=np.uint8)[keep].tobytes()
+        return block
+
+    # handle one command line, with the replies of LightSensorProgram.ino
+    def handle(self, command):
+        self.commands.append(command)
+        if (self.unresponsive): return
+        code = command[:2]
+
+        if (code == "00"):
+            self.recording = not self.recording
+            self.println("DATA")
+            self.println(int(self.recording))
+            self.println("OK")
+
+        elif (code == "01"):
+            line = self.capture(manual=True)
+            self.println("DATA")
+            self.println(line)
+            self.println("OK")
+
+        elif (code == "02"):
+            size = self.log_size()
+            self.println("DATA")
+            self.println(ERROR_SIZE if size is None else size)
+            if (size is None):
+                self.println("ERR")
+            elif (not self.stream_log(0)):
+                return
+            # no line break after a streamed log
+            self.write("OK")
+
+        elif (code == "03"):
+            self.delete_log()
+            self.name = DEV_NAME_PREFIX
+            self.logging_interval = DEF_CAPTURE_INTERVAL
+            self.data_counter = 0
+            self.calibration_factor = DEF_CALIBRATION_FACTOR
+            self.recording = False
+            self.println("OK")
+
+        elif (code == "04"):
+            self.logging_interval = to_int(after_underscore(command))
+            self.println("OK")
+
+        elif (code == "05"):
+            date = [to_int(command[start:end]) for start, end in [(2, 6), (6, 8), (8, 10), (10, 12), (12, 14), (14, 16)]]
+            try:
+                self.clock = (calendar.timegm(tuple(date)), time.monotonic())
+            except (ValueError, OverflowError):
+                self.clock = (0, time.monotonic())
+            self.println("OK")
+
+        elif (code == "07"):
+            self.println("DATA")
+            self.println(self.name)
+            self.println(self.logging_interval)
+            self.println(int(self.recording))
+            self.println(self.data_counter)
+            self.println("OK")
+
+        elif (code == "08"):
+            self.name = DEV_NAME_PREFIX + "_" + after_underscore(command)
+            self.println("OK")
+
+        elif (code == "09"):
+            # the firmware prints the uptime in base 8
+            uptime = format(int((time.monotonic() - self.started) / 60), "o")
+            self.println("DATA")
+            self.println("device_name: " + self.name + " data_points: " + str(self.data_counter) + " uptime: " + uptime +
+                         "m Logging interval: " + str(self.logging_interval) + "ms")
+            self.println("OK")
+
+        elif (code == "10"):
+            self.ae = int(bool(to_int(command[2:3])))
+            self.frame_avg = to_int(command[3:6])
+            self.int_time = to_int(command[6:])
+            self.println("OK")
+
+        elif (code == "11"):
+            self.calibration_factor = to_float(after_underscore(command))
+            self.println("OK")
+
+        elif (code == "12"):
+            self.recording = True
+            self.println("OK")
+
+        elif (code == "13"):
+            self.recording = False
+            self.println("OK")
+
+        elif (code == "14"):
+            self.delete_log()
+            self.data_counter = 0
+            self.println("OK")
+
+        elif (code == "15"):
+            offset = to_int(after_underscore(command))
+            size = self.log_size()
+            if (size is None):
+                self.println("ERR")
+                self.println("OK")
+                return
+
+            self.println("DATA")
+            if (size < offset):
+                # the firmware returns without "OK"
+                self.println(-1)
+                return
+            self.println(size - offset)
+            if (not self.stream_log(offset)): return
+            self.println("OK")
+
+        elif (code == "16" and self.framed):
+            first, _, count = after_underscore(command).partition("_")
+            count, _, encoding = count.partition("_")
+            if (not self.encoded or encoding not in ENCODINGS): encoding = "CSV"
+            size = self.log_size()
+            if (size is None):
+                self.println("ERR")
+                self.println("OK")
+                return
+
+            self.println("DATA")
+            self.println(size)
+            self.println(FRAME_CHUNK_SIZE)
+            if (not self.stream_frames(to_int(first), to_int(count), size, encoding)): return
+            self.println("OK")
+
+        elif (code == "20" and self.previewed):
+            line = self.capture(manual=True, log=False)
+            self.println("DATA")
+            self.println(line)
+            self.println("OK")
+
+        elif (code == "19" and self.encoded):
+            self.println("DATA")
+            self.println(",".join(ENCODINGS))
+            self.println("OK")
+
+        elif (code in ("17", "18") and self.scheduled):
+            # YYYYMMDDhhmmss in device time, anything else clears it
+            date = after_underscore(command)
+            try:
+                when = calendar.timegm(time.strptime(date, "%Y%m%d%H%M%S")) if len(date) == 14 else None
+            except ValueError:
+                when = None
+            if (code == "17"):
+                self.scheduled_start = when
+            else:
+                self.scheduled_stop = when
+            self.println("OK")
+
+        elif (code in ("17", "18")):
+            # firmware released before timed start and stop does not answer them
+            pass
+
+        else:
+            self.println("Err '" + command + "'")
+
+# one frame of a framed export: FRAME_MAGIC, chunk number, payload length, payload and CRC-32 of all but FRAME_MAGIC
+def frame(chunk, payload):
+    header = struct.pack("<IH", chunk, len(payload))
+    return FRAME_MAGIC + header + payload + struct.pack("<I", zlib.crc32(header + payload))
+
+# encode the lines of an open log file that start in a chunk, one record per line, like the firmware. A line that
+# starts in the previous chunk belongs to that chunk
+def encode_chunk(f, chunk, size, encoding):
+    start = chunk * FRAME_CHUNK_SIZE
+    end = min(start + FRAME_CHUNK_SIZE, size)
+
+    f.seek(start)
+    if (chunk > 0):
+        f.seek(start - 1)
+        f.readline()
+
+    records = []
+    while f.tell() < end:
+        records.append(encode_line(f.readline().rstrip(b"\r\n"), encoding))
+    return b"".join(records)
+
+# serve a device on a new pseudo terminal in a background thread. Returns the port name
+def serve_pty(device):
+    connection = PtyConnection()
+    Thread(target=device.serve, args=(connection,), daemon=True).start()
+    return connection.port_name
+
+# serve a device on a TCP socket in a background thread, one host connection at a time. Returns the port name,
+# a pyserial socket:// URL
+def serve_socket(device, host = "localhost", port = 0):
+    server = socket.create_server((host, port))
+
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            connection.settimeout(WRITE_TIMEOUT)
+            with connection:
+                device.serve(connection)
+
+    Thread(target=accept, daemon=True).start()
+    return "socket://" + host + ":" + str(server.getsockname()[1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve simulated OSS devices until stdin is closed.")
+    parser.add_argument("--count", type=int, default=1, help="how many devices to serve")
+    parser.add_argument("--name", default=DEV_NAME_PREFIX, help="device name, numbered when serving several devices")
+    parser.add_argument("--rows", type=int, default=0, help="datapoints in each generated log")
+    parser.add_argument("--socket", action="store_true", help="serve on TCP sockets instead of pseudo terminals")
+    parser.add_argument("--link-speed", type=float, help="bytes per second each device sends")
+    parser.add_argument("--loop-delay", type=float, default=LOOP_DELAY, help="seconds the device waits after each command")
+    parser.add_argument("--no-framed", action="store_true", help="simulate firmware without framed exports")
+    parser.add_argument("--no-encoded", action="store_true", help="simulate firmware that only exports CSV")
+    parser.add_argument("--no-scheduled", action="store_true", help="simulate firmware without timed start and stop")
+    parser.add_argument("--no-previewed", action="store_true", help="simulate firmware without captures that are not logged")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="probability of each streamed byte being corrupted")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of each streamed byte being lost")
+    parser.add_argument("--stall-after", type=int, help="the first stream stops after this many bytes")
+    args = parser.parse_args()
+
+    serve = serve_socket if args.socket else serve_pty
+    for i in range(args.count):
+        name = args.name if args.count == 1 else args.name + "_" + str(i + 1)
+        device = SimulatedDevice(name, args.rows, seed=i, link_speed=args.link_speed, loop_delay=args.loop_delay,
+                                 framed=not args.no_framed, encoded=not args.no_encoded, scheduled=not args.no_scheduled, previewed=not args.no_previewed, corrupt_rate=args.corrupt_rate, drop_rate=args.drop_rate, stall_after=args.stall_after)
+        print(serve(device), flush=True)
+
+    try:
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,174 @@
+'''
+Streaming pipeline over the bytes of a device log while they are being transferred.
+
+Every stage is a generator. A source yields raw chunks of the log, from a transfer in progress (dock.iter_stream)
+or from a file (logfile.read_blocks). parse_batches turns the chunks into small batches of NumPy columns, the
+same columns logfile.parse_log returns, and the stages after it filter, aggregate or write batches as they
+arrive. Each stage only holds the batch it is working on, so memory stays bounded however large the log is.
+
+    batches = parse_batches(chunks)
+    batches = select_quality(batches)
+    drain(write_dataset(batches, "data/LOG.ossd"))
+
+The payloads of an encoded framed export (see encoding.py) are already columns: decode_batches turns them into
+batches without parsing any text, and write_decoded formats them as CSV lines again for the log file, which is
+therefore not a copy of the bytes on the device.
+'''
+
+import os
+import numpy as np
+
+from logfile import SPECTRA_TYPE, parse_block
+from dataset import HEADER_FILENAME, create_dataset, append_rows, format_row
+from encoding import decode_records
+
+# CONSTANTS
+STREAM_BATCH_BYTES = 1048576                # how many bytes of complete lines to collect before parsing them
+
+# write raw chunks to a file and pass them on
+def write_chunks(chunks, f):
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+# collect chunks into blocks of complete lines of at least batch_bytes. A line split across chunks is kept whole
+def line_blocks(chunks, batch_bytes = STREAM_BATCH_BYTES):
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        if (len(pending) < batch_bytes): continue
+
+        end = pending.rfind(b"\n") + 1
+        if (end > 0):
+            yield bytes(pending[:end])
+            del pending[:end]
+
+    if pending: yield bytes(pending)
+
+# parse chunks of a log into batches of columns. Batches without datapoints are skipped
+def parse_batches(chunks, batch_bytes = STREAM_BATCH_BYTES, spectra_dtype = SPECTRA_TYPE):
+    for block in line_blocks(chunks, batch_bytes):
+        batch = parse_block(block, spectra_dtype)
+        if (len(batch["timestamp"]) > 0): yield batch
+
+# decode the payloads of an encoded framed export into (batch, lines) pairs, see encoding.decode_records.
+# Payloads hold whole records, and are collected into at least batch_bytes before decoding
+def decode_batches(payloads, encoding, batch_bytes = STREAM_BATCH_BYTES):
+    pending = []
+    size = 0
+    for payload in payloads:
+        pending.append(payload)
+        size += len(payload)
+        if (size < batch_bytes): continue
+
+        yield decode_records(b"".join(pending), encoding)
+        pending = []
+        size = 0
+
+    if pending: yield decode_records(b"".join(pending), encoding)
+
+# write decoded (batch, lines) pairs as CSV lines in the device layout, the text lines in their place between the
+# datapoints, and pass on the batches that hold datapoints
+def write_decoded(decoded, f):
+    for batch, lines in decoded:
+        rows = len(batch["timestamp"])
+        text = []
+        start = 0
+        for row, line in lines + [(rows, None)]:
+            text += [format_row(batch, i)[:-1] + "\r\n" for i in range(start, row)]
+            if (line is not None): text.append(line.decode("ascii", "replace") + "\r\n")
+            start = row
+
+        f.write("".join(text).encode("ascii"))
+        if (rows > 0): yield batch
+
+# the rows of a batch selected by a boolean mask or index array
+def take(batch, index):
+    return {column: (values if column == "wavelengths" else values[index]) for column, values in batch.items()}
+
+# yield one datapoint at a time as a dict, with the spectrum under "spectrum"
+def iter_records(batches):
+    for batch in batches:
+        columns = [column for column in batch if column not in ("spectra", "wavelengths")]
+        for i in range(len(batch["timestamp"])):
+            record = {column: batch[column][i].item() for column in columns}
+            record["spectrum"] = batch["spectra"][i]
+            yield record
+
+# keep the rows for which predicate(batch) returns True
+def select(batches, predicate):
+    for batch in batches:
+        mask = predicate(batch)
+        if (not mask.any()):
+            continue
+        elif (mask.all()):
+            yield batch
+        else:
+            yield take(batch, mask)
+
+# keep only datapoints captured under good lighting conditions (QUALITY 0)
+def select_quality(batches, quality = 0):
+    return select(batches, lambda batch: batch["quality"] == quality)
+
+# average datapoints over time buckets of interval seconds. Yields batches with the bucket start as "timestamp",
+# the number of datapoints as "count" and the mean "spectra", "x", "y" and "z". A bucket is yielded once a datapoint
+# from a later bucket arrives, and the last one when the stream ends. Logs are append-ordered, so a bucket that
+# appears again after a clock change is yielded again
+def aggregate(batches, interval):
+    columns = ["spectra", "x", "y", "z"]
+    current = None
+    wavelengths = None
+
+    for batch in batches:
+        if (len(batch["timestamp"]) == 0): continue
+        wavelengths = batch["wavelengths"]
+        buckets = batch["timestamp"] // interval * interval
+
+        # consecutive rows in the same bucket form a run
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        runs = {"timestamp": buckets[starts], "count": np.diff(np.append(starts, len(buckets)))}
+        for column in columns:
+            runs[column] = np.add.reduceat(batch[column].astype(np.float64), starts, axis=0)
+
+        # the first run continues the bucket left open by the previous batch
+        if (current is not None and current["timestamp"][0] == runs["timestamp"][0]):
+            for column in ["count"] + columns:
+                runs[column][0] += current[column][0]
+        elif (current is not None):
+            runs = {column: np.concatenate((current[column], runs[column])) for column in runs}
+
+        # keep the last bucket open, it may continue in the next batch
+        current = {column: values[-1:] for column, values in runs.items()}
+        if (len(runs["timestamp"]) > 1):
+            yield bucket_means({column: values[:-1] for column, values in runs.items()}, wavelengths)
+
+    if current is not None: yield bucket_means(current, wavelengths)
+
+# turn bucket sums into means
+def bucket_means(sums, wavelengths):
+    means = {"timestamp": sums["timestamp"], "count": sums["count"], "wavelengths": wavelengths}
+    means["spectra"] = (sums["spectra"] / sums["count"][:, None]).astype(SPECTRA_TYPE)
+    for column in ["x", "y", "z"]:
+        means[column] = sums[column] / sums["count"]
+    return means
+
+# append batches to a dataset and pass them on. The dataset is created if it does not exist
+def write_dataset(batches, path):
+    if (not os.path.exists(os.path.join(path, HEADER_FILENAME))): create_dataset(path)
+
+    for batch in batches:
+        append_rows(path, batch)
+        yield batch
+
+# write batches as CSV lines in the device layout and pass them on
+def write_csv(batches, f):
+    for batch in batches:
+        f.write("".join([format_row(batch, i) for i in range(len(batch["timestamp"]))]))
+        yield batch
+
+# run a pipeline to the end. Returns how many items the last stage yielded
+def drain(items):
+    count = 0
+    for _ in items:
+        count += 1
+    return count
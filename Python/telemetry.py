@@ -0,0 +1,221 @@
+'''
+Instrumentation of device commands and transfers, to find out where the time goes and which docking stations are slow.
+
+Every device command records its round trip, from the command being sent to its reply, and every export and sync
+records its bytes, throughput, stall time (how long the line was quiet, see device.STALL_GAP), the chunks asked
+for again, the host CPU time and how long each phase took: asking for the log, receiving and writing it, flushing
+it to disk, indexing and rolling it up. Everything is kept in memory by the process-wide recorder, and can also be
+appended to a log file as one JSON object per line and written to a Prometheus text-format file for the node
+exporter textfile collector. The Prometheus file is written again after every transfer, replacing the old one.
+
+    telemetry.configure("logs/dock.jsonl", "/var/lib/node_exporter/oss.prom")
+
+ThreadProfiler runs cProfile in every thread, for a breakdown of a whole command, see dock.py --profile.
+'''
+
+import os
+import json
+import time
+import threading
+
+# CONSTANTS
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]   # upper bounds in seconds of the round trip histogram
+METRIC_PREFIX = "oss_"                      # prefix of every Prometheus metric
+TRANSFER_TOTALS = ["bytes", "wire_bytes", "seconds", "stall_seconds", "retries", "cpu_seconds"]  # transfer values added up per port
+
+# the round trips, transfers and phases of the device commands, by port
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}                  # (port, command) -> {"count", "sum", "max", "buckets", "outcomes"}
+        self.transfers = {}                 # (port, kind) -> TRANSFER_TOTALS, "count", "incomplete", "bytes_per_second", "phases"
+        self.log = None                     # the JSON lines log file, if any
+        self.prometheus_filename = None
+
+    # log every event to log_filename, and write the metrics to prometheus_filename after every transfer. None turns either off
+    def configure(self, log_filename = None, prometheus_filename = None):
+        with self.lock:
+            if self.log: self.log.close()
+            self.log = None
+            if log_filename:
+                if (os.path.dirname(log_filename)): os.makedirs(os.path.dirname(log_filename), exist_ok=True)
+                self.log = open(log_filename, 'a', buffering=1)
+            self.prometheus_filename = prometheus_filename
+
+    # append an event to the JSON lines log. Call with the lock held
+    def write_event(self, event):
+        if self.log: self.log.write(json.dumps(dict([("time", round(time.time(), 3))] + list(event.items()))) + "\n")
+
+    # record the round trip of a command. outcome is "ok", "error" (the device answered with an error) or "timeout"
+    def command(self, port, command, seconds, outcome = "ok"):
+        with self.lock:
+            stats = self.commands.setdefault((port, command), {"count": 0, "sum": 0.0, "max": 0.0,
+                                                               "buckets": [0] * len(LATENCY_BUCKETS), "outcomes": {}})
+            stats["count"] += 1
+            stats["sum"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if (seconds <= bound): stats["buckets"][i] += 1
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+            self.write_event({"event": "command", "port": port, "command": command, "seconds": round(seconds, 6), "outcome": outcome})
+
+    # record a transfer. kind is "export" or "sync", status is the status of the transfer (see device.Device.stream)
+    # with "cpu_seconds", and phases maps each phase to its seconds. Writes the Prometheus file if there is one
+    def transfer(self, port, kind, status, phases = {}, **fields):
+        values = {"bytes": status.get("bytes", 0), "wire_bytes": status.get("wire_bytes", status.get("bytes", 0)),
+                  "seconds": status.get("elapsed", 0), "stall_seconds": status.get("stall_seconds", 0),
+                  "retries": status.get("retries", 0), "cpu_seconds": status.get("cpu_seconds", 0)}
+        bytes_per_second = values["bytes"] / max(values["seconds"], 1e-6)
+
+        with self.lock:
+            totals = self.transfers.setdefault((port, kind), dict([(key, 0) for key in TRANSFER_TOTALS] +
+                                                                  [("count", 0), ("incomplete", 0), ("bytes_per_second", 0), ("phases", {})]))
+            for key in TRANSFER_TOTALS:
+                totals[key] += values[key]
+            totals["count"] += 1
+            totals["incomplete"] += 0 if status.get("complete") else 1
+            totals["bytes_per_second"] = bytes_per_second
+            for phase, seconds in phases.items():
+                totals["phases"][phase] = totals["phases"].get(phase, 0) + seconds
+
+            event = {"event": "transfer", "port": port, "kind": kind}
+            event.update(fields)
+            event.update([(key, round(value, 6)) for key, value in values.items()])
+            event["bytes_per_second"] = round(bytes_per_second)
+            event["complete"] = bool(status.get("complete"))
+            event["phases"] = dict([(phase, round(seconds, 6)) for phase, seconds in phases.items()])
+            self.write_event(event)
+
+        if self.prometheus_filename: self.write_prometheus(self.prometheus_filename)
+
+    # the metrics in the Prometheus text format
+    def prometheus(self):
+        lines = []
+        def metric(name, kind, description):
+            lines.append("# HELP " + METRIC_PREFIX + name + " " + description)
+            lines.append("# TYPE " + METRIC_PREFIX + name + " " + kind)
+        def sample(name, labels, value):
+            lines.append(METRIC_PREFIX + name + "{" + ",".join([key + '="' + escape_label(label) + '"' for key, label in labels]) +
+                         "} " + (str(value) if isinstance(value, int) else repr(float(value))))
+
+        with self.lock:
+            commands = sorted(self.commands.items())
+            transfers = sorted(self.transfers.items())
+
+            metric("command_seconds", "histogram", "Round trip of device commands, from the command being sent to its reply")
+            for (port, command), stats in commands:
+                labels = [("port", port), ("command", command)]
+                for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+                    sample("command_seconds_bucket", labels + [("le", repr(float(bound)))], count)
+                sample("command_seconds_bucket", labels + [("le", "+Inf")], stats["count"])
+                sample("command_seconds_sum", labels, stats["sum"])
+                sample("command_seconds_count", labels, stats["count"])
+
+            metric("command_outcomes_total", "counter", "Device commands by outcome: ok, error or timeout")
+            for (port, command), stats in commands:
+                for outcome, count in sorted(stats["outcomes"].items()):
+                    sample("command_outcomes_total", [("port", port), ("command", command), ("outcome", outcome)], count)
+
+            for name, key, description in [("transfers_total", "count", "Exports and syncs"),
+                                           ("transfers_incomplete_total", "incomplete", "Exports and syncs that did not complete"),
+                                           ("transfer_bytes_total", "bytes", "Bytes of device logs transferred"),
+                                           ("transfer_wire_bytes_total", "wire_bytes", "Bytes sent over the line, encoded"),
+                                           ("transfer_seconds_total", "seconds", "Time spent transferring"),
+                                           ("transfer_stall_seconds_total", "stall_seconds", "Time the line was quiet during transfers"),
+                                           ("transfer_retries_total", "retries", "Chunks asked for again"),
+                                           ("transfer_cpu_seconds_total", "cpu_seconds", "Host CPU time used during transfers")]:
+                metric(name, "counter", description)
+                for (port, kind), totals in transfers:
+                    sample(name, [("port", port), ("kind", kind)], totals[key])
+
+            metric("transfer_bytes_per_second", "gauge", "Throughput of the last transfer")
+            for (port, kind), totals in transfers:
+                sample("transfer_bytes_per_second", [("port", port), ("kind", kind)], totals["bytes_per_second"])
+
+            metric("transfer_phase_seconds_total", "counter", "Time spent in each phase of the transfers")
+            for (port, kind), totals in transfers:
+                for phase, seconds in sorted(totals["phases"].items()):
+                    sample("transfer_phase_seconds_total", [("port", port), ("kind", kind), ("phase", phase)], seconds)
+
+        return "\n".join(lines) + "\n"
+
+    # write the metrics to a Prometheus text-format file, replacing it atomically so the collector never reads half a file
+    def write_prometheus(self, filename):
+        with open(filename + ".part", 'w') as f:
+            f.write(self.prometheus())
+        os.replace(filename + ".part", filename)
+
+    # a table of the round trips of each command and the transfers of each port
+    def summary(self):
+        with self.lock:
+            lines = ["%-24s %-18s %6s %10s %10s %8s" % ("port", "command", "count", "mean ms", "max ms", "failed")]
+            for (port, command), stats in sorted(self.commands.items()):
+                lines.append("%-24s %-18s %6d %10.1f %10.1f %8d" % (port, command, stats["count"], stats["sum"] / stats["count"] * 1000,
+                             stats["max"] * 1000, stats["count"] - stats["outcomes"].get("ok", 0)))
+
+            for (port, kind), totals in sorted(self.transfers.items()):
+                lines.append(port + " " + kind + ": " + str(totals["count"]) + " transfers, " + str(totals["bytes"]) + " bytes in " +
+                             str(round(totals["seconds"], 2)) + " s (" + str(int(totals["bytes"] / max(totals["seconds"], 1e-6))) +
+                             " bytes/s), stalled " + str(round(totals["stall_seconds"], 2)) + " s, " + str(totals["retries"]) +
+                             " retries, " + str(round(totals["cpu_seconds"], 2)) + " s CPU")
+                if totals["phases"]:
+                    lines.append("    " + ", ".join([phase + " " + str(round(seconds, 3)) + " s" for phase, seconds in totals["phases"].items()]))
+
+        return "\n".join(lines)
+
+# escape a Prometheus label value
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+recorder = Recorder()                       # the recorder of the whole process
+
+def configure(log_filename = None, prometheus_filename = None):
+    recorder.configure(log_filename, prometheus_filename)
+
+def record_command(port, command, seconds, outcome = "ok"):
+    recorder.command(port, command, seconds, outcome)
+
+def record_transfer(port, kind, status, phases = {}, **fields):
+    recorder.transfer(port, kind, status, phases, **fields)
+
+# write the Prometheus file, if there is one, with everything recorded so far
+def flush():
+    if recorder.prometheus_filename: recorder.write_prometheus(recorder.prometheus_filename)
+
+# cProfile in the calling thread and in every thread started after start(). Each thread has its own profile,
+# which stop() adds up
+class ThreadProfiler:
+    def __init__(self):
+        self.profiles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.setprofile(self.profile_thread)
+        self.profile_thread()
+
+    # start profiling the calling thread. New threads call it through threading.setprofile
+    def profile_thread(self, *args):
+        import cProfile
+
+        self.local.profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(self.local.profile)
+        self.local.profile.enable()
+
+    # stop profiling the calling thread, for threads that keep running after stop()
+    def stop_thread(self):
+        profile = getattr(self.local, "profile", None)
+        if profile: profile.disable()
+
+    # stop profiling. Returns the pstats.Stats of every thread profiled
+    def stop(self):
+        import pstats
+
+        threading.setprofile(None)
+        self.stop_thread()
+        with self.lock:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        return stats
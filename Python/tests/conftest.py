@@ -0,0 +1,52 @@
+'''
+Fixtures shared by the tests: the modules of the Python directory on the import path, simulated devices and
+generated logs. Run the tests from the Python directory:
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from simulator import SimulatedDevice, serve_socket, generate_log
+
+# CONSTANTS
+TEST_ROWS = 500                             # datapoints in the generated logs, enough for several parse blocks of the tests
+TEST_LOOP_DELAY = 0.001                     # seconds simulated devices wait after each command, to keep the tests fast
+TEST_COMMAND_TIMEOUT = 2                    # seconds to wait for a simulated device, which answers at once unless told not to
+
+# the directory dock.py saves to, a fresh one for each test
+@pytest.fixture
+def save_dir(tmp_path, monkeypatch):
+    import dock
+
+    monkeypatch.setattr(dock, "SAVE_DIR", str(tmp_path / "data") + "/")
+    return str(tmp_path / "data")
+
+# serve simulated devices for a test and connect to them the way dock.py does. Call with the options of
+# SimulatedDevice, returns (device, connection)
+@pytest.fixture
+def simulated(save_dir):
+    from device import get_device_thread
+
+    connections = []
+    def connect(**options):
+        options.setdefault("loop_delay", TEST_LOOP_DELAY)
+        device = SimulatedDevice(**options)
+        connections.append(get_device_thread().open(serve_socket(device), timeout=TEST_COMMAND_TIMEOUT))
+        return device, connections[-1]
+
+    yield connect
+    for connection in connections:
+        connection.close()
+
+# a generated log of TEST_ROWS datapoints in the device layout
+@pytest.fixture
+def log_file(tmp_path):
+    filename = str(tmp_path / "LOG.CSV")
+    generate_log(filename, TEST_ROWS)
+    return filename
@@ -0,0 +1,98 @@
+'''
+Lighting metrics against reference spectra: Planckian radiators, illuminant A, points off the locus and the CIE
+F-series fluorescent illuminants, whose CCT and CRI are published in CIE 015 and whose TM-30 indices are those of the
+colour-science reference implementation.
+'''
+
+import os
+import numpy as np
+import pytest
+
+import analytics
+from analytics import Weights, analyze, planck, read_table, tristimulus, uv_1960, cct_duv, cri, tm30
+from logfile import WAVELENGTHS
+
+# CONSTANTS
+REFERENCE_CCT = [2000, 2856, 3500, 4500, 6500, 10000, 20000]  # K, Planckian references the metrics must recover
+F_SERIES_FILE = "cie_f_series.csv"          # the CIE F1 to F12 illuminants, in TABLES_DIR
+F_SERIES_CCT = [6430, 4230, 3450, 2940, 6350, 4150, 6500, 5000, 4150, 5000, 4000, 3000]  # K, CIE 015, to 10 K
+F_SERIES_RA = [76, 64, 57, 51, 72, 59, 90, 95, 90, 81, 83, 83]  # CIE 015, rounded
+F_SERIES_TM30 = {2: (70.12, 86.42), 7: (91.47, 98.90), 11: (80.04, 101.06)}  # F number: (Rf, Rg), colour-science 0.4.7
+
+@pytest.fixture(scope="module")
+def weights():
+    return analytics.get_weights(WAVELENGTHS)
+
+@pytest.fixture(scope="module")
+def references():
+    reference = np.array(REFERENCE_CCT, dtype=np.float64)
+    return reference, planck(WAVELENGTHS, reference)
+
+@pytest.fixture(scope="module")
+def f_series():
+    return read_table(os.path.join(analytics.TABLES_DIR, F_SERIES_FILE), WAVELENGTHS)
+
+def test_planckian_cct_and_duv(references):
+    reference, spectra = references
+    metrics = analyze(spectra, ["cct", "duv"])
+    assert np.abs(metrics["cct"] / reference - 1).max() < 1e-4
+    assert np.abs(metrics["duv"]).max() < 1e-6
+
+def test_illuminant_a_chromaticity(references, weights):
+    xyz = tristimulus(references[1][1:2], weights)[0]
+    assert np.allclose(xyz[:2] / xyz.sum(), [0.44757, 0.40745], atol=1e-4)
+
+def test_illuminance_scales_with_the_spectrum(references):
+    metrics, scaled = analyze(references[1], ["illuminance", "cct"]), analyze(references[1] * 3.5, ["illuminance", "cct"])
+    assert np.allclose(scaled["illuminance"], metrics["illuminance"] * 3.5) and np.allclose(scaled["cct"], metrics["cct"])
+
+# points moved off the locus along its normal keep their CCT, and Duv is the distance moved
+def test_off_locus_cct_and_duv(references, weights):
+    reference, spectra = references
+    u, v = uv_1960(tristimulus(spectra, weights))
+    index = np.abs(weights.locus_cct[:, None] - reference).argmin(axis=0)
+    du, dv = np.gradient(weights.locus_u)[index], np.gradient(weights.locus_v)[index]
+    distance = np.linspace(-0.02, 0.02, len(reference))
+    cct, duv = cct_duv(u + dv * distance / np.hypot(du, dv), v - du * distance / np.hypot(du, dv), weights)
+    assert np.abs(cct / reference - 1).max() < 1e-3
+    assert np.abs(duv - distance).max() < 1e-5
+
+def test_planckian_radiator_renders_its_own_colours(references, weights):
+    reference, spectra = references
+    planckian = spectra[reference < min(analytics.CRI_DAYLIGHT_CCT, analytics.TM30_BLEND[0])]
+    ra, r = cri(planckian, weights)
+    rf, rg = tm30(planckian, weights)
+    assert np.allclose(r, 100, atol=1e-3) and np.allclose(rf, 100, atol=1e-3) and np.allclose(rg, 100, atol=1e-3)
+
+def test_every_metric_is_supported_by_the_shipped_tables(weights):
+    assert all([weights.supports(metric) for metric in analytics.METRIC_TABLES])
+
+def test_no_metric_is_supported_without_tables(tmp_path):
+    weights = Weights(WAVELENGTHS, str(tmp_path))
+    assert not any([weights.supports(metric) for metric in analytics.METRIC_TABLES])
+
+def test_f_series_cct(f_series):
+    assert np.allclose(analyze(f_series, ["cct"])["cct"], F_SERIES_CCT, atol=10)
+
+def test_f_series_cri(f_series):
+    assert np.allclose(analyze(f_series, ["cri_ra"])["cri_ra"], F_SERIES_RA, atol=0.6)
+
+def test_f_series_tm30(f_series):
+    numbers = list(F_SERIES_TM30)
+    metrics = analyze(f_series[[number - 1 for number in numbers]], ["tm30_rf", "tm30_rg"])
+    assert np.allclose(metrics["tm30_rf"], [F_SERIES_TM30[number][0] for number in numbers], atol=0.05)
+    assert np.allclose(metrics["tm30_rg"], [F_SERIES_TM30[number][1] for number in numbers], atol=0.05)
+
+# a black spectrum, as the sensor gives in the dark, has no colour: NaN and no warnings, and the others are unchanged
+def test_black_spectra_give_nan_without_warnings(f_series):
+    import warnings
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        black = analyze(np.zeros((3, len(WAVELENGTHS))))
+        mixed = analyze(np.vstack([np.zeros(len(WAVELENGTHS)), f_series[0]]))
+
+    assert np.array_equal(black["illuminance"], np.zeros(3)) and np.array_equal(black["melanopic_edi"], np.zeros(3))
+    assert all([np.isnan(black[metric]).all() for metric in ["cct", "duv", "cri_ra", "cri_r", "tm30_rf", "tm30_rg"]])
+    lit = analyze(f_series[:1])
+    assert all([np.allclose(mixed[metric][1:], lit[metric], rtol=1e-9) for metric in lit])
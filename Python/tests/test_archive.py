@@ -0,0 +1,48 @@
+'''
+Archives of a generated daylight log: the error bound of the spectra, exact metadata, time windows and lossless archives.
+'''
+
+import numpy as np
+import pytest
+
+from logfile import COLUMN_TYPES
+from dataset import csv_to_dataset, open_dataset
+from archive import ARCHIVE_MAX_ERROR, archive_file, read_archive
+from simulator import START_TIME, CAPTURE_INTERVAL, generate_daylight_log
+
+# CONSTANTS
+ARCHIVE_ROWS = 3000                         # rows in the generated daylight log, two days at one per minute
+ARCHIVE_WINDOW = 86400                      # seconds of the time window read back from the archive
+
+# a daylight log, its dataset and its archive. Returns (log, the dataset, the archive path)
+@pytest.fixture
+def archived(tmp_path):
+    log = str(tmp_path / "LOG.CSV")
+    generate_daylight_log(log, ARCHIVE_ROWS)
+    csv_to_dataset(log, str(tmp_path / "LOG.ossd"))
+    archive_file(str(tmp_path / "LOG.ossd"), str(tmp_path / "LOG.ossa"))
+    return log, open_dataset(str(tmp_path / "LOG.ossd")), str(tmp_path / "LOG.ossa")
+
+def test_metadata_is_exact(archived):
+    log, data, archive = archived
+    restored = read_archive(archive)
+    for column in COLUMN_TYPES:
+        assert np.array_equal(restored[column], data[column]), column
+
+def test_spectra_are_within_the_maximum_error_of_their_peak(archived):
+    log, data, archive = archived
+    errors = np.abs(read_archive(archive)["spectra"] - data["spectra"]).max(axis=1) / np.abs(data["spectra"]).max(axis=1)
+    assert errors.max() <= ARCHIVE_MAX_ERROR
+
+def test_time_window_reads_back_the_datapoints_in_it(archived):
+    log, data, archive = archived
+    start = START_TIME + ARCHIVE_ROWS * CAPTURE_INTERVAL // 2
+    window = read_archive(archive, start, start + ARCHIVE_WINDOW)
+    inside = (data["timestamp"] >= start) & (data["timestamp"] < start + ARCHIVE_WINDOW)
+    assert np.array_equal(window["timestamp"], data["timestamp"][inside])
+    assert np.array_equal(window["spectra"], read_archive(archive)["spectra"][inside])
+
+def test_lossless_archive_is_exact(archived, tmp_path):
+    log, data, archive = archived
+    archive_file(log, str(tmp_path / "LOSSLESS.ossa"), 0)
+    assert np.array_equal(read_archive(str(tmp_path / "LOSSLESS.ossa"))["spectra"], data["spectra"])
@@ -0,0 +1,78 @@
+'''
+The parse cache: logs loaded through it must match parse_log, and only what was not cached yet is parsed.
+'''
+
+import os
+import numpy as np
+import pytest
+
+import cache
+from cache import load_log, read_index
+from logfile import COLUMN_TYPES, parse_log
+from simulator import START_TIME, CAPTURE_INTERVAL, generate_log
+from conftest import TEST_ROWS
+
+def check(filename, data):
+    expected = parse_log(filename)
+    for column in list(COLUMN_TYPES) + ["spectra"]:
+        assert np.array_equal(data[column], expected[column]), os.path.basename(filename) + " differs in " + column
+
+# the bytes of the log, and of more datapoints following it without the header
+@pytest.fixture
+def contents(log_file, tmp_path):
+    generate_log(str(tmp_path / "more.CSV"), 100, seed=1, start_time=START_TIME + TEST_ROWS * CAPTURE_INTERVAL)
+    with open(log_file, 'rb') as f, open(str(tmp_path / "more.CSV"), 'rb') as g:
+        return f.read(), g.read().split(b"\n", 1)[1]
+
+def write(filename, data, mode = 'wb'):
+    with open(filename, mode) as f:
+        f.write(data)
+    return filename
+
+def test_log_loaded_cold_and_again_matches_parse_log(log_file, tmp_path):
+    store = str(tmp_path / "cache")
+    check(log_file, load_log(log_file, store))
+    check(log_file, load_log(log_file, store))
+    assert len(read_index(store)["entries"]) == 1
+
+def test_copy_of_a_cached_log_is_not_parsed_again(log_file, contents, tmp_path):
+    store = str(tmp_path / "cache")
+    load_log(log_file, store)
+    check(write(str(tmp_path / "copy.CSV"), contents[0]), load_log(str(tmp_path / "copy.CSV"), store))
+    assert len(read_index(store)["entries"]) == 1
+
+# a sync file growing in pieces cut anywhere, lines cut off included
+def test_growing_sync_file_matches_parse_log(contents, tmp_path):
+    store, sync = str(tmp_path / "cache"), str(tmp_path / "SYNC.CSV")
+    data = contents[0] + contents[1]
+    start = 0
+    for cut in sorted(np.random.default_rng(0).integers(1, len(data), 6).tolist()) + [len(data)]:
+        write(sync, data[start:cut], 'ab')
+        check(sync, load_log(sync, store))
+        start = cut
+
+# an export of a device that was not erased starts with the log, which keeps its own cached parse
+def test_export_starting_with_a_cached_log_matches_parse_log(log_file, contents, tmp_path):
+    store = str(tmp_path / "cache")
+    load_log(log_file, store)
+    check(write(str(tmp_path / "A0.CSV"), contents[0] + contents[1]), load_log(str(tmp_path / "A0.CSV"), store))
+    check(log_file, load_log(log_file, store))
+
+def test_new_parser_version_parses_again(log_file, tmp_path, monkeypatch):
+    store = str(tmp_path / "cache")
+    load_log(log_file, store)
+    monkeypatch.setattr(cache, "PARSER_VERSION", cache.PARSER_VERSION + 1)
+    check(log_file, load_log(log_file, store))
+    assert len(read_index(store)["entries"]) == 2
+
+def test_cache_is_evicted_down_to_its_size_limit(log_file, contents, tmp_path):
+    store = str(tmp_path / "cache")
+    load_log(log_file, store)
+    other = write(str(tmp_path / "B.CSV"), contents[0][:contents[0].index(b"\n", len(contents[0]) // 2) + 1])
+    load_log(other, store)
+    limit = max([entry["disk"] for entry in read_index(store)["entries"].values()])
+
+    check(log_file, load_log(log_file, store, limit))
+    index = read_index(store)
+    assert len(index["entries"]) == 1 and os.path.abspath(log_file) in index["files"] and os.path.abspath(other) not in index["files"]
+    assert sum([entry["disk"] for entry in index["entries"].values()]) <= limit and len(os.listdir(store)) == 2
@@ -0,0 +1,80 @@
+'''
+Round trips between logs and datasets: a log converted to a dataset, written back out as CSV and converted again
+must hold exactly the same values, the spectra being the float32 of the text in the log.
+'''
+
+import calendar
+import numpy as np
+import pytest
+
+from logfile import COLUMN_TYPES, file_header, is_datapoint
+from dataset import csv_to_dataset, dataset_to_csv, open_dataset
+from simulator import START_TIME, CAPTURE_INTERVAL, generate_log, generate_daylight_log, format_datapoint
+from conftest import TEST_ROWS
+
+# write a log whose spectral values span every magnitude a float32 holds, negative, zero and with more digits
+# than a float32 keeps, and whose metadata reaches the ends of their types
+def write_extreme_log(filename, rows):
+    rng = np.random.default_rng(0)
+    values = rng.choice([-1, 1], (rows, 135)) * 10.0 ** rng.uniform(-37, 37, (rows, 135))
+    values[:, :5] = [0.0, -0.0, 1e-45, 3.4e38, 0.1]
+
+    with open(filename, 'w', newline='') as f:
+        f.write(file_header().replace("\n", "\r\n"))
+        for i in range(rows):
+            body = "%.4f,%.4f,%.4f," % (i * 1234.5678, 0.0001, 99999.9999) + "".join([repr(v) + "," for v in values[i].tolist()])
+            f.write(format_datapoint(START_TIME + i * CAPTURE_INTERVAL, body, i % 2, 32767 - i, 1 + i % 32767, 1 - i % 2, i % 3 - 1) + "\r\n")
+
+LOGS = {"generated": generate_log, "daylight": generate_daylight_log, "extreme": write_extreme_log}
+
+# the columns of a log parsed field by field with plain Python, the way the device wrote them
+def read_text(filename):
+    with open(filename, 'r') as f:
+        fields = [line.rstrip("\r\n").split(",") for line in f if is_datapoint(line.rstrip("\r\n"))]
+
+    columns = {"timestamp": [calendar.timegm(tuple([int(part) for part in reversed(row[0].split("/"))]) +
+                                             tuple([int(part) for part in row[1].split(":")])) for row in fields]}
+    for i, column in enumerate(list(COLUMN_TYPES)[1:]):
+        columns[column] = [float(row[2 + i]) for row in fields]
+    columns = {column: np.array(values, dtype=COLUMN_TYPES[column]) for column, values in columns.items()}
+    columns["spectra"] = np.array([[float(value) for value in row[10:-1]] for row in fields]).astype(np.float32)
+    return columns
+
+@pytest.fixture(params=list(LOGS))
+def log(request, tmp_path):
+    filename = str(tmp_path / "LOG.CSV")
+    LOGS[request.param](filename, TEST_ROWS)
+    return filename
+
+# the two datasets of log -> dataset -> CSV -> dataset
+@pytest.fixture
+def round_trip(log, tmp_path):
+    first, second = str(tmp_path / "LOG.ossd"), str(tmp_path / "AGAIN.ossd")
+    csv_to_dataset(log, first)
+    dataset_to_csv(first, str(tmp_path / "AGAIN.CSV"))
+    csv_to_dataset(str(tmp_path / "AGAIN.CSV"), second)
+    return open_dataset(first), open_dataset(second)
+
+def test_round_trip_gives_equal_arrays(round_trip):
+    first, second = round_trip
+    assert len(first["timestamp"]) == TEST_ROWS
+    for column in list(COLUMN_TYPES) + ["spectra", "wavelengths"]:
+        assert first[column].dtype == second[column].dtype, column
+        assert np.array_equal(first[column], second[column]), column
+    assert np.array_equal(np.signbit(first["spectra"]), np.signbit(second["spectra"]))
+
+def test_spectra_are_the_float32_of_the_text(log, round_trip):
+    expected = read_text(log)["spectra"]
+    for data in round_trip:
+        assert np.array_equal(data["spectra"].view(np.uint32), expected.view(np.uint32))
+
+def test_time_and_metadata_are_exact(log, round_trip):
+    expected = read_text(log)
+    for data in round_trip:
+        for column in COLUMN_TYPES:
+            assert np.array_equal(data[column], expected[column]), column
+
+def test_csv_written_back_is_stable(round_trip, tmp_path):
+    dataset_to_csv(str(tmp_path / "AGAIN.ossd"), str(tmp_path / "THIRD.CSV"))
+    with open(str(tmp_path / "AGAIN.CSV"), 'rb') as f, open(str(tmp_path / "THIRD.CSV"), 'rb') as g:
+        assert f.read() == g.read()
@@ -0,0 +1,29 @@
+'''
+Probing simulated devices with hello, alone and mixed with ports that never answer, like a first discovery scan.
+'''
+
+import os
+import asyncio
+import pytest
+
+from device import hello_all
+from discovery import PROBE_TIMEOUT
+from simulator import SimulatedDevice, serve_socket
+from conftest import TEST_LOOP_DELAY
+
+@pytest.fixture
+def port_names():
+    return [serve_socket(SimulatedDevice("NSP_" + str(i), loop_delay=TEST_LOOP_DELAY)) for i in range(4)]
+
+def test_hello_finds_every_device(port_names):
+    statuses = asyncio.run(hello_all(port_names, PROBE_TIMEOUT))
+    assert sorted([status["device_name"] for status in statuses]) == ["NSP_0", "NSP_1", "NSP_2", "NSP_3"]
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="silent ports are pseudo terminals")
+def test_hello_finds_every_device_among_silent_ports(port_names):
+    silent_ports = [os.openpty() for _ in range(4)]
+    try:
+        statuses = asyncio.run(hello_all(port_names + [os.ttyname(slave) for master, slave in silent_ports], PROBE_TIMEOUT))
+    finally:
+        for fd in [fd for pair in silent_ports for fd in pair]: os.close(fd)
+    assert sorted([status["port_name"] for status in statuses]) == sorted(port_names)
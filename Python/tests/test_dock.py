@@ -0,0 +1,26 @@
+'''
+dock.py itself: its startup, which must stay within the budget of bench.py and must not import heavy modules.
+'''
+
+import os
+import sys
+import subprocess
+import statistics
+
+from bench import STARTUP_BUDGET, STARTUP_RUNS, timed
+
+# CONSTANTS
+LAZY_MODULES = ["matplotlib", "numpy"]      # heavy modules dock.py must only import when a command needs them
+
+def test_dock_does_not_import_heavy_modules_on_startup():
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.run([sys.executable, "-c", "import sys, dock; print(' '.join([m for m in " + repr(LAZY_MODULES) + " if m in sys.modules]))"],
+                            cwd=directory, capture_output=True, text=True, check=True).stdout.split()
+    assert not loaded, "dock.py imports " + ", ".join(loaded) + " on startup"
+
+# the median of a few starts, so one slow start on a busy computer does not fail the test
+def test_dock_starts_within_budget():
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    run = lambda: subprocess.run([sys.executable, "dock.py", "--help"], cwd=directory, capture_output=True, check=True)
+    startup = statistics.median([timed(run)[1] for _ in range(STARTUP_RUNS)])
+    assert startup <= STARTUP_BUDGET, "dock.py takes " + str(round(startup, 3)) + " s to start, over the " + str(STARTUP_BUDGET) + " s budget"
@@ -0,0 +1,81 @@
+'''
+Encoded exports through dock.py from simulated devices: CSV by default, F4 and Q2 decoded within their tolerance, and
+from firmware that only exports CSV. And the records of a log with text lines between its datapoints, decoded.
+'''
+
+import os
+import numpy as np
+import pytest
+
+import dock
+from logfile import COLUMN_TYPES, parse_log
+from dataset import DATASET_EXT, open_dataset
+from encoding import Q2_TOLERANCE, encode_line, decode_records
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def export(connection):
+    filename, bytes_read, elapsed, complete, message = dock.export_datapoints(connection, "EXPORT", False)
+    assert complete, message
+    return filename
+
+# CSV is the default, so the saved log stays a copy of the device log even when the firmware has other encodings
+def test_export_sends_csv_by_default(simulated):
+    device, connection = simulated(rows=300)
+    filename, bytes_read, elapsed, complete, message = dock.export_datapoints(connection, "EXPORT", False)
+    assert complete and "sent as" not in message
+    assert read_bytes(filename) == read_bytes(device.log_path)
+
+# the exported log and its dataset against the device log: metadata exact, F4 spectra exact, Q2 spectra within
+# Q2_TOLERANCE of the largest absolute value of each spectrum
+@pytest.mark.parametrize("encoding, tolerance", [("F4", 0), ("Q2", Q2_TOLERANCE)])
+def test_encoded_export_decodes_within_tolerance(simulated, monkeypatch, encoding, tolerance):
+    monkeypatch.setattr(dock, "FRAMED_EXPORT", True)
+    monkeypatch.setattr(dock, "EXPORT_ENCODINGS", [encoding])
+    device, connection = simulated(rows=300)
+    filename = export(connection)
+    original = parse_log(device.log_path)
+    peaks = np.abs(original["spectra"].astype(np.float64)).max(axis=1)[:, None]
+
+    for exported in [parse_log(filename), open_dataset(os.path.splitext(filename)[0] + DATASET_EXT)]:
+        assert len(exported["timestamp"]) == len(original["timestamp"])
+        for column in COLUMN_TYPES:
+            assert np.allclose(exported[column], original[column], rtol=0, atol=1e-9), column
+        assert (np.abs(exported["spectra"].astype(np.float64) - original["spectra"]) / peaks).max() <= tolerance
+
+def test_export_falls_back_to_csv_on_firmware_without_encodings(simulated, monkeypatch):
+    monkeypatch.setattr(dock, "FRAMED_EXPORT", True)
+    monkeypatch.setattr(dock, "EXPORT_ENCODINGS", ["F4", "CSV"])
+    device, connection = simulated(rows=300, encoded=False)
+    assert read_bytes(export(connection)) == read_bytes(device.log_path)
+
+# the lines of a log with an error line after its first and between two of its datapoints, encoded
+@pytest.fixture
+def records(log_file):
+    with open(log_file, 'rb') as f:
+        lines = f.read().split(b"\r\n")[:-1]
+    return lines[:2] + [b"DATA LOGGING ERROR"] + lines[2:100] + [b"DATA LOGGING ERROR"] + lines[100:]
+
+@pytest.mark.parametrize("encoding", ["F4", "Q2"])
+def test_decode_records_finds_text_between_datapoints(log_file, records, encoding):
+    columns, lines = decode_records(b"".join([encode_line(line, encoding) for line in records]), encoding)
+    original = parse_log(log_file)
+
+    assert lines == [(0, records[0]), (1, records[2]), (99, records[101])]
+    for column in COLUMN_TYPES:
+        assert np.allclose(columns[column], original[column], rtol=0, atol=1e-9), column
+
+    # records starting with a datapoint and ending with a text record
+    part, lines = decode_records(b"".join([encode_line(line, encoding) for line in records[3:102]]), encoding)
+    assert lines == [(98, records[101])]
+    assert np.array_equal(part["spectra"], columns["spectra"][1:99])
+
+@pytest.mark.parametrize("encoding", ["F4", "Q2"])
+def test_decode_records_rejects_a_cut_off_record(records, encoding):
+    encoded = b"".join([encode_line(line, encoding) for line in records[3:10]])
+    with pytest.raises(ValueError):
+        decode_records(encoded[:-1], encoding)
+    with pytest.raises(ValueError):
+        decode_records(encoded + encode_line(records[2], encoding)[:-1], encoding)
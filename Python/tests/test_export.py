@@ -0,0 +1,40 @@
+'''
+Exports through dock.py from simulated devices: plain and framed, damaged on the way, and from older firmware.
+'''
+
+import pytest
+
+import dock
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def export(connection):
+    filename, bytes_read, elapsed, complete, message = dock.export_datapoints(connection, "EXPORT", False)
+    assert complete, message
+    return filename
+
+@pytest.mark.parametrize("framed", [False, True])
+def test_export_is_a_copy_of_the_device_log(simulated, monkeypatch, framed):
+    monkeypatch.setattr(dock, "FRAMED_EXPORT", framed)
+    device, connection = simulated(rows=300)
+    assert read_bytes(export(connection)) == read_bytes(device.log_path)
+
+def test_framed_export_recovers_from_damaged_transfer(simulated, monkeypatch):
+    monkeypatch.setattr(dock, "FRAMED_EXPORT", True)
+    device, connection = simulated(rows=1000, corrupt_rate=1e-5, drop_rate=1e-5, stall_after=500000)
+    assert read_bytes(export(connection)) == read_bytes(device.log_path)
+
+def test_export_falls_back_to_a_plain_stream_on_older_firmware(simulated, monkeypatch):
+    monkeypatch.setattr(dock, "FRAMED_EXPORT", True)
+    device, connection = simulated(rows=300, framed=False)
+    assert read_bytes(export(connection)) == read_bytes(device.log_path)
+
+# checking for framed exports before an export must not leave a transfer behind for the export to read
+@pytest.mark.parametrize("framed", [False, True])
+def test_framed_export_check_starts_no_transfer(simulated, framed):
+    device, connection = simulated(rows=300, framed=framed)
+    assert dock.supports_framed_export(connection) == framed
+    assert connection.device.transfer is None
+    assert connection.request("_SAY_HELLO") is not None
@@ -0,0 +1,91 @@
+'''
+The fleet daemon looking after simulated devices through a recording window: one with firmware without timed start and
+stop, and one that does not answer until the window starts, like a device plugged in late.
+'''
+
+import os
+import time
+import datetime
+import threading
+import pytest
+
+import dock
+import fleet
+from simulator import SimulatedDevice, serve_socket
+
+# CONSTANTS
+FLEET_DEVICES = 6                           # simulated devices the daemon looks after
+FLEET_ROWS = 200                            # datapoints already in the log of each simulated device
+FLEET_WINDOW = (4, 10)                      # seconds from now the recording window starts and stops
+FLEET_INTERVAL = 250                        # ms between captures of the simulated devices
+
+# run the daemon through a recording window. Returns the devices, their ports, the messages logged, whether each
+# device was recording before, during and after the window, and the sync file of each device
+@pytest.fixture(scope="module")
+def fleet_run(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("fleet"))
+    messages = []
+    def log(state, message):
+        messages.append((state["port_name"], message))
+
+    simulated = []
+    for i in range(FLEET_DEVICES):
+        os.makedirs(os.path.join(directory, str(i)))
+        simulated.append(SimulatedDevice("NSP_FLEET" + str(i), FLEET_ROWS, os.path.join(directory, str(i)), seed=i,
+                                         scheduled=(i != 0), unresponsive=(i == 1)))
+        simulated[-1].logging_interval = FLEET_INTERVAL
+    ports = [serve_socket(device) for device in simulated]
+
+    start = datetime.datetime.now().replace(microsecond=0)
+    clocks = [(start + datetime.timedelta(seconds=seconds)).strftime("%H:%M:%S") for seconds in FLEET_WINDOW]
+    config = {"sync_interval": 1, "clock_interval": 60, "workers": 8, "timeout": 1, "windows": [clocks]}
+    stop = threading.Event()
+    recording = {}
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(dock, "SAVE_DIR", os.path.join(directory, "data") + "/")
+        monkeypatch.setattr(fleet, "BACKOFF_BASE", 0.5)
+        daemon = threading.Thread(target=fleet.run, args=(config, ports, stop, log, 0.1))
+        daemon.start()
+        try:
+            time.sleep(FLEET_WINDOW[0] - 1)
+            recording["before"] = [device.recording for device in simulated]
+            simulated[1].unresponsive = False
+            time.sleep(1 + fleet.EDGE_GRACE + 1)
+            recording["during"] = [device.recording for device in simulated]
+            time.sleep(FLEET_WINDOW[1] - FLEET_WINDOW[0] + 1)
+            recording["after"] = [device.recording for device in simulated]
+        finally:
+            stop.set()
+            daemon.join()
+        sync_files = [dock.get_sync_filename(device.name) for device in simulated]
+
+    return simulated, ports, messages, recording, sync_files
+
+def test_devices_record_only_during_their_window(fleet_run):
+    recording = fleet_run[3]
+    assert not any(recording["before"])
+    assert all(recording["during"])
+    assert not any(recording["after"])
+
+def test_devices_have_their_clock_set(fleet_run):
+    assert all([device.clock is not None for device in fleet_run[0]])
+
+def test_devices_are_synced_in_full(fleet_run):
+    simulated, ports, messages, recording, sync_files = fleet_run
+    for device, sync_file in zip(simulated, sync_files):
+        assert device.data_counter > FLEET_ROWS, device.name + " did not record"
+        with open(sync_file, 'rb') as f, open(device.log_path, 'rb') as g:
+            assert f.read() == g.read(), device.name + " was not synced in full"
+
+def test_unresponsive_device_is_backed_off(fleet_run):
+    simulated, ports, messages, recording, sync_files = fleet_run
+    assert any([port == ports[1] and message.startswith("visit failed") for port, message in messages])
+
+def test_older_firmware_is_started_and_stopped(fleet_run):
+    simulated, ports, messages, recording, sync_files = fleet_run
+    assert any([port == ports[0] and message == "recording started" for port, message in messages])
+
+def test_timed_start_and_stop_are_used_when_supported(fleet_run):
+    simulated, ports, messages, recording, sync_files = fleet_run
+    assert not any([port not in ports[:2] and message.startswith("recording") for port, message in messages])
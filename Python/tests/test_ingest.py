@@ -0,0 +1,74 @@
+'''
+Ingesting a directory of generated microSD cards into datasets.
+'''
+
+import os
+import numpy as np
+import pytest
+
+from logfile import COLUMN_TYPES, parse_log
+from dataset import open_dataset
+from ingest import ingest, find_logs
+from simulator import START_TIME, generate_log
+
+# CONSTANTS
+INGEST_ROWS = 400                           # rows in the log of the largest generated card
+INGEST_CARDS = 3                            # generated microSD cards, each with half the rows of the one before
+
+def same_datapoints(a, b):
+    return all([np.array_equal(a[column], b[column]) for column in list(COLUMN_TYPES) + ["spectra"]])
+
+# the cards, named after their devices, the first with a lower case log name. Returns (source, logs, dataset names)
+@pytest.fixture
+def cards(tmp_path):
+    source = str(tmp_path / "cards")
+    logs = []
+    for card in range(INGEST_CARDS):
+        os.makedirs(os.path.join(source, "NSP_" + chr(ord("A") + card)))
+        logs.append(os.path.join(source, "NSP_" + chr(ord("A") + card), "LOG2.CSV" if card else "log.csv"))
+        generate_log(logs[-1], INGEST_ROWS >> card, seed=card)
+    names = ["cards_NSP_" + chr(ord("A") + card) + ("_LOG2" if card else "_log") + ".ossd" for card in range(INGEST_CARDS)]
+    return source, logs, names
+
+def test_every_card_is_ingested_into_its_dataset(cards, tmp_path):
+    source, logs, names = cards
+    status = {}
+    ingest([source], str(tmp_path / "datasets"), status, 1)
+
+    assert status["files"] == INGEST_CARDS and status["bytes"] == sum([os.path.getsize(log) for log in logs])
+    for log, name in zip(logs, names):
+        assert same_datapoints(parse_log(log), open_dataset(str(tmp_path / "datasets" / name))), name + " does not match its log"
+
+def test_only_changed_cards_are_ingested_again(cards, tmp_path):
+    source, logs, names = cards
+    status = {}
+    ingest([source], str(tmp_path / "datasets"), status, 1)
+
+    generate_log(str(tmp_path / "more.CSV"), INGEST_ROWS >> 4, seed=INGEST_CARDS, start_time=START_TIME + 10 ** 8)
+    with open(str(tmp_path / "more.CSV"), 'rb') as more, open(logs[1], 'ab') as f:
+        f.write(more.read().split(b"\n", 1)[1])
+    ingest([source], str(tmp_path / "datasets"), status, 1)
+
+    assert status["files"] == 1 and status["skipped"] == INGEST_CARDS - 1
+    assert same_datapoints(parse_log(logs[1]), open_dataset(str(tmp_path / "datasets" / names[1])))
+
+# parts of a few datapoints, so every log is parsed in several parts
+def test_worker_processes_give_the_same_datasets(cards, tmp_path):
+    source, logs, names = cards
+    ingest([source], str(tmp_path / "datasets"), workers=1)
+    ingest([source], str(tmp_path / "parallel"), workers=2, part_bytes=20000)
+
+    for name in names:
+        assert same_datapoints(open_dataset(str(tmp_path / "datasets" / name)), open_dataset(str(tmp_path / "parallel" / name)))
+
+def test_missing_source_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        find_logs(str(tmp_path / "unmounted"))
+
+def test_sources_with_the_same_names_raise(cards, tmp_path):
+    source, logs, names = cards
+    other = tmp_path / "other" / "cards" / "NSP_A"
+    os.makedirs(str(other))
+    generate_log(str(other / "log.csv"), 10)
+    with pytest.raises(ValueError):
+        ingest([source, str(tmp_path / "other" / "cards")], str(tmp_path / "datasets"), workers=1)
@@ -0,0 +1,20 @@
+'''
+The bulk log parser against the per-line parser dock.py keeps for single datapoints.
+'''
+
+import numpy as np
+
+from logfile import WAVELENGTHS, is_datapoint, parse_timestamp, parse_log
+
+def test_parse_log_matches_get_formatted_datapoint(log_file):
+    from dock import get_formatted_datapoint
+
+    columns = parse_log(log_file)
+    with open(log_file, 'r') as f:
+        datapoints = [get_formatted_datapoint(line) for line in f if is_datapoint(line.rstrip("\r\n"))]
+
+    assert len(datapoints) == len(columns["timestamp"])
+    assert np.array_equal(np.array([y for x, y, *rest in datapoints], dtype=np.float32), columns["spectra"])
+    assert np.array_equal([parse_timestamp(*datapoint[2].split(" ")) for datapoint in datapoints], columns["timestamp"])
+    assert np.array_equal([int(datapoint[7]) for datapoint in datapoints], columns["quality"])
+    assert all([datapoint[0] == WAVELENGTHS for datapoint in datapoints])
@@ -0,0 +1,47 @@
+'''
+Merging overlapping exports, a sync file with segments out of order and another device taken at the same times.
+'''
+
+import numpy as np
+import pytest
+
+from logfile import parse_log
+from dataset import open_dataset
+from merge import merge, input_order
+from simulator import generate_log
+
+# CONSTANTS
+MERGE_ROWS = 600                            # rows in the largest generated log
+MERGE_TEST_BATCH_ROWS = 64                  # rows merged at a time, so the merge runs in many batches
+
+# the inputs: two exports of device A, the second holding the first, a sync file of A with its two halves swapped
+# and an export of device B. Returns their paths
+@pytest.fixture
+def inputs(tmp_path):
+    paths = [str(tmp_path / name) for name in ["A.CSV", "A0.CSV", "SYNC_A.CSV", "B.CSV"]]
+    generate_log(paths[0], MERGE_ROWS * 2 // 3)
+    generate_log(paths[1], MERGE_ROWS)
+    generate_log(paths[3], MERGE_ROWS // 3, seed=1)
+    with open(paths[1], 'rb') as f:
+        data = f.read()
+    header, middle = data.index(b"\n") + 1, data.index(b"\n", len(data) // 2) + 1
+    with open(paths[2], 'wb') as f:
+        f.write(data[:header] + data[middle:] + data[:middle])
+    for path in paths: input_order(path)
+    return paths
+
+def test_each_datapoint_is_written_once(inputs, tmp_path):
+    read, written = merge(inputs, str(tmp_path / "MERGED.ossd"), MERGE_TEST_BATCH_ROWS, 1)
+    assert read == MERGE_ROWS * 2 // 3 + MERGE_ROWS * 2 + MERGE_ROWS // 3
+    assert written == MERGE_ROWS + MERGE_ROWS // 3
+    assert len(open_dataset(str(tmp_path / "MERGED.ossd"))["timestamp"]) == written
+
+def test_merged_datapoints_are_in_time_order(inputs, tmp_path):
+    merge(inputs, str(tmp_path / "MERGED.ossd"), MERGE_TEST_BATCH_ROWS, 1)
+    assert (np.diff(open_dataset(str(tmp_path / "MERGED.ossd"))["timestamp"]) >= 0).all()
+
+def test_worker_processes_give_the_same_result(inputs, tmp_path):
+    merge(inputs, str(tmp_path / "MERGED.ossd"), MERGE_TEST_BATCH_ROWS, 1)
+    merge(inputs, str(tmp_path / "MERGED.CSV"), MERGE_TEST_BATCH_ROWS, 2)
+    merged, parallel = open_dataset(str(tmp_path / "MERGED.ossd")), parse_log(str(tmp_path / "MERGED.CSV"))
+    assert np.array_equal(parallel["timestamp"], merged["timestamp"]) and np.array_equal(parallel["spectra"], merged["spectra"])
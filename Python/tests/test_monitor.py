@@ -0,0 +1,90 @@
+'''
+The live monitor: its ring buffer, its captures from a simulated device and how it stops.
+'''
+
+import io
+import os
+import queue
+import numpy as np
+from threading import Event
+
+from logfile import file_header, is_datapoint, parse_log
+from device import DeviceError
+from monitor import MONITOR_MAX_ERRORS, RingBuffer, capture_loop, monitor
+
+# a device whose requests fail with a DeviceError the first failures times, then answer with a datapoint
+class FailingDevice:
+    def __init__(self, failures, line):
+        self.failures = failures
+        self.line = line
+        self.requests = 0
+
+    def request(self, command, argument = "", timeout = None):
+        self.requests += 1
+        if (self.requests <= self.failures): raise DeviceError("COM1 replied nothing")
+        return [self.line]
+
+def capture_all(serial_object, count = None):
+    lines = queue.Queue()
+    capture_loop(serial_object, lines, Event(), count)
+    items = []
+    while not lines.empty(): items.append(lines.get())
+    return items
+
+def test_ring_buffer_keeps_latest_rows_in_order(log_file):
+    data = parse_log(log_file)
+    buffer = RingBuffer(64)
+    for start in range(0, 300, 50):
+        buffer.append({column: values[start:start + 50] for column, values in data.items() if column != "wavelengths"})
+
+    assert len(buffer) == 64
+    assert np.array_equal(buffer.ordered("timestamp"), data["timestamp"][300 - 64:300])
+    assert np.array_equal(buffer.ordered("spectra"), data["spectra"][300 - 64:300])
+    assert np.array_equal(buffer.latest("spectra"), data["spectra"][299])
+
+    # a batch larger than the buffer keeps only its last rows, in the slots after the rows already kept
+    buffer.append({column: values[300:400] for column, values in data.items() if column != "wavelengths"})
+    assert len(buffer) == 64
+    assert np.array_equal(buffer.ordered("timestamp"), data["timestamp"][400 - 64:400])
+    assert np.array_equal(buffer.ordered("spectra"), data["spectra"][400 - 64:400])
+    assert np.array_equal(buffer.latest("timestamp"), data["timestamp"][399])
+
+def test_monitor_saves_every_capture(simulated):
+    device, connection = simulated()
+    f = io.StringIO()
+    f.write(file_header())
+    stats = monitor(connection, f, 100, 50, plot=False)
+
+    assert stats["captures"] == 50 and stats["error"] is None
+    lines = f.getvalue().splitlines()
+    assert len([line for line in lines if is_datapoint(line)]) == 50
+    assert len([line for line in lines if not is_datapoint(line)]) == len(file_header().splitlines())
+
+def test_monitor_does_not_log_on_the_device(simulated):
+    device, connection = simulated(rows=10)
+    size = os.path.getsize(device.log_path)
+    stats = monitor(connection, None, 100, 20, plot=False)
+
+    assert stats["captures"] == 20
+    assert os.path.getsize(device.log_path) == size and device.data_counter == 10
+
+def test_monitor_stops_on_firmware_that_logs_every_capture(simulated):
+    device, connection = simulated(rows=10, previewed=False)
+    size = os.path.getsize(device.log_path)
+    stats = monitor(connection, None, 100, 20, plot=False)
+
+    assert stats["captures"] == 0 and isinstance(stats["error"], DeviceError)
+    assert os.path.getsize(device.log_path) == size
+
+def test_capture_loop_stops_after_repeated_errors():
+    device = FailingDevice(10 ** 6, "")
+    items = capture_all(device)
+
+    assert device.requests == MONITOR_MAX_ERRORS
+    assert isinstance(items[0], DeviceError) and items[-1] is None
+
+def test_capture_loop_recovers_from_occasional_errors(log_file):
+    line = [line for line in open(log_file).read().splitlines() if is_datapoint(line)][0]
+    device = FailingDevice(MONITOR_MAX_ERRORS - 1, line)
+
+    assert capture_all(device, 3) == [line] * 3 + [None]
@@ -0,0 +1,66 @@
+'''
+Binning logs and datasets over time for plotting, against binning the whole parsed log at once, and rendering the plots.
+'''
+
+import numpy as np
+import pytest
+
+from logfile import parse_log
+from analytics import analyze
+from dataset import csv_to_dataset
+from plots import bin_inputs, plot_all
+
+# CONSTANTS
+TEST_TIME_BINS = 64                         # time bins, fewer than the datapoints so bins hold several
+
+# a generated log and its dataset. Returns (log, dataset path)
+@pytest.fixture
+def inputs(log_file, tmp_path):
+    csv_to_dataset(log_file, str(tmp_path / "LOG.ossd"))
+    return log_file, str(tmp_path / "LOG.ossd")
+
+def same_bins(a, b):
+    return np.array_equal(a["count"], b["count"]) and np.allclose(a["spectra"], b["spectra"], equal_nan=True)
+
+def test_bins_match_the_whole_log_binned_at_once(inputs):
+    binned = bin_inputs([inputs[0]], TEST_TIME_BINS, None, 1)
+    data = parse_log(inputs[0])
+    index = np.searchsorted(binned["edges"], data["timestamp"], 'right') - 1
+    count = np.bincount(index, minlength=len(binned["count"]))
+    sums = np.zeros(binned["spectra"].shape)
+    np.add.at(sums, index, data["spectra"].astype(np.float64))
+
+    assert np.array_equal(binned["count"], count)
+    assert np.allclose(binned["spectra"][count > 0], sums[count > 0] / count[count > 0, None])
+    for metric, values in analyze(data["spectra"], list(binned["metrics"])).items():
+        low, high = np.full(len(count), np.inf), np.full(len(count), -np.inf)
+        np.minimum.at(low, index[np.isfinite(values)], values[np.isfinite(values)])
+        np.maximum.at(high, index[np.isfinite(values)], values[np.isfinite(values)])
+        filled = np.isfinite(low)
+        assert np.allclose(binned["metrics"][metric]["min"][filled], low[filled]), metric
+        assert np.allclose(binned["metrics"][metric]["max"][filled], high[filled]), metric
+
+def test_dataset_is_binned_like_its_log(inputs):
+    assert same_bins(bin_inputs([inputs[1]], TEST_TIME_BINS, None, 1), bin_inputs([inputs[0]], TEST_TIME_BINS, None, 1))
+
+def test_worker_processes_give_the_same_bins(inputs):
+    assert same_bins(bin_inputs(list(inputs), TEST_TIME_BINS, None, 2), bin_inputs(list(inputs), TEST_TIME_BINS, None, 1))
+
+def test_no_datapoints_raise(tmp_path):
+    from logfile import file_header
+
+    with open(str(tmp_path / "EMPTY.CSV"), 'w') as f:
+        f.write(file_header())
+    with pytest.raises(ValueError):
+        bin_inputs([str(tmp_path / "EMPTY.CSV")], TEST_TIME_BINS, None, 1)
+
+@pytest.mark.parametrize("extension, magic", [(".png", b"\x89PNG\r"), (".svg", b"<?xml")])
+def test_every_plot_is_rendered(inputs, tmp_path, extension, magic):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    filenames = plot_all([inputs[1]], str(tmp_path / "plots" / "LOG"), extension, TEST_TIME_BINS)
+    assert filenames
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            assert f.read(5) == magic, filename
@@ -0,0 +1,91 @@
+'''
+Quality flags of a generated daylight log with every kind of problem added at known rows, and of the datasets
+saved by exports and ingest.
+'''
+
+import os
+import numpy as np
+import pytest
+
+import quality
+from quality import FLAGS_COLUMN, new_state, flag_columns, flag_batches, flag_names
+from logfile import parse_log
+from dataset import create_dataset, append_rows, dataset_to_csv, open_dataset
+from stream import take
+from simulator import generate_daylight_log
+
+# CONSTANTS
+QUALITY_ROWS = 3000                         # rows in the generated daylight log
+QUALITY_BATCHES = 50                        # random batches the log is cut into, to check flags carry over between batches
+
+# the columns of a daylight log with problems at known rows, spikes only where the device found the light good.
+# Returns (columns, the flags expected)
+@pytest.fixture(scope="module")
+def problems(tmp_path_factory):
+    log = str(tmp_path_factory.mktemp("quality") / "LOG.CSV")
+    generate_daylight_log(log, QUALITY_ROWS)
+    columns = parse_log(log)
+
+    rng = np.random.default_rng(0)
+    picked = rng.choice(np.arange(10, QUALITY_ROWS - 10, 3), 70, replace=False).reshape(7, 10)
+    expected = np.zeros(QUALITY_ROWS, dtype=np.uint16)
+    expected[columns["quality"] < 0] |= quality.FLAG_DARK
+    expected[columns["quality"] > 0] |= quality.FLAG_SATURATED
+    columns["int_time"][picked[0][:5]] = quality.QUALITY_MIN_INT_TIME
+    columns["int_time"][picked[0][5:]] = quality.QUALITY_MAX_INT_TIME
+    expected[picked[0]] |= quality.FLAG_EXPOSURE
+    columns["spectra"][picked[1]] = 0
+    expected[picked[1]] |= quality.FLAG_DROPOUT
+    columns["spectra"][picked[2], 60] *= 1 + 4 * quality.QUALITY_SPIKE_THRESHOLD / columns["spectra"][picked[2], 60] * columns["spectra"][picked[2]].max(axis=1)
+    expected[picked[2]] |= quality.FLAG_SPIKE
+    for row in np.sort(picked[3]):
+        columns["timestamp"][row:] += 3600
+    expected[picked[3]] |= quality.FLAG_GAP
+    columns["timestamp"][picked[4]] = columns["timestamp"][picked[4] - 1]
+    expected[picked[4]] |= quality.FLAG_DUPLICATE
+    for row in np.sort(picked[5]):
+        columns["timestamp"][row:] -= 7200
+    expected[picked[5]] |= quality.FLAG_BACKWARDS
+    return columns, expected
+
+def test_problems_are_flagged_at_their_rows(problems):
+    columns, expected = problems
+    flags = flag_columns(columns, new_state())
+    wrong = {int(row): (flag_names(flags[row]), flag_names(expected[row])) for row in np.flatnonzero(flags != expected)}
+    assert not wrong, "rows flagged (as, instead of): " + str(wrong)
+
+def test_flags_are_the_same_when_the_log_is_cut_into_batches(problems):
+    columns, expected = problems
+    cuts = np.sort(np.random.default_rng(1).choice(np.arange(1, QUALITY_ROWS), QUALITY_BATCHES - 1, replace=False))
+    parts = [take(columns, slice(start, end)) for start, end in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [QUALITY_ROWS])))]
+    assert np.array_equal(np.concatenate([batch[FLAGS_COLUMN] for batch in flag_batches(parts)]), expected)
+
+def test_spectrum_that_is_not_a_number_is_a_dropout(problems):
+    columns, expected = problems
+    nan = dict(take(columns, slice(0, 100)), spectra=columns["spectra"][:100].copy())
+    nan["spectra"][50, 7] = np.nan
+    assert flag_columns(nan, new_state())[50] & quality.FLAG_DROPOUT
+
+def test_ingest_saves_the_flags(problems, tmp_path):
+    from ingest import ingest
+
+    columns, expected = problems
+    os.makedirs(str(tmp_path / "cards"))
+    create_dataset(str(tmp_path / "LOG.ossd"))
+    append_rows(str(tmp_path / "LOG.ossd"), columns)
+    dataset_to_csv(str(tmp_path / "LOG.ossd"), str(tmp_path / "cards" / "LOG.CSV"))
+    ingest([str(tmp_path / "cards")], str(tmp_path / "datasets"), workers=1)
+    assert np.array_equal(open_dataset(str(tmp_path / "datasets" / "cards_LOG.ossd"))[FLAGS_COLUMN], expected)
+
+def test_export_saves_dataset_with_quality_flags(simulated):
+    import dock
+    from logfile import COLUMN_TYPES
+    from dataset import DATASET_EXT
+
+    device, connection = simulated(rows=300)
+    filename, bytes_read, elapsed, complete, message = dock.export_datapoints(connection, "EXPORT", False)
+    assert complete, message
+    data = open_dataset(os.path.splitext(filename)[0] + DATASET_EXT)
+    expected = parse_log(filename)
+    assert all([np.array_equal(data[column], expected[column]) for column in list(COLUMN_TYPES) + ["spectra"]])
+    assert np.array_equal(data[FLAGS_COLUMN], flag_columns(expected, new_state()))
@@ -0,0 +1,78 @@
+'''
+Rollups kept up to date sync by sync or export by export, against a full recompute, and merged rollup stores.
+'''
+
+import numpy as np
+import pytest
+
+from logfile import parse_log
+from rollup import INTERVALS, combine, rollup_columns, update_rollup, read_rollup, merge_rollups
+from simulator import START_TIME, CAPTURE_INTERVAL, generate_log
+
+# CONSTANTS
+ROLLUP_ROWS = 3000                          # rows in the first segment of the sync file, two days at one per minute
+ROLLUP_SYNCS = 12                           # how many syncs the sync file is appended in, cut anywhere
+
+# check every interval of a rollup store against a full recompute of columns
+def check(path, columns):
+    for interval, seconds in INTERVALS.items():
+        incremental = read_rollup(path, interval)
+        full = combine(rollup_columns(columns, seconds))
+        assert np.array_equal(incremental["timestamp"], full["timestamp"]), interval
+        assert np.array_equal(incremental["count"], full["count"]), interval
+
+        # matrix products round differently depending on how many rows they are given, by about 1e-16
+        assert np.allclose(incremental["illuminance_min"], full["illuminance_min"], rtol=1e-12), interval
+        assert np.allclose(incremental["illuminance_max"], full["illuminance_max"], rtol=1e-12), interval
+        assert np.allclose(incremental["illuminance_mean"], full["illuminance_sum"] / full["count"], rtol=1e-9), interval
+        assert np.allclose(incremental["spectra"], full["spectra_sum"] / full["count"][:, None], rtol=1e-6), interval
+
+# a log, and a second segment that goes back in time. Returns their bytes
+@pytest.fixture
+def segments(tmp_path):
+    filename = str(tmp_path / "LOG.CSV")
+    generate_log(filename, ROLLUP_ROWS)
+    with open(filename, 'rb') as f:
+        log = f.read()
+    generate_log(filename, ROLLUP_ROWS // 10, seed=1, start_time=START_TIME + ROLLUP_ROWS * CAPTURE_INTERVAL // 2 + 1234)
+    with open(filename, 'rb') as f:
+        return log, f.read()
+
+# the sync file appended in pieces cut anywhere, then the new segment. Returns (sync file, rollup store)
+def sync_in_pieces(directory, log, segment):
+    sync_filename, store = str(directory / "SYNC.CSV"), str(directory / "SYNC.rollup")
+    data = log + segment
+    start = 0
+    for cut in sorted(np.random.default_rng(0).integers(1, len(log), ROLLUP_SYNCS - 2).tolist()) + [len(log), len(data)]:
+        with open(sync_filename, 'ab') as f:
+            f.write(data[start:cut])
+        update_rollup(store, sync_filename)
+        start = cut
+    return sync_filename, store
+
+def test_sync_rollup_matches_a_full_recompute(segments, tmp_path):
+    sync_filename, store = sync_in_pieces(tmp_path, *segments)
+    check(store, parse_log(sync_filename))
+
+# exports of a device that was not erased, each holding the one before
+def export_in_pieces(directory, log):
+    store = str(directory / "EXPORTS.rollup")
+    for i, end in enumerate([len(log) // 3, len(log) // 2, len(log) - 1]):
+        export_filename = str(directory / ("LOG" + str(i) + ".CSV"))
+        with open(export_filename, 'wb') as f:
+            f.write(log[:log.index(b"\n", end) + 1])
+        update_rollup(store, export_filename)
+    return export_filename, store
+
+def test_export_rollup_matches_a_full_recompute(segments, tmp_path):
+    export_filename, store = export_in_pieces(tmp_path, segments[0])
+    check(store, parse_log(export_filename))
+
+def test_merged_rollups_match_a_full_recompute(segments, tmp_path):
+    sync_filename, sync_store = sync_in_pieces(tmp_path, *segments)
+    export_filename, export_store = export_in_pieces(tmp_path, segments[0])
+    merge_rollups([sync_store, export_store], str(tmp_path / "MERGED.rollup"))
+
+    synced, exported = parse_log(sync_filename), parse_log(export_filename)
+    check(str(tmp_path / "MERGED.rollup"), {column: values if column == "wavelengths" else np.concatenate([values, exported[column]])
+                                            for column, values in synced.items()})
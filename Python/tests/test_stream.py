@@ -0,0 +1,127 @@
+'''
+The stages of the streaming pipeline against a direct NumPy recompute on the whole parsed log: records, quality
+selection and time buckets, with batches cut anywhere in the log and with no datapoints at all.
+'''
+
+import numpy as np
+import pytest
+
+from logfile import COLUMN_TYPES, empty_columns, file_header, parse_log
+from simulator import CAPTURE_INTERVAL, START_TIME, generate_log
+from stream import parse_batches, iter_records, select_quality, aggregate
+from conftest import TEST_ROWS
+
+# CONSTANTS
+CHUNK_BYTES = 10000                         # bytes of each chunk fed to the pipeline, lines are cut across chunks
+BATCH_BYTES = 50000                         # bytes of each parsed batch, about 17 datapoints
+BUCKET_INTERVAL = 7 * CAPTURE_INTERVAL      # seconds of each time bucket, so the first and last buckets are partial
+
+# the chunks of a file, as a transfer would deliver them
+def read_chunks(filename, size = CHUNK_BYTES):
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk: break
+            yield chunk
+
+def batches(filename):
+    return parse_batches(read_chunks(filename), BATCH_BYTES)
+
+# the time buckets of the datapoints of data in log order, a bucket that appears again after a clock change counted
+# again. Returns the bucket starts, counts and sums of the spectra and x, y, z
+def bucket_sums(data, interval):
+    buckets = data["timestamp"] // interval * interval
+    runs = np.cumsum(np.concatenate(([0], buckets[1:] != buckets[:-1])))
+    sums = {"timestamp": buckets[np.concatenate(([True], buckets[1:] != buckets[:-1]))], "count": np.bincount(runs)}
+    for column in ["spectra", "x", "y", "z"]:
+        values = data[column].astype(np.float64)
+        sums[column] = np.zeros((len(sums["count"]),) + values.shape[1:])
+        np.add.at(sums[column], runs, values)
+    return sums
+
+def concatenate(items):
+    items = list(items)
+    return {column: np.concatenate([item[column] for item in items]) for column in items[0] if column != "wavelengths"}
+
+@pytest.fixture
+def empty_log(tmp_path):
+    filename = str(tmp_path / "EMPTY.CSV")
+    with open(filename, 'w', newline='') as f:
+        f.write(file_header().replace("\n", "\r\n") + "POWER LOSS DETECTED\r\n")
+    return filename
+
+# a log whose clock was set back by a few buckets halfway, so buckets appear again
+@pytest.fixture
+def clock_change_log(tmp_path):
+    filename, later = str(tmp_path / "LOG.CSV"), str(tmp_path / "LATER.CSV")
+    generate_log(filename, TEST_ROWS // 2)
+    generate_log(later, TEST_ROWS // 2, seed=1, start_time=START_TIME + (TEST_ROWS // 2 - 30) * CAPTURE_INTERVAL)
+    with open(later, 'rb') as f, open(filename, 'ab') as g:
+        g.write(f.read().split(b"\n", 1)[1])
+    return filename
+
+def test_iter_records_yields_every_row(log_file):
+    data = parse_log(log_file)
+    records = list(iter_records(batches(log_file)))
+
+    assert len(records) == len(data["timestamp"]) == TEST_ROWS
+    for i, record in enumerate(records):
+        assert set(record) == set(COLUMN_TYPES) | {"spectrum"}
+        assert all([record[column] == data[column][i] for column in COLUMN_TYPES])
+        assert np.array_equal(record["spectrum"], data["spectra"][i])
+
+@pytest.mark.parametrize("quality", [-1, 0, 1])
+def test_select_quality_keeps_only_rows_of_that_quality(log_file, quality):
+    data = parse_log(log_file)
+    mask = data["quality"] == quality
+    selected = concatenate(select_quality(batches(log_file), quality))
+
+    assert 0 < mask.sum() < TEST_ROWS
+    for column in list(COLUMN_TYPES) + ["spectra"]:
+        assert np.array_equal(selected[column], data[column][mask]), column
+
+def test_select_quality_skips_batches_without_matches(log_file):
+    assert list(select_quality(batches(log_file), 5)) == []
+
+@pytest.mark.parametrize("log", ["log_file", "clock_change_log"])
+def test_aggregate_matches_a_direct_recompute(request, log):
+    filename = request.getfixturevalue(log)
+    data = parse_log(filename)
+    expected = bucket_sums(data, BUCKET_INTERVAL)
+    buckets = concatenate(aggregate(batches(filename), BUCKET_INTERVAL))
+
+    assert np.array_equal(buckets["timestamp"], expected["timestamp"])
+    assert np.array_equal(buckets["count"], expected["count"])
+    assert buckets["spectra"].dtype == data["spectra"].dtype
+    assert np.allclose(buckets["spectra"], expected["spectra"] / expected["count"][:, None], rtol=1e-6)
+    for column in ["x", "y", "z"]:
+        assert np.allclose(buckets[column], expected[column] / expected["count"], rtol=1e-12), column
+
+def test_aggregate_yields_partial_windows(log_file):
+    buckets = concatenate(aggregate(batches(log_file), BUCKET_INTERVAL))
+    full = BUCKET_INTERVAL // CAPTURE_INTERVAL
+
+    assert buckets["count"].sum() == TEST_ROWS
+    assert (buckets["count"][1:-1] == full).all()
+    assert 0 < buckets["count"][0] < full and 0 < buckets["count"][-1] < full
+
+def test_aggregate_repeats_buckets_after_a_clock_change(clock_change_log):
+    timestamps = concatenate(aggregate(batches(clock_change_log), BUCKET_INTERVAL))["timestamp"]
+    assert len(timestamps) > len(np.unique(timestamps))
+
+def test_stages_yield_nothing_without_datapoints(empty_log):
+    assert list(batches(empty_log)) == []
+    assert list(iter_records(batches(empty_log))) == []
+    assert list(select_quality(batches(empty_log))) == []
+    assert list(aggregate(batches(empty_log), BUCKET_INTERVAL)) == []
+    assert list(aggregate([], BUCKET_INTERVAL)) == []
+
+# a batch with no rows, as a filter stage may leave
+def test_stages_skip_empty_batches(log_file):
+    data = parse_log(log_file)
+    with_empty = lambda: [empty_columns()] + list(batches(log_file)) + [empty_columns()]
+
+    assert len(list(iter_records(with_empty()))) == TEST_ROWS
+    assert all([len(batch["timestamp"]) > 0 for batch in select_quality(with_empty())])
+    assert np.array_equal(concatenate(aggregate(with_empty(), BUCKET_INTERVAL))["count"], bucket_sums(data, BUCKET_INTERVAL)["count"])
+    assert list(select_quality([empty_columns()])) == [] and list(aggregate([empty_columns()], BUCKET_INTERVAL)) == []
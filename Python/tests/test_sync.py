@@ -0,0 +1,65 @@
+'''
+Syncs through dock.py from simulated devices: new datapoints, interrupted syncs and device logs replaced since the last sync.
+'''
+
+import pytest
+
+import dock
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def sync(connection, name = "A"):
+    filename, bytes_synced, elapsed, complete, message = dock.sync_datapoints(connection, name, False)
+    assert complete, message
+    return filename, message
+
+def test_sync_appends_only_new_datapoints(simulated):
+    device, connection = simulated(rows=200)
+    filename, _ = sync(connection)
+    assert read_bytes(filename) == read_bytes(device.log_path)
+
+    size = len(read_bytes(filename))
+    for _ in range(3): device.capture()
+    _, bytes_synced, _, complete, _ = dock.sync_datapoints(connection, "A", False)
+    assert complete and bytes_synced == len(read_bytes(device.log_path)) - size
+    assert read_bytes(filename) == read_bytes(device.log_path)
+
+def test_interrupted_sync_resumes(simulated):
+    device, connection = simulated(rows=200)
+    device.stall_after = 100000
+    assert not dock.sync_datapoints(connection, "A", False)[3]
+
+    filename, _ = sync(connection)
+    assert read_bytes(filename) == read_bytes(device.log_path)
+
+# a device log shorter than the local copy by less than the verified overlap must not swallow the end marker
+@pytest.mark.parametrize("cut", [100, dock.SYNC_VERIFY_BYTES - 1])
+def test_sync_starts_new_segment_when_device_log_is_shorter(simulated, cut):
+    device, connection = simulated(rows=200)
+    filename, _ = sync(connection)
+    synced = read_bytes(filename)
+
+    with open(device.log_path, 'wb') as f:
+        f.write(synced[:-cut])
+    _, message = sync(connection)
+    assert message.startswith("Device log was replaced")
+    assert read_bytes(filename) == synced + synced[:-cut]
+
+    # and the next sync picks up from the new segment
+    device.capture()
+    sync(connection)
+    assert read_bytes(filename) == synced + read_bytes(device.log_path)
+
+def test_sync_starts_new_segment_when_device_log_was_replaced(simulated):
+    from simulator import generate_log
+
+    device, connection = simulated(rows=200)
+    filename, _ = sync(connection)
+    synced = read_bytes(filename)
+
+    generate_log(device.log_path, 300, seed=1)
+    _, message = sync(connection)
+    assert message.startswith("Device log was replaced")
+    assert read_bytes(filename) == synced + read_bytes(device.log_path)
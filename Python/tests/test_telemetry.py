@@ -0,0 +1,64 @@
+'''
+Telemetry of a damaged export run through "dock.py --profile" with a JSON log and a Prometheus file.
+'''
+
+import io
+import re
+import os
+import json
+import contextlib
+import pytest
+
+import dock
+from simulator import SimulatedDevice, serve_socket
+from conftest import TEST_LOOP_DELAY
+
+# export a simulated device that corrupts and stalls the transfer. Returns the exit code, the events of the JSON
+# log, the samples of the Prometheus file and what was printed
+@pytest.fixture(scope="module")
+def recorded(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("telemetry"))
+    device = SimulatedDevice(rows=1000, loop_delay=TEST_LOOP_DELAY, corrupt_rate=4e-5, stall_after=100000)
+    log, prometheus = os.path.join(directory, "dock.jsonl"), os.path.join(directory, "oss.prom")
+    output = io.StringIO()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(dock, "SAVE_DIR", os.path.join(directory, "data") + "/")
+        monkeypatch.setattr(dock, "FRAMED_EXPORT", True)
+        monkeypatch.setattr(dock, "EXPORT_ENCODINGS", ["F4", "CSV"])
+        with contextlib.redirect_stdout(output):
+            code = dock.run_command(["--log", log, "--prometheus", prometheus, "--profile", "export", "-p", serve_socket(device)])
+        dock.telemetry.configure()
+
+    with open(log, 'r') as f:
+        events = [json.loads(line) for line in f]
+    with open(prometheus, 'r') as f:
+        samples = [line for line in f.read().splitlines() if not line.startswith("#")]
+    return code, events, samples, output.getvalue()
+
+def transfers(events):
+    return [event for event in events if event["event"] == "transfer"]
+
+def test_export_completes(recorded):
+    code, events, samples, output = recorded
+    assert code == 0, output
+    assert len(transfers(events)) == 1 and transfers(events)[0]["complete"]
+
+def test_transfer_records_retries_and_stalls(recorded):
+    transfer = transfers(recorded[1])[0]
+    assert transfer["retries"] > 0 and transfer["stall_seconds"] > 0
+
+def test_transfer_records_its_phases(recorded):
+    assert set(["request", "transfer", "flush", "index", "rollup"]) <= set(transfers(recorded[1])[0]["phases"])
+
+def test_command_round_trips_are_recorded(recorded):
+    commands = set([event["command"] for event in recorded[1] if event["event"] == "command"])
+    assert set(["_SAY_HELLO", "_SET_DATETIME", "_GET_ENCODINGS"]) <= commands
+
+def test_prometheus_file_is_valid(recorded):
+    sample = re.compile(r'^oss_[a-z_]+\{([a-z_]+="[^"]*",?)*\} [-+0-9.eE]+$')
+    samples = recorded[2]
+    assert samples and all([sample.match(line) for line in samples])
+
+def test_profile_is_printed(recorded):
+    assert "function calls" in recorded[3]
@@ -0,0 +1,51 @@
+'''
+The time index of a log: queries against parsing the whole log, and incremental updates of a growing sync file.
+'''
+
+import numpy as np
+import pytest
+
+from logfile import parse_log
+from timeindex import update_index, query
+
+# CONSTANTS
+QUERY_ROWS = 48                             # datapoints in each queried range
+
+@pytest.fixture
+def indexed(log_file):
+    header = update_index(log_file)
+    return log_file, header, parse_log(log_file)
+
+def test_index_holds_every_datapoint_in_order(indexed):
+    filename, header, full = indexed
+    assert header["entries"] == len(full["timestamp"]) and header["sorted"]
+
+def test_queries_return_the_datapoints_in_their_range(indexed):
+    filename, header, full = indexed
+    for first in np.random.default_rng(0).integers(0, len(full["timestamp"]) - QUERY_ROWS, 10).tolist():
+        columns = query(filename, full["timestamp"][first], full["timestamp"][first + QUERY_ROWS])
+        assert np.array_equal(columns["timestamp"], full["timestamp"][first:first + QUERY_ROWS])
+        assert np.array_equal(columns["spectra"], full["spectra"][first:first + QUERY_ROWS])
+
+def test_cut_off_line_is_not_indexed(indexed):
+    filename, header, full = indexed
+    with open(filename, 'rb') as f:
+        line = f.read().split(b"\n")[1]
+    with open(filename, 'ab') as f:
+        f.write(line[:1000])
+    assert update_index(filename)["entries"] == header["entries"]
+
+# a sync appending the rest of a cut off line, then a new segment that starts over in time
+def test_appended_segment_is_indexed(indexed):
+    filename, header, full = indexed
+    with open(filename, 'rb') as f:
+        lines = f.read(100000).split(b"\n")
+    with open(filename, 'ab') as f:
+        f.write(lines[1][:1000])
+    update_index(filename)
+    with open(filename, 'ab') as f:
+        f.write(lines[1][1000:] + b"\n" + lines[0] + b"\n" + b"\n".join(lines[1:4]) + b"\n")
+
+    updated = update_index(filename)
+    assert updated["entries"] == header["entries"] + 4 and not updated["sorted"]
+    assert len(query(filename, full["timestamp"][0], full["timestamp"][3])["timestamp"]) == 7
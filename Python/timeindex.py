@@ -0,0 +1,243 @@
+'''
+Time index of log files, for reading the datapoints of a time range without parsing the whole file.
+
+The index of a log file is a sidecar file next to it (filename + INDEX_EXT): a fixed size header followed by one
+entry per datapoint line, in file order, holding its timestamp (seconds since 1970-01-01 in device time, like
+logfile.parse_log), the byte offset of the line and its length. Entry i is also row i of the dataset saved with an
+export. The header records how many bytes of the log file are indexed and a CRC-32 of the last indexed bytes, so
+update_index only reads what was appended since, like a sync, and rebuilds the index if the file was replaced.
+Entries are written before the header, so an index interrupted while updating still opens with the entries
+the header counts.
+
+    columns = query("data/SYNC_NSP_A.CSV", parse_time("2023-01-03 09:00"), parse_time("2023-01-03 17:00"))
+
+When the timestamps are in order, which the header records, a range is found with a binary search of the memory
+mapped entries and read with one seek. Sync files with several segments and logs with clock changes are searched
+entry by entry instead.
+'''
+
+import os
+import time
+import zlib
+import struct
+import calendar
+import numpy as np
+
+from logfile import LINE_FIELDS, SPECTRA_TYPE, parse_timestamp, epoch_seconds, parse_block, concatenate_columns, empty_columns
+
+# CONSTANTS
+INDEX_EXT = ".tidx"                         # suffix of the index file next to a log file
+INDEX_MAGIC = b"OSSTIDX1"                   # the first bytes of an index file, and its version
+INDEX_HEADER = struct.Struct("<8sQQIB3x")   # INDEX_MAGIC, entries, indexed bytes of the log, fingerprint, sorted
+INDEX_FINGERPRINT_BYTES = 256               # how many of the last indexed bytes the fingerprint covers
+INDEX_BLOCK_SIZE = 8388608                  # how many bytes of a log file to index at once
+TIMESTAMP_LAYOUT = b"00/00/0000,00:00:00,"  # how the device writes DATE and TIME, 0 standing for a digit
+TIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y"]  # formats parse_time reads
+
+# one entry per datapoint line
+ENTRY_TYPE = np.dtype([("timestamp", "<i8"), ("offset", "<i8"), ("length", "<u4")])
+
+def index_filename(filename):
+    return filename + INDEX_EXT
+
+# read the header of an index file. Returns a dict with "entries", "indexed_bytes", "fingerprint" and "sorted",
+# or None if there is no valid index
+def read_index_header(filename):
+    try:
+        with open(filename, 'rb') as f:
+            magic, entries, indexed_bytes, fingerprint, is_sorted = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+    except (OSError, struct.error):
+        return None
+
+    if (magic != INDEX_MAGIC or size < INDEX_HEADER.size + entries * ENTRY_TYPE.itemsize): return None
+    return {"entries": entries, "indexed_bytes": indexed_bytes, "fingerprint": fingerprint, "sorted": bool(is_sorted)}
+
+def write_index_header(f, header):
+    f.seek(0)
+    f.write(INDEX_HEADER.pack(INDEX_MAGIC, header["entries"], header["indexed_bytes"], header["fingerprint"], header["sorted"]))
+
+# CRC-32 of the INDEX_FINGERPRINT_BYTES bytes of a file before end, to tell whether a file still starts the same
+def fingerprint(f, end):
+    f.seek(max(0, end - INDEX_FINGERPRINT_BYTES))
+    return zlib.crc32(f.read(min(end, INDEX_FINGERPRINT_BYTES)))
+
+# the timestamps of the lines starting at starts in a buffer. Lines in the device layout are decoded all at once,
+# any other line with parse_timestamp. Returns (timestamps, valid), valid being False where a line has no timestamp
+def line_timestamps(data, starts):
+    layout = np.frombuffer(TIMESTAMP_LAYOUT, dtype=np.uint8)
+    fields = data[starts[:, None] + np.arange(len(layout))]
+    digits = fields - np.uint8(ord("0"))
+    is_digit = layout == ord("0")
+    fixed = ((digits[:, is_digit] <= 9).all(axis=1) & (fields[:, ~is_digit] == layout[~is_digit]).all(axis=1))
+
+    value = lambda first, count: (digits[:, first:first + count].astype(np.int64) * 10 ** np.arange(count - 1, -1, -1)).sum(axis=1)
+    timestamps = epoch_seconds(value(0, 2), value(3, 2), value(6, 4), value(11, 2), value(14, 2), value(17, 2))
+    valid = fixed.copy()
+
+    for i in np.flatnonzero(~fixed).tolist():
+        line = bytes(data[starts[i]:starts[i] + 40]).decode("ascii", "replace").split(",")
+        try:
+            timestamps[i] = parse_timestamp(line[0], line[1])
+            valid[i] = True
+        except (ValueError, IndexError):
+            pass
+
+    return timestamps, valid
+
+# the entries of the datapoint lines in a buffer of complete lines that starts at byte position of the log file
+def index_block(buffer, position):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    ends = np.flatnonzero(data == ord("\n")) + 1
+    starts = np.concatenate([[0], ends[:-1]])
+
+    # a datapoint line starts with a digit and has a value for every column
+    commas = np.flatnonzero(data == ord(","))
+    counts = np.diff(np.searchsorted(commas, np.concatenate([[0], ends])))
+    lines = np.flatnonzero((counts == LINE_FIELDS) & (data[starts] >= ord("0")) & (data[starts] <= ord("9")))
+
+    timestamps, valid = line_timestamps(data, starts[lines])
+    lines = lines[valid]
+
+    entries = np.empty(len(lines), dtype=ENTRY_TYPE)
+    entries["timestamp"] = timestamps[valid]
+    entries["offset"] = starts[lines] + position
+    entries["length"] = ends[lines] - starts[lines]
+    return entries
+
+# bring the index of a log file up to date, indexing only the lines appended since the last update. The index is
+# built from scratch if it is missing or the indexed part of the file changed. A line cut off at the end of the file
+# is indexed once it is complete. Returns the index header, see read_index_header
+def update_index(filename):
+    header = read_index_header(index_filename(filename))
+
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if (header is None or header["indexed_bytes"] > size or fingerprint(f, header["indexed_bytes"]) != header["fingerprint"]):
+            header = {"entries": 0, "indexed_bytes": 0, "fingerprint": 0, "sorted": True}
+            open(index_filename(filename), 'wb').close()
+        if (header["indexed_bytes"] == size): return header
+
+        with open(index_filename(filename), 'r+b') as index:
+            # drop anything past the committed entries, left over from an interrupted update
+            index.truncate(INDEX_HEADER.size + header["entries"] * ENTRY_TYPE.itemsize)
+            last = None
+            if (header["entries"] > 0):
+                index.seek(-ENTRY_TYPE.itemsize, os.SEEK_END)
+                last = np.frombuffer(index.read(ENTRY_TYPE.itemsize), dtype=ENTRY_TYPE)["timestamp"][0]
+            index.seek(0, os.SEEK_END)
+
+            position = header["indexed_bytes"]
+            f.seek(position)
+            carry = b""
+            while True:
+                data = f.read(INDEX_BLOCK_SIZE)
+                if not data: break
+
+                data = carry + data
+                end = data.rfind(b"\n") + 1
+                carry = data[end:]
+                if (end == 0): continue
+
+                entries = index_block(data[:end], position)
+                position += end
+                if (len(entries) == 0): continue
+
+                timestamps = entries["timestamp"]
+                header["sorted"] = bool(header["sorted"] and (last is None or last <= timestamps[0]) and (np.diff(timestamps) >= 0).all())
+                last = timestamps[-1]
+                index.write(entries.tobytes())
+                header["entries"] += len(entries)
+
+            index.flush()
+            os.fsync(index.fileno())
+            header["indexed_bytes"] = position
+            header["fingerprint"] = fingerprint(f, position)
+            write_index_header(index, header)
+
+    return header
+
+# memory-map the entries of an index, see update_index
+def open_index(filename, header):
+    if (header["entries"] == 0): return np.empty(0, dtype=ENTRY_TYPE)
+    return np.memmap(index_filename(filename), dtype=ENTRY_TYPE, mode='r', offset=INDEX_HEADER.size, shape=(header["entries"],))
+
+# the rows with start <= timestamp < end, in order
+def select_rows(timestamps, start, end, is_sorted):
+    if (is_sorted):
+        return np.arange(np.searchsorted(timestamps, start, 'left'), np.searchsorted(timestamps, end, 'left'))
+    return np.flatnonzero((timestamps >= start) & (timestamps < end))
+
+# parse the datapoint lines of a log file at the given rows of its index, in that order. Each run of consecutive
+# rows is read with one seek, lines between them that are not datapoints are skipped by parse_block.
+# Returns the same columns as logfile.parse_log
+def read_rows(filename, entries, rows, spectra_dtype = SPECTRA_TYPE):
+    if (len(rows) == 0): return empty_columns(spectra_dtype)
+
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    firsts = rows[np.concatenate([[0], breaks])]
+    lasts = rows[np.concatenate([breaks - 1, [len(rows) - 1]])]
+    offsets = entries["offset"]
+    blocks = []
+    with open(filename, 'rb') as f:
+        for first, last in zip(firsts.tolist(), lasts.tolist()):
+            f.seek(offsets[first])
+            blocks.append(parse_block(f.read(offsets[last] + entries["length"][last] - offsets[first]), spectra_dtype))
+
+    return concatenate_columns(blocks, spectra_dtype)
+
+# parse the datapoints of a log file with start <= timestamp < end, start and end in seconds since 1970-01-01 in
+# device time (see parse_time). The index is brought up to date first, then only the lines in the range are read.
+# Returns the same columns as logfile.parse_log
+def query(filename, start, end, spectra_dtype = SPECTRA_TYPE):
+    header = update_index(filename)
+    entries = open_index(filename, header)
+    return read_rows(filename, entries, select_rows(entries["timestamp"], start, end, header["sorted"]), spectra_dtype)
+
+# the datapoints of a dataset with start <= timestamp < end, see query. A dataset is already indexed by its
+# memory-mapped timestamp column. Returns the same columns as dataset.open_dataset, holding only the selected rows
+def query_dataset(path, start, end):
+    from dataset import open_dataset
+
+    data = open_dataset(path)
+    timestamps = data["timestamp"]
+    rows = select_rows(timestamps, start, end, bool((np.diff(timestamps) >= 0).all()))
+    return {column: values if column == "wavelengths" else np.asarray(values[rows]) for column, values in data.items()}
+
+# seconds since 1970-01-01 of a date and time in one of TIME_FORMATS, read as device time, or of a number of seconds.
+# Raises ValueError for anything else
+def parse_time(text):
+    try:
+        return int(text)
+    except ValueError:
+        pass
+
+    for time_format in TIME_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(text, time_format))
+        except ValueError:
+            pass
+    raise ValueError("unknown time " + text + ", use YYYY-MM-DD HH:MM:SS")
+
+if __name__ == "__main__":
+    import sys
+    from dataset import DATASET_EXT
+
+    if (len(sys.argv) not in (2, 4)):
+        print("Usage: python timeindex.py EXPORT.CSV                  build or update the index\n" +
+              "       python timeindex.py EXPORT.CSV|DATASET" + DATASET_EXT + " START END   count the datapoints in a time range\n" +
+              "START and END are YYYY-MM-DD [HH:MM[:SS]] in device time, END is excluded")
+        exit(1)
+
+    start_time = time.perf_counter()
+    if (len(sys.argv) == 2):
+        header = update_index(sys.argv[1])
+        print(str(header["entries"]) + " datapoints indexed in " + index_filename(sys.argv[1]) + " (" +
+              ("in time order" if header["sorted"] else "not in time order") + "), " +
+              str(round(time.perf_counter() - start_time, 3)) + " s")
+    else:
+        start, end = parse_time(sys.argv[2]), parse_time(sys.argv[3])
+        is_dataset = sys.argv[1].rstrip("/\\").endswith(DATASET_EXT)
+        columns = query_dataset(sys.argv[1], start, end) if is_dataset else query(sys.argv[1], start, end)
+        print(str(len(columns["timestamp"])) + " datapoints in range, read in " + str(round((time.perf_counter() - start_time) * 1000, 1)) + " ms")